@@ -0,0 +1,433 @@
+#!/usr/bin/env python3
+"""
+Spike and Dip Anomaly Detection
+Local stand-in for ANOMALYDETECTION_SPIKEANDDIP, used by
+queries/06-anomaly-spike-detection.sql.
+
+Each partition (device) keeps its last `history` values in a fixed-size
+ring. A new value is scored against the mean and standard deviation of
+that history, and the score is the p-value of that z-score: the chance of
+a value at least that extreme under the history's distribution. The value
+is an anomaly when the p-value is below 1 - confidence/100. The ring keeps
+running sums, so scoring costs O(1) per event and never re-scans the
+history.
+
+The Stream Analytics function fits an adaptive kernel density, so scores
+will not match the service exactly. The confidence and history size
+behave the same way, which is what the local runs are for: tuning them on
+recorded data.
+
+Two ways to run it:
+- Streaming: SpikeAndDipDetector.score() per event. The engine uses this
+  for the OVER(PARTITION BY ... LIMIT DURATION(...)) form.
+- Batch: score_batch() scores a whole file across thousands of devices
+  with NumPy in one pass. Running this module does that, and takes
+  several confidence/history settings for tuning.
+"""
+
+import argparse
+import json
+import logging
+import math
+import sys
+import time
+from array import array
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from saql_engine import Evaluator, Literal, SaqlError, iter_json_records, parse_datetime, time_unit_seconds
+from saql_windows import to_micros
+
+logger = logging.getLogger(__name__)
+
+SPIKES = "spikes"
+DIPS = "dips"
+SPIKES_AND_DIPS = "spikesanddips"
+MODES = (SPIKES, DIPS, SPIKES_AND_DIPS)
+
+# Values needed in the history before anything is flagged
+MIN_HISTORY = 8
+
+# Below this relative variance the history is treated as constant
+_FLAT_VARIANCE = 1e-12
+
+_SQRT2 = math.sqrt(2.0)
+
+def _check_parameters(confidence: float, history: int, mode: str):
+    if not 0 < confidence < 100:
+        raise SaqlError("Anomaly detection confidence must be between 0 and 100 (exclusive)")
+    if history < 2:
+        raise SaqlError("Anomaly detection history size must be at least 2")
+    if mode not in MODES:
+        raise SaqlError(f"Anomaly detection mode must be one of: {', '.join(MODES)}")
+
+def p_value(z: float, mode: str) -> float:
+    """Tail probability of a z-score for the given mode."""
+    if mode == SPIKES:
+        return 0.5 * math.erfc(z / _SQRT2)
+    if mode == DIPS:
+        return 0.5 * math.erfc(-z / _SQRT2)
+    return math.erfc(abs(z) / _SQRT2)
+
+def _z_score(value: float, mean: float, variance: float) -> float:
+    scale = mean * mean + 1.0
+    if variance <= _FLAT_VARIANCE * scale:
+        # Constant history: any real change is infinitely surprising
+        deviation = value - mean
+        if abs(deviation) <= 1e-9 * math.sqrt(scale):
+            return 0.0
+        return math.copysign(math.inf, deviation)
+    return (value - mean) / math.sqrt(variance)
+
+class RingBufferStore:
+    """Fixed-size value/time rings for many partitions in flat arrays.
+    
+    Partition slots are allocated on first use. A slot's ring occupies
+    history consecutive entries of the shared value and time arrays. Per
+    slot, the store keeps the head index and size, plus sums of the values
+    shifted by a per-slot constant. The shift keeps the sum of squares
+    numerically stable. The sums are recomputed from the ring once every
+    history updates, so rounding drift stays bounded at amortized O(1) cost.
+    """
+    
+    def __init__(self, history: int):
+        self.history = history
+        self.slots: Dict[Any, int] = {}
+        self.values = array('d')
+        self.times = array('q')
+        self.head = array('l')
+        self.size = array('l')
+        self.shift = array('d')
+        self.sum = array('d')
+        self.sum_sq = array('d')
+        self.updates = array('l')
+    
+    def __len__(self) -> int:
+        return len(self.slots)
+    
+    def slot(self, key: Any) -> int:
+        slot = self.slots.get(key)
+        if slot is None:
+            slot = self.slots[key] = len(self.slots)
+            self.values.extend(array('d', bytes(8 * self.history)))
+            self.times.extend(array('q', bytes(8 * self.history)))
+            for column in (self.head, self.size, self.updates):
+                column.append(0)
+            for column in (self.shift, self.sum, self.sum_sq):
+                column.append(0.0)
+        return slot
+    
+    def stats(self, slot: int) -> Tuple[int, float, float]:
+        """(count, mean, sample variance) of the values in a slot's ring."""
+        n = self.size[slot]
+        if n == 0:
+            return 0, 0.0, 0.0
+        total = self.sum[slot]
+        mean = self.shift[slot] + total / n
+        if n < 2:
+            return n, mean, 0.0
+        variance = (self.sum_sq[slot] - total * total / n) / (n - 1)
+        return n, mean, max(variance, 0.0)
+    
+    def expire(self, slot: int, cutoff: int):
+        """Drop values recorded at or before cutoff (microseconds)."""
+        base = slot * self.history
+        while self.size[slot] and self.times[base + self.head[slot]] <= cutoff:
+            self._remove_oldest(slot, base)
+    
+    def push(self, slot: int, value: float, micros: int = 0) -> Optional[Tuple[float, int]]:
+        """Append a value; returns the (value, micros) it pushed out of a full ring, if any."""
+        base = slot * self.history
+        evicted = None
+        if self.size[slot] == self.history:
+            oldest = base + self.head[slot]
+            evicted = (self.values[oldest], self.times[oldest])
+            self._remove_oldest(slot, base)
+        if self.size[slot] == 0:
+            self.shift[slot] = value
+            self.sum[slot] = 0.0
+            self.sum_sq[slot] = 0.0
+            self.updates[slot] = 0
+        index = base + (self.head[slot] + self.size[slot]) % self.history
+        self.values[index] = value
+        self.times[index] = micros
+        self.size[slot] += 1
+        shifted = value - self.shift[slot]
+        self.sum[slot] += shifted
+        self.sum_sq[slot] += shifted * shifted
+        
+        self.updates[slot] += 1
+        if self.updates[slot] >= self.history:
+            self._resync(slot, base)
+        return evicted
+    
+    def _remove_oldest(self, slot: int, base: int):
+        shifted = self.values[base + self.head[slot]] - self.shift[slot]
+        self.sum[slot] -= shifted
+        self.sum_sq[slot] -= shifted * shifted
+        self.head[slot] = (self.head[slot] + 1) % self.history
+        self.size[slot] -= 1
+    
+    def _resync(self, slot: int, base: int):
+        """Recompute the sums from the ring around its current mean."""
+        n = self.size[slot]
+        head = self.head[slot]
+        ring = [self.values[base + (head + offset) % self.history] for offset in range(n)]
+        shift = math.fsum(ring) / n
+        self.shift[slot] = shift
+        self.sum[slot] = math.fsum(value - shift for value in ring)
+        self.sum_sq[slot] = math.fsum((value - shift) ** 2 for value in ring)
+        self.updates[slot] = 0
+
+class SpikeAndDipDetector:
+    """Incremental per-partition spike and dip scoring."""
+    
+    def __init__(self, confidence: float = 95, history: int = 120, mode: str = SPIKES_AND_DIPS,
+                 limit_duration: Optional[float] = None, min_history: int = MIN_HISTORY):
+        mode = mode.lower()
+        _check_parameters(confidence, history, mode)
+        self.confidence = confidence
+        self.alpha = 1.0 - confidence / 100.0
+        self.mode = mode
+        self.limit_duration = None if limit_duration is None else round(limit_duration * 1e6)
+        self.min_history = min(max(min_history, 2), history)
+        self.store = RingBufferStore(history)
+        self.scored = 0
+        self.anomalies = 0
+    
+    def score(self, key: Any, value: Optional[float], micros: int = 0) -> Optional[Dict[str, Any]]:
+        """Score value against its partition's history, then add it to the history.
+        
+        micros is the event time in microseconds; it only matters with a
+        limit duration. Returns a {'Score', 'IsAnomaly'} record, or None when
+        value is missing. Score is None until min_history values are known.
+        """
+        if value is None:
+            return None
+        value = float(value)
+        store = self.store
+        slot = store.slot(key)
+        if self.limit_duration is not None:
+            store.expire(slot, micros - self.limit_duration)
+        
+        n, mean, variance = store.stats(slot)
+        store.push(slot, value, micros)
+        if n < self.min_history:
+            return {"Score": None, "IsAnomaly": 0}
+        
+        score = p_value(_z_score(value, mean, variance), self.mode)
+        is_anomaly = 1 if score < self.alpha else 0
+        self.scored += 1
+        self.anomalies += is_anomaly
+        return {"Score": score, "IsAnomaly": is_anomaly}
+
+def _constant_argument(node, description: str):
+    if not isinstance(node, Literal):
+        raise SaqlError(f"ANOMALYDETECTION_SPIKEANDDIP {description} must be a constant")
+    return node.value
+
+def compile_spike_and_dip(node, compiler) -> Evaluator:
+    """Engine hook for ANOMALYDETECTION_SPIKEANDDIP(value, confidence, history, mode) OVER (...)."""
+    if len(node.args) != 4:
+        raise SaqlError("ANOMALYDETECTION_SPIKEANDDIP takes (value, confidence, history size, mode)")
+    value = compiler.compile(node.args[0])
+    confidence = _constant_argument(node.args[1], "confidence")
+    history = _constant_argument(node.args[2], "history size")
+    mode = _constant_argument(node.args[3], "mode")
+    if not isinstance(history, int) or not isinstance(mode, str):
+        raise SaqlError("ANOMALYDETECTION_SPIKEANDDIP needs an integer history size and a mode string")
+    
+    over = node.over
+    limit_duration = None
+    if over.limit_duration is not None:
+        unit, amount = over.limit_duration
+        limit_duration = time_unit_seconds(unit) * amount
+    keys = [compiler.compile(expr) for expr in over.partition_by]
+    when = compiler.compile(over.when) if over.when is not None else None
+    detector = SpikeAndDipDetector(confidence, history, mode, limit_duration)
+    
+    def spike_and_dip(record, ts):
+        # Events that fail WHEN are neither scored nor added to the history
+        if when is not None and not when(record, ts):
+            return None
+        key = tuple(key(record, ts) for key in keys)
+        return detector.score(key, value(record, ts), to_micros(ts))
+    return spike_and_dip
+
+# ---------------------------------------------------------------------------
+# Batch scoring
+# ---------------------------------------------------------------------------
+
+def score_batch(keys: Sequence[Any], values: Sequence[float], times: Optional[Sequence[int]] = None,
+                confidence: float = 95, history: int = 120, mode: str = SPIKES_AND_DIPS,
+                limit_duration: Optional[float] = None, min_history: int = MIN_HISTORY):
+    """Score every event of a recorded stream at once; returns (scores, is_anomaly) arrays.
+    
+    Gives the same results as feeding the events to SpikeAndDipDetector in
+    order. The events are stably grouped by key. Each event's history window
+    is then a range of its group, and window sums come from differences of
+    cumulative sums. times (microseconds) are only needed with a limit
+    duration and must be ascending within each key. Scores are NaN during
+    warm-up and for missing values.
+    """
+    import numpy as np
+    
+    mode = mode.lower()
+    _check_parameters(confidence, history, mode)
+    min_history = min(max(min_history, 2), history)
+    
+    values = np.asarray(values, dtype=float)
+    count = len(values)
+    scores = np.full(count, np.nan)
+    anomalies = np.zeros(count, dtype=np.int8)
+    # Missing values never enter a history
+    present = np.flatnonzero(~np.isnan(values))
+    if len(present) == 0:
+        return scores, anomalies
+    
+    _, codes = np.unique(np.asarray(keys, dtype=object)[present].astype(str), return_inverse=True)
+    order = np.argsort(codes, kind='stable')
+    codes = codes[order]
+    x = values[present][order]
+    positions = np.arange(len(x))
+    group_starts = np.flatnonzero(np.r_[True, codes[1:] != codes[:-1]])
+    group_start = group_starts[np.cumsum(np.r_[True, codes[1:] != codes[:-1]]) - 1]
+    
+    # History window of event i: [start, i) within its group
+    start = np.maximum(group_start, positions - history)
+    if limit_duration is not None:
+        if times is None:
+            raise SaqlError("A limit duration needs event times")
+        t = np.asarray(times, dtype=np.int64)[present][order]
+        span = int(t.max() - t.min()) + round(limit_duration * 1e6) + 1
+        # One sorted axis over (group, time) lets a single searchsorted find
+        # each event's first in-duration history entry
+        axis = codes.astype(np.int64) * span + (t - t.min())
+        start = np.maximum(start, np.searchsorted(axis, axis - round(limit_duration * 1e6), side='right'))
+    
+    # Shift each group by its mean to keep the sum of squares stable
+    counts = np.bincount(codes)
+    shift = (np.bincount(codes, weights=x) / counts)[codes]
+    shifted = x - shift
+    sums = np.r_[0.0, np.cumsum(shifted)]
+    sums_sq = np.r_[0.0, np.cumsum(shifted * shifted)]
+    
+    n = positions - start
+    total = sums[positions] - sums[start]
+    total_sq = sums_sq[positions] - sums_sq[start]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        mean = shift + total / n
+        variance = np.maximum((total_sq - total * total / n) / (n - 1), 0.0)
+        scale = mean * mean + 1.0
+        deviation = x - mean
+        flat = variance <= _FLAT_VARIANCE * scale
+        z = np.where(flat,
+                     np.where(np.abs(deviation) <= 1e-9 * np.sqrt(scale), 0.0, np.copysign(np.inf, deviation)),
+                     deviation / np.sqrt(variance))
+    
+    erfc = np.frompyfunc(math.erfc, 1, 1)
+    if mode == SPIKES:
+        p = 0.5 * erfc(z / _SQRT2).astype(float)
+    elif mode == DIPS:
+        p = 0.5 * erfc(-z / _SQRT2).astype(float)
+    else:
+        p = erfc(np.abs(z) / _SQRT2).astype(float)
+    
+    ready = n >= min_history
+    target = present[order]
+    scores[target[ready]] = p[ready]
+    anomalies[target[ready]] = p[ready] < 1.0 - confidence / 100.0
+    return scores, anomalies
+
+# ---------------------------------------------------------------------------
+# Command line
+# ---------------------------------------------------------------------------
+
+def number_list(text: str, cast) -> List:
+    """Parse a comma-separated list of numbers, such as 95,99,99.9."""
+    return [cast(item) for item in text.split(',') if item.strip()]
+
+def load_columns(path: str, value_field: str, partition_field: str,
+                 time_field: Optional[str]) -> Tuple[List[Any], List[float], Optional[List[int]], List[Dict[str, Any]]]:
+    """Read a file into (keys, values, times, records); missing values become NaN."""
+    keys, values, times, records = [], [], [] if time_field else None, []
+    for record in iter_json_records(path):
+        keys.append(record.get(partition_field))
+        value = record.get(value_field)
+        values.append(float('nan') if value is None else float(value))
+        if times is not None:
+            stamp = parse_datetime(record.get(time_field))
+            times.append(to_micros(stamp) if isinstance(stamp, datetime) else 0)
+        records.append(record)
+    return keys, values, times, records
+
+def parse_args():
+    """Parse command line options."""
+    parser = argparse.ArgumentParser(description="Score recorded telemetry for spikes and dips")
+    parser.add_argument("input", help="JSON array or JSON Lines file of events")
+    parser.add_argument("--value", default="temperature", help="Field to score (default: temperature)")
+    parser.add_argument("--partition", default="deviceId", help="Field that identifies a device (default: deviceId)")
+    parser.add_argument("--confidence", default="95",
+                        help="Confidence level, or a comma-separated list to compare (default: 95)")
+    parser.add_argument("--history", default="120",
+                        help="History size, or a comma-separated list to compare (default: 120)")
+    parser.add_argument("--mode", choices=MODES, default=SPIKES_AND_DIPS)
+    parser.add_argument("--limit-duration", type=float, default=None, metavar="SECONDS",
+                        help="Only values this recent form the history, as LIMIT DURATION does")
+    parser.add_argument("--timestamp", default="timestamp",
+                        help="Event time field, used with --limit-duration (default: timestamp)")
+    parser.add_argument("--output", default=None,
+                        help="Write anomalous events with their scores as JSON Lines (first setting only)")
+    parser.add_argument("--stream", action="store_true",
+                        help="Score event by event with the streaming detector instead of NumPy")
+    return parser.parse_args()
+
+def main():
+    """Score a file for each confidence/history setting and report anomaly counts."""
+    args = parse_args()
+    try:
+        confidences = number_list(args.confidence, float)
+        histories = number_list(args.history, int)
+        keys, values, times, records = load_columns(
+            args.input, args.value, args.partition, args.timestamp if args.limit_duration is not None else None)
+    except (OSError, ValueError, SaqlError) as e:
+        logger.error(f"✗ {e}")
+        sys.exit(1)
+    print(f"Loaded {len(records)} events for {len(set(map(str, keys)))} devices from {args.input}")
+    
+    output_written = False
+    for history in histories:
+        for confidence in confidences:
+            started = time.perf_counter()
+            try:
+                if args.stream:
+                    detector = SpikeAndDipDetector(confidence, history, args.mode, args.limit_duration)
+                    results = [
+                        detector.score(key, None if math.isnan(value) else value, times[i] if times else 0)
+                        for i, (key, value) in enumerate(zip(keys, values))
+                    ]
+                    scores = [None if result is None else result["Score"] for result in results]
+                    flags = [0 if result is None else result["IsAnomaly"] for result in results]
+                else:
+                    scores, flags = score_batch(keys, values, times, confidence, history, args.mode,
+                                                args.limit_duration)
+                    scores = [None if math.isnan(score) else score for score in scores.tolist()]
+                    flags = flags.tolist()
+            except SaqlError as e:
+                logger.error(f"✗ {e}")
+                sys.exit(1)
+            elapsed = max(time.perf_counter() - started, 1e-9)
+            anomalies = sum(flags)
+            print(f"✓ confidence {confidence:g}, history {history}: {anomalies} anomalies "
+                  f"({anomalies / max(len(flags), 1):.2%}) in {elapsed:.2f}s ({len(flags) / elapsed:.0f} events/sec)")
+            
+            if args.output and not output_written:
+                with open(args.output, 'w', encoding='utf-8') as handle:
+                    for record, score, flag in zip(records, scores, flags):
+                        if flag:
+                            handle.write(json.dumps(dict(record, AnomalyScore=score, IsAnomaly=1)) + "\n")
+                output_written = True
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    main()
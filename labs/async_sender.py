@@ -0,0 +1,346 @@
+#!/usr/bin/env python3
+"""
+Asyncio Sending Engine for Azure Event Hub
+Keeps many sends in flight from a single process, for both the Azure SDK
+(azure.eventhub.aio) and the REST API (aiohttp) paths.
+"""
+
+import asyncio
+import logging
+import signal
+import time
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+from flow_control import (
+    RETRYABLE_STATUSES,
+    THROTTLE_STATUSES,
+    RetryPolicy,
+    is_sdk_retryable_error,
+    is_sdk_throttle_error,
+    parse_retry_after,
+)
+from metrics import METRICS
+from serializers import JsonSerializer, RecordBatch, encode_records
+
+logger = logging.getLogger(__name__)
+
+class AsyncSendStats:
+    """Counters for one engine run."""
+    
+    def __init__(self):
+        self.generated = 0
+        self.sent = 0
+        self.failed = 0
+        self.batches = 0
+        self.started = time.monotonic()
+        self.finished = None
+    
+    @property
+    def elapsed(self) -> float:
+        end = self.finished if self.finished is not None else time.monotonic()
+        return max(end - self.started, 1e-9)
+    
+    def summary(self) -> str:
+        """Return a one-line summary of the run."""
+        return (
+            f"generated {self.generated}, sent {self.sent}, failed {self.failed} "
+            f"in {self.batches} batches, {self.sent / self.elapsed:.1f} events/sec"
+        )
+
+class AsyncSendEngine:
+    """Moves generated events to a sender through a bounded queue.
+    
+    A single producer coroutine generates events in groups of batch_size and
+    puts them on the queue; max_in_flight worker coroutines each take one
+    group at a time and await the send, so at most max_in_flight sends are
+    outstanding. Stopping lets the workers drain whatever is already queued.
+    
+    With a limiter (flow_control.AdaptiveConcurrencyLimiter) workers also
+    acquire a slot per send, so throttling can cut the effective concurrency
+    below max_in_flight. A batch waiting for retry keeps its worker busy, so
+    the bounded queue pushes back on generation instead of dropping events.
+    """
+    
+    def __init__(self, send_batch: Callable[[RecordBatch], Awaitable[int]],
+                 max_in_flight: int = 8, batch_size: int = 100, queue_size: int = 64,
+                 generate_batch: Optional[Callable[[int], RecordBatch]] = None,
+                 limiter=None):
+        if max_in_flight < 1:
+            raise ValueError("max_in_flight must be at least 1")
+        self.send_batch = send_batch
+        self.max_in_flight = max_in_flight
+        self.batch_size = batch_size
+        self.queue_size = queue_size
+        self.generate_batch = generate_batch
+        self.limiter = limiter
+        self.stats = AsyncSendStats()
+        self._stop = None
+    
+    def stop(self):
+        """Ask the engine to stop generating and drain the queue."""
+        if self._stop is not None:
+            self._stop.set()
+    
+    async def run(self, generate: Callable[[], Dict[str, Any]],
+                  max_events: Optional[int] = None) -> AsyncSendStats:
+        """Generate and send until stopped or max_events have been generated."""
+        self._stop = asyncio.Event()
+        self.stats = AsyncSendStats()
+        queue = asyncio.Queue(maxsize=self.queue_size)
+        
+        workers = [
+            asyncio.create_task(self._worker(queue))
+            for _ in range(self.max_in_flight)
+        ]
+        try:
+            await self._produce(queue, generate, max_events)
+        finally:
+            # One sentinel per worker; each exits after draining the items ahead of it
+            for _ in workers:
+                await queue.put(None)
+            await asyncio.gather(*workers)
+            self.stats.finished = time.monotonic()
+        
+        return self.stats
+    
+    async def _produce(self, queue: asyncio.Queue, generate: Callable[[], Dict[str, Any]],
+                       max_events: Optional[int]):
+        """Fill the queue with batches of generated events."""
+        while not self._stop.is_set():
+            count = self.batch_size
+            if max_events is not None:
+                count = min(count, max_events - self.stats.generated)
+                if count <= 0:
+                    break
+            
+            if self.generate_batch is not None:
+                batch = self.generate_batch(count)
+            else:
+                batch = [generate() for _ in range(count)]
+            self.stats.generated += count
+            
+            # put() only suspends when the queue is full; yield anyway so
+            # workers get to start their sends between generated batches
+            await queue.put(batch)
+            METRICS.queue_depth.set(queue.qsize())
+            await asyncio.sleep(0)
+    
+    async def _worker(self, queue: asyncio.Queue):
+        """Send batches from the queue until a sentinel is received."""
+        while True:
+            batch = await queue.get()
+            if batch is None:
+                return
+            METRICS.queue_depth.set(queue.qsize())
+            if self.limiter is not None:
+                await self.limiter.acquire()
+            started = time.perf_counter()
+            try:
+                sent = await self.send_batch(batch)
+                METRICS.send_latency.observe(time.perf_counter() - started)
+            except Exception as e:
+                logger.error(f"✗ Failed to send batch of {len(batch)} events: {e}")
+                sent = 0
+            finally:
+                if self.limiter is not None:
+                    await self.limiter.release()
+            self.stats.batches += 1
+            self.stats.sent += sent
+            self.stats.failed += len(batch) - sent
+            METRICS.sent.inc(sent)
+            METRICS.failed.inc(len(batch) - sent)
+
+class AsyncSdkSender:
+    """Sends batches with the asyncio Event Hub producer client.
+    
+    Sends that fail with server-busy or transient errors are retried with
+    jittered backoff; throttling is reported to the optional limiter.
+    """
+    
+    def __init__(self, connection_string: str, eventhub_name: str,
+                 retry_policy: Optional[RetryPolicy] = None, limiter=None):
+        from azure.eventhub import EventData
+        from azure.eventhub.aio import EventHubProducerClient
+        
+        self._event_data = EventData
+        self.serializer = JsonSerializer()
+        self.producer_client = EventHubProducerClient.from_connection_string(
+            conn_str=connection_string,
+            eventhub_name=eventhub_name
+        )
+        self.retry_policy = retry_policy or RetryPolicy(max_attempts=5)
+        self.limiter = limiter
+        self.bytes_sent = 0
+        self.throttled = 0
+        self.retries = 0
+    
+    async def _send_with_retry(self, batch) -> int:
+        """Send one EventDataBatch, retrying retryable errors. Returns events sent."""
+        attempt = 1
+        while True:
+            try:
+                await self.producer_client.send_batch(batch)
+            except Exception as e:
+                throttled = is_sdk_throttle_error(e)
+                if throttled:
+                    self.throttled += 1
+                    if self.limiter is not None:
+                        self.limiter.on_throttle()
+                if not (throttled or is_sdk_retryable_error(e)) or not self.retry_policy.should_retry(attempt):
+                    raise
+                self.retries += 1
+                await asyncio.sleep(self.retry_policy.delay(attempt))
+                attempt += 1
+                continue
+            
+            if self.limiter is not None:
+                self.limiter.on_success()
+            self.bytes_sent += batch.size_in_bytes
+            METRICS.bytes_sent.inc(batch.size_in_bytes)
+            METRICS.batch_fill.observe(batch.size_in_bytes / batch.max_size_in_bytes)
+            return len(batch)
+    
+    async def send_batch(self, messages: RecordBatch) -> int:
+        """Send messages in as few EventDataBatches as fit. Returns events sent."""
+        sent = 0
+        batch = await self.producer_client.create_batch()
+        for payload in encode_records(self.serializer, messages):
+            event_data = self._event_data(payload)
+            try:
+                batch.add(event_data)
+            except ValueError:
+                if len(batch) == 0:
+                    logger.error("✗ Message is larger than the maximum batch size, dropped")
+                    continue
+                sent += await self._send_with_retry(batch)
+                batch = await self.producer_client.create_batch()
+                batch.add(event_data)
+        
+        if len(batch) > 0:
+            sent += await self._send_with_retry(batch)
+        return sent
+    
+    async def close(self):
+        """Close the producer connection."""
+        await self.producer_client.close()
+
+class AsyncRestSender:
+    """Sends batch POSTs with aiohttp, reusing an EventHubRestClient for auth and packing.
+    
+    Throttled (429/503) and failed POSTs are retried after the server's
+    Retry-After or a jittered backoff, following the client's retry_policy;
+    outcomes are reported to the optional limiter.
+    """
+    
+    def __init__(self, rest_client, max_in_flight: int = 8, limiter=None):
+        import aiohttp
+        from generate_sample_data_rest import BATCH_CONTENT_TYPE
+        
+        self.rest_client = rest_client
+        self._aiohttp = aiohttp
+        self._content_type = BATCH_CONTENT_TYPE
+        self.max_in_flight = max_in_flight
+        self.limiter = limiter
+        self.session = None
+        self.bytes_sent = 0
+        self.throttled = 0
+        self.retries = 0
+    
+    async def _get_session(self):
+        """Create the HTTP session lazily, inside the running event loop."""
+        if self.session is None:
+            connector = self._aiohttp.TCPConnector(limit=self.max_in_flight)
+            self.session = self._aiohttp.ClientSession(
+                connector=connector,
+                timeout=self._aiohttp.ClientTimeout(total=30)
+            )
+        return self.session
+    
+    async def send_batch(self, messages: RecordBatch) -> int:
+        """Send messages as one or more batch POSTs. Returns events accepted."""
+        sent = 0
+        for group in self.rest_client._pack_batches(encode_records(self.rest_client.serializer, messages)):
+            body = b'[' + b','.join(group) + b']'
+            attempt = 1
+            while True:
+                status, retry_after = await self._post(body)
+                if status == 201:
+                    sent += len(group)
+                    self.bytes_sent += len(body)
+                    METRICS.bytes_sent.inc(len(body))
+                    METRICS.batch_fill.observe(len(body) / self.rest_client.max_batch_bytes)
+                    if self.limiter is not None:
+                        self.limiter.on_success()
+                    break
+                
+                if status in THROTTLE_STATUSES:
+                    self.throttled += 1
+                    if self.limiter is not None:
+                        self.limiter.on_throttle()
+                policy = self.rest_client.retry_policy
+                if status not in RETRYABLE_STATUSES or not policy.should_retry(attempt):
+                    logger.error(f"✗ Failed to send batch of {len(group)} events after {attempt} attempts. "
+                                 f"Status: {status}")
+                    break
+                self.retries += 1
+                await asyncio.sleep(policy.delay(attempt, retry_after))
+                attempt += 1
+        
+        return sent
+    
+    async def _post(self, body: bytes):
+        """POST one batch body. Returns (status, Retry-After seconds); 0 on network errors."""
+        session = await self._get_session()
+        headers = {
+            'Authorization': self.rest_client.token_cache.get(),
+            'Content-Type': self._content_type
+        }
+        try:
+            async with session.post(self.rest_client.messages_url, data=body,
+                                    headers=headers) as response:
+                if response.status != 201:
+                    text = await response.text()
+                    logger.debug(f"POST returned {response.status}: {text}")
+                return response.status, parse_retry_after(response.headers.get('Retry-After'))
+        except (self._aiohttp.ClientError, asyncio.TimeoutError) as e:
+            logger.error(f"✗ Network error sending batch: {e}")
+            return 0, None
+    
+    async def close(self):
+        """Close pooled connections."""
+        if self.session is not None:
+            await self.session.close()
+            self.session = None
+
+async def run_engine(sender, generate: Callable[[], Dict[str, Any]],
+                     max_in_flight: int = 8, batch_size: int = 100,
+                     max_events: Optional[int] = None,
+                     generate_batch: Optional[Callable[[int], RecordBatch]] = None,
+                     limiter=None) -> AsyncSendStats:
+    """Run an engine over the given sender and close the sender afterwards.
+    
+    Pass the same limiter given to the sender to make concurrency adaptive.
+    
+    Ctrl+C (SIGINT) stops generation and drains in-flight sends where the
+    platform supports loop signal handlers; elsewhere it cancels the run.
+    """
+    engine = AsyncSendEngine(
+        sender.send_batch,
+        max_in_flight=max_in_flight,
+        batch_size=batch_size,
+        generate_batch=generate_batch,
+        limiter=limiter
+    )
+    loop = asyncio.get_running_loop()
+    try:
+        loop.add_signal_handler(signal.SIGINT, engine.stop)
+        handler_installed = True
+    except (NotImplementedError, RuntimeError):
+        handler_installed = False
+    
+    try:
+        return await engine.run(generate, max_events)
+    finally:
+        if handler_installed:
+            loop.remove_signal_handler(signal.SIGINT)
+        await sender.close()
@@ -0,0 +1,471 @@
+#!/usr/bin/env python3
+"""
+Event Hub Sender Benchmark
+Runs each sending mode (REST/SDK, single/batched, sync/async) for a fixed
+duration or event count and reports events/sec, bytes/sec, send latency
+percentiles, CPU time and peak RSS. Results are written as JSON so they can
+be tracked over time.
+
+REST modes run against a local stand-in (local_eventhub.py) started in its
+own process, so its CPU is not counted against the sender. SDK modes speak
+AMQP and need --sdk-connection-string (a real namespace or the Event Hubs
+emulator); they are skipped otherwise.
+"""
+
+import argparse
+import asyncio
+import json
+import math
+import multiprocessing
+import os
+import platform
+import queue
+import random
+import sys
+import time
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, List, Optional
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+REST_MODES = ["rest-single", "rest-batch", "rest-async"]
+SDK_MODES = ["sdk-single", "sdk-batch", "sdk-async"]
+
+# Records are generated once up front so the benchmark measures sending only
+RECORD_POOL_SIZE = 10000
+
+def build_record_pool(seed: int, size: int = RECORD_POOL_SIZE) -> List[Dict[str, Any]]:
+    """Deterministic telemetry records to cycle through during a run."""
+    rng = random.Random(seed)
+    return [
+        {
+            "deviceId": f"device-{rng.randint(1, 100):03d}",
+            "timestamp": f"2024-01-15T10:{i // 600 % 60:02d}:{i // 10 % 60:02d}.{i % 10 * 100:03d}Z",
+            "temperature": round(rng.uniform(20, 40), 1),
+            "humidity": round(rng.uniform(30, 80), 1),
+            "pressure": round(rng.uniform(1000, 1100), 2),
+            "location": {
+                "lat": 47.6062,
+                "lon": -122.3321
+            },
+            "metadata": {
+                "sensorType": rng.choice(["DHT22", "BME280", "SHT30", "AM2302", "DS18B20"]),
+                "firmware": rng.choice(["v1.2.3", "v1.3.0", "v1.2.5", "v1.4.1", "v1.1.9"])
+            }
+        }
+        for i in range(size)
+    ]
+
+def percentile(sorted_values: List[float], fraction: float) -> float:
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return 0.0
+    index = max(0, math.ceil(fraction * len(sorted_values)) - 1)
+    return sorted_values[index]
+
+def peak_rss_mb() -> Optional[float]:
+    """Peak resident set size of this process in MiB, where the platform reports it."""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports KiB, macOS reports bytes
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+class RunBudget:
+    """Stop condition shared by all modes: a duration, an event count, or both."""
+    
+    def __init__(self, duration_seconds: Optional[float], max_events: Optional[int]):
+        self.duration_seconds = duration_seconds
+        self.max_events = max_events
+        self.started = time.perf_counter()
+    
+    def remaining(self, sent: int) -> Optional[int]:
+        return None if self.max_events is None else self.max_events - sent
+    
+    def done(self, sent: int) -> bool:
+        if self.max_events is not None and sent >= self.max_events:
+            return True
+        return (self.duration_seconds is not None
+                and time.perf_counter() - self.started >= self.duration_seconds)
+
+class ModeResult:
+    """Raw measurements collected by one mode run."""
+    
+    def __init__(self):
+        self.events = 0
+        self.failed = 0
+        self.bytes = 0
+        self.latencies: List[float] = []
+
+def _cycle(pool: List[Dict[str, Any]]) -> Callable[[int], List[Dict[str, Any]]]:
+    position = [0]
+    
+    def take(count: int) -> List[Dict[str, Any]]:
+        start = position[0]
+        position[0] = (start + count) % len(pool)
+        if start + count <= len(pool):
+            return pool[start:start + count]
+        return pool[start:] + pool[:start + count - len(pool)]
+    return take
+
+def run_rest_single(config, take, budget: RunBudget) -> ModeResult:
+    from generate_sample_data_rest import EventHubRestClient
+    
+    client = EventHubRestClient(config["connection_string"], config["eventhub_name"],
+                                base_url=config["base_url"])
+    result = ModeResult()
+    try:
+        while not budget.done(result.events + result.failed):
+            message = take(1)[0]
+            started = time.perf_counter()
+            ok = client.send_message(message)
+            result.latencies.append(time.perf_counter() - started)
+            if ok:
+                result.events += 1
+                result.bytes += len(json.dumps(message))
+            else:
+                result.failed += 1
+    finally:
+        client.close()
+    return result
+
+def run_rest_batch(config, take, budget: RunBudget) -> ModeResult:
+    from generate_sample_data_rest import EventHubRestClient
+    
+    client = EventHubRestClient(config["connection_string"], config["eventhub_name"],
+                                base_url=config["base_url"])
+    result = ModeResult()
+    try:
+        while not budget.done(result.events + result.failed):
+            remaining = budget.remaining(result.events + result.failed)
+            batch = take(config["batch_size"] if remaining is None else min(config["batch_size"], remaining))
+            started = time.perf_counter()
+            sent = client.send_batch(batch)
+            result.latencies.append(time.perf_counter() - started)
+            result.events += sent
+            result.failed += len(batch) - sent
+        result.bytes = client.bytes_sent
+    finally:
+        client.close()
+    return result
+
+def _run_async(sender, take, config, budget: RunBudget) -> ModeResult:
+    from async_sender import AsyncSendEngine
+    
+    result = ModeResult()
+    send_batch = sender.send_batch
+    
+    async def timed_send(batch):
+        started = time.perf_counter()
+        try:
+            return await send_batch(batch)
+        finally:
+            result.latencies.append(time.perf_counter() - started)
+    
+    async def run():
+        engine = AsyncSendEngine(
+            timed_send,
+            max_in_flight=config["max_in_flight"],
+            batch_size=config["batch_size"],
+            generate_batch=take
+        )
+        
+        async def stop_after_duration():
+            if budget.duration_seconds is not None:
+                await asyncio.sleep(budget.duration_seconds)
+                engine.stop()
+        
+        timer = asyncio.create_task(stop_after_duration())
+        try:
+            stats = await engine.run(lambda: take(1)[0], budget.max_events)
+        finally:
+            timer.cancel()
+            await sender.close()
+        return stats
+    
+    stats = asyncio.run(run())
+    result.events = stats.sent
+    result.failed = stats.failed
+    return result
+
+def run_rest_async(config, take, budget: RunBudget) -> ModeResult:
+    from async_sender import AsyncRestSender
+    from generate_sample_data_rest import EventHubRestClient
+    
+    client = EventHubRestClient(config["connection_string"], config["eventhub_name"],
+                                base_url=config["base_url"])
+    sender = AsyncRestSender(client, max_in_flight=config["max_in_flight"])
+    result = _run_async(sender, take, config, budget)
+    result.bytes = sender.bytes_sent
+    client.close()
+    return result
+
+def run_sdk_single(config, take, budget: RunBudget) -> ModeResult:
+    from azure.eventhub import EventData, EventHubProducerClient
+    
+    producer = EventHubProducerClient.from_connection_string(
+        conn_str=config["sdk_connection_string"], eventhub_name=config["eventhub_name"])
+    result = ModeResult()
+    try:
+        while not budget.done(result.events + result.failed):
+            body = json.dumps(take(1)[0])
+            started = time.perf_counter()
+            try:
+                batch = producer.create_batch()
+                batch.add(EventData(body))
+                producer.send_batch(batch)
+                result.events += 1
+                result.bytes += len(body)
+            except Exception:
+                result.failed += 1
+            result.latencies.append(time.perf_counter() - started)
+    finally:
+        producer.close()
+    return result
+
+def run_sdk_batch(config, take, budget: RunBudget) -> ModeResult:
+    from azure.eventhub import EventData, EventHubProducerClient
+    
+    producer = EventHubProducerClient.from_connection_string(
+        conn_str=config["sdk_connection_string"], eventhub_name=config["eventhub_name"])
+    result = ModeResult()
+    try:
+        while not budget.done(result.events + result.failed):
+            remaining = budget.remaining(result.events + result.failed)
+            records = take(config["batch_size"] if remaining is None else min(config["batch_size"], remaining))
+            batch = producer.create_batch()
+            for record in records:
+                batch.add(EventData(json.dumps(record)))
+            started = time.perf_counter()
+            try:
+                producer.send_batch(batch)
+                result.events += len(batch)
+                result.bytes += batch.size_in_bytes
+            except Exception:
+                result.failed += len(batch)
+            result.latencies.append(time.perf_counter() - started)
+    finally:
+        producer.close()
+    return result
+
+def run_sdk_async(config, take, budget: RunBudget) -> ModeResult:
+    from async_sender import AsyncSdkSender
+    
+    sender = AsyncSdkSender(config["sdk_connection_string"], config["eventhub_name"])
+    result = _run_async(sender, take, config, budget)
+    result.bytes = sender.bytes_sent
+    return result
+
+MODE_RUNNERS = {
+    "rest-single": run_rest_single,
+    "rest-batch": run_rest_batch,
+    "rest-async": run_rest_async,
+    "sdk-single": run_sdk_single,
+    "sdk-batch": run_sdk_batch,
+    "sdk-async": run_sdk_async,
+}
+
+def _mode_process(mode: str, config: Dict[str, Any], results_queue):
+    """Run one mode in a fresh process so CPU time and peak RSS are its own."""
+    import logging
+    logging.disable(logging.CRITICAL)
+    
+    take = _cycle(build_record_pool(config["seed"]))
+    budget = RunBudget(config["duration"], config["events"])
+    cpu_before = time.process_time()
+    started = time.perf_counter()
+    try:
+        result = MODE_RUNNERS[mode](config, take, budget)
+        error = None
+    except Exception as e:
+        result = ModeResult()
+        error = str(e)
+    elapsed = max(time.perf_counter() - started, 1e-9)
+    cpu_seconds = time.process_time() - cpu_before
+    results_queue.put(_result_entry(mode, result, elapsed, cpu_seconds, peak_rss_mb(), error))
+
+def _result_entry(mode: str, result: ModeResult, elapsed: float, cpu_seconds: float,
+                  rss_mb: Optional[float], error: Optional[str]) -> Dict[str, Any]:
+    """The JSON record for one mode."""
+    latencies_ms = sorted(value * 1000 for value in result.latencies)
+    return {
+        "mode": mode,
+        "events": result.events,
+        "failed": result.failed,
+        "bytes": result.bytes,
+        "duration_seconds": round(elapsed, 3),
+        "events_per_sec": round(result.events / elapsed, 1),
+        "bytes_per_sec": round(result.bytes / elapsed, 1),
+        "sends": len(latencies_ms),
+        "latency_ms": {
+            "p50": round(percentile(latencies_ms, 0.50), 3),
+            "p95": round(percentile(latencies_ms, 0.95), 3),
+            "p99": round(percentile(latencies_ms, 0.99), 3),
+            "max": round(latencies_ms[-1], 3) if latencies_ms else 0.0,
+        },
+        "cpu_seconds": round(cpu_seconds, 3),
+        "cpu_per_1k_events_ms": round(cpu_seconds / result.events * 1e6, 3) if result.events else None,
+        "peak_rss_mb": round(rss_mb, 1) if rss_mb is not None else None,
+        "error": error,
+    }
+
+def _collect_result(mode: str, process, results_queue) -> Dict[str, Any]:
+    """Wait for a mode's result; a process that dies without one is recorded as failed."""
+    started = time.perf_counter()
+    while True:
+        try:
+            return results_queue.get(timeout=1.0)
+        except queue.Empty:
+            if process.is_alive():
+                continue
+        # The result may have been put just before the process exited
+        try:
+            return results_queue.get(timeout=1.0)
+        except queue.Empty:
+            elapsed = max(time.perf_counter() - started, 1e-9)
+            return _result_entry(mode, ModeResult(), elapsed, 0.0, None,
+                                 f"benchmark process exited with code {process.exitcode} without a result")
+
+def _stand_in_process(config: Dict[str, Any], ready, stop):
+    """Host the local stand-in in its own process."""
+    import logging
+    logging.disable(logging.CRITICAL)
+    from local_eventhub import LocalEventHub, LocalEventHubServer
+    
+    hub = LocalEventHub(
+        eventhub_name=config["eventhub_name"],
+        key_name=config["key_name"],
+        key=config["key"],
+        partition_count=4,
+        retention=100000,
+        latency_ms=config["latency_ms"]
+    )
+    server = LocalEventHubServer(hub, "127.0.0.1", config["port"]).start()
+    ready.put((server.port, server.connection_string))
+    stop.wait()
+    server.stop()
+
+def run_benchmark(modes: List[str], config: Dict[str, Any]) -> Dict[str, Any]:
+    """Run the selected modes one after another and collect their results."""
+    context = multiprocessing.get_context("spawn")
+    stand_in = None
+    stop = context.Event()
+    
+    if any(mode in REST_MODES for mode in modes) and not config.get("base_url"):
+        ready = context.Queue()
+        stand_in = context.Process(target=_stand_in_process, args=(config, ready, stop), daemon=True)
+        stand_in.start()
+        port, connection_string = ready.get(timeout=30)
+        config["base_url"] = f"http://127.0.0.1:{port}"
+        config["connection_string"] = connection_string
+    
+    results = []
+    try:
+        for mode in modes:
+            if mode in SDK_MODES and not config.get("sdk_connection_string"):
+                print(f"  {mode:12s} skipped (needs --sdk-connection-string)")
+                continue
+            results_queue = context.Queue()
+            process = context.Process(target=_mode_process, args=(mode, config, results_queue))
+            process.start()
+            result = _collect_result(mode, process, results_queue)
+            process.join()
+            results.append(result)
+            _print_result(result)
+    finally:
+        if stand_in is not None:
+            stop.set()
+            stand_in.join(timeout=10)
+    
+    return {
+        "timestamp": datetime.now(timezone.utc).isoformat().replace('+00:00', 'Z'),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "config": {
+            key: value for key, value in config.items()
+            if key not in ("connection_string", "sdk_connection_string", "key")
+        },
+        "results": results,
+    }
+
+def _print_result(result: Dict[str, Any]):
+    latency = result["latency_ms"]
+    rss = f"{result['peak_rss_mb']:.0f} MiB" if result["peak_rss_mb"] is not None else "n/a"
+    line = (
+        f"  {result['mode']:12s} {result['events_per_sec']:>10.1f} ev/s "
+        f"{result['bytes_per_sec'] / 1024 / 1024:>7.2f} MiB/s  "
+        f"p50 {latency['p50']:>7.2f} ms  p95 {latency['p95']:>7.2f} ms  p99 {latency['p99']:>7.2f} ms  "
+        f"cpu {result['cpu_seconds']:.2f}s  rss {rss}"
+    )
+    if result["failed"]:
+        line += f"  failed {result['failed']}"
+    if result["error"]:
+        line += f"  error: {result['error']}"
+    print(line)
+
+def parse_args():
+    """Parse command line options."""
+    parser = argparse.ArgumentParser(description="Benchmark Event Hub sending modes")
+    parser.add_argument("--modes", default=",".join(REST_MODES + SDK_MODES),
+                        help="Comma separated list of modes: " + ", ".join(REST_MODES + SDK_MODES))
+    parser.add_argument("--duration", type=float, default=10.0,
+                        help="Seconds per mode; pass 0 to stop on --events only")
+    parser.add_argument("--events", type=int, default=None,
+                        help="Stop each mode after this many events")
+    parser.add_argument("--batch-size", type=int, default=500)
+    parser.add_argument("--max-in-flight", type=int, default=8)
+    parser.add_argument("--latency-ms", type=float, default=0.0,
+                        help="Latency injected by the local stand-in")
+    parser.add_argument("--base-url", default=None,
+                        help="Use an already running REST endpoint instead of starting the stand-in")
+    parser.add_argument("--connection-string", default=os.getenv('EVENTHUB_CONNECTION_STRING'),
+                        help="Connection string for --base-url")
+    parser.add_argument("--sdk-connection-string", default=None,
+                        help="AMQP connection string for the sdk-* modes")
+    parser.add_argument("--eventhub", default="telemetry-data")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output", default="benchmark-results.json")
+    return parser.parse_args()
+
+def main():
+    """Main function to run the benchmark."""
+    args = parse_args()
+    modes = [mode.strip() for mode in args.modes.split(',') if mode.strip()]
+    unknown = [mode for mode in modes if mode not in MODE_RUNNERS]
+    if unknown:
+        print(f"Unknown modes: {', '.join(unknown)}")
+        sys.exit(1)
+    
+    config = {
+        "eventhub_name": args.eventhub,
+        "duration": args.duration or None,
+        "events": args.events,
+        "batch_size": args.batch_size,
+        "max_in_flight": args.max_in_flight,
+        "latency_ms": args.latency_ms,
+        "base_url": args.base_url,
+        "connection_string": args.connection_string,
+        "sdk_connection_string": args.sdk_connection_string,
+        "key_name": "RootManageSharedAccessKey",
+        "key": "benchmark-key",
+        "port": 0,
+        "seed": args.seed,
+    }
+    if config["duration"] is None and config["events"] is None:
+        print("Set --duration, --events or both")
+        sys.exit(1)
+    
+    print("Event Hub Sender Benchmark")
+    print("=" * 50)
+    report = run_benchmark(modes, config)
+    
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    print(f"\nResults written to {args.output}")
+
+if __name__ == "__main__":
+    main()
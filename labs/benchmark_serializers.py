@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+"""
+Event Serializer Benchmark
+Encodes the same telemetry records in every format serializers.py offers
+and reports the encoding cost per record and the bytes per record and per
+event body, uncompressed and gzip-compressed. Record dicts (what the
+generators send) and columnar TelemetryBatch input are timed separately;
+json.dumps() of each dict is the baseline.
+"""
+
+import argparse
+import json
+import sys
+import time
+import zlib
+from typing import Any, Callable, Dict, List
+
+from serializers import FORMATS, JSON, make_serializer
+
+try:
+    from telemetry_batch import generate_telemetry_batch
+except ImportError:
+    generate_telemetry_batch = None
+
+def best_time(run: Callable[[], Any], repeat: int) -> float:
+    """Fastest of repeat runs, in seconds."""
+    best = float('inf')
+    for _ in range(repeat):
+        started = time.perf_counter()
+        run()
+        best = min(best, time.perf_counter() - started)
+    return best
+
+def measure(name: str, encode: Callable[[], List[bytes]], join: Callable[[List[bytes]], bytes],
+            records: int, per_event: int, repeat: int) -> Dict[str, Any]:
+    """Time encode() plus joining its parts into bodies of per_event records."""
+    def run():
+        parts = encode()
+        return [join(parts[start:start + per_event]) for start in range(0, len(parts), per_event)]
+    
+    seconds = best_time(run, repeat)
+    bodies = run()
+    raw = sum(len(body) for body in bodies)
+    compressed = sum(len(zlib.compress(body, 6)) for body in bodies)
+    return {
+        "case": name,
+        "us_per_record": seconds / records * 1e6,
+        "records_per_sec": records / seconds,
+        "bytes_per_record": raw / records,
+        "bytes_per_event": raw / len(bodies),
+        "gzip_bytes_per_record": compressed / records,
+    }
+
+def run_benchmark(count: int, per_event: int, repeat: int, seed: int) -> List[Dict[str, Any]]:
+    import numpy as np
+    batch = generate_telemetry_batch(count, rng=np.random.default_rng(seed))
+    records = batch.to_records()
+    newline_join = b'\n'.join
+    results = [measure("json.dumps (baseline)", lambda: [json.dumps(record).encode('utf-8') for record in records],
+                       newline_join, count, per_event, repeat)]
+    for format_name in FORMATS:
+        serializer = make_serializer(format_name)
+        label = "json lines" if format_name == JSON and per_event > 1 else format_name
+        results.append(measure(f"{label} (dicts)", lambda: [serializer.encode(record) for record in records],
+                               serializer.join, count, per_event, repeat))
+        results.append(measure(f"{label} (columnar)", lambda: serializer.encode_batch(batch),
+                               serializer.join, count, per_event, repeat))
+    return results
+
+def parse_args():
+    """Parse command line options."""
+    parser = argparse.ArgumentParser(description="Benchmark event serialization formats")
+    parser.add_argument("--records", type=int, default=20000,
+                        help="Records encoded per run (default: 20000)")
+    parser.add_argument("--records-per-event", type=int, default=100,
+                        help="Records joined into each event body (default: 100)")
+    parser.add_argument("--repeat", type=int, default=5,
+                        help="Runs per case; the fastest counts (default: 5)")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output", default=None,
+                        help="Also write the results as JSON to this file")
+    return parser.parse_args()
+
+def main():
+    """Main function to run the benchmark."""
+    args = parse_args()
+    if generate_telemetry_batch is None:
+        print("NumPy is required for the serializer benchmark (pip install numpy)")
+        sys.exit(1)
+    
+    print("Event Serializer Benchmark")
+    print("=" * 50)
+    print(f"{args.records} records, {args.records_per_event} per event body, best of {args.repeat}\n")
+    results = run_benchmark(args.records, max(1, args.records_per_event), args.repeat, args.seed)
+    
+    print(f"  {'case':24s} {'us/rec':>7s} {'rec/s':>10s} {'B/rec':>7s} {'B/event':>9s} {'gzip B/rec':>10s}")
+    for result in results:
+        print(f"  {result['case']:24s} {result['us_per_record']:>7.2f} {result['records_per_sec']:>10.0f} "
+              f"{result['bytes_per_record']:>7.1f} {result['bytes_per_event']:>9.0f} "
+              f"{result['gzip_bytes_per_record']:>10.1f}")
+    
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump({"config": vars(args), "results": results}, f, indent=2)
+        print(f"\nResults written to {args.output}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,302 @@
+#!/usr/bin/env python3
+"""
+Change Point Detection
+Local stand-in for ANOMALYDETECTION_CHANGEPOINT, used by
+queries/07-changepoint-detection.sql.
+
+A device's history of `history` values is split in two. The newest
+quarter is the recent window and the rest is the reference window. Each
+event is scored by how unlikely the gap between the two windows' means
+is, using a Welch two-sample z-test. A persistent level shift fills the
+recent window and pushes the score toward 1. A lone spike is winsorized
+to three reference standard deviations before it enters the recent
+window, so it barely moves the recent mean.
+
+Under stationary noise the score hovers like |N(0, 1)|, so it crosses any
+single confidence level every few dozen events. IsChangePoint therefore
+treats the confidence as applying to a whole recent window: the score has
+to stay at or above 1 - (1 - confidence/100) / recent for a full recent
+window's worth of consecutive events. The alarm then re-arms only once
+the score falls back below confidence/100, so one shift is reported once.
+
+Both windows are rings with running sums (anomaly_detection.RingBufferStore):
+values leave the recent ring into the reference ring, and each event
+costs O(1) however long the history is.
+
+The Stream Analytics function uses an exchangeability martingale, so the
+scores differ from the service's; the local scorer is meant for tuning
+confidence and history size on recorded telemetry. Running this module
+backtests a file, sharding devices across worker processes.
+"""
+
+import argparse
+import json
+import logging
+import math
+import multiprocessing
+import os
+import sys
+import time
+import zlib
+from array import array
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from anomaly_detection import MIN_HISTORY, RingBufferStore, load_columns, number_list
+from saql_engine import Evaluator, Literal, SaqlError, time_unit_seconds
+from saql_windows import to_micros
+
+logger = logging.getLogger(__name__)
+
+# Values further than this many reference standard deviations from the
+# reference mean are clipped before they enter the recent window
+CLIP_DEVIATIONS = 3.0
+
+# Below this relative variance a window is treated as constant
+_FLAT_VARIANCE = 1e-12
+
+class ChangePointDetector:
+    """Incremental per-partition level-shift scoring over a sliding history."""
+    
+    def __init__(self, confidence: float = 80, history: int = 120,
+                 limit_duration: Optional[float] = None, recent: Optional[int] = None,
+                 min_history: int = MIN_HISTORY):
+        if not 0 < confidence < 100:
+            raise SaqlError("Change point confidence must be between 0 and 100 (exclusive)")
+        recent = recent or max(2, history // 4)
+        if history - recent < 2:
+            raise SaqlError("Change point history size must leave at least 2 values for the reference window")
+        self.confidence = confidence
+        # The confidence covers a recent window's worth of consecutive events
+        self.threshold = confidence / 100.0
+        self.event_threshold = 1.0 - (1.0 - self.threshold) / recent
+        self.persistence = recent
+        self.history = history
+        self.limit_duration = None if limit_duration is None else round(limit_duration * 1e6)
+        self.min_history = max(min_history, 2)
+        self.recent = RingBufferStore(recent)
+        self.reference = RingBufferStore(history - recent)
+        # Per slot: consecutive events at or above event_threshold, and 1 from
+        # a change point until the score drops below threshold again
+        self.run = array('i')
+        self.alarm = array('b')
+        self.scored = 0
+        self.change_points = 0
+    
+    def score(self, key: Any, value: Optional[float], micros: int = 0) -> Optional[Dict[str, Any]]:
+        """Add value to its partition's history and score the recent/reference split.
+        
+        Returns a {'Score', 'IsChangePoint'} record, or None when value is
+        missing. Score is None until the reference window holds
+        min_history values.
+        """
+        if value is None:
+            return None
+        value = float(value)
+        recent, reference = self.recent, self.reference
+        # Both stores allocate slots in first-seen order, so they agree
+        slot = recent.slot(key)
+        reference.slot(key)
+        if slot == len(self.alarm):
+            self.run.append(0)
+            self.alarm.append(0)
+        if self.limit_duration is not None:
+            cutoff = micros - self.limit_duration
+            reference.expire(slot, cutoff)
+            recent.expire(slot, cutoff)
+        
+        n_ref, mean_ref, var_ref = reference.stats(slot)
+        if n_ref >= 2 and var_ref > _FLAT_VARIANCE * (mean_ref * mean_ref + 1.0):
+            limit = CLIP_DEVIATIONS * math.sqrt(var_ref)
+            value = min(max(value, mean_ref - limit), mean_ref + limit)
+        evicted = recent.push(slot, value, micros)
+        if evicted is not None:
+            reference.push(slot, *evicted)
+        
+        n_ref, mean_ref, var_ref = reference.stats(slot)
+        n_rec, mean_rec, var_rec = recent.stats(slot)
+        if n_ref < self.min_history or n_rec < 2:
+            return {"Score": None, "IsChangePoint": 0}
+        
+        score = math.erf(abs(_welch_z(mean_ref, var_ref, n_ref, mean_rec, var_rec, n_rec)) / math.sqrt(2.0))
+        self.run[slot] = self.run[slot] + 1 if score >= self.event_threshold else 0
+        is_change_point = 1 if self.run[slot] >= self.persistence and not self.alarm[slot] else 0
+        if is_change_point:
+            self.alarm[slot] = 1
+        elif score < self.threshold:
+            self.alarm[slot] = 0
+        self.scored += 1
+        self.change_points += is_change_point
+        return {"Score": score, "IsChangePoint": is_change_point}
+
+def _welch_z(mean_a: float, var_a: float, n_a: int, mean_b: float, var_b: float, n_b: int) -> float:
+    """z statistic for the difference of two means with unequal variances."""
+    difference = mean_b - mean_a
+    error = var_a / n_a + var_b / n_b
+    scale = mean_a * mean_a + 1.0
+    if error <= _FLAT_VARIANCE * scale:
+        # Both windows constant: any real difference is a certain change
+        if abs(difference) <= 1e-9 * math.sqrt(scale):
+            return 0.0
+        return math.copysign(math.inf, difference)
+    return difference / math.sqrt(error)
+
+def compile_changepoint(node, compiler) -> Evaluator:
+    """Engine hook for ANOMALYDETECTION_CHANGEPOINT(value, confidence, history) OVER (...)."""
+    if len(node.args) != 3:
+        raise SaqlError("ANOMALYDETECTION_CHANGEPOINT takes (value, confidence, history size)")
+    value = compiler.compile(node.args[0])
+    if not all(isinstance(arg, Literal) for arg in node.args[1:]):
+        raise SaqlError("ANOMALYDETECTION_CHANGEPOINT confidence and history size must be constants")
+    confidence, history = node.args[1].value, node.args[2].value
+    if not isinstance(history, int):
+        raise SaqlError("ANOMALYDETECTION_CHANGEPOINT needs an integer history size")
+    
+    over = node.over
+    limit_duration = None
+    if over.limit_duration is not None:
+        unit, amount = over.limit_duration
+        limit_duration = time_unit_seconds(unit) * amount
+    keys = [compiler.compile(expr) for expr in over.partition_by]
+    when = compiler.compile(over.when) if over.when is not None else None
+    detector = ChangePointDetector(confidence, history, limit_duration)
+    
+    def changepoint(record, ts):
+        # Events that fail WHEN are neither scored nor added to the history
+        if when is not None and not when(record, ts):
+            return None
+        key = tuple(key(record, ts) for key in keys)
+        return detector.score(key, value(record, ts), to_micros(ts))
+    return changepoint
+
+# ---------------------------------------------------------------------------
+# Sharded backtesting
+# ---------------------------------------------------------------------------
+
+def shard_of(key: Any, shards: int) -> int:
+    """Stable shard for a partition key (the same in every process)."""
+    return zlib.crc32(str(key).encode('utf-8')) % shards
+
+def _score_shard(job: Tuple[List[Any], array, Optional[array], Dict[str, Any]]) -> Tuple[array, array]:
+    """Worker: score one shard's events in order; returns (scores, flags) arrays."""
+    keys, values, times, settings = job
+    detector = ChangePointDetector(**settings)
+    scores = array('d')
+    flags = array('b')
+    for index, key in enumerate(keys):
+        value = values[index]
+        result = detector.score(key, None if math.isnan(value) else value, times[index] if times is not None else 0)
+        if result is None or result["Score"] is None:
+            scores.append(math.nan)
+            flags.append(0)
+        else:
+            scores.append(result["Score"])
+            flags.append(result["IsChangePoint"])
+    return scores, flags
+
+def score_sharded(keys: Sequence[Any], values: Sequence[float], times: Optional[Sequence[int]] = None,
+                  confidence: float = 80, history: int = 120, limit_duration: Optional[float] = None,
+                  workers: int = 1) -> Tuple[array, array]:
+    """Score a recorded stream with devices sharded across worker processes.
+    
+    Every device's events stay on one worker and in their original order,
+    so results equal a single ChangePointDetector run. Returns (scores,
+    flags) arrays aligned with the input. Scores are NaN during warm-up and
+    for missing values.
+    """
+    settings = {"confidence": confidence, "history": history, "limit_duration": limit_duration}
+    ChangePointDetector(**settings)  # validate before starting workers
+    workers = max(1, workers)
+    
+    positions: List[array] = [array('q') for _ in range(workers)]
+    shard_cache: Dict[Any, int] = {}
+    for index, key in enumerate(keys):
+        shard = shard_cache.get(key)
+        if shard is None:
+            shard = shard_cache[key] = shard_of(key, workers)
+        positions[shard].append(index)
+    
+    jobs = []
+    for shard_positions in positions:
+        jobs.append((
+            [keys[index] for index in shard_positions],
+            array('d', (values[index] for index in shard_positions)),
+            None if times is None else array('q', (times[index] for index in shard_positions)),
+            settings,
+        ))
+    
+    if workers == 1:
+        results = [_score_shard(jobs[0])]
+    else:
+        with multiprocessing.get_context("spawn").Pool(workers) as pool:
+            results = pool.map(_score_shard, jobs)
+    
+    scores = array('d', bytes(8 * len(keys)))
+    flags = array('b', bytes(len(keys)))
+    for shard_positions, (shard_scores, shard_flags) in zip(positions, results):
+        for offset, index in enumerate(shard_positions):
+            scores[index] = shard_scores[offset]
+            flags[index] = shard_flags[offset]
+    return scores, flags
+
+# ---------------------------------------------------------------------------
+# Command line
+# ---------------------------------------------------------------------------
+
+def parse_args():
+    """Parse command line options."""
+    parser = argparse.ArgumentParser(description="Backtest change point detection on recorded telemetry")
+    parser.add_argument("input", help="JSON array or JSON Lines file of events")
+    parser.add_argument("--value", default="temperature", help="Field to score (default: temperature)")
+    parser.add_argument("--partition", default="deviceId", help="Field that identifies a device (default: deviceId)")
+    parser.add_argument("--confidence", default="80",
+                        help="Confidence level, or a comma-separated list to compare (default: 80)")
+    parser.add_argument("--history", default="120",
+                        help="History size, or a comma-separated list to compare (default: 120)")
+    parser.add_argument("--limit-duration", type=float, default=None, metavar="SECONDS",
+                        help="Only values this recent form the history, as LIMIT DURATION does")
+    parser.add_argument("--timestamp", default="timestamp",
+                        help="Event time field, used with --limit-duration (default: timestamp)")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1,
+                        help="Worker processes; devices are sharded across them (default: CPU count)")
+    parser.add_argument("--output", default=None,
+                        help="Write change point events with their scores as JSON Lines (first setting only)")
+    return parser.parse_args()
+
+def main():
+    """Backtest a file for each confidence/history setting and report change point counts."""
+    args = parse_args()
+    try:
+        confidences = number_list(args.confidence, float)
+        histories = number_list(args.history, int)
+        keys, values, times, records = load_columns(
+            args.input, args.value, args.partition, args.timestamp if args.limit_duration is not None else None)
+    except (OSError, ValueError, SaqlError) as e:
+        logger.error(f"✗ {e}")
+        sys.exit(1)
+    print(f"Loaded {len(records)} events for {len(set(map(str, keys)))} devices from {args.input}")
+    
+    output_written = False
+    for history in histories:
+        for confidence in confidences:
+            started = time.perf_counter()
+            try:
+                scores, flags = score_sharded(keys, values, times, confidence, history,
+                                              args.limit_duration, args.workers)
+            except SaqlError as e:
+                logger.error(f"✗ {e}")
+                sys.exit(1)
+            elapsed = max(time.perf_counter() - started, 1e-9)
+            change_points = sum(flags)
+            print(f"✓ confidence {confidence:g}, history {history}: {change_points} change points "
+                  f"in {elapsed:.2f}s ({len(flags) / elapsed:.0f} events/sec, {args.workers} workers)")
+            
+            if args.output and not output_written:
+                with open(args.output, 'w', encoding='utf-8') as handle:
+                    for record, score, flag in zip(records, scores, flags):
+                        if flag:
+                            handle.write(json.dumps(dict(record, ChangePointScore=score, IsChangePoint=1)) + "\n")
+                output_written = True
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    main()
@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+"""
+Connection String Cache
+Keeps connection strings resolved through the Azure management plane on
+disk for a limited time, keyed by resource group and namespace, so a
+generator start skips the Azure CLI call, the credential and management
+library imports and the two management-plane requests while the entry is
+fresh.
+
+The cache holds shared access keys, so the directory is created 0700 and
+the file is written 0600 through an atomic rename. On POSIX systems a
+cache file that other users can read, or that belongs to someone else, is
+ignored rather than trusted.
+"""
+
+import json
+import logging
+import os
+import tempfile
+import time
+from typing import Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+# Keys are rotated rarely; an hour bounds how long a rotated key is reused
+DEFAULT_TTL_SECONDS = 3600
+
+CACHE_FILE_NAME = "connection-strings.json"
+
+def default_cache_dir() -> str:
+    """EVENTHUB_CACHE_DIR, else the platform's per-user cache directory."""
+    configured = os.getenv('EVENTHUB_CACHE_DIR')
+    if configured:
+        return configured
+    if os.name == 'nt':
+        base = os.getenv('LOCALAPPDATA') or os.path.expanduser('~')
+    else:
+        base = os.getenv('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+    return os.path.join(base, 'eventhub-sample-data')
+
+class ConnectionStringCache:
+    """TTL-bound, permission-restricted on-disk cache of resolved connection strings."""
+    
+    def __init__(self, cache_dir: Optional[str] = None, ttl_seconds: float = DEFAULT_TTL_SECONDS):
+        self.cache_dir = cache_dir or default_cache_dir()
+        self.path = os.path.join(self.cache_dir, CACHE_FILE_NAME)
+        self.ttl_seconds = ttl_seconds
+    
+    @staticmethod
+    def key(resource_group: str, namespace: str) -> str:
+        return f"{resource_group.lower()}/{namespace.lower()}"
+    
+    def get(self, resource_group: str, namespace: str) -> Optional[str]:
+        """The cached connection string, or None if missing, expired or untrusted."""
+        if self.ttl_seconds <= 0:
+            return None
+        entry = self._load().get(self.key(resource_group, namespace))
+        if not entry or entry.get("expiresAt", 0) <= time.time():
+            return None
+        return entry.get("connectionString")
+    
+    def put(self, resource_group: str, namespace: str, connection_string: str):
+        """Store a connection string for ttl_seconds; expired entries are pruned."""
+        if self.ttl_seconds <= 0:
+            return
+        now = time.time()
+        entries = {key: entry for key, entry in self._load().items() if entry.get("expiresAt", 0) > now}
+        entries[self.key(resource_group, namespace)] = {
+            "connectionString": connection_string,
+            "expiresAt": now + self.ttl_seconds,
+        }
+        self._save(entries)
+    
+    def invalidate(self, resource_group: str, namespace: str):
+        """Forget one entry, e.g. after its key was rejected."""
+        entries = self._load()
+        if entries.pop(self.key(resource_group, namespace), None) is not None:
+            self._save(entries)
+    
+    def _load(self) -> Dict[str, Dict]:
+        try:
+            with open(self.path, 'r', encoding='utf-8') as handle:
+                if not self._trusted(os.fstat(handle.fileno())):
+                    logger.warning(f"Ignoring connection cache {self.path}: readable by other users")
+                    return {}
+                entries = json.load(handle)
+        except FileNotFoundError:
+            return {}
+        except (OSError, ValueError) as e:
+            logger.warning(f"Ignoring unreadable connection cache {self.path}: {e}")
+            return {}
+        return entries if isinstance(entries, dict) else {}
+    
+    @staticmethod
+    def _trusted(stat: os.stat_result) -> bool:
+        if os.name == 'nt':
+            # Per-user profile directories carry the access control on Windows
+            return True
+        return stat.st_uid == os.getuid() and not stat.st_mode & 0o077
+    
+    def _save(self, entries: Dict[str, Dict]):
+        try:
+            os.makedirs(self.cache_dir, mode=0o700, exist_ok=True)
+            # mkstemp creates the file 0600; renaming it over the cache means
+            # concurrent starts never read a partial file
+            fd, temporary = tempfile.mkstemp(prefix='.connection-', dir=self.cache_dir)
+            try:
+                with os.fdopen(fd, 'w', encoding='utf-8') as handle:
+                    json.dump(entries, handle)
+                os.replace(temporary, self.path)
+            except BaseException:
+                os.unlink(temporary)
+                raise
+        except OSError as e:
+            logger.warning(f"Could not write connection cache {self.path}: {e}")
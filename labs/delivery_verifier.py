@@ -0,0 +1,475 @@
+#!/usr/bin/env python3
+"""
+End-to-End Delivery Verifier
+Reads events back from every partition of an event hub, or of the local
+stand-in, in parallel. It reports what actually arrived:
+- latency histograms for send -> enqueued, enqueued -> consumed and
+  send -> consumed
+- lost and duplicate events, and events reordered within a partition,
+  found from the per-producer sequence numbers the generators embed when
+  run with --sequence-tags
+
+Compressed bodies (--compression) are decoded back into their records.
+
+Memory stays constant however long it runs. Histograms have fixed
+buckets. Sequence tracking keeps, per producer, the highest number seen
+and the gaps below it that may still be filled. A gap more than
+--reorder-window numbers behind the highest is counted as lost and
+forgotten.
+"""
+
+import argparse
+import base64
+import bisect
+import itertools
+import logging
+import math
+import os
+import random
+import socket
+import sys
+import threading
+import time
+from array import array
+from datetime import datetime, timezone
+from typing import Any, Dict, Iterable, List, Optional, Tuple, Union
+
+from serializers import decode_records
+
+logger = logging.getLogger(__name__)
+
+# Fields added to every event by SequenceTagger
+PRODUCER_FIELD = "producerId"
+SEQUENCE_FIELD = "seq"
+SENT_AT_FIELD = "sentAt"
+
+def _format_time(moment: datetime) -> str:
+    return moment.isoformat(timespec='milliseconds').replace('+00:00', 'Z')
+
+def _parse_time(text: Any) -> Optional[float]:
+    """Epoch seconds of an ISO 8601 string, or None."""
+    if not isinstance(text, str):
+        return None
+    try:
+        return datetime.fromisoformat(text.replace('Z', '+00:00')).timestamp()
+    except ValueError:
+        return None
+
+# ---------------------------------------------------------------------------
+# Producer side
+# ---------------------------------------------------------------------------
+
+class SequenceTagger:
+    """Stamps records with this producer's id, a sequence number and the send time."""
+    
+    def __init__(self, producer_id: Optional[str] = None):
+        self.producer_id = producer_id or f"{socket.gethostname()}-{os.getpid()}-{random.getrandbits(16):04x}"
+        # next() on itertools.count is atomic under the GIL, so generation
+        # threads can share one tagger
+        self._sequence = itertools.count()
+    
+    def tag(self, records: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """Tag records in place (one send time per call) and return them."""
+        sent_at = _format_time(datetime.now(timezone.utc))
+        for record in records:
+            record[PRODUCER_FIELD] = self.producer_id
+            record[SEQUENCE_FIELD] = next(self._sequence)
+            record[SENT_AT_FIELD] = sent_at
+        return records
+
+# ---------------------------------------------------------------------------
+# Statistics
+# ---------------------------------------------------------------------------
+
+class LatencyHistogram:
+    """Fixed-size log-bucketed latency histogram (about 2.3% bucket width)."""
+    
+    BUCKETS_PER_DECADE = 100
+    MIN_MS = 0.01
+    DECADES = 9  # 0.01 ms to 10^7 ms (about 2.8 hours)
+    
+    def __init__(self, name: str):
+        self.name = name
+        self.counts = array('q', bytes(8 * (self.BUCKETS_PER_DECADE * self.DECADES + 1)))
+        self.count = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+        # Negative latencies mean the producer's and consumer's clocks disagree
+        self.negative = 0
+    
+    def record(self, seconds: float):
+        ms = seconds * 1000.0
+        if ms < 0:
+            self.negative += 1
+            ms = 0.0
+        if ms <= self.MIN_MS:
+            index = 0
+        else:
+            index = min(len(self.counts) - 1,
+                        int(math.log10(ms / self.MIN_MS) * self.BUCKETS_PER_DECADE) + 1)
+        self.counts[index] += 1
+        self.count += 1
+        self.total_ms += ms
+        self.max_ms = max(self.max_ms, ms)
+    
+    def percentile(self, fraction: float) -> float:
+        """Upper bound in ms of the bucket holding the given fraction of samples."""
+        if not self.count:
+            return 0.0
+        target = max(1, math.ceil(fraction * self.count))
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if seen >= target:
+                return min(self.max_ms, self.MIN_MS * 10 ** (index / self.BUCKETS_PER_DECADE))
+        return self.max_ms
+    
+    def summary(self) -> str:
+        if not self.count:
+            return f"{self.name}: no samples"
+        skew = f", {self.negative} negative (clock skew)" if self.negative else ""
+        return (f"{self.name}: p50 {self.percentile(0.5):.1f} ms, p90 {self.percentile(0.9):.1f} ms, "
+                f"p99 {self.percentile(0.99):.1f} ms, max {self.max_ms:.1f} ms, "
+                f"mean {self.total_ms / self.count:.1f} ms{skew}")
+
+class _ProducerState:
+    __slots__ = ("lowest", "highest", "gaps", "received")
+    
+    def __init__(self, sequence: int):
+        # The reader may join mid-stream, so the range starts at the first
+        # number seen and grows both ways
+        self.lowest = sequence
+        self.highest = sequence - 1
+        # Sorted, disjoint [first, last] ranges of sequence numbers not seen yet
+        self.gaps: List[List[int]] = []
+        self.received = 0
+
+class SequenceTracker:
+    """Gap, duplicate and reorder detection over per-producer sequence numbers.
+    
+    A producer's events are spread over partitions that are read in
+    parallel, so a number below the highest seen is normal: it fills a gap
+    and counts as late. A number that fills no gap is a duplicate; one
+    older than the reorder window can no longer be told apart and counts
+    as stale. Within one partition a producer's numbers must rise, so a
+    drop there counts as reordered.
+    """
+    
+    def __init__(self, reorder_window: int = 100000):
+        self.reorder_window = reorder_window
+        self.producers: Dict[str, _ProducerState] = {}
+        self._last_in_partition: Dict[Tuple[str, str], int] = {}
+        self.lost = 0
+        self.late = 0
+        self.duplicates = 0
+        self.stale = 0
+        self.reordered = 0
+    
+    def observe(self, producer: str, sequence: int, partition: str):
+        state = self.producers.get(producer)
+        if state is None:
+            state = self.producers[producer] = _ProducerState(sequence)
+        state.received += 1
+        
+        if sequence > state.highest:
+            if sequence > state.highest + 1:
+                state.gaps.append([state.highest + 1, sequence - 1])
+            state.highest = sequence
+            self._expire(state)
+        elif sequence < state.lowest and sequence >= state.highest - self.reorder_window:
+            # Earlier than anything seen, e.g. read first from a slower partition
+            if sequence < state.lowest - 1:
+                state.gaps.insert(0, [sequence + 1, state.lowest - 1])
+            state.lowest = sequence
+        elif not self._fill(state, sequence):
+            if sequence < state.highest - self.reorder_window:
+                self.stale += 1
+            else:
+                self.duplicates += 1
+            return
+        
+        key = (producer, partition)
+        last = self._last_in_partition.get(key)
+        if last is not None and sequence < last:
+            self.reordered += 1
+        else:
+            self._last_in_partition[key] = sequence
+    
+    def _fill(self, state: _ProducerState, sequence: int) -> bool:
+        gaps = state.gaps
+        index = bisect.bisect_right(gaps, [sequence, math.inf]) - 1
+        if index < 0 or gaps[index][1] < sequence:
+            return False
+        first, last = gaps[index]
+        if first == last:
+            del gaps[index]
+        elif sequence == first:
+            gaps[index][0] += 1
+        elif sequence == last:
+            gaps[index][1] -= 1
+        else:
+            gaps[index][1] = sequence - 1
+            gaps.insert(index + 1, [sequence + 1, last])
+        self.late += 1
+        return True
+    
+    def _expire(self, state: _ProducerState):
+        horizon = state.highest - self.reorder_window
+        gaps = state.gaps
+        expired = 0
+        while expired < len(gaps) and gaps[expired][1] < horizon:
+            self.lost += gaps[expired][1] - gaps[expired][0] + 1
+            expired += 1
+        if expired:
+            del gaps[:expired]
+    
+    @property
+    def missing(self) -> int:
+        """Numbers not seen yet that are still inside the reorder window."""
+        return sum(last - first + 1 for state in self.producers.values() for first, last in state.gaps)
+    
+    @property
+    def received(self) -> int:
+        return sum(state.received for state in self.producers.values())
+    
+    def summary(self) -> str:
+        return (f"{len(self.producers)} producers, {self.lost} lost, {self.missing} missing (within window), "
+                f"{self.duplicates} duplicates, {self.reordered} reordered within a partition, "
+                f"{self.late} arrived after a later number, {self.stale} too late to classify")
+
+# ---------------------------------------------------------------------------
+# Decoding and verification
+# ---------------------------------------------------------------------------
+
+def decode_body(body: Union[str, bytes]) -> List[Dict[str, Any]]:
+    """Records carried by one event body: JSON (an object, an array or JSON
+    Lines), CSV or Avro, plain or gzip/deflate-compressed."""
+    return decode_records(body)
+
+class DeliveryVerifier:
+    """Thread-safe sink for received event batches."""
+    
+    def __init__(self, reorder_window: int = 100000, report_interval: float = 5.0):
+        self.sequences = SequenceTracker(reorder_window)
+        self.ingest = LatencyHistogram("send -> enqueued")
+        self.consume = LatencyHistogram("enqueued -> consumed")
+        self.end_to_end = LatencyHistogram("send -> consumed")
+        self.events = 0
+        self.records = 0
+        self.untagged = 0
+        self.undecodable = 0
+        self.report_interval = report_interval
+        self.started = time.monotonic()
+        self.last_event_at = self.started
+        self._last_report = self.started
+        self._lock = threading.Lock()
+    
+    def observe_batch(self, partition: str, events: Iterable[Tuple[Union[str, bytes], Optional[float]]]):
+        """Account for (body, enqueued epoch seconds) pairs received together."""
+        consumed = time.time()
+        decoded = []
+        for body, enqueued in events:
+            try:
+                decoded.append((decode_body(body), enqueued))
+            except (ValueError, OSError) as e:
+                logger.debug(f"Undecodable event body: {e}")
+                decoded.append((None, enqueued))
+        
+        with self._lock:
+            for records, enqueued in decoded:
+                self.events += 1
+                if records is None:
+                    self.undecodable += 1
+                    continue
+                if enqueued is not None:
+                    self.consume.record(consumed - enqueued)
+                for record in records:
+                    self._observe_record(record, partition, enqueued, consumed)
+            if decoded:
+                self.last_event_at = time.monotonic()
+            self._maybe_report()
+    
+    def _observe_record(self, record: Dict[str, Any], partition: str, enqueued: Optional[float], consumed: float):
+        self.records += 1
+        producer = record.get(PRODUCER_FIELD)
+        sequence = record.get(SEQUENCE_FIELD)
+        if producer is None or not isinstance(sequence, int):
+            self.untagged += 1
+            return
+        self.sequences.observe(producer, sequence, partition)
+        sent = _parse_time(record.get(SENT_AT_FIELD))
+        if sent is None:
+            return
+        if enqueued is not None:
+            self.ingest.record(enqueued - sent)
+        self.end_to_end.record(consumed - sent)
+    
+    def _maybe_report(self):
+        now = time.monotonic()
+        if now - self._last_report < self.report_interval:
+            return
+        self._last_report = now
+        elapsed = now - self.started
+        print(f"[{elapsed:7.1f}s] {self.records} records ({self.records / max(elapsed, 1e-9):.0f}/s), "
+              f"{self.sequences.lost} lost, {self.sequences.duplicates} duplicates, "
+              f"send -> consumed p99 {self.end_to_end.percentile(0.99):.1f} ms")
+    
+    def summary_lines(self) -> List[str]:
+        elapsed = max(time.monotonic() - self.started, 1e-9)
+        lines = [f"{self.records} records in {self.events} events over {elapsed:.1f}s "
+                 f"({self.records / elapsed:.0f} records/sec)"]
+        if self.untagged or self.undecodable:
+            lines.append(f"{self.untagged} records without sequence tags, {self.undecodable} undecodable events")
+        lines.append(f"Sequence: {self.sequences.summary()}")
+        lines.extend(f"Latency {histogram.summary()}" for histogram in (self.ingest, self.consume, self.end_to_end))
+        return lines
+
+# ---------------------------------------------------------------------------
+# Readers
+# ---------------------------------------------------------------------------
+
+class StandInReader:
+    """Polls every partition of the local stand-in's read endpoint, one thread each."""
+    
+    def __init__(self, base_url: str, eventhub_name: str, verifier: DeliveryVerifier,
+                 batch_size: int = 1000, poll_interval: float = 0.05, from_start: bool = False):
+        import requests
+        self.session = requests.Session()
+        self.url = f"{base_url.rstrip('/')}/{eventhub_name}/partitions"
+        self.verifier = verifier
+        self.batch_size = batch_size
+        self.poll_interval = poll_interval
+        self.from_start = from_start
+        self._stop = threading.Event()
+    
+    def run(self, should_stop):
+        partitions = self.session.get(self.url, timeout=10).json()
+        threads = []
+        for partition in partitions:
+            start = partition["firstSequenceNumber"] if self.from_start else partition["lastSequenceNumber"] + 1
+            thread = threading.Thread(target=self._poll, args=(partition["partitionId"], start), daemon=True)
+            thread.start()
+            threads.append(thread)
+        print(f"Reading {len(partitions)} partitions from {'the start' if self.from_start else 'the end'}")
+        try:
+            while not should_stop():
+                time.sleep(0.1)
+        finally:
+            self._stop.set()
+            for thread in threads:
+                thread.join(timeout=5)
+    
+    def _poll(self, partition_id: str, next_sequence: int):
+        url = f"{self.url}/{partition_id}/events"
+        while not self._stop.is_set():
+            try:
+                response = self.session.get(url, params={"from": next_sequence, "limit": self.batch_size}, timeout=10)
+                response.raise_for_status()
+                page = response.json()
+            except Exception as e:
+                logger.warning(f"Read from partition {partition_id} failed: {e}")
+                self._stop.wait(1.0)
+                continue
+            events = page["events"]
+            if events:
+                self.verifier.observe_batch(partition_id, [
+                    (base64.b64decode(event["body"]) if event.get("bodyEncoding") == "base64" else event["body"],
+                     _parse_time(event.get("enqueuedTime")))
+                    for event in events
+                ])
+            next_sequence = page["nextSequence"]
+            if len(events) < self.batch_size:
+                self._stop.wait(self.poll_interval)
+
+class EventHubReader:
+    """Receives from every partition of an event hub with the SDK consumer."""
+    
+    def __init__(self, connection_string: str, eventhub_name: str, verifier: DeliveryVerifier,
+                 consumer_group: str = "$Default", batch_size: int = 1000, from_start: bool = False):
+        from azure.eventhub import EventHubConsumerClient
+        self.client = EventHubConsumerClient.from_connection_string(
+            connection_string, consumer_group=consumer_group, eventhub_name=eventhub_name)
+        self.verifier = verifier
+        self.batch_size = batch_size
+        self.from_start = from_start
+    
+    def _on_batch(self, partition_context, events):
+        self.verifier.observe_batch(partition_context.partition_id, [
+            (b''.join(event.body), event.enqueued_time.timestamp() if event.enqueued_time else None)
+            for event in events
+        ])
+    
+    def run(self, should_stop):
+        # receive_batch blocks and reads the partitions on its own threads;
+        # closing the client from here ends it
+        receiver = threading.Thread(target=self.client.receive_batch, kwargs={
+            "on_event_batch": self._on_batch,
+            "max_batch_size": self.batch_size,
+            "max_wait_time": 1,
+            "starting_position": "-1" if self.from_start else "@latest",
+        }, daemon=True)
+        receiver.start()
+        print(f"Receiving from all partitions from {'the start' if self.from_start else 'the end'}")
+        try:
+            while not should_stop() and receiver.is_alive():
+                time.sleep(0.1)
+        finally:
+            self.client.close()
+            receiver.join(timeout=10)
+
+# ---------------------------------------------------------------------------
+# Command line
+# ---------------------------------------------------------------------------
+
+def parse_args():
+    """Parse command line options."""
+    parser = argparse.ArgumentParser(description="Measure end-to-end latency and loss of generated telemetry")
+    parser.add_argument("--eventhub", default="telemetry-data")
+    parser.add_argument("--base-url", default=os.getenv('EVENTHUB_REST_BASE_URL'),
+                        help="Read from the local stand-in at this URL instead of Azure")
+    parser.add_argument("--consumer-group", default="$Default")
+    parser.add_argument("--from-start", action="store_true",
+                        help="Read retained events too, not only events sent after start")
+    parser.add_argument("--batch-size", type=int, default=1000, help="Events per receive (default: 1000)")
+    parser.add_argument("--duration", type=float, default=None, help="Stop after this many seconds")
+    parser.add_argument("--idle-timeout", type=float, default=None,
+                        help="Stop once no events arrived for this many seconds")
+    parser.add_argument("--reorder-window", type=int, default=100000,
+                        help="Sequence numbers a missing event may lag before it counts as lost")
+    parser.add_argument("--report-interval", type=float, default=5.0)
+    return parser.parse_args()
+
+def main():
+    """Read until stopped, then print the loss and latency report."""
+    args = parse_args()
+    verifier = DeliveryVerifier(args.reorder_window, args.report_interval)
+    if args.base_url:
+        reader = StandInReader(args.base_url, args.eventhub, verifier, args.batch_size, from_start=args.from_start)
+    else:
+        connection_string = os.getenv('EVENTHUB_CONNECTION_STRING')
+        if not connection_string:
+            logger.error("✗ Set EVENTHUB_CONNECTION_STRING, or --base-url for the local stand-in")
+            sys.exit(1)
+        try:
+            reader = EventHubReader(connection_string, args.eventhub, verifier, args.consumer_group,
+                                    args.batch_size, args.from_start)
+        except ImportError:
+            logger.error("✗ Reading from Azure needs azure-eventhub: pip install -r requirements.txt")
+            sys.exit(1)
+    
+    def should_stop() -> bool:
+        now = time.monotonic()
+        if args.duration is not None and now - verifier.started >= args.duration:
+            return True
+        return args.idle_timeout is not None and now - verifier.last_event_at >= args.idle_timeout
+    
+    try:
+        reader.run(should_stop)
+    except KeyboardInterrupt:
+        print("\n⏹️  Stopping verifier...")
+    for line in verifier.summary_lines():
+        print(line)
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    main()
@@ -0,0 +1,255 @@
+#!/usr/bin/env python3
+"""
+Event-Time Ordering for the Offline SAQL Engine
+Puts out-of-order input back into event-time order the way a Stream
+Analytics job does with its event ordering policy:
+
+- Out-of-order tolerance: events are held in a per-partition heap until the
+  partition's watermark (latest event time minus the tolerance) passes them,
+  then released in timestamp order. Events that arrive even further out of
+  order are adjusted to the watermark or dropped.
+- Late arrival tolerance: events whose event time is more than the tolerance
+  behind their arrival time (EventEnqueuedUtcTime) are adjusted to arrival
+  time minus the tolerance, or dropped.
+
+The stage emits watermark markers, (time, None) tuples, that tell window
+operators no earlier event will follow, so windows close on time progress
+rather than on the next event. The buffer is bounded: when it is full the
+oldest event is released early. Counters and a disorder distribution help
+size the tolerance settings.
+"""
+
+import heapq
+import itertools
+import logging
+from datetime import datetime
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from saql_engine import Event, SaqlError, parse_datetime
+from saql_windows import QuantileSketch, from_micros, to_micros
+
+logger = logging.getLogger(__name__)
+
+ADJUST = "adjust"
+DROP = "drop"
+
+class EventOrderingPolicy:
+    """Event ordering settings, in seconds, mirroring the job's Event ordering page."""
+    
+    def __init__(self, out_of_order_tolerance: float = 0.0,
+                 late_arrival_tolerance: Optional[float] = 5.0,
+                 action: str = ADJUST,
+                 partition_field: Optional[str] = "PartitionId",
+                 arrival_field: str = "EventEnqueuedUtcTime",
+                 max_buffered_events: int = 100000,
+                 watermark_interval: float = 1.0):
+        if action not in (ADJUST, DROP):
+            raise SaqlError(f"Event ordering action must be '{ADJUST}' or '{DROP}'")
+        if out_of_order_tolerance < 0 or (late_arrival_tolerance is not None and late_arrival_tolerance < 0):
+            raise SaqlError("Event ordering tolerances must not be negative")
+        self.out_of_order_tolerance = out_of_order_tolerance
+        self.late_arrival_tolerance = late_arrival_tolerance
+        self.action = action
+        self.partition_field = partition_field
+        self.arrival_field = arrival_field
+        self.max_buffered_events = max_buffered_events
+        self.watermark_interval = watermark_interval
+    
+    def describe(self) -> str:
+        late = "off" if self.late_arrival_tolerance is None else f"{self.late_arrival_tolerance:g}s"
+        return (f"out-of-order tolerance {self.out_of_order_tolerance:g}s, late arrival tolerance {late}, "
+                f"action {self.action}")
+
+class OrderingStats:
+    """What the ordering stage did to one input."""
+    
+    def __init__(self):
+        self.events = 0
+        self.released = 0
+        self.out_of_order = 0
+        self.adjusted_out_of_order = 0
+        self.dropped_out_of_order = 0
+        self.adjusted_late = 0
+        self.dropped_late = 0
+        self.forced_releases = 0
+        self.max_buffered = 0
+        self.watermarks = 0
+        # How far behind the partition's latest event time each
+        # out-of-order event arrived, in seconds
+        self.disorder = QuantileSketch()
+    
+    def disorder_percentile(self, fraction: float) -> float:
+        return self.disorder.quantile(fraction) or 0.0
+    
+    def summary(self) -> str:
+        lines = [
+            f"events {self.events}, released {self.released}, out of order {self.out_of_order}, "
+            f"max buffered {self.max_buffered}, forced releases {self.forced_releases}",
+            f"out-of-order beyond tolerance: adjusted {self.adjusted_out_of_order}, "
+            f"dropped {self.dropped_out_of_order}; late arrivals: adjusted {self.adjusted_late}, "
+            f"dropped {self.dropped_late}",
+        ]
+        if self.out_of_order:
+            lines.append(
+                f"disorder p50 {self.disorder_percentile(0.5):.3f}s, p95 {self.disorder_percentile(0.95):.3f}s, "
+                f"p99 {self.disorder_percentile(0.99):.3f}s, max {self.disorder_percentile(1.0):.3f}s "
+                f"(an out-of-order tolerance near p99 keeps 99% of these events in place)"
+            )
+        return "\n".join(lines)
+
+class _Partition:
+    __slots__ = ('heap', 'max_time')
+    
+    def __init__(self):
+        self.heap: List[Tuple[int, int, datetime, Dict[str, Any]]] = []
+        self.max_time: Optional[int] = None
+
+class ReorderBuffer:
+    """Per-partition heaps released in event-time order behind a watermark.
+    
+    The watermark of a partition is its latest event time minus the
+    out-of-order tolerance; the stage's watermark is the minimum over the
+    partitions seen so far, so a slow partition holds back the others just as
+    in a Stream Analytics job.
+    """
+    
+    def __init__(self, policy: EventOrderingPolicy):
+        self.policy = policy
+        self.tolerance = round(policy.out_of_order_tolerance * 1e6)
+        self.late_tolerance = (None if policy.late_arrival_tolerance is None
+                               else round(policy.late_arrival_tolerance * 1e6))
+        self.watermark_step = max(1, round(policy.watermark_interval * 1e6))
+        self.partitions: Dict[Any, _Partition] = {}
+        self.buffered = 0
+        self.released_until: Optional[int] = None
+        self.last_watermark: Optional[int] = None
+        self.stats = OrderingStats()
+        self._sequence = itertools.count()
+    
+    def _watermark(self) -> Optional[int]:
+        if not self.partitions:
+            return None
+        return min(partition.max_time for partition in self.partitions.values()) - self.tolerance
+    
+    def run(self, events: Iterable[Event]) -> Iterator[Event]:
+        """Reorder (event time, record) pairs; yields events and (watermark, None) markers."""
+        stats = self.stats
+        partition_field = self.policy.partition_field
+        for ts, record in events:
+            stats.events += 1
+            micros = to_micros(ts)
+            late_micros = self._apply_late_policy(micros, record)
+            if late_micros is None:
+                continue
+            if late_micros != micros:
+                micros = late_micros
+                ts = from_micros(micros)
+            
+            key = record.get(partition_field) if partition_field else None
+            partition = self.partitions.get(key)
+            if partition is None:
+                partition = self.partitions[key] = _Partition()
+            
+            emitted = self._emitted_until()
+            if partition.max_time is None or micros >= partition.max_time:
+                if emitted is not None and micros < emitted:
+                    # New for its partition, but behind what was already
+                    # released, e.g. the first event of a new partition
+                    stats.out_of_order += 1
+                    stats.disorder.add((emitted - micros) / 1e6)
+                    adjusted = self._apply_out_of_order_policy(micros, emitted)
+                    if adjusted is None:
+                        if partition.max_time is None:
+                            del self.partitions[key]
+                        continue
+                    micros = adjusted
+                    ts = from_micros(micros)
+                partition.max_time = micros
+            else:
+                stats.out_of_order += 1
+                stats.disorder.add((partition.max_time - micros) / 1e6)
+                floor = partition.max_time - self.tolerance
+                if emitted is not None:
+                    floor = max(floor, emitted)
+                adjusted = self._apply_out_of_order_policy(micros, floor)
+                if adjusted is None:
+                    continue
+                if adjusted != micros:
+                    micros = adjusted
+                    ts = from_micros(micros)
+            
+            heapq.heappush(partition.heap, (micros, next(self._sequence), ts, record))
+            self.buffered += 1
+            if self.buffered > stats.max_buffered:
+                stats.max_buffered = self.buffered
+            
+            yield from self._release(self._watermark())
+            while self.buffered > self.policy.max_buffered_events:
+                # Bounded memory: give up waiting for the oldest event's stragglers
+                stats.forced_releases += 1
+                yield from self._release(self._oldest_buffered())
+        
+        # End of input: everything left is in order by construction
+        yield from self._release(None)
+    
+    def _apply_late_policy(self, micros: int, record: Dict[str, Any]) -> Optional[int]:
+        if self.late_tolerance is None:
+            return micros
+        arrival = parse_datetime(record.get(self.policy.arrival_field))
+        if arrival is None:
+            return micros
+        earliest = to_micros(arrival) - self.late_tolerance
+        if micros >= earliest:
+            return micros
+        if self.policy.action == DROP:
+            self.stats.dropped_late += 1
+            return None
+        self.stats.adjusted_late += 1
+        return earliest
+    
+    def _emitted_until(self) -> Optional[int]:
+        """Latest event time or watermark already yielded; nothing earlier may follow."""
+        if self.released_until is None:
+            return self.last_watermark
+        if self.last_watermark is None:
+            return self.released_until
+        return max(self.released_until, self.last_watermark)
+    
+    def _apply_out_of_order_policy(self, micros: int, floor: int) -> Optional[int]:
+        """Handle an event older than floor; returns its (possibly new) time, or None to drop it."""
+        if micros >= floor:
+            return micros
+        if self.policy.action == DROP:
+            self.stats.dropped_out_of_order += 1
+            return None
+        self.stats.adjusted_out_of_order += 1
+        return floor
+    
+    def _oldest_buffered(self) -> int:
+        return min(partition.heap[0][0] for partition in self.partitions.values() if partition.heap)
+    
+    def _release(self, watermark: Optional[int]) -> Iterator[Event]:
+        """Yield buffered events up to watermark (all if None) in time order, then a marker."""
+        partitions = [partition for partition in self.partitions.values() if partition.heap]
+        while partitions:
+            # Few partitions: a linear scan of the heap tops is cheapest
+            best = min(partitions, key=lambda partition: partition.heap[0][0])
+            micros = best.heap[0][0]
+            if watermark is not None and micros > watermark:
+                break
+            _, _, ts, record = heapq.heappop(best.heap)
+            if not best.heap:
+                partitions.remove(best)
+            self.buffered -= 1
+            self.stats.released += 1
+            self.released_until = micros
+            yield ts, record
+        
+        if watermark is None:
+            return
+        if self.released_until is not None:
+            watermark = max(watermark, self.released_until)
+        if self.last_watermark is None or watermark >= self.last_watermark + self.watermark_step:
+            self.last_watermark = watermark
+            self.stats.watermarks += 1
+            yield from_micros(watermark), None
@@ -0,0 +1,332 @@
+#!/usr/bin/env python3
+"""
+Adaptive Flow Control for Event Hub Senders
+AIMD (additive increase, multiplicative decrease) tuning of batch size and
+concurrency, Retry-After aware jittered exponential backoff, and a bounded
+retry buffer, so senders can run right at the hub's throttle limit without
+dropping events.
+"""
+
+import heapq
+import itertools
+import logging
+import random
+import time
+from typing import Any, List, Optional, Tuple
+
+from metrics import METRICS
+from serializers import encode_records
+
+logger = logging.getLogger(__name__)
+
+# HTTP statuses that mean "slow down and try again"; 0 stands for a network error
+THROTTLE_STATUSES = (429, 503)
+RETRYABLE_STATUSES = (0, 408, 429, 500, 502, 503, 504)
+
+# azure-eventhub reports ServerBusy as a generic EventHubError; these transient
+# error types are matched by name so this module doesn't need the SDK installed
+SDK_RETRYABLE_ERRORS = ("OperationTimeoutError", "ConnectionLostError", "ConnectError")
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """Parse a Retry-After header given in seconds; HTTP dates are ignored."""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        return None
+
+def is_sdk_throttle_error(error: Exception) -> bool:
+    """True if an azure-eventhub error means the namespace is throttling (ServerBusy)."""
+    text = str(error).lower()
+    return "server-busy" in text or "serverbusy" in text
+
+def is_sdk_retryable_error(error: Exception) -> bool:
+    """True if an azure-eventhub send error is worth retrying."""
+    return is_sdk_throttle_error(error) or type(error).__name__ in SDK_RETRYABLE_ERRORS
+
+class RetryPolicy:
+    """Jittered exponential backoff that honors a server-provided Retry-After.
+    
+    Uses "full jitter": the delay is uniform between 0 and the exponential
+    cap, which spreads retries from many senders instead of synchronizing them.
+    """
+    
+    def __init__(self, max_attempts: int = 10, base_delay: float = 0.1,
+                 max_delay: float = 30.0):
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+    
+    def delay(self, attempt: int, retry_after: Optional[float] = None) -> float:
+        """Seconds to wait before retry number attempt (1 for the first retry)."""
+        cap = min(self.max_delay, self.base_delay * (2 ** (attempt - 1)))
+        backoff = random.uniform(0, cap)
+        if retry_after is not None:
+            # Never retry earlier than the service asked; add jitter on top
+            return retry_after + backoff * 0.1
+        return backoff
+    
+    def should_retry(self, attempt: int) -> bool:
+        return attempt < self.max_attempts
+
+class AimdController:
+    """Additive-increase / multiplicative-decrease control of one integer knob.
+    
+    on_success() adds increase (up to maximum); on_throttle() multiplies by
+    decrease_factor (down to minimum). Throttles that arrive within cooldown
+    seconds of the last decrease are treated as the same congestion event.
+    """
+    
+    def __init__(self, initial: float, minimum: float, maximum: float,
+                 increase: float = 1.0, decrease_factor: float = 0.5,
+                 cooldown: float = 1.0):
+        self.value = float(initial)
+        self.minimum = minimum
+        self.maximum = maximum
+        self.increase = increase
+        self.decrease_factor = decrease_factor
+        self.cooldown = cooldown
+        self.decreases = 0
+        self._last_decrease = float('-inf')
+    
+    @property
+    def current(self) -> int:
+        return max(int(self.minimum), int(self.value))
+    
+    def on_success(self):
+        self.value = min(self.maximum, self.value + self.increase)
+    
+    def on_throttle(self):
+        now = time.monotonic()
+        if now - self._last_decrease < self.cooldown:
+            return
+        self._last_decrease = now
+        self.decreases += 1
+        self.value = max(self.minimum, self.value * self.decrease_factor)
+
+class RetryBuffer:
+    """Bounded buffer of payloads waiting to be retried, ordered by when they are due.
+    
+    Capacity is counted in events. When it is full, callers should stop taking
+    new data and drain due retries instead (backpressure) rather than drop.
+    """
+    
+    def __init__(self, max_events: int = 100000):
+        self.max_events = max_events
+        self.events = 0
+        self._heap: List[Tuple[float, int, Any, int, int]] = []
+        self._counter = itertools.count()
+    
+    def __len__(self) -> int:
+        return len(self._heap)
+    
+    @property
+    def full(self) -> bool:
+        return self.events >= self.max_events
+    
+    def put(self, payload: Any, event_count: int, attempt: int, delay: float):
+        """Schedule payload for retry after delay seconds."""
+        heapq.heappush(self._heap, (time.monotonic() + delay, next(self._counter), payload, event_count, attempt))
+        self.events += event_count
+    
+    def next_due_in(self) -> Optional[float]:
+        """Seconds until the earliest retry is due, or None if empty."""
+        if not self._heap:
+            return None
+        return max(0.0, self._heap[0][0] - time.monotonic())
+    
+    def pop_due(self) -> Optional[Tuple[Any, int, int]]:
+        """Remove and return (payload, event_count, attempt) if one is due."""
+        if not self._heap or self._heap[0][0] > time.monotonic():
+            return None
+        _, _, payload, event_count, attempt = heapq.heappop(self._heap)
+        self.events -= event_count
+        return payload, event_count, attempt
+
+class FlowStats:
+    """Counters for a flow-controlled sender."""
+    
+    def __init__(self):
+        self.sent = 0
+        self.failed = 0
+        self.throttled = 0
+        self.retries = 0
+    
+    def summary(self) -> str:
+        return (f"sent {self.sent}, failed {self.failed}, "
+                f"throttled responses {self.throttled}, retries {self.retries}")
+
+class AdaptiveRestSender:
+    """Flow-controlled batch sending on top of EventHubRestClient.
+    
+    The number of events per POST is tuned by AIMD: it grows while sends
+    succeed and halves once per throttle episode, i.e. per run of 429/503
+    responses without a success in between. Throttled or failed requests go
+    to a bounded retry buffer and are re-sent after a jittered backoff (or
+    the server's Retry-After). A throttle also holds back the whole sender:
+    no new chunk is posted until that backoff has passed. When the buffer is
+    full, send() blocks draining it, which pushes back on the caller instead
+    of dropping events.
+    """
+    
+    def __init__(self, client, retry_policy: Optional[RetryPolicy] = None,
+                 batch_control: Optional[AimdController] = None,
+                 retry_buffer_events: int = 100000):
+        self.client = client
+        self.retry_policy = retry_policy or RetryPolicy()
+        self.batch_control = batch_control or AimdController(
+            initial=100, minimum=1, maximum=5000, increase=50)
+        self.retry_buffer = RetryBuffer(retry_buffer_events)
+        self.stats = FlowStats()
+        # time.monotonic() before which nothing is posted after a throttle
+        self._blocked_until = 0.0
+        self._throttle_episode = False
+    
+    def send(self, messages: Any, partition_key: Optional[str] = None,
+             partition_id: Optional[str] = None) -> int:
+        """Send messages (record dicts or a TelemetryBatch) with flow control.
+        
+        Returns events confirmed sent during this call.
+        """
+        sent_before = self.stats.sent
+        url = self.client.messages_url if partition_id is None else self.client.partition_url(partition_id)
+        payloads = encode_records(self.client.serializer, messages)
+        
+        self._process_due_retries()
+        position = 0
+        while position < len(payloads):
+            chunk = payloads[position:position + self.batch_control.current]
+            position += len(chunk)
+            for group in self.client._pack_batches(chunk, partition_key):
+                self._wait_while_blocked()
+                self._attempt((url, group), len(group), 1)
+            
+            # Backpressure: don't take more data while the retry buffer is full
+            while self.retry_buffer.full:
+                self._wait_for_retry()
+        
+        return self.stats.sent - sent_before
+    
+    def flush(self, timeout: Optional[float] = None) -> bool:
+        """Retry everything still buffered. Returns True if the buffer emptied."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while len(self.retry_buffer):
+            if deadline is not None and time.monotonic() >= deadline:
+                return False
+            self._wait_for_retry()
+        return True
+    
+    def _wait_for_retry(self):
+        # A retry that is due still waits out a throttle's block
+        wait = max(self.retry_buffer.next_due_in() or 0.0, self._blocked_until - time.monotonic())
+        if wait > 0:
+            time.sleep(wait)
+        self._process_due_retries()
+    
+    def _wait_while_blocked(self):
+        """Hold new data back until a throttle's backoff has passed; due retries go first."""
+        while True:
+            wait = self._blocked_until - time.monotonic()
+            if wait > 0:
+                time.sleep(wait)
+            self._process_due_retries()
+            if self._blocked_until <= time.monotonic():
+                return
+    
+    def _process_due_retries(self):
+        while time.monotonic() >= self._blocked_until:
+            item = self.retry_buffer.pop_due()
+            if item is None:
+                return
+            payload, event_count, attempt = item
+            METRICS.queue_depth.set(self.retry_buffer.events)
+            self.stats.retries += 1
+            self._attempt(payload, event_count, attempt)
+    
+    def _attempt(self, payload, event_count: int, attempt: int):
+        url, group = payload
+        started = time.perf_counter()
+        status, retry_after = self.client.post_group(url, group)
+        
+        if status == 201:
+            self.stats.sent += event_count
+            METRICS.sent.inc(event_count)
+            METRICS.send_latency.observe(time.perf_counter() - started)
+            self.batch_control.on_success()
+            self._throttle_episode = False
+            return
+        
+        if status == 413 and len(group) > 1:
+            # Too large for the service: split and try both halves right away
+            self.batch_control.on_throttle()
+            middle = len(group) // 2
+            self._attempt((url, group[:middle]), middle, attempt)
+            self._attempt((url, group[middle:]), len(group) - middle, attempt)
+            return
+        
+        delay = self.retry_policy.delay(attempt, retry_after)
+        if status in THROTTLE_STATUSES:
+            self.stats.throttled += 1
+            if not self._throttle_episode:
+                self._throttle_episode = True
+                self.batch_control.on_throttle()
+            self._blocked_until = max(self._blocked_until, time.monotonic() + delay)
+        
+        if status in RETRYABLE_STATUSES and self.retry_policy.should_retry(attempt):
+            self.retry_buffer.put(payload, event_count, attempt + 1, delay)
+            METRICS.queue_depth.set(self.retry_buffer.events)
+            return
+        
+        self.stats.failed += event_count
+        METRICS.failed.inc(event_count)
+        logger.error(f"✗ Giving up on batch of {event_count} events after {attempt} attempts "
+                     f"(status {status})")
+
+class AdaptiveConcurrencyLimiter:
+    """Async limiter whose limit is tuned by AIMD.
+    
+    Acquire before each send and release afterwards; report throttling with
+    on_throttle(). The limit halves on throttling and grows by one after a
+    full window of successful sends, like TCP congestion avoidance.
+    """
+    
+    def __init__(self, initial: int = 8, minimum: int = 1, maximum: int = 64):
+        self.control = AimdController(initial, minimum, maximum, increase=1.0)
+        self._in_flight = 0
+        self._successes = 0
+        self._condition = None
+    
+    @property
+    def limit(self) -> int:
+        return self.control.current
+    
+    def _get_condition(self):
+        # Created lazily so the limiter can be built outside the event loop,
+        # and asyncio is only imported by the async modes
+        if self._condition is None:
+            import asyncio
+            self._condition = asyncio.Condition()
+        return self._condition
+    
+    async def acquire(self):
+        condition = self._get_condition()
+        async with condition:
+            await condition.wait_for(lambda: self._in_flight < self.limit)
+            self._in_flight += 1
+    
+    async def release(self):
+        condition = self._get_condition()
+        async with condition:
+            self._in_flight -= 1
+            condition.notify_all()
+    
+    def on_success(self):
+        self._successes += 1
+        if self._successes >= self.limit:
+            self._successes = 0
+            self.control.on_success()
+    
+    def on_throttle(self):
+        self._successes = 0
+        self.control.on_throttle()
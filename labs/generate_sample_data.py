@@ -4,47 +4,37 @@ Azure Event Hub Sample Data Generator
 Sends simulated telemetry data to Azure Event Hub on a periodic basis.
 """
 
+import argparse
 import json
 import time
 import random
 import logging
 from datetime import datetime, timezone
-from typing import Dict, Any
+from typing import Dict, Any, List, Optional, Tuple, Union
 import sys
 import os
 
-# Try to import Azure libraries
+# The producer library is needed for every send. azure-identity and
+# azure-mgmt-eventhub are only imported when a connection string has to be
+# resolved through Azure (see get_connection_string_from_azure).
 try:
     from azure.eventhub import EventHubProducerClient, EventData
-    from azure.identity import DefaultAzureCredential, AzureCliCredential
-    from azure.mgmt.eventhub import EventHubManagementClient
     AZURE_LIBRARIES_AVAILABLE = True
 except ImportError:
-    print("Azure libraries not found. Installing required packages...")
-    import subprocess
-    
-    packages = [
-        "azure-eventhub",
-        "azure-identity", 
-        "azure-mgmt-eventhub"
-    ]
-    
-    for package in packages:
-        try:
-            subprocess.check_call([sys.executable, "-m", "pip", "install", package])
-        except subprocess.CalledProcessError as e:
-            print(f"Failed to install {package}: {e}")
-            sys.exit(1)
-    
-    # Try importing again after installation
-    try:
-        from azure.eventhub import EventHubProducerClient, EventData
-        from azure.identity import DefaultAzureCredential, AzureCliCredential
-        from azure.mgmt.eventhub import EventHubManagementClient
-        AZURE_LIBRARIES_AVAILABLE = True
-    except ImportError as e:
-        print(f"Still unable to import Azure libraries after installation: {e}")
-        AZURE_LIBRARIES_AVAILABLE = False
+    AZURE_LIBRARIES_AVAILABLE = False
+
+# Only what every send needs is imported here. Flow control, the offline
+# spool, compression and the NumPy batch generator are imported by the
+# modes and options that use them, so interval mode and --help start fast.
+from connection_cache import DEFAULT_TTL_SECONDS, ConnectionStringCache
+from metrics import METRICS
+from serializers import JSON, JsonSerializer, RecordBatch, RecordPacker, encode_records
+
+# List of sensor types to randomly choose from
+SENSOR_TYPES = ("DHT22", "BME280", "SHT30", "AM2302", "DS18B20")
+
+# List of firmware versions to randomly choose from
+FIRMWARE_VERSIONS = ("v1.2.3", "v1.3.0", "v1.2.5", "v1.4.1", "v1.1.9")
 
 # Configure logging - suppress verbose Azure SDK messages
 logging.basicConfig(
@@ -59,19 +49,113 @@ logging.getLogger('azure.eventhub').setLevel(logging.ERROR)
 logging.getLogger('azure.core').setLevel(logging.ERROR)
 logging.getLogger('uamqp').setLevel(logging.ERROR)
 
+class BatchStats:
+    """Running statistics for batches sent in throughput mode."""
+    
+    def __init__(self):
+        self.batches = 0
+        self.events = 0
+        self.bytes = 0
+        self.send_seconds = 0.0
+        self.started = time.monotonic()
+    
+    def record(self, events: int, size_bytes: int, latency_seconds: float):
+        """Record one sent batch."""
+        self.batches += 1
+        self.events += events
+        self.bytes += size_bytes
+        self.send_seconds += latency_seconds
+    
+    def summary(self) -> str:
+        """Return a one-line summary of everything sent so far."""
+        elapsed = max(time.monotonic() - self.started, 1e-9)
+        avg_latency_ms = (self.send_seconds / self.batches * 1000) if self.batches else 0.0
+        return (
+            f"{self.events} events in {self.batches} batches, "
+            f"{self.bytes / 1024:.1f} KiB, "
+            f"{self.events / elapsed:.1f} events/sec, "
+            f"avg send latency {avg_latency_ms:.1f} ms"
+        )
+
 class EventHubDataGenerator:
     """Class to handle Event Hub data generation and sending."""
     
-    def __init__(self, resource_group: str, namespace_name: str, eventhub_name: str):
+    def __init__(self, resource_group: str, namespace_name: str, eventhub_name: str,
+                 linger_seconds: float = 0.05, retry_policy=None,
+                 simulated_devices: Optional[int] = None,
+                 packer: Optional[RecordPacker] = None,
+                 sequence_tags: bool = False,
+                 connection_cache: Optional[ConnectionStringCache] = None,
+                 quiet: bool = False,
+                 spool=None, spool_retry_interval: float = 5.0):
         self.resource_group = resource_group
         self.namespace_name = namespace_name
         self.eventhub_name = eventhub_name
         self.connection_string = None
         self.producer_client = None
         
+        # Connection strings resolved through Azure are cached on disk so
+        # later starts skip the CLI and management-plane calls
+        self.connection_cache = connection_cache or ConnectionStringCache()
+        self.connection_from_cache = False
+        
+        # Throughput mode state: one open batch that is filled until it is
+        # full or has been open for longer than linger_seconds.
+        self.linger_seconds = linger_seconds
+        self.batch_stats = BatchStats()
+        self._batch = None
+        self._batch_opened_at = 0.0
+        self._batch_records = 0
+        # Single events are JSON from compiled templates; when a packer is set,
+        # records are packed into multi-record bodies, one EventData each
+        self.serializer = JsonSerializer()
+        self.packer = packer
+        
+        # ServerBusy and transient send errors are retried with jittered
+        # backoff; the caller blocks meanwhile, which is the backpressure
+        if retry_policy is None:
+            from flow_control import RetryPolicy
+            retry_policy = RetryPolicy(max_attempts=5)
+        self.retry_policy = retry_policy
+        self.throttled = 0
+        # Optional stateful fleet (fleet_simulator.py) in place of random readings
+        self.fleet = None
+        if simulated_devices:
+            from fleet_simulator import FleetSimulator
+            self.fleet = FleetSimulator(simulated_devices)
+        # Optional per-producer sequence numbers for delivery_verifier.py
+        self.tagger = None
+        if sequence_tags:
+            from delivery_verifier import SequenceTagger
+            self.tagger = SequenceTagger()
+        # Quiet mode drops per-event and per-batch output; metrics.py reports instead
+        self.quiet = quiet
+        # Events that cannot be sent wait in a disk spool (spool.py SegmentSpool);
+        # its OfflineSpool starts draining once the producer exists
+        self.spool_log = spool
+        self.spool_retry_interval = spool_retry_interval
+        self.spool = None
+        self._batch_bodies: List[bytes] = []
+    
+    def get_connection_string(self, refresh: bool = False) -> str:
+        """Cached connection string for this namespace, resolved through Azure on a miss."""
+        self.connection_from_cache = False
+        if not refresh:
+            cached = self.connection_cache.get(self.resource_group, self.namespace_name)
+            if cached:
+                self.connection_from_cache = True
+                return cached
+        connection_string = self.get_connection_string_from_azure()
+        self.connection_cache.put(self.resource_group, self.namespace_name, connection_string)
+        return connection_string
+    
     def get_connection_string_from_azure(self) -> str:
         """Get Event Hub connection string using Azure credentials."""
         try:
+            # Imported here: these libraries are only needed on a cache miss
+            from azure.identity import DefaultAzureCredential, AzureCliCredential
+            from azure.mgmt.eventhub import EventHubManagementClient
+            
             # Try different credential types
             credential = None
             
@@ -126,7 +210,7 @@ class EventHubDataGenerator:
             connection_string = keys.primary_connection_string
             # logger.info("Successfully retrieved connection string from Azure")
             return connection_string
-            
+        
         except Exception as e:
             logger.error(f"Failed to get connection string from Azure: {e}")
             raise
@@ -139,12 +223,12 @@ class EventHubDataGenerator:
             return conn_str
         raise Exception("EVENTHUB_CONNECTION_STRING environment variable not set")
     
-    def initialize_producer(self):
+    def initialize_producer(self, refresh_connection: bool = False):
         """Initialize the Event Hub producer client."""
         try:
-            # Try to get connection string from Azure first
+            # Try the cached or Azure-resolved connection string first
             try:
-                self.connection_string = self.get_connection_string_from_azure()
+                self.connection_string = self.get_connection_string(refresh_connection)
             except Exception as e:
                 # logger.warning(f"Failed to get connection string from Azure: {e}")
                 # logger.info("Trying environment variable...")
@@ -155,24 +239,23 @@ class EventHubDataGenerator:
                 conn_str=self.connection_string,
                 eventhub_name=self.eventhub_name
             )
+            if self.spool_log is not None and self.spool is None:
+                from spool import OfflineSpool
+                self.spool = OfflineSpool(self.spool_log, self.send_spooled, retry_interval=self.spool_retry_interval)
             
             # logger.info("Event Hub producer client initialized successfully")
-            
+        
         except Exception as e:
             logger.error(f"Failed to initialize producer client: {e}")
             raise
     
     def generate_telemetry_data(self) -> Dict[str, Any]:
         """Generate random telemetry data."""
+        if self.fleet is not None:
+            return self._emit(self.fleet.next_batch(1).to_records())[0]
         device_id = f"device-{random.randint(1, 100):03d}"
         timestamp = datetime.now(timezone.utc).isoformat().replace('+00:00', 'Z')
         
-        # List of sensor types to randomly choose from
-        sensor_types = ["DHT22", "BME280", "SHT30", "AM2302", "DS18B20"]
-        
-        # List of firmware versions to randomly choose from
-        firmware_versions = ["v1.2.3", "v1.3.0", "v1.2.5", "v1.4.1", "v1.1.9"]
-        
         data = {
             "deviceId": device_id,
             "timestamp": timestamp,
@@ -184,31 +267,272 @@ class EventHubDataGenerator:
                 "lon": -122.3321
             },
             "metadata": {
-                "sensorType": random.choice(sensor_types),
-                "firmware": random.choice(firmware_versions)
+                "sensorType": random.choice(SENSOR_TYPES),
+                "firmware": random.choice(FIRMWARE_VERSIONS)
             }
         }
         
-        return data
+        return self._emit([data])[0]
+    
+    def _emit(self, records: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """Count generated records and embed sequence tags when they are on."""
+        METRICS.generated.inc(len(records))
+        return records if self.tagger is None else self.tagger.tag(records)
+    
+    def generate_telemetry_batch(self, count: int) -> RecordBatch:
+        """Generate count telemetry records, vectorized with NumPy when available.
+        
+        The NumPy columns are returned as a TelemetryBatch that the send paths
+        encode column by column; sequence tags need the records as dicts.
+        """
+        if self.fleet is not None:
+            return self._emit_batch(self.fleet.next_batch(count))
+        try:
+            from telemetry_batch import generate_telemetry_batch
+        except ImportError:
+            # NumPy is optional; without it records are generated one by one
+            return [self.generate_telemetry_data() for _ in range(count)]
+        return self._emit_batch(generate_telemetry_batch(count))
+    
+    def _emit_batch(self, batch) -> RecordBatch:
+        """Count a generated TelemetryBatch, turning it into tagged dicts only when tags are on."""
+        if self.tagger is not None:
+            return self._emit(batch.to_records())
+        METRICS.generated.inc(len(batch))
+        return batch
     
-    def send_message(self, message_data: Dict[str, Any]) -> bool:
-        """Send a message to Event Hub."""
+    def send_message(self, message_data: Dict[str, Any], probe: bool = False) -> bool:
+        """Send a message to Event Hub.
+        
+        A probe (the connectivity test) goes straight to the hub even while the
+        spool holds a backlog, is never spooled and is left out of METRICS.
+        """
+        message_json = None
         try:
-            message_json = json.dumps(message_data)
+            message_json = self.serializer.encode_text(message_data)
+            if not probe and self.spool is not None and self.spool.active:
+                self._spool([message_json.encode('utf-8')], 1)
+                return False
             event_data = EventData(message_json)
             
-            # Send the event
-            with self.producer_client:
-                event_data_batch = self.producer_client.create_batch()
-                event_data_batch.add(event_data)
-                self.producer_client.send_batch(event_data_batch)
+            # Send the event (the producer stays open until close())
+            event_data_batch = self.producer_client.create_batch()
+            event_data_batch.add(event_data)
+            started = time.perf_counter()
+            self._send_with_retry(event_data_batch)
+            if not probe:
+                METRICS.send_latency.observe(time.perf_counter() - started)
+                METRICS.sent.inc()
+                METRICS.bytes_sent.inc(event_data_batch.size_in_bytes)
             
-            print(f"✓ Message sent successfully at {datetime.now()}")
+            if not self.quiet:
+                print(f"✓ Message sent successfully at {datetime.now()}")
             return True
-            
+        
         except Exception as e:
             logger.error(f"✗ Failed to send message: {e}")
+            if probe:
+                return False
+            # A record that could not be encoded is not a link failure
+            if self.spool is not None and message_json is not None:
+                self.spool.link_failed()
+                self._spool([message_json.encode('utf-8')], 1)
+            else:
+                METRICS.failed.inc()
+            return False
+    
+    @property
+    def record_serializer(self):
+        """The serializer records are encoded with before they are batched or packed."""
+        return self.serializer if self.packer is None else self.packer.serializer
+    
+    def add_to_batch(self, message_data: Dict[str, Any]) -> bool:
+        """Add a message to the open batch, sending it when full or lingered."""
+        return self.add_payload(self.record_serializer.encode(message_data))
+    
+    def add_payload(self, payload: bytes) -> bool:
+        """Add one encoded record to the open batch, sending it when full or lingered."""
+        if self.spool is not None and self.spool.active:
+            # Queue behind the spooled backlog; no batch while the link is down
+            if self.packer is None:
+                self._spool([payload], 1)
+            else:
+                for body, records in self.packer.add(payload):
+                    self._spool([body], records)
+            return True
+        
+        if self._batch is None:
+            self._open_batch()
+        
+        if self.packer is None:
+            added = self._add_event(payload, 1)
+        else:
+            # The record waits in the packer until its body closes; a dropped
+            # body fails the call even though this record may not be in it
+            added = True
+            for body, records in self.packer.add(payload):
+                added = self._add_event(body, records) and added
+        if not added:
             return False
+        
+        if time.monotonic() - self._batch_opened_at >= self.linger_seconds:
+            return self.flush_batch()
+        return True
+    
+    def _add_event(self, body: Union[str, bytes], records: int) -> bool:
+        """Add one event body carrying records records, sending the batch first if it is full."""
+        event_data = EventData(body)
+        if self._batch is None:
+            self._open_batch()
+        try:
+            self._batch.add(event_data)
+        except ValueError:
+            # Batch reached its max size; send it and start a new one
+            self.flush_batch()
+            self._open_batch()
+            try:
+                self._batch.add(event_data)
+            except ValueError:
+                logger.error("✗ Message is larger than the maximum batch size, dropped")
+                METRICS.failed.inc(records)
+                return False
+        self._batch_records += records
+        if self.spool is not None:
+            # Kept until the batch is sent, in case it has to be spooled
+            self._batch_bodies.append(body.encode('utf-8') if isinstance(body, str) else body)
+        return True
+    
+    def _open_batch(self):
+        """Start a new empty batch on the persistent producer."""
+        self._batch = self.producer_client.create_batch()
+        self._batch_opened_at = time.monotonic()
+        self._batch_records = 0
+        self._batch_bodies = []
+    
+    def flush_batch(self) -> bool:
+        """Send the open batch, if any, and report its statistics."""
+        if self.packer is not None:
+            # Close the partial packed body so lingered records go out too
+            for body, records in self.packer.flush():
+                self._add_event(body, records)
+        batch = self._batch
+        self._batch = None
+        if batch is None or len(batch) == 0:
+            return True
+        
+        events = self._batch_records
+        size_bytes = batch.size_in_bytes
+        if self.spool is not None and self.spool.active:
+            self._spool(self._batch_bodies, events)
+            return True
+        try:
+            started = time.perf_counter()
+            self._send_with_retry(batch)
+            latency = time.perf_counter() - started
+        except Exception as e:
+            logger.error(f"✗ Failed to send batch of {events} events: {e}")
+            if self.spool is not None:
+                self.spool.link_failed()
+                self._spool(self._batch_bodies, events)
+            else:
+                METRICS.failed.inc(events)
+            return False
+        
+        self.batch_stats.record(events, size_bytes, latency)
+        METRICS.sent.inc(events)
+        METRICS.bytes_sent.inc(size_bytes)
+        METRICS.send_latency.observe(latency)
+        METRICS.batch_fill.observe(size_bytes / batch.max_size_in_bytes)
+        if not self.quiet:
+            print(
+                f"✓ Batch {self.batch_stats.batches}: {events} events, "
+                f"{size_bytes} bytes, sent in {latency * 1000:.1f} ms"
+            )
+        return True
+    
+    def _send_with_retry(self, batch):
+        """Send an EventDataBatch, retrying ServerBusy and transient errors."""
+        from flow_control import is_sdk_retryable_error, is_sdk_throttle_error
+        
+        attempt = 1
+        while True:
+            try:
+                self.producer_client.send_batch(batch)
+                return
+            except Exception as e:
+                throttled = is_sdk_throttle_error(e)
+                if throttled:
+                    self.throttled += 1
+                if not (throttled or is_sdk_retryable_error(e)) or not self.retry_policy.should_retry(attempt):
+                    raise
+                delay = self.retry_policy.delay(attempt)
+                logger.warning(f"Send failed ({type(e).__name__}), retrying in {delay:.2f}s")
+                time.sleep(delay)
+                attempt += 1
+    
+    def _spool(self, bodies: List[bytes], records: int):
+        """Keep event bodies that were not sent in the offline spool."""
+        from spool import KIND_JSON, KIND_PACKED
+        
+        self.spool.store(bodies, KIND_JSON if self.packer is None else KIND_PACKED)
+        METRICS.spooled.inc(records)
+    
+    def send_spooled(self, records: List[Tuple[int, bytes]]) -> int:
+        """Send spooled (kind, body) records in order, one attempt per batch.
+        
+        Returns how many leading records were sent; the spool tries the rest
+        again later. A record too large for any batch is dropped.
+        """
+        from spool import KIND_PACKED
+        
+        done = 0
+        while done < len(records):
+            batch = self.producer_client.create_batch()
+            taken = events = 0
+            for kind, body in records[done:]:
+                try:
+                    batch.add(EventData(body))
+                except ValueError:
+                    break
+                taken += 1
+                if kind == KIND_PACKED and self.packer is not None:
+                    events += self.packer.count_records(body)
+                else:
+                    events += 1
+            if not taken:
+                METRICS.failed.inc()
+                logger.error("✗ Spooled event is larger than the maximum batch size, dropped")
+                done += 1
+                continue
+            started = time.perf_counter()
+            try:
+                self.producer_client.send_batch(batch)
+            except Exception as e:
+                logger.debug(f"Spool drain failed: {e}")
+                return done
+            METRICS.send_latency.observe(time.perf_counter() - started)
+            METRICS.sent.inc(events)
+            METRICS.bytes_sent.inc(batch.size_in_bytes)
+            METRICS.batch_fill.observe(batch.size_in_bytes / batch.max_size_in_bytes)
+            done += taken
+        return done
+    
+    def close(self):
+        """Flush any pending batch, drain the spool briefly and close the producer connection."""
+        if self.producer_client is None:
+            return
+        try:
+            self.flush_batch()
+            if self.spool is not None:
+                self.spool.close()
+                print(f"Spool: {self.spool.summary()}")
+        finally:
+            self.producer_client.close()
+            self.producer_client = None
+            if self.packer is not None:
+                from payload_compression import PayloadCompressor
+                if isinstance(self.packer, PayloadCompressor) and self.packer.stats.bodies:
+                    print(f"Compression: {self.packer.stats.summary()}")
     
     def test_connectivity(self) -> bool:
         """Test Event Hub connectivity by sending a test message."""
@@ -230,12 +554,12 @@ class EventHubDataGenerator:
             }
         }
         
-        success = self.send_message(test_data)
+        success = self.send_message(test_data, probe=True)
         if success:
             print("✓ Test message sent successfully! Event Hub is reachable.")
         else:
             print("✗ Test message failed!")
-            
+        
         return success
     
     def run_continuous_generation(self, interval_seconds: int = 5):
@@ -243,42 +567,205 @@ class EventHubDataGenerator:
         # logger.info(f"Starting continuous data generation (every {interval_seconds} seconds)")
         # logger.info("Press Ctrl+C to stop...")
         
+        # Schedule sends on the monotonic clock so send time does not add drift
+        next_send = time.monotonic()
         try:
             while True:
                 # Generate sample data
                 sample_data = self.generate_telemetry_data()
                 
                 # Print the data
-                print("\nSample telemetry data:")
-                print(json.dumps(sample_data, indent=2))
+                if not self.quiet:
+                    print("\nSample telemetry data:")
+                    print(json.dumps(sample_data, indent=2))
                 
                 # Send to Event Hub
                 self.send_message(sample_data)
                 
                 # Wait for next iteration
-                time.sleep(interval_seconds)
-                
+                next_send += interval_seconds
+                time.sleep(max(0.0, next_send - time.monotonic()))
+        
         except KeyboardInterrupt:
             print("\n⏹️  Stopping data generation...")
         except Exception as e:
             logger.error(f"Error in continuous generation: {e}")
             raise
+    
+    def run_throughput_generation(self, max_events: Optional[int] = None):
+        """Generate and send as fast as possible using size-packed batches."""
+        generated = 0
+        try:
+            while max_events is None or generated < max_events:
+                count = 1000 if max_events is None else min(1000, max_events - generated)
+                for payload in encode_records(self.record_serializer, self.generate_telemetry_batch(count)):
+                    self.add_payload(payload)
+                generated += count
+        
+        except KeyboardInterrupt:
+            print("\n⏹️  Stopping data generation...")
+        except Exception as e:
+            logger.error(f"Error in throughput generation: {e}")
+            raise
+        finally:
+            # Send whatever is still buffered before reporting
+            self.flush_batch()
+            print(f"Throughput summary: {self.batch_stats.summary()}")
+    
+    def _send_chunk(self, messages: RecordBatch) -> int:
+        """Add messages to the open batch; returns how many were accepted."""
+        return sum(1 for payload in encode_records(self.record_serializer, messages) if self.add_payload(payload))
+    
+    def run_rate_generation(self, profile, duration_seconds: Optional[float] = None):
+        """Send at the target rate given by a load profile, using size-packed batches."""
+        from load_profiles import run_rate_controlled
+        
+        try:
+            run_rate_controlled(
+                self.generate_telemetry_data,
+                self._send_chunk,
+                profile,
+                duration_seconds=duration_seconds,
+                generate_batch=self.generate_telemetry_batch
+            )
+        finally:
+            self.flush_batch()
+    
+    def run_replay_generation(self, path: str, speed: float = 1.0, rebase: str = "none",
+                              time_field: str = "timestamp", max_events: Optional[int] = None):
+        """Re-send a recorded JSON/JSON Lines file on its own schedule, scaled by speed."""
+        from replay import run_replay
+        from saql_engine import iter_json_records
+        
+        def send(messages) -> int:
+            accepted = self._send_chunk(self._emit(messages))
+            if speed:
+                # Paced chunks can be far apart; don't let a batch wait for the next one
+                self.flush_batch()
+            return accepted
+        
+        try:
+            run_replay(iter_json_records(path), send, speed=speed, rebase=rebase,
+                       time_field=time_field, max_events=max_events)
+        finally:
+            self.flush_batch()
+    
+    def run_async_generation(self, max_in_flight: int = 8, batch_size: int = 100,
+                             max_events: Optional[int] = None):
+        """Generate and send with the asyncio producer, keeping several sends in flight."""
+        import asyncio
+        from async_sender import AsyncSdkSender, run_engine
+        from flow_control import AdaptiveConcurrencyLimiter
+        
+        # Concurrency starts at max_in_flight and backs off while throttled
+        limiter = AdaptiveConcurrencyLimiter(initial=max_in_flight, maximum=max_in_flight)
+        sender = AsyncSdkSender(self.connection_string, self.eventhub_name,
+                                retry_policy=self.retry_policy, limiter=limiter)
+        stats = asyncio.run(run_engine(
+            sender,
+            self.generate_telemetry_data,
+            max_in_flight=max_in_flight,
+            batch_size=batch_size,
+            max_events=max_events,
+            generate_batch=self.generate_telemetry_batch,
+            limiter=limiter
+        ))
+        print(f"Async summary: {stats.summary()}")
+        print(f"Flow control: {sender.throttled} throttled sends, {sender.retries} retries, "
+              f"final concurrency {limiter.limit}")
 
-def main():
-    """Main function to run the Event Hub data generator."""
+def parse_args():
+    """Parse command line options."""
+    from metrics import add_metrics_arguments
+    from payload_compression import add_compression_arguments
+    from serializers import add_format_arguments, records_per_event
+    from spool import add_spool_arguments
     
     # Configuration (replace with your values)
     RESOURCE_GROUP = "rg-streamanalytics-workshop"
     NAMESPACE_NAME = "eventhub-sa-workshop-1234"
     EVENTHUB_NAME = "telemetry-data"
     SEND_INTERVAL = 5  # seconds
+    BATCH_LINGER = 0.05  # seconds
+    
+    parser = argparse.ArgumentParser(description="Azure Event Hub Sample Data Generator")
+    parser.add_argument("--resource-group", default=RESOURCE_GROUP)
+    parser.add_argument("--namespace", default=NAMESPACE_NAME)
+    parser.add_argument("--eventhub", default=EVENTHUB_NAME)
+    parser.add_argument("--mode", choices=["interval", "throughput", "async", "rate", "replay"], default="interval",
+                        help="'interval' sends one event every --interval seconds; "
+                             "'throughput' sends size-packed batches as fast as possible; "
+                             "'async' keeps up to --max-in-flight batch sends outstanding; "
+                             "'rate' follows the --profile target rate; "
+                             "'replay' re-sends the --replay-file recording")
+    parser.add_argument("--interval", type=float, default=SEND_INTERVAL,
+                        help="Seconds between events in interval mode")
+    parser.add_argument("--linger", type=float, default=BATCH_LINGER,
+                        help="Max seconds a batch stays open in throughput mode")
+    parser.add_argument("--max-in-flight", type=int, default=8,
+                        help="Concurrent batch sends in async mode")
+    parser.add_argument("--profile", default="constant:100",
+                        help="Load profile for rate mode, e.g. constant:1000, ramp:100:5000:300, "
+                             "step:60x100,60x1000, burst:200:5000:60:5, sine:1000:800:3600")
+    parser.add_argument("--duration", type=float, default=None,
+                        help="Stop rate mode after this many seconds")
+    parser.add_argument("--batch-size", type=int, default=100,
+                        help="Events per queued batch in async mode")
+    parser.add_argument("--max-events", type=int, default=None,
+                        help="Stop after this many events in throughput, async or replay mode")
+    parser.add_argument("--simulated-devices", type=int, default=None, metavar="N",
+                        help="Draw readings from a stateful simulated fleet of N devices "
+                             "(random walks, drift, faults; needs NumPy) instead of random values")
+    parser.add_argument("--replay-file", default=None,
+                        help="JSON array or JSON Lines recording to send in replay mode")
+    parser.add_argument("--speed", type=float, default=1.0,
+                        help="Replay speed-up over the recorded cadence; 0 sends as fast as possible")
+    parser.add_argument("--rebase", choices=["none", "shift", "warp"], default="none",
+                        help="Replay timestamps: keep them, shift them to start now, or also "
+                             "compress them by --speed so event time follows send time")
+    parser.add_argument("--time-field", default="timestamp",
+                        help="Recorded event time field that drives replay pacing")
+    parser.add_argument("--connection-cache-ttl", type=float, default=DEFAULT_TTL_SECONDS, metavar="SECONDS",
+                        help="How long a connection string resolved through Azure is reused from the "
+                             "on-disk cache (0 disables the cache)")
+    parser.add_argument("--refresh-connection", action="store_true",
+                        help="Resolve the connection string through Azure even if it is cached")
+    parser.add_argument("--sequence-tags", action="store_true",
+                        help="Embed producerId, seq and sentAt in every event so delivery_verifier.py "
+                             "can measure latency and detect loss, duplicates and reordering")
+    add_format_arguments(parser)
+    add_compression_arguments(parser)
+    add_metrics_arguments(parser)
+    add_spool_arguments(parser)
+    args = parser.parse_args()
+    if args.mode == "replay" and not args.replay_file:
+        parser.error("--mode replay needs --replay-file")
+    packed = args.compression or args.format != JSON or records_per_event(args) > 1
+    if packed and args.mode in ("interval", "async"):
+        parser.error("--compression, --format csv/avro and --records-per-event apply to the throughput, "
+                     "rate and replay modes")
+    if args.spool_dir and args.mode == "async":
+        parser.error("--spool-dir applies to the interval, throughput, rate and replay modes")
+    return args
+
+def main():
+    """Main function to run the Event Hub data generator."""
+    from metrics import MetricsOutput
+    from serializers import packer_from_args
+    from spool import spool_from_args
+    
+    args = parse_args()
+    RESOURCE_GROUP = args.resource_group
+    NAMESPACE_NAME = args.namespace
+    EVENTHUB_NAME = args.eventhub
+    SEND_INTERVAL = args.interval
     
     print("Azure Event Hub Sample Data Generator")
     print("=" * 50)
     
     if not AZURE_LIBRARIES_AVAILABLE:
         print("❌ Azure libraries are not available. Please install them manually:")
-        print("pip install azure-eventhub azure-identity azure-mgmt-eventhub")
+        print("pip install -r requirements.txt")
         sys.exit(1)
     
     try:
@@ -286,14 +773,35 @@ def main():
         generator = EventHubDataGenerator(
             resource_group=RESOURCE_GROUP,
             namespace_name=NAMESPACE_NAME,
-            eventhub_name=EVENTHUB_NAME
+            eventhub_name=EVENTHUB_NAME,
+            linger_seconds=args.linger,
+            simulated_devices=args.simulated_devices,
+            packer=packer_from_args(args),
+            sequence_tags=args.sequence_tags,
+            connection_cache=ConnectionStringCache(ttl_seconds=args.connection_cache_ttl),
+            quiet=args.quiet,
+            spool=spool_from_args(args),
+            spool_retry_interval=args.spool_retry_interval
         )
         
         # Initialize producer
-        generator.initialize_producer()
+        generator.initialize_producer(args.refresh_connection)
         
         # Test connectivity
-        if not generator.test_connectivity():
+        connected = generator.test_connectivity()
+        if not connected and generator.connection_from_cache:
+            # The cached key may have been rotated; resolve it once more
+            generator.connection_cache.invalidate(RESOURCE_GROUP, NAMESPACE_NAME)
+            # Only the producer is replaced; a spool keeps its backlog and drain
+            # thread, so the new producer is in place before the old one closes
+            stale_producer = generator.producer_client
+            generator.initialize_producer(refresh_connection=True)
+            stale_producer.close()
+            connected = generator.test_connectivity()
+        if not connected and generator.spool is not None:
+            print("Starting anyway; events are spooled until Event Hub is reachable")
+            generator.spool.link_failed()
+        elif not connected:
             print("\n❌ Connectivity test failed. Please check your configuration:")
             print("1. Ensure your Azure credentials are set up (az login)")
             print(f"2. Verify resource group '{RESOURCE_GROUP}' exists")
@@ -303,12 +811,39 @@ def main():
             print("\nAlternatively, set EVENTHUB_CONNECTION_STRING environment variable")
             sys.exit(1)
         
-        print(f"\nStarting continuous data generation (every {SEND_INTERVAL} seconds)")
-        print("Press Ctrl+C to stop...")
-        
-        # Start continuous generation
-        generator.run_continuous_generation(SEND_INTERVAL)
-        
+        metrics_output = MetricsOutput(args)
+        metrics_output.start()
+        try:
+            if args.mode == "throughput":
+                print(f"\nStarting throughput generation (batch linger {args.linger} seconds)")
+                print("Press Ctrl+C to stop...")
+                generator.run_throughput_generation(args.max_events)
+            elif args.mode == "rate":
+                from load_profiles import parse_profile
+                profile = parse_profile(args.profile)
+                print(f"\nStarting rate-controlled generation ({profile.describe()})")
+                print("Press Ctrl+C to stop...")
+                generator.run_rate_generation(profile, args.duration)
+            elif args.mode == "async":
+                print(f"\nStarting async generation ({args.max_in_flight} sends in flight)")
+                print("Press Ctrl+C to stop...")
+                generator.run_async_generation(args.max_in_flight, args.batch_size, args.max_events)
+            elif args.mode == "replay":
+                pace = "as fast as possible" if not args.speed else f"at {args.speed:g}x"
+                print(f"\nReplaying {args.replay_file} {pace} (timestamps: {args.rebase})")
+                print("Press Ctrl+C to stop...")
+                generator.run_replay_generation(args.replay_file, args.speed, args.rebase,
+                                                args.time_field, args.max_events)
+            else:
+                print(f"\nStarting continuous data generation (every {SEND_INTERVAL} seconds)")
+                print("Press Ctrl+C to stop...")
+                
+                # Start continuous generation
+                generator.run_continuous_generation(SEND_INTERVAL)
+        finally:
+            generator.close()
+            metrics_output.stop()
+    
     except Exception as e:
         logger.error(f"Application error: {e}")
         sys.exit(1)
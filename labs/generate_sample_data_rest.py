@@ -5,6 +5,7 @@ Sends simulated telemetry data to Azure Event Hub using REST API calls.
 Alternative approach that doesn't require Azure SDK.
 """
 
+import argparse
 import json
 import time
 import random
@@ -12,13 +13,30 @@ import logging
 import hashlib
 import hmac
 import base64
+import threading
 import urllib.parse
 import requests
+from requests.adapters import HTTPAdapter
 from datetime import datetime, timezone
-from typing import Dict, Any
+from typing import Dict, Any, Iterator, List, Optional, Tuple
 import sys
 import os
 
+from flow_control import (
+    RETRYABLE_STATUSES,
+    AdaptiveConcurrencyLimiter,
+    AdaptiveRestSender,
+    RetryPolicy,
+    parse_retry_after,
+)
+from metrics import METRICS, MetricsOutput, add_metrics_arguments
+from payload_compression import COMPRESSED_CONTENT_TYPE, PayloadCompressor, add_compression_arguments
+from serializers import (
+    JSON, JsonSerializer, RecordBatch, RecordPacker, add_format_arguments, encode_records, packer_from_args,
+    records_per_event
+)
+from spool import KIND_JSON, KIND_PACKED, OfflineSpool, SegmentSpool, add_spool_arguments, spool_from_args
+
 # Configure logging
 logging.basicConfig(
     level=logging.INFO,
@@ -26,10 +44,76 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# Content type for sending several events in one POST
+BATCH_CONTENT_TYPE = 'application/vnd.microsoft.servicebus.json'
+
+# Event Hubs rejects requests over 1 MB; leave headroom for headers and framing
+MAX_BATCH_PAYLOAD_BYTES = 1000000
+
+class SasTokenCache:
+    """Caches a signed SAS token and refreshes it shortly before it expires.
+    
+    Safe to share between threads and between coroutines: signing happens
+    under a lock with no await inside, so concurrent callers that all see an
+    expiring token wait for a single refresh instead of each signing one.
+    """
+    
+    def __init__(self, resource_uri: str, key_name: str, key: str,
+                 ttl_seconds: int = 3600, refresh_margin_seconds: int = 300):
+        if refresh_margin_seconds >= ttl_seconds:
+            raise ValueError("refresh_margin_seconds must be smaller than ttl_seconds")
+        self.ttl_seconds = ttl_seconds
+        self.refresh_margin_seconds = refresh_margin_seconds
+        self._encoded_uri = urllib.parse.quote(resource_uri, safe='')
+        self._key_name = key_name
+        self._key_bytes = key.encode('utf-8')
+        self._lock = threading.Lock()
+        # (token, refresh_at) is replaced as a whole so readers never see a torn pair
+        self._entry = (None, 0.0)
+    
+    def get(self) -> str:
+        """Return a valid token, signing a new one only when needed."""
+        token, refresh_at = self._entry
+        if token is not None and time.time() < refresh_at:
+            return token
+        
+        with self._lock:
+            # Another caller may have refreshed while we waited for the lock
+            token, refresh_at = self._entry
+            if token is None or time.time() >= refresh_at:
+                expiry = int(time.time()) + self.ttl_seconds
+                token = self._sign(expiry)
+                self._entry = (token, expiry - self.refresh_margin_seconds)
+            return token
+    
+    def invalidate(self):
+        """Force the next get() to sign a fresh token."""
+        with self._lock:
+            self._entry = (None, 0.0)
+    
+    def _sign(self, expiry: int) -> str:
+        """Sign a token that expires at the given Unix time."""
+        string_to_sign = f"{self._encoded_uri}\n{expiry}".encode('utf-8')
+        signature = base64.b64encode(
+            hmac.new(self._key_bytes, string_to_sign, hashlib.sha256).digest()
+        ).decode('utf-8')
+        
+        return (
+            f"SharedAccessSignature sr={self._encoded_uri}"
+            f"&sig={urllib.parse.quote(signature, safe='')}"
+            f"&se={expiry}"
+            f"&skn={self._key_name}"
+        )
+
 class EventHubRestClient:
     """Event Hub client using REST API calls."""
     
-    def __init__(self, connection_string: str, eventhub_name: str):
+    def __init__(self, connection_string: str, eventhub_name: str,
+                 base_url: Optional[str] = None, pool_size: int = 10,
+                 max_batch_bytes: int = MAX_BATCH_PAYLOAD_BYTES,
+                 token_ttl_seconds: int = 3600, token_refresh_margin_seconds: int = 300,
+                 retry_policy: Optional[RetryPolicy] = None,
+                 packer: Optional[RecordPacker] = None):
         self.eventhub_name = eventhub_name
         self.connection_string = connection_string
         self.endpoint = None
@@ -37,6 +121,52 @@ class EventHubRestClient:
         self.key_name = None
         self.key = None
         self._parse_connection_string()
+        
+        # base_url overrides the https://<namespace> endpoint, e.g. to point
+        # the client at a local HTTP stand-in
+        self.base_url = (base_url or f"https://{self.namespace}").rstrip('/')
+        self.messages_url = f"{self.base_url}/{self.eventhub_name}/messages"
+        self.max_batch_bytes = max_batch_bytes
+        self.session = self._create_session(pool_size)
+        self.bytes_sent = 0
+        
+        # Throttled (429/503) and failed requests are retried with jittered backoff
+        self.retry_policy = retry_policy or RetryPolicy(max_attempts=5)
+        # Single events are JSON from compiled templates; when a packer is set,
+        # send_batch packs records into multi-record bodies instead
+        self.serializer = JsonSerializer()
+        self.packer = packer
+        # Quiet mode drops the per-message success log; metrics.py reports instead
+        self.quiet = False
+        # When set, events that cannot be sent wait in a disk spool (spool.py)
+        self.spool: Optional[OfflineSpool] = None
+        
+        # Resource URI for SAS token (use sb:// format)
+        self.token_cache = SasTokenCache(
+            resource_uri=f"{self.endpoint}/{self.eventhub_name}",
+            key_name=self.key_name,
+            key=self.key,
+            ttl_seconds=token_ttl_seconds,
+            refresh_margin_seconds=token_refresh_margin_seconds
+        )
+    
+    @staticmethod
+    def _create_session(pool_size: int) -> requests.Session:
+        """Create a keep-alive session with a connection pool."""
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        session.mount('https://', adapter)
+        session.mount('http://', adapter)
+        return session
+    
+    def close(self):
+        """Drain the spool briefly, close pooled connections and report compression savings."""
+        if self.spool is not None:
+            self.spool.close()
+            logger.info(f"Spool: {self.spool.summary()}")
+        self.session.close()
+        if isinstance(self.packer, PayloadCompressor) and self.packer.stats.bodies:
+            logger.info(f"Compression: {self.packer.stats.summary()}")
     
     def _parse_connection_string(self):
         """Parse the Event Hub connection string."""
@@ -58,94 +188,308 @@ class EventHubRestClient:
             self.key = parts['SharedAccessKey']
             
             logger.info(f"Parsed connection string for namespace: {self.namespace}")
-            
+        
         except Exception as e:
             logger.error(f"Failed to parse connection string: {e}")
             raise
     
     def _generate_sas_token(self) -> str:
-        """Generate SAS token for authentication."""
+        """Get a SAS token for authentication, reusing the cached one while valid."""
         try:
-            # Resource URI for SAS token (use sb:// format)
-            resource_uri = f"{self.endpoint}/{self.eventhub_name}"
-            
-            # Token expiry (1 hour from now)
-            expiry = int(time.time()) + 3600
-            
-            # String to sign
-            string_to_sign = f"{urllib.parse.quote(resource_uri, safe='')}\n{expiry}"
-            
-            # Generate signature
-            key_bytes = self.key.encode('utf-8')
-            string_bytes = string_to_sign.encode('utf-8')
-            signature = base64.b64encode(
-                hmac.new(key_bytes, string_bytes, hashlib.sha256).digest()
-            ).decode('utf-8')
-            
-            # Construct SAS token
-            token = (
-                f"SharedAccessSignature sr={urllib.parse.quote(resource_uri, safe='')}"
-                f"&sig={urllib.parse.quote(signature, safe='')}"
-                f"&se={expiry}"
-                f"&skn={self.key_name}"
-            )
-            
-            return token
-            
+            return self.token_cache.get()
         except Exception as e:
             logger.error(f"Failed to generate SAS token: {e}")
             raise
     
-    def send_message(self, message_data: Dict[str, Any]) -> bool:
-        """Send a message to Event Hub using REST API."""
+    def send_message(self, message_data: Dict[str, Any], probe: bool = False) -> bool:
+        """Send a message to Event Hub using REST API, retrying when throttled.
+        
+        A probe (the connectivity test) goes straight to the hub even while the
+        spool holds a backlog, is never spooled and is left out of METRICS.
+        """
         try:
-            # Generate SAS token
-            token = self._generate_sas_token()
-            
-            # Prepare the request
-            url = f"https://{self.namespace}/{self.eventhub_name}/messages"
-            headers = {
-                'Authorization': token,
-                'Content-Type': 'application/json; charset=utf-8'
-            }
-            
             # Convert message to JSON
-            message_json = json.dumps(message_data)
+            body = self.serializer.encode(message_data)
+            if not probe and self.spool is not None and self.spool.active:
+                self._spool([body], KIND_JSON, 1)
+                return False
             
-            logger.debug(f"Sending to URL: {url}")
+            logger.debug(f"Sending to URL: {self.messages_url}")
             
-            # Send the request
-            response = requests.post(
+            attempt = 1
+            started = time.perf_counter()
+            while True:
+                status, retry_after = self.post_body(self.messages_url, body, 'application/json; charset=utf-8')
+                if status == 201:
+                    if not probe:
+                        METRICS.send_latency.observe(time.perf_counter() - started)
+                        METRICS.sent.inc()
+                    if not self.quiet:
+                        logger.info(f"✓ Message sent successfully at {datetime.now()}")
+                    return True
+                if status not in RETRYABLE_STATUSES or not self.retry_policy.should_retry(attempt):
+                    logger.error(f"✗ Failed to send message after {attempt} attempts. Status: {status}")
+                    if probe:
+                        return False
+                    if self.spool is not None:
+                        self.spool.link_failed()
+                        self._spool([body], KIND_JSON, 1)
+                    else:
+                        METRICS.failed.inc()
+                    return False
+                delay = self.retry_policy.delay(attempt, retry_after)
+                logger.warning(f"Send throttled or failed (status {status}), retrying in {delay:.2f}s")
+                time.sleep(delay)
+                attempt += 1
+        
+        except Exception as e:
+            if not probe:
+                METRICS.failed.inc()
+            logger.error(f"✗ Failed to send message: {e}")
+            return False
+    
+    def post_body(self, url: str, body: bytes, content_type: str,
+                  partition_key: Optional[str] = None) -> Tuple[int, Optional[float]]:
+        """POST one request body. Returns (status, Retry-After seconds).
+        
+        Network errors are reported as status 0 so callers can treat them like
+        any other retryable failure.
+        """
+        headers = {
+            'Authorization': self._generate_sas_token(),
+            'Content-Type': content_type
+        }
+        if partition_key is not None:
+            headers['BrokerProperties'] = json.dumps({"PartitionKey": partition_key})
+        try:
+            response = self.session.post(
                 url=url,
                 headers=headers,
-                data=message_json.encode('utf-8'),
+                data=body,
                 timeout=30
             )
+        except requests.exceptions.RequestException as e:
+            logger.error(f"✗ Network error sending to {url}: {e}")
+            return 0, None
+        
+        if response.status_code == 201:
+            self.bytes_sent += len(body)
+            METRICS.bytes_sent.inc(len(body))
+        else:
+            if response.status_code == 401:
+                # Force a fresh token in case the cached one was rejected
+                self.token_cache.invalidate()
+            logger.debug(f"POST returned {response.status_code}: {response.text}")
+        return response.status_code, parse_retry_after(response.headers.get('Retry-After'))
+    
+    def post_group(self, url: str, group: List[bytes]) -> Tuple[int, Optional[float]]:
+        """POST one packed group of batch entries. Returns (status, Retry-After seconds)."""
+        body = b'[' + b','.join(group) + b']'
+        METRICS.batch_fill.observe(len(body) / self.max_batch_bytes)
+        return self.post_body(url, body, BATCH_CONTENT_TYPE)
+    
+    def _pack_batches(self, payloads: List[bytes],
+                      partition_key: Optional[str] = None) -> Iterator[List[bytes]]:
+        """Split encoded records into groups of batch entries under the payload limit."""
+        group = []
+        group_bytes = 2  # enclosing [ ]
+        for payload in payloads:
+            entry = {"Body": payload.decode('utf-8')}
+            if partition_key is not None:
+                entry["BrokerProperties"] = {"PartitionKey": partition_key}
+            entry = json.dumps(entry).encode('utf-8')
+            # Each entry after the first also costs a separating comma
+            entry_bytes = len(entry) + (1 if group else 0)
+            
+            if group and group_bytes + entry_bytes > self.max_batch_bytes:
+                yield group
+                group = []
+                group_bytes = 2
+                entry_bytes = len(entry)
             
-            if response.status_code == 201:
-                logger.info(f"✓ Message sent successfully at {datetime.now()}")
+            if group_bytes + entry_bytes > self.max_batch_bytes:
+                logger.error(f"✗ Message of {len(entry)} bytes exceeds the batch payload limit, dropped")
+                continue
+            
+            group.append(entry)
+            group_bytes += entry_bytes
+        
+        if group:
+            yield group
+    
+    def partition_url(self, partition_id: str) -> str:
+        """URL for sending directly to one partition."""
+        return f"{self.base_url}/{self.eventhub_name}/partitions/{partition_id}/messages"
+    
+    def send_batch(self, messages: RecordBatch, partition_key: Optional[str] = None,
+                   partition_id: Optional[str] = None) -> int:
+        """Send messages as one or more batch POSTs. Returns the number of events accepted.
+        
+        All messages share partition_key when given, which keeps them in order on
+        one partition; partition_id pins the POST to a specific partition instead.
+        Throttled (429/503) and failed POSTs are retried per retry_policy.
+        With a packer, messages are packed into multi-record bodies (JSON Lines,
+        CSV or Avro, compressed or not) that are each POSTed as one event; the
+        batch envelope cannot carry binary bodies.
+        """
+        url = self.messages_url if partition_id is None else self.partition_url(partition_id)
+        sent = 0
+        if self.packer is not None:
+            content_type = self.packer.content_type
+            for body, records in self.packer.pack(encode_records(self.packer.serializer, messages)):
+                if self._post_or_spool(lambda: self.post_body(url, body, content_type, partition_key),
+                                       records, lambda: [body], KIND_PACKED):
+                    sent += records
+            return sent
+        
+        payloads = encode_records(self.serializer, messages)
+        if self.spool is not None and self.spool.active:
+            # Skip the batch envelope; the spool keeps plain event bodies
+            self._spool(payloads, KIND_JSON, len(payloads))
+            return 0
+        
+        for group in self._pack_batches(payloads, partition_key):
+            if self._post_or_spool(lambda: self.post_group(url, group), len(group),
+                                   lambda: [json.loads(entry)["Body"].encode('utf-8') for entry in group], KIND_JSON):
+                sent += len(group)
+        
+        return sent
+    
+    def _spool(self, bodies: List[bytes], kind: int, records: int):
+        """Keep bodies that were not sent in the offline spool."""
+        self.spool.store(bodies, kind)
+        METRICS.spooled.inc(records)
+    
+    def _post_or_spool(self, post, events: int, bodies, kind: int) -> bool:
+        """POST with retries, or spool bodies() when the link is down or the POST fails."""
+        if self.spool is None:
+            return self._post_with_retry(post, events)
+        if not self.spool.active:
+            if self._post_with_retry(post, events, final=False):
                 return True
+            self.spool.link_failed()
+        self._spool(bodies(), kind, events)
+        return False
+    
+    def send_spooled(self, records: List[Tuple[int, bytes]]) -> int:
+        """Send spooled (kind, body) records in order, one attempt per POST.
+        
+        Returns how many leading records were dealt with; the spool tries the
+        rest again later. Records the hub rejects outright are dropped so one
+        bad event cannot hold up the spool. Spooled events are sent to the
+        hub, not a partition, so the original partition keys are not kept.
+        """
+        done = 0
+        while done < len(records):
+            kind, body = records[done]
+            started = time.perf_counter()
+            if kind == KIND_PACKED:
+                # Left by this run's packer, or by an earlier run's; assume the same format
+                taken, events = 1, self.packer.count_records(body) if self.packer is not None else 1
+                content_type = self.packer.content_type if self.packer is not None else COMPRESSED_CONTENT_TYPE
+                status, _ = self.post_body(self.messages_url, body, content_type)
+            else:
+                group = []
+                group_bytes = 2  # enclosing [ ]
+                for kind, body in records[done:]:
+                    if kind != KIND_JSON:
+                        break
+                    entry = json.dumps({"Body": body.decode('utf-8')}).encode('utf-8')
+                    if group and group_bytes + 1 + len(entry) > self.max_batch_bytes:
+                        break
+                    group_bytes += len(entry) + (1 if group else 0)
+                    group.append(entry)
+                taken = events = len(group)
+                status, _ = self.post_group(self.messages_url, group)
+            if status == 201:
+                METRICS.send_latency.observe(time.perf_counter() - started)
+                METRICS.sent.inc(events)
+            elif status in RETRYABLE_STATUSES or status in (401, 403):
+                return done
             else:
-                logger.error(f"✗ Failed to send message. Status: {response.status_code}")
-                logger.error(f"Response: {response.text}")
+                METRICS.failed.inc(events)
+                logger.error(f"✗ Hub rejected {events} spooled events with status {status}; dropped")
+            done += taken
+        return done
+    
+    def _post_with_retry(self, post, events: int, final: bool = True) -> bool:
+        """Run post() until it returns 201 or retries run out.
+        
+        final=False leaves the events out of the failed count because the
+        caller keeps them (in the spool).
+        """
+        attempt = 1
+        started = time.perf_counter()
+        while True:
+            status, retry_after = post()
+            if status == 201:
+                METRICS.send_latency.observe(time.perf_counter() - started)
+                METRICS.sent.inc(events)
+                logger.debug(f"Sent batch of {events} events")
+                return True
+            if status not in RETRYABLE_STATUSES or not self.retry_policy.should_retry(attempt):
+                if final:
+                    METRICS.failed.inc(events)
+                logger.error(f"✗ Failed to send batch of {events} events after {attempt} attempts. "
+                             f"Status: {status}")
                 return False
-                
-        except requests.exceptions.RequestException as e:
-            logger.error(f"✗ Network error sending message: {e}")
-            return False
-        except Exception as e:
-            logger.error(f"✗ Failed to send message: {e}")
-            return False
+            # Blocking here is the backpressure: the caller generates no
+            # more events until this group is accepted
+            time.sleep(self.retry_policy.delay(attempt, retry_after))
+            attempt += 1
 
 class EventHubDataGeneratorRest:
     """Class to handle Event Hub data generation using REST API."""
     
-    def __init__(self, connection_string: str, eventhub_name: str):
+    def __init__(self, connection_string: str, eventhub_name: str,
+                 base_url: Optional[str] = None, adaptive: bool = False,
+                 simulated_devices: Optional[int] = None,
+                 packer: Optional[RecordPacker] = None,
+                 sequence_tags: bool = False, quiet: bool = False,
+                 spool: Optional[SegmentSpool] = None, spool_retry_interval: float = 5.0):
         self.eventhub_name = eventhub_name
-        self.client = EventHubRestClient(connection_string, eventhub_name)
+        
+        # Adaptive mode tunes batch size and concurrency to the throttle limit
+        # (AIMD) and keeps retrying throttled batches rather than dropping them
+        self.adaptive = adaptive
+        retry_policy = RetryPolicy(max_attempts=20) if adaptive else None
+        self.client = EventHubRestClient(connection_string, eventhub_name, base_url=base_url,
+                                         retry_policy=retry_policy, packer=packer)
+        self.client.quiet = quiet
+        self.quiet = quiet
+        if spool is not None:
+            self.client.spool = OfflineSpool(spool, self.client.send_spooled, retry_interval=spool_retry_interval)
+        self.adaptive_sender = AdaptiveRestSender(self.client, retry_policy=retry_policy) if adaptive else None
+        # Optional stateful fleet (fleet_simulator.py) in place of random readings
+        self.fleet = None
+        if simulated_devices:
+            from fleet_simulator import FleetSimulator
+            self.fleet = FleetSimulator(simulated_devices)
+        # Optional per-producer sequence numbers for delivery_verifier.py
+        self.tagger = None
+        if sequence_tags:
+            from delivery_verifier import SequenceTagger
+            self.tagger = SequenceTagger()
+    
+    def _batch_sender(self):
+        """The send function for batch and rate modes."""
+        if self.adaptive_sender is not None:
+            return self.adaptive_sender.send
+        return self.client.send_batch
+    
+    def _finish_adaptive(self):
+        """Drain the retry buffer and report flow-control counters."""
+        if self.adaptive_sender is None:
+            return
+        if not self.adaptive_sender.flush(timeout=60):
+            logger.error(f"✗ {self.adaptive_sender.retry_buffer.events} events still waiting for retry")
+        logger.info(f"Flow control: {self.adaptive_sender.stats.summary()}, "
+                    f"final batch size {self.adaptive_sender.batch_control.current}")
     
     def generate_telemetry_data(self) -> Dict[str, Any]:
         """Generate random telemetry data."""
+        if self.fleet is not None:
+            return self._emit(self.fleet.next_batch(1, decimals=2, include_metadata=False).to_records())[0]
         device_id = f"device-{random.randint(1, 100):03d}"
         timestamp = datetime.now(timezone.utc).isoformat().replace('+00:00', 'Z')
         
@@ -161,7 +505,34 @@ class EventHubDataGeneratorRest:
             }
         }
         
-        return data
+        return self._emit([data])[0]
+    
+    def _emit(self, records: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """Count generated records and embed sequence tags when they are on."""
+        METRICS.generated.inc(len(records))
+        return records if self.tagger is None else self.tagger.tag(records)
+    
+    def generate_telemetry_batch(self, count: int) -> RecordBatch:
+        """Generate count telemetry records, vectorized with NumPy when available.
+        
+        The NumPy columns are returned as a TelemetryBatch that the send paths
+        encode column by column; sequence tags need the records as dicts.
+        """
+        if self.fleet is not None:
+            return self._emit_batch(self.fleet.next_batch(count, decimals=2, include_metadata=False))
+        try:
+            from telemetry_batch import generate_telemetry_batch
+        except ImportError:
+            # NumPy is optional; without it records are generated one by one
+            return [self.generate_telemetry_data() for _ in range(count)]
+        return self._emit_batch(generate_telemetry_batch(count, decimals=2, include_metadata=False))
+    
+    def _emit_batch(self, batch) -> RecordBatch:
+        """Count a generated TelemetryBatch, turning it into tagged dicts only when tags are on."""
+        if self.tagger is not None:
+            return self._emit(batch.to_records())
+        METRICS.generated.inc(len(batch))
+        return batch
     
     def test_connectivity(self) -> bool:
         """Test Event Hub connectivity by sending a test message."""
@@ -179,12 +550,12 @@ class EventHubDataGeneratorRest:
             }
         }
         
-        success = self.client.send_message(test_data)
+        success = self.client.send_message(test_data, probe=True)
         if success:
             logger.info("✓ Test message sent successfully! Event Hub is reachable.")
         else:
             logger.error("✗ Test message failed!")
-            
+        
         return success
     
     def run_continuous_generation(self, interval_seconds: int = 5):
@@ -192,26 +563,121 @@ class EventHubDataGeneratorRest:
         logger.info(f"Starting continuous data generation (every {interval_seconds} seconds)")
         logger.info("Press Ctrl+C to stop...")
         
+        # Schedule sends on the monotonic clock so send time does not add drift
+        next_send = time.monotonic()
         try:
             while True:
                 # Generate sample data
                 sample_data = self.generate_telemetry_data()
                 
                 # Print the data
-                print("\nSample telemetry data:")
-                print(json.dumps(sample_data, indent=2))
+                if not self.quiet:
+                    print("\nSample telemetry data:")
+                    print(json.dumps(sample_data, indent=2))
                 
                 # Send to Event Hub
                 self.client.send_message(sample_data)
                 
                 # Wait for next iteration
-                time.sleep(interval_seconds)
-                
+                next_send += interval_seconds
+                time.sleep(max(0.0, next_send - time.monotonic()))
+        
         except KeyboardInterrupt:
             logger.info("\n⏹️  Stopping data generation...")
         except Exception as e:
             logger.error(f"Error in continuous generation: {e}")
             raise
+    
+    def run_batched_generation(self, batch_size: int = 500, max_events: Optional[int] = None):
+        """Generate and send events as fast as possible in multi-event batch POSTs."""
+        logger.info(f"Starting batched data generation ({batch_size} events per batch)")
+        logger.info("Press Ctrl+C to stop...")
+        
+        send_batch = self._batch_sender()
+        generated = 0
+        sent = 0
+        started = time.monotonic()
+        try:
+            while max_events is None or generated < max_events:
+                count = batch_size if max_events is None else min(batch_size, max_events - generated)
+                batch = self.generate_telemetry_batch(count)
+                generated += count
+                sent += send_batch(batch)
+        
+        except KeyboardInterrupt:
+            logger.info("\n⏹️  Stopping data generation...")
+        except Exception as e:
+            logger.error(f"Error in batched generation: {e}")
+            raise
+        finally:
+            if self.adaptive_sender is not None:
+                sent_before = self.adaptive_sender.stats.sent
+                self._finish_adaptive()
+                sent += self.adaptive_sender.stats.sent - sent_before
+            elapsed = max(time.monotonic() - started, 1e-9)
+            logger.info(f"Sent {sent}/{generated} events, {sent / elapsed:.1f} events/sec")
+    
+    def run_rate_generation(self, profile, duration_seconds: Optional[float] = None):
+        """Send batch POSTs at the target rate given by a load profile."""
+        from load_profiles import run_rate_controlled
+        
+        logger.info(f"Starting rate-controlled generation ({profile.describe()})")
+        logger.info("Press Ctrl+C to stop...")
+        try:
+            run_rate_controlled(
+                self.generate_telemetry_data,
+                self._batch_sender(),
+                profile,
+                duration_seconds=duration_seconds,
+                generate_batch=self.generate_telemetry_batch
+            )
+        finally:
+            self._finish_adaptive()
+    
+    def run_replay_generation(self, path: str, speed: float = 1.0, rebase: str = "none",
+                              time_field: str = "timestamp", max_events: Optional[int] = None):
+        """Re-send a recorded JSON/JSON Lines file as batch POSTs on its own schedule."""
+        from replay import run_replay
+        from saql_engine import iter_json_records
+        
+        send_batch = self._batch_sender()
+        
+        def send(messages) -> int:
+            return send_batch(self._emit(messages))
+        
+        pace = "as fast as possible" if not speed else f"at {speed:g}x"
+        logger.info(f"Replaying {path} {pace} (timestamps: {rebase})")
+        logger.info("Press Ctrl+C to stop...")
+        try:
+            run_replay(iter_json_records(path), send, speed=speed, rebase=rebase,
+                       time_field=time_field, max_events=max_events)
+        finally:
+            self._finish_adaptive()
+    
+    def run_async_generation(self, max_in_flight: int = 8, batch_size: int = 500,
+                             max_events: Optional[int] = None):
+        """Generate and send batch POSTs with aiohttp, keeping several requests in flight."""
+        import asyncio
+        from async_sender import AsyncRestSender, run_engine
+        
+        logger.info(f"Starting async data generation ({max_in_flight} requests in flight)")
+        logger.info("Press Ctrl+C to stop...")
+        
+        limiter = AdaptiveConcurrencyLimiter(maximum=max_in_flight, initial=max_in_flight) if self.adaptive else None
+        sender = AsyncRestSender(self.client, max_in_flight=max_in_flight, limiter=limiter)
+        stats = asyncio.run(run_engine(
+            sender,
+            self.generate_telemetry_data,
+            max_in_flight=max_in_flight,
+            batch_size=batch_size,
+            max_events=max_events,
+            generate_batch=self.generate_telemetry_batch,
+            limiter=limiter
+        ))
+        logger.info(f"Async summary: {stats.summary()}")
+        if limiter is not None:
+            logger.info(f"Flow control: {sender.throttled} throttled responses, {sender.retries} retries, "
+                        f"final concurrency {limiter.limit}")
 
 def get_connection_string() -> str:
     """Get connection string from environment or user input."""
@@ -235,12 +701,75 @@ def get_connection_string() -> str:
             return conn_str
         print("Connection string cannot be empty. Please try again.")
 
-def main():
-    """Main function to run the Event Hub data generator."""
-    
+def parse_args():
+    """Parse command line options."""
     # Configuration
     EVENTHUB_NAME = "telemetry-data"
     SEND_INTERVAL = 5  # seconds
+    BATCH_SIZE = 500  # events per batch POST
+    
+    parser = argparse.ArgumentParser(description="Azure Event Hub Sample Data Generator (REST API)")
+    parser.add_argument("--eventhub", default=EVENTHUB_NAME)
+    parser.add_argument("--mode", choices=["interval", "batch", "async", "rate", "replay"], default="interval",
+                        help="'interval' sends one event every --interval seconds; "
+                             "'batch' sends multi-event POSTs as fast as possible; "
+                             "'async' keeps up to --max-in-flight batch POSTs outstanding; "
+                             "'rate' follows the --profile target rate; "
+                             "'replay' re-sends the --replay-file recording")
+    parser.add_argument("--interval", type=float, default=SEND_INTERVAL,
+                        help="Seconds between events in interval mode")
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE,
+                        help="Events generated per batch in batch and async modes")
+    parser.add_argument("--max-in-flight", type=int, default=8,
+                        help="Concurrent batch POSTs in async mode")
+    parser.add_argument("--profile", default="constant:100",
+                        help="Load profile for rate mode, e.g. constant:1000, ramp:100:5000:300, "
+                             "step:60x100,60x1000, burst:200:5000:60:5, sine:1000:800:3600")
+    parser.add_argument("--duration", type=float, default=None,
+                        help="Stop rate mode after this many seconds")
+    parser.add_argument("--max-events", type=int, default=None,
+                        help="Stop after this many events in batch, async or replay mode")
+    parser.add_argument("--base-url", default=os.getenv('EVENTHUB_REST_BASE_URL'),
+                        help="Override the https://<namespace> endpoint (e.g. a local stand-in)")
+    parser.add_argument("--adaptive", action="store_true",
+                        help="Adapt batch size (batch/rate) or concurrency (async) to throttling "
+                             "and buffer throttled batches for retry")
+    parser.add_argument("--simulated-devices", type=int, default=None, metavar="N",
+                        help="Draw readings from a stateful simulated fleet of N devices "
+                             "(random walks, drift, faults; needs NumPy) instead of random values")
+    parser.add_argument("--replay-file", default=None,
+                        help="JSON array or JSON Lines recording to send in replay mode")
+    parser.add_argument("--speed", type=float, default=1.0,
+                        help="Replay speed-up over the recorded cadence; 0 sends as fast as possible")
+    parser.add_argument("--rebase", choices=["none", "shift", "warp"], default="none",
+                        help="Replay timestamps: keep them, shift them to start now, or also "
+                             "compress them by --speed so event time follows send time")
+    parser.add_argument("--time-field", default="timestamp",
+                        help="Recorded event time field that drives replay pacing")
+    parser.add_argument("--sequence-tags", action="store_true",
+                        help="Embed producerId, seq and sentAt in every event so delivery_verifier.py "
+                             "can measure latency and detect loss, duplicates and reordering")
+    add_format_arguments(parser)
+    add_compression_arguments(parser)
+    add_metrics_arguments(parser)
+    add_spool_arguments(parser)
+    args = parser.parse_args()
+    if args.mode == "replay" and not args.replay_file:
+        parser.error("--mode replay needs --replay-file")
+    packed = args.compression or args.format != JSON or records_per_event(args) > 1
+    if packed and (args.adaptive or args.mode in ("interval", "async")):
+        parser.error("--compression, --format csv/avro and --records-per-event apply to the batch, rate "
+                     "and replay modes without --adaptive")
+    if args.spool_dir and (args.adaptive or args.mode == "async"):
+        parser.error("--spool-dir applies to the interval, batch, rate and replay modes without --adaptive")
+    return args
+
+def main():
+    """Main function to run the Event Hub data generator."""
+    
+    args = parse_args()
+    EVENTHUB_NAME = args.eventhub
+    SEND_INTERVAL = args.interval
     
     print("Azure Event Hub Sample Data Generator (REST API)")
     print("=" * 60)
@@ -252,20 +781,48 @@ def main():
         # Initialize the generator
         generator = EventHubDataGeneratorRest(
             connection_string=connection_string,
-            eventhub_name=EVENTHUB_NAME
+            eventhub_name=EVENTHUB_NAME,
+            base_url=args.base_url,
+            adaptive=args.adaptive,
+            simulated_devices=args.simulated_devices,
+            packer=packer_from_args(args),
+            sequence_tags=args.sequence_tags,
+            quiet=args.quiet,
+            spool=spool_from_args(args),
+            spool_retry_interval=args.spool_retry_interval
         )
         
-        # Test connectivity
+        # Test connectivity; with a spool, an unreachable hub is not fatal
         if not generator.test_connectivity():
-            print("\n❌ Connectivity test failed. Please check:")
-            print("1. Your connection string is correct")
-            print("2. Your Event Hub exists and is accessible")
-            print("3. Your network connection is working")
-            sys.exit(1)
-        
-        # Start continuous generation
-        generator.run_continuous_generation(SEND_INTERVAL)
+            if generator.client.spool is None:
+                print("\n❌ Connectivity test failed. Please check:")
+                print("1. Your connection string is correct")
+                print("2. Your Event Hub exists and is accessible")
+                print("3. Your network connection is working")
+                sys.exit(1)
+            logger.warning("Starting anyway; events are spooled until the hub is reachable")
+            generator.client.spool.link_failed()
         
+        metrics_output = MetricsOutput(args)
+        metrics_output.start()
+        try:
+            if args.mode == "batch":
+                generator.run_batched_generation(args.batch_size, args.max_events)
+            elif args.mode == "rate":
+                from load_profiles import parse_profile
+                generator.run_rate_generation(parse_profile(args.profile), args.duration)
+            elif args.mode == "async":
+                generator.run_async_generation(args.max_in_flight, args.batch_size, args.max_events)
+            elif args.mode == "replay":
+                generator.run_replay_generation(args.replay_file, args.speed, args.rebase,
+                                                args.time_field, args.max_events)
+            else:
+                # Start continuous generation
+                generator.run_continuous_generation(SEND_INTERVAL)
+        finally:
+            generator.client.close()
+            metrics_output.stop()
+    
     except Exception as e:
         logger.error(f"Application error: {e}")
         sys.exit(1)
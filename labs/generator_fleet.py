@@ -0,0 +1,444 @@
+#!/usr/bin/env python3
+"""
+Multi-Process Event Hub Generator Fleet
+Starts one worker process per core. Each worker owns a disjoint slice of the
+device-id space and its own producer, and sends with partition_key=deviceId
+(or pinned to a partition) so per-device ordering is preserved. A REST batch
+POST carries a single partition key, so the REST transport's key mode maps
+each device to a fixed partition instead and posts one batch per partition.
+"""
+
+import argparse
+import logging
+import multiprocessing
+import os
+import queue
+import random
+import signal
+import sys
+import threading
+import time
+import zlib
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional, Tuple
+
+from serializers import RecordBatch, encode_records
+
+logging.basicConfig(
+    level=logging.ERROR,
+    format='%(message)s'
+)
+logger = logging.getLogger(__name__)
+
+# Seconds between stats reports from each worker
+STATS_INTERVAL = 1.0
+
+def split_device_range(device_count: int, workers: int) -> List[Tuple[int, int]]:
+    """Split device numbers 1..device_count into contiguous, disjoint (first, last) slices."""
+    workers = max(1, min(workers, device_count))
+    base, extra = divmod(device_count, workers)
+    ranges = []
+    first = 1
+    for index in range(workers):
+        size = base + (1 if index < extra else 0)
+        ranges.append((first, first + size - 1))
+        first += size
+    return ranges
+
+class WorkerStats:
+    """Counters updated by a worker's send path, possibly from SDK callback threads."""
+    
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.sent = 0
+        self.failed = 0
+        self.bytes = 0
+    
+    def add(self, sent: int = 0, failed: int = 0, size_bytes: int = 0):
+        with self._lock:
+            self.sent += sent
+            self.failed += failed
+            self.bytes += size_bytes
+    
+    def snapshot(self) -> Tuple[int, int, int]:
+        with self._lock:
+            return self.sent, self.failed, self.bytes
+
+def _make_generator(first_device: int, last_device: int, stateful: bool = False):
+    """Return a function that generates records for this worker's devices.
+    
+    With NumPy the records stay a columnar TelemetryBatch that the senders
+    encode column by column; without it they are a list of dicts.
+    """
+    if stateful:
+        # Each worker simulates only its own slice of the fleet
+        from fleet_simulator import FleetSimulator
+        fleet = FleetSimulator(last_device - first_device + 1, first_device=first_device)
+        return lambda count: fleet.next_batch(count)
+    try:
+        from telemetry_batch import generate_telemetry_batch
+    except ImportError:
+        generate_telemetry_batch = None
+    
+    if generate_telemetry_batch is not None:
+        def generate(count: int) -> RecordBatch:
+            return generate_telemetry_batch(count, device_count=last_device, first_device=first_device)
+        return generate
+    
+    from generate_sample_data import FIRMWARE_VERSIONS, SENSOR_TYPES
+    
+    def generate(count: int) -> List[Dict[str, Any]]:
+        timestamp = datetime.now(timezone.utc).isoformat().replace('+00:00', 'Z')
+        return [
+            {
+                "deviceId": f"device-{random.randint(first_device, last_device):03d}",
+                "timestamp": timestamp,
+                "temperature": round(random.uniform(20, 40), 1),
+                "humidity": round(random.uniform(30, 80), 1),
+                "pressure": round(random.uniform(1000, 1100), 2),
+                "location": {
+                    "lat": 47.6062,
+                    "lon": -122.3321
+                },
+                "metadata": {
+                    "sensorType": random.choice(SENSOR_TYPES),
+                    "firmware": random.choice(FIRMWARE_VERSIONS)
+                }
+            }
+            for _ in range(count)
+        ]
+    return generate
+
+def _device_ids(records: RecordBatch) -> List[str]:
+    if not isinstance(records, list):
+        return records.device_ids().tolist()
+    return [record["deviceId"] for record in records]
+
+def device_partition(device_id: str, partition_count: int) -> str:
+    """Fixed partition for a device (the same in every worker and run)."""
+    return str(zlib.crc32(device_id.encode('utf-8')) % partition_count)
+
+def _group_by_partition(records: RecordBatch, partition_count: int) -> Dict[str, RecordBatch]:
+    """Split records by their device's partition, keeping each device's records in order."""
+    partitions: Dict[str, str] = {}
+    positions: Dict[str, List[int]] = {}
+    for index, device_id in enumerate(_device_ids(records)):
+        partition_id = partitions.get(device_id)
+        if partition_id is None:
+            partition_id = partitions[device_id] = device_partition(device_id, partition_count)
+        positions.setdefault(partition_id, []).append(index)
+    if not isinstance(records, list):
+        return {partition_id: records.take(indices) for partition_id, indices in positions.items()}
+    return {partition_id: [records[index] for index in indices] for partition_id, indices in positions.items()}
+
+class SdkWorkerSender:
+    """Per-worker sender built on the Azure SDK producer."""
+    
+    def __init__(self, config: Dict[str, Any], worker_index: int, stats: WorkerStats):
+        from azure.eventhub import EventData, EventHubProducerClient
+        from serializers import JsonSerializer
+        
+        self._event_data = EventData
+        self._serializer = JsonSerializer()
+        self.stats = stats
+        self.partition_id = None
+        
+        if config["partition_mode"] == "key":
+            # Buffered mode batches per partition in the background and
+            # resolves partition keys to partitions on the client
+            self.producer_client = EventHubProducerClient.from_connection_string(
+                conn_str=config["connection_string"],
+                eventhub_name=config["eventhub_name"],
+                buffered_mode=True,
+                max_wait_time=config["linger_seconds"],
+                on_success=self._on_success,
+                on_error=self._on_error
+            )
+        else:
+            self.producer_client = EventHubProducerClient.from_connection_string(
+                conn_str=config["connection_string"],
+                eventhub_name=config["eventhub_name"]
+            )
+            partition_ids = self.producer_client.get_partition_ids()
+            self.partition_id = partition_ids[worker_index % len(partition_ids)]
+    
+    def _on_success(self, events, partition_id):
+        self.stats.add(sent=len(events), size_bytes=sum(len(e.body_as_str()) for e in events))
+    
+    def _on_error(self, events, partition_id, error):
+        logger.error(f"✗ Failed to send {len(events)} events to partition {partition_id}: {error}")
+        self.stats.add(failed=len(events))
+    
+    def send(self, records: RecordBatch):
+        payloads = encode_records(self._serializer, records)
+        if self.partition_id is None:
+            for payload, device_id in zip(payloads, _device_ids(records)):
+                self.producer_client.send_event(
+                    self._event_data(payload),
+                    partition_key=device_id
+                )
+            return
+        
+        batch = self.producer_client.create_batch(partition_id=self.partition_id)
+        for payload in payloads:
+            event_data = self._event_data(payload)
+            try:
+                batch.add(event_data)
+            except ValueError:
+                self._send_pinned(batch)
+                batch = self.producer_client.create_batch(partition_id=self.partition_id)
+                batch.add(event_data)
+        self._send_pinned(batch)
+    
+    def _send_pinned(self, batch):
+        if len(batch) == 0:
+            return
+        try:
+            self.producer_client.send_batch(batch)
+            self.stats.add(sent=len(batch), size_bytes=batch.size_in_bytes)
+        except Exception as e:
+            logger.error(f"✗ Failed to send batch of {len(batch)} events: {e}")
+            self.stats.add(failed=len(batch))
+    
+    def close(self):
+        self.producer_client.close()
+
+class RestWorkerSender:
+    """Per-worker sender built on the REST client."""
+    
+    def __init__(self, config: Dict[str, Any], worker_index: int, stats: WorkerStats):
+        from generate_sample_data_rest import EventHubRestClient
+        
+        self.client = EventHubRestClient(
+            config["connection_string"],
+            config["eventhub_name"],
+            base_url=config.get("base_url")
+        )
+        self.stats = stats
+        self.partition_count = config["partition_count"]
+        self.partition_id = None
+        if config["partition_mode"] == "pinned":
+            self.partition_id = str(worker_index % self.partition_count)
+    
+    def send(self, records: RecordBatch):
+        bytes_before = self.client.bytes_sent
+        if self.partition_id is not None:
+            sent = self.client.send_batch(records, partition_id=self.partition_id)
+        else:
+            # A batch POST carries one partition key, and per-device keys would
+            # mean one small POST per device; each device keeps a fixed partition
+            sent = 0
+            for partition_id, partition_records in _group_by_partition(records, self.partition_count).items():
+                sent += self.client.send_batch(partition_records, partition_id=partition_id)
+        self.stats.add(sent=sent, failed=len(records) - sent,
+                       size_bytes=self.client.bytes_sent - bytes_before)
+    
+    def close(self):
+        self.client.close()
+
+def fleet_worker(config: Dict[str, Any], worker_index: int, device_range: Tuple[int, int],
+                 stats_queue, stop_event):
+    """Worker process entry point: generate and send until stop_event is set."""
+    # The parent handles Ctrl+C and sets stop_event so workers can flush
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    
+    stats = WorkerStats()
+    sender_class = SdkWorkerSender if config["transport"] == "sdk" else RestWorkerSender
+    try:
+        sender = sender_class(config, worker_index, stats)
+    except Exception as e:
+        stats_queue.put((worker_index, 0, 0, 0, f"startup failed: {e}"))
+        return
+    
+    generate = _make_generator(*device_range, stateful=config.get("stateful", False))
+    chunk_size = config["chunk_size"]
+    max_events = config.get("max_events_per_worker")
+    generated = 0
+    last_report = time.monotonic()
+    error = None
+    try:
+        while not stop_event.is_set():
+            count = chunk_size if max_events is None else min(chunk_size, max_events - generated)
+            if count <= 0:
+                break
+            sender.send(generate(count))
+            generated += count
+            
+            now = time.monotonic()
+            if now - last_report >= STATS_INTERVAL:
+                stats_queue.put((worker_index, *stats.snapshot(), None))
+                last_report = now
+    except Exception as e:
+        error = str(e)
+    finally:
+        try:
+            sender.close()
+        except Exception as e:
+            error = error or str(e)
+        stats_queue.put((worker_index, *stats.snapshot(), error or "done"))
+
+class FleetStats:
+    """Latest per-worker counters, aggregated in the parent process."""
+    
+    def __init__(self, workers: int):
+        self.per_worker = {index: (0, 0, 0) for index in range(workers)}
+        self.errors = {}
+        self.started = time.monotonic()
+    
+    def update(self, worker_index: int, sent: int, failed: int, size_bytes: int):
+        self.per_worker[worker_index] = (sent, failed, size_bytes)
+    
+    def totals(self) -> Tuple[int, int, int]:
+        sent = sum(v[0] for v in self.per_worker.values())
+        failed = sum(v[1] for v in self.per_worker.values())
+        size_bytes = sum(v[2] for v in self.per_worker.values())
+        return sent, failed, size_bytes
+    
+    def summary(self) -> str:
+        sent, failed, size_bytes = self.totals()
+        elapsed = max(time.monotonic() - self.started, 1e-9)
+        return (
+            f"sent {sent}, failed {failed}, {size_bytes / 1024 / 1024:.1f} MiB, "
+            f"{sent / elapsed:.1f} events/sec across {len(self.per_worker)} workers"
+        )
+
+def run_fleet(config: Dict[str, Any], workers: int, device_count: int,
+              duration_seconds: Optional[float] = None) -> FleetStats:
+    """Start the worker processes and aggregate their stats until they finish."""
+    ranges = split_device_range(device_count, workers)
+    context = multiprocessing.get_context("spawn")
+    stats_queue = context.Queue()
+    stop_event = context.Event()
+    
+    processes = [
+        context.Process(
+            target=fleet_worker,
+            args=(config, index, device_range, stats_queue, stop_event),
+            name=f"fleet-worker-{index}"
+        )
+        for index, device_range in enumerate(ranges)
+    ]
+    for process in processes:
+        process.start()
+    
+    fleet_stats = FleetStats(len(processes))
+    finished = set()
+    last_print = time.monotonic()
+    try:
+        while len(finished) < len(processes):
+            if duration_seconds is not None and time.monotonic() - fleet_stats.started >= duration_seconds:
+                stop_event.set()
+            
+            try:
+                index, sent, failed, size_bytes, status = stats_queue.get(timeout=0.5)
+            except queue.Empty:
+                if not any(p.is_alive() for p in processes):
+                    break
+                continue
+            
+            fleet_stats.update(index, sent, failed, size_bytes)
+            if status is not None:
+                finished.add(index)
+                if status != "done":
+                    fleet_stats.errors[index] = status
+                    logger.error(f"✗ Worker {index} stopped: {status}")
+            
+            if time.monotonic() - last_print >= 5:
+                print(f"Fleet: {fleet_stats.summary()}")
+                last_print = time.monotonic()
+    
+    except KeyboardInterrupt:
+        print("\n⏹️  Stopping fleet, waiting for workers to flush...")
+        stop_event.set()
+        while len(finished) < len(processes):
+            try:
+                index, sent, failed, size_bytes, status = stats_queue.get(timeout=30)
+            except queue.Empty:
+                break
+            fleet_stats.update(index, sent, failed, size_bytes)
+            if status is not None:
+                finished.add(index)
+    finally:
+        stop_event.set()
+        for process in processes:
+            process.join(timeout=30)
+    
+    for index in sorted(fleet_stats.per_worker):
+        sent, failed, size_bytes = fleet_stats.per_worker[index]
+        first, last = ranges[index]
+        print(f"  worker {index} (devices {first}-{last}): sent {sent}, failed {failed}")
+    print(f"Fleet summary: {fleet_stats.summary()}")
+    return fleet_stats
+
+def resolve_connection_string(args) -> str:
+    """Resolve the connection string once in the parent so workers don't each look it up."""
+    conn_str = os.getenv('EVENTHUB_CONNECTION_STRING')
+    if conn_str:
+        return conn_str
+    if args.transport == "rest":
+        raise Exception("EVENTHUB_CONNECTION_STRING environment variable not set")
+    
+    from generate_sample_data import EventHubDataGenerator
+    generator = EventHubDataGenerator(args.resource_group, args.namespace, args.eventhub)
+    return generator.get_connection_string()
+
+def parse_args():
+    """Parse command line options."""
+    parser = argparse.ArgumentParser(description="Multi-process Event Hub generator fleet")
+    parser.add_argument("--transport", choices=["sdk", "rest"], default="sdk")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--devices", type=int, default=100,
+                        help="Total devices, split into disjoint slices across workers")
+    parser.add_argument("--stateful", action="store_true",
+                        help="Simulate each device's state over time (fleet_simulator.py) "
+                             "instead of independent random readings")
+    parser.add_argument("--partition-mode", choices=["key", "pinned"], default="key",
+                        help="'key' sends with partition_key=deviceId (REST: a fixed partition per device); "
+                             "'pinned' sends each worker to one partition")
+    parser.add_argument("--partition-count", type=int, default=4,
+                        help="Partitions in the hub (REST transport only)")
+    parser.add_argument("--chunk-size", type=int, default=500,
+                        help="Events generated per worker iteration")
+    parser.add_argument("--linger", type=float, default=0.05,
+                        help="Max seconds events wait in the SDK buffer")
+    parser.add_argument("--duration", type=float, default=None)
+    parser.add_argument("--max-events-per-worker", type=int, default=None)
+    parser.add_argument("--resource-group", default="rg-streamanalytics-workshop")
+    parser.add_argument("--namespace", default="eventhub-sa-workshop-1234")
+    parser.add_argument("--eventhub", default="telemetry-data")
+    parser.add_argument("--base-url", default=os.getenv('EVENTHUB_REST_BASE_URL'),
+                        help="Override the REST endpoint (e.g. a local stand-in)")
+    return parser.parse_args()
+
+def main():
+    """Main function to run the generator fleet."""
+    args = parse_args()
+    
+    print("Azure Event Hub Generator Fleet")
+    print("=" * 50)
+    
+    try:
+        config = {
+            "transport": args.transport,
+            "connection_string": resolve_connection_string(args),
+            "eventhub_name": args.eventhub,
+            "base_url": args.base_url,
+            "partition_mode": args.partition_mode,
+            "partition_count": args.partition_count,
+            "chunk_size": args.chunk_size,
+            "linger_seconds": args.linger,
+            "max_events_per_worker": args.max_events_per_worker,
+            "stateful": args.stateful,
+        }
+        print(f"Starting {args.workers} workers for {args.devices} devices "
+              f"({args.transport}, partition mode '{args.partition_mode}')")
+        print("Press Ctrl+C to stop...")
+        stats = run_fleet(config, args.workers, args.devices, args.duration)
+        if stats.errors:
+            sys.exit(1)
+    except Exception as e:
+        logger.error(f"Application error: {e}")
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,281 @@
+#!/usr/bin/env python3
+"""
+Target-Rate Load Generation
+Token-bucket pacing and traffic profiles (constant, ramp, step, burst,
+diurnal sine) for driving Event Hub senders at a chosen events/sec.
+"""
+
+import math
+import time
+from abc import ABC, abstractmethod
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+class LoadProfile(ABC):
+    """Target rate in events/sec as a function of seconds since start."""
+    
+    name = "profile"
+    
+    @abstractmethod
+    def rate_at(self, elapsed: float) -> float:
+        """Target events/sec at elapsed seconds since start."""
+    
+    def describe(self) -> str:
+        return self.name
+
+class ConstantProfile(LoadProfile):
+    """The same rate for the whole run."""
+    
+    name = "constant"
+    
+    def __init__(self, rate: float):
+        self.rate = rate
+    
+    def rate_at(self, elapsed: float) -> float:
+        return self.rate
+    
+    def describe(self) -> str:
+        return f"constant {self.rate:g}/s"
+
+class RampProfile(LoadProfile):
+    """Linear ramp from start_rate to end_rate, then hold end_rate."""
+    
+    name = "ramp"
+    
+    def __init__(self, start_rate: float, end_rate: float, ramp_seconds: float):
+        self.start_rate = start_rate
+        self.end_rate = end_rate
+        self.ramp_seconds = ramp_seconds
+    
+    def rate_at(self, elapsed: float) -> float:
+        if elapsed >= self.ramp_seconds:
+            return self.end_rate
+        fraction = elapsed / self.ramp_seconds
+        return self.start_rate + (self.end_rate - self.start_rate) * fraction
+    
+    def describe(self) -> str:
+        return f"ramp {self.start_rate:g}/s -> {self.end_rate:g}/s over {self.ramp_seconds:g}s"
+
+class StepProfile(LoadProfile):
+    """A sequence of (duration_seconds, rate) steps; the last rate is held."""
+    
+    name = "step"
+    
+    def __init__(self, steps: List[Tuple[float, float]]):
+        if not steps:
+            raise ValueError("StepProfile needs at least one step")
+        self.steps = steps
+    
+    def rate_at(self, elapsed: float) -> float:
+        for duration, rate in self.steps:
+            if elapsed < duration:
+                return rate
+            elapsed -= duration
+        return self.steps[-1][1]
+    
+    def describe(self) -> str:
+        return "step " + ", ".join(f"{rate:g}/s for {duration:g}s" for duration, rate in self.steps)
+
+class BurstProfile(LoadProfile):
+    """A base rate with a burst of burst_rate for burst_seconds every period_seconds."""
+    
+    name = "burst"
+    
+    def __init__(self, base_rate: float, burst_rate: float, period_seconds: float,
+                 burst_seconds: float):
+        self.base_rate = base_rate
+        self.burst_rate = burst_rate
+        self.period_seconds = period_seconds
+        self.burst_seconds = burst_seconds
+    
+    def rate_at(self, elapsed: float) -> float:
+        if elapsed % self.period_seconds < self.burst_seconds:
+            return self.burst_rate
+        return self.base_rate
+    
+    def describe(self) -> str:
+        return (f"burst {self.base_rate:g}/s with {self.burst_rate:g}/s for "
+                f"{self.burst_seconds:g}s every {self.period_seconds:g}s")
+
+class SineProfile(LoadProfile):
+    """Diurnal-style sine wave around mean_rate, never below zero."""
+    
+    name = "sine"
+    
+    def __init__(self, mean_rate: float, amplitude: float, period_seconds: float):
+        self.mean_rate = mean_rate
+        self.amplitude = amplitude
+        self.period_seconds = period_seconds
+    
+    def rate_at(self, elapsed: float) -> float:
+        phase = 2 * math.pi * elapsed / self.period_seconds
+        return max(0.0, self.mean_rate + self.amplitude * math.sin(phase))
+    
+    def describe(self) -> str:
+        return (f"sine {self.mean_rate:g}/s ± {self.amplitude:g}/s, "
+                f"period {self.period_seconds:g}s")
+
+def parse_profile(spec: str) -> LoadProfile:
+    """Build a profile from a command line spec.
+    
+    Formats:
+        constant:RATE
+        ramp:START_RATE:END_RATE:RAMP_SECONDS
+        step:SECONDSxRATE,SECONDSxRATE,...
+        burst:BASE_RATE:BURST_RATE:PERIOD_SECONDS:BURST_SECONDS
+        sine:MEAN_RATE:AMPLITUDE:PERIOD_SECONDS
+    A bare number is treated as constant:RATE.
+    """
+    kind, _, rest = spec.partition(':')
+    try:
+        if not rest:
+            return ConstantProfile(float(kind))
+        if kind == "constant":
+            return ConstantProfile(float(rest))
+        if kind == "ramp":
+            start, end, seconds = (float(v) for v in rest.split(':'))
+            return RampProfile(start, end, seconds)
+        if kind == "step":
+            steps = []
+            for step in rest.split(','):
+                seconds, rate = step.split('x')
+                steps.append((float(seconds), float(rate)))
+            return StepProfile(steps)
+        if kind == "burst":
+            base, burst, period, burst_seconds = (float(v) for v in rest.split(':'))
+            return BurstProfile(base, burst, period, burst_seconds)
+        if kind == "sine":
+            mean, amplitude, period = (float(v) for v in rest.split(':'))
+            return SineProfile(mean, amplitude, period)
+    except ValueError as e:
+        raise ValueError(f"Invalid load profile '{spec}': {e}")
+    raise ValueError(f"Unknown load profile '{kind}'")
+
+class TokenBucket:
+    """Token bucket on the monotonic clock whose refill rate can change over time.
+    
+    Tokens accrue at the current rate up to capacity; take(n) returns how long
+    to wait before n tokens are available (0 if they were taken immediately).
+    """
+    
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = 0.0
+        self._last = time.monotonic()
+    
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self._last) * self.rate)
+        self._last = now
+    
+    def set_rate(self, rate: float):
+        """Change the refill rate, crediting tokens earned at the old rate first."""
+        self._refill(time.monotonic())
+        self.rate = rate
+    
+    def take(self, count: float) -> float:
+        """Take count tokens if available; otherwise return seconds to wait."""
+        self._refill(time.monotonic())
+        if self.tokens >= count:
+            self.tokens -= count
+            return 0.0
+        if self.rate <= 0:
+            return float('inf')
+        return (count - self.tokens) / self.rate
+
+class RateReport:
+    """Tracks achieved vs. target rate over reporting intervals."""
+    
+    def __init__(self, interval_seconds: float = 5.0):
+        self.interval_seconds = interval_seconds
+        self.started = time.monotonic()
+        self.total_sent = 0
+        self.total_target = 0.0
+        self._window_start = self.started
+        self._window_sent = 0
+        self._window_target = 0.0
+    
+    def record(self, sent: int):
+        self.total_sent += sent
+        self._window_sent += sent
+    
+    def add_target(self, events: float):
+        """Accumulate the number of events the profile asked for."""
+        self.total_target += events
+        self._window_target += events
+    
+    def maybe_report(self, profile_rate: float):
+        """Log one line per interval with target and achieved rates."""
+        now = time.monotonic()
+        window = now - self._window_start
+        if window < self.interval_seconds:
+            return
+        achieved = self._window_sent / window
+        target = self._window_target / window
+        print(
+            f"[{now - self.started:7.1f}s] target {target:9.1f}/s "
+            f"achieved {achieved:9.1f}/s (profile now {profile_rate:.1f}/s)"
+        )
+        self._window_start = now
+        self._window_sent = 0
+        self._window_target = 0.0
+    
+    def summary(self) -> str:
+        elapsed = max(time.monotonic() - self.started, 1e-9)
+        ratio = (self.total_sent / self.total_target * 100) if self.total_target else 0.0
+        return (
+            f"sent {self.total_sent} events in {elapsed:.1f}s: "
+            f"target {self.total_target / elapsed:.1f}/s, "
+            f"achieved {self.total_sent / elapsed:.1f}/s ({ratio:.1f}% of target)"
+        )
+
+def run_rate_controlled(generate: Callable[[], Dict[str, Any]],
+                        send: Callable[[List[Dict[str, Any]]], int],
+                        profile: LoadProfile,
+                        duration_seconds: Optional[float] = None,
+                        max_chunk: int = 500,
+                        report_interval: float = 5.0,
+                        generate_batch: Optional[Callable[[int], List[Dict[str, Any]]]] = None
+                        ) -> RateReport:
+    """Send generated events at the rate given by profile.
+    
+    Events are released in chunks of roughly 10 ms worth of traffic so that
+    high rates do not pay per-event sleep overhead. Pacing is based on the
+    monotonic clock, so time spent in send() is not added on top of the
+    target interval. generate_batch, when given, produces a whole chunk at once.
+    """
+    report = RateReport(report_interval)
+    bucket = TokenBucket(profile.rate_at(0.0), capacity=max_chunk)
+    started = report.started
+    last_target_at = started
+    
+    try:
+        while True:
+            now = time.monotonic()
+            elapsed = now - started
+            if duration_seconds is not None and elapsed >= duration_seconds:
+                break
+            
+            rate = profile.rate_at(elapsed)
+            bucket.set_rate(rate)
+            report.add_target(rate * (now - last_target_at))
+            last_target_at = now
+            
+            chunk = int(min(max_chunk, max(1, rate * 0.01)))
+            wait = bucket.take(chunk)
+            if wait > 0:
+                # Re-evaluate the profile at least every 100 ms while waiting
+                time.sleep(min(wait, 0.1))
+                continue
+            
+            if generate_batch is not None:
+                events = generate_batch(chunk)
+            else:
+                events = [generate() for _ in range(chunk)]
+            report.record(send(events))
+            report.maybe_report(rate)
+    
+    except KeyboardInterrupt:
+        print("\n⏹️  Stopping data generation...")
+    
+    print(f"Rate summary ({profile.describe()}): {report.summary()}")
+    return report
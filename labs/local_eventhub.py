@@ -0,0 +1,544 @@
+#!/usr/bin/env python3
+"""
+Local Event Hubs Stand-in Server
+Implements the Event Hubs REST send endpoint on localhost so the sample
+senders can be benchmarked and regression-tested without a live namespace.
+
+Supported:
+    POST /{hub}/messages                      single event or batch
+    POST /{hub}/partitions/{id}/messages      send to one partition
+    GET  /{hub}/partitions                    partition summary
+    GET  /{hub}/partitions/{id}/events?from=SEQ&limit=N   read events back
+
+Responses: 201 (accepted), 401 (bad SAS token), 413 (payload too large),
+429 (throttled, with Retry-After) and 503 (injected server errors).
+"""
+
+import argparse
+import asyncio
+import base64
+import hashlib
+import hmac
+import json
+import logging
+import os
+import random
+import threading
+import time
+import urllib.parse
+import zlib
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional, Tuple, Union
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger(__name__)
+
+BATCH_CONTENT_TYPE = 'application/vnd.microsoft.servicebus.json'
+
+# Single-event bodies sent with this content type are stored as raw bytes
+BINARY_CONTENT_TYPE = 'application/octet-stream'
+
+# Event Hubs rejects requests larger than 1 MB
+MAX_REQUEST_BYTES = 1024 * 1024
+
+# Ingress allowance of one throughput unit
+EVENTS_PER_THROUGHPUT_UNIT = 1000
+BYTES_PER_THROUGHPUT_UNIT = 1024 * 1024
+
+_REASONS = {
+    200: "OK",
+    201: "Created",
+    400: "Bad Request",
+    401: "Unauthorized",
+    404: "Not Found",
+    405: "Method Not Allowed",
+    411: "Length Required",
+    413: "Request Entity Too Large",
+    429: "Too Many Requests",
+    503: "Service Unavailable",
+}
+
+class StoredEvent:
+    """One event in a partition log.
+    
+    Binary bodies (e.g. compressed payloads) are kept as bytes and read back
+    base64-encoded, flagged by "bodyEncoding".
+    """
+    
+    __slots__ = ("sequence_number", "offset", "enqueued_time", "partition_key", "body")
+    
+    def __init__(self, sequence_number: int, offset: int, enqueued_time: float,
+                 partition_key: Optional[str], body: Union[str, bytes]):
+        self.sequence_number = sequence_number
+        self.offset = offset
+        self.enqueued_time = enqueued_time
+        self.partition_key = partition_key
+        self.body = body
+    
+    def to_dict(self) -> Dict[str, Any]:
+        enqueued = datetime.fromtimestamp(self.enqueued_time, timezone.utc)
+        event = {
+            "sequenceNumber": self.sequence_number,
+            "offset": self.offset,
+            "enqueuedTime": enqueued.isoformat().replace('+00:00', 'Z'),
+            "partitionKey": self.partition_key,
+            "body": self.body,
+        }
+        if isinstance(self.body, bytes):
+            event["body"] = base64.b64encode(self.body).decode('ascii')
+            event["bodyEncoding"] = "base64"
+        return event
+
+class PartitionLog:
+    """Append-only in-memory log for one partition, optionally mirrored to a file.
+    
+    Only the newest retention events are kept in memory; trimming happens in
+    bulk so appends stay amortized O(1). The file mirror is written through
+    a buffered handle and never fsynced, so disk never throttles ingestion.
+    """
+    
+    def __init__(self, partition_id: str, retention: int, data_dir: Optional[str] = None):
+        self.partition_id = partition_id
+        self.retention = retention
+        self.events: List[StoredEvent] = []
+        self.first_sequence = 0
+        self.next_sequence = 0
+        self.next_offset = 0
+        self._file = None
+        if data_dir:
+            path = os.path.join(data_dir, f"partition-{partition_id}.jsonl")
+            self._file = open(path, "a", encoding="utf-8", buffering=1024 * 1024)
+    
+    def append(self, body: Union[str, bytes], partition_key: Optional[str], enqueued_time: float):
+        event = StoredEvent(self.next_sequence, self.next_offset, enqueued_time, partition_key, body)
+        self.events.append(event)
+        self.next_sequence += 1
+        self.next_offset += len(body)
+        
+        if self._file is not None:
+            self._file.write(json.dumps(event.to_dict()))
+            self._file.write("\n")
+        
+        if len(self.events) > self.retention + self.retention // 2:
+            drop = len(self.events) - self.retention
+            del self.events[:drop]
+            self.first_sequence += drop
+    
+    def read(self, from_sequence: int, limit: int) -> List[StoredEvent]:
+        start = max(from_sequence, self.first_sequence) - self.first_sequence
+        return self.events[start:start + limit]
+    
+    def flush(self):
+        if self._file is not None:
+            self._file.flush()
+    
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+class IngressThrottle:
+    """Token buckets for events/sec and bytes/sec, like throughput units.
+    
+    The buckets hold one second of capacity. A request is admitted while
+    both hold a positive balance and may leave them in debt, so a request
+    larger than one second of capacity still goes through once the buckets
+    have refilled, and the average rate stays at the limit.
+    """
+    
+    def __init__(self, throughput_units: float):
+        self.events_rate = throughput_units * EVENTS_PER_THROUGHPUT_UNIT
+        self.bytes_rate = throughput_units * BYTES_PER_THROUGHPUT_UNIT
+        self.events = self.events_rate
+        self.bytes = self.bytes_rate
+        self._last = time.monotonic()
+    
+    def admit(self, events: int, size_bytes: int) -> bool:
+        now = time.monotonic()
+        elapsed = now - self._last
+        self._last = now
+        self.events = min(self.events_rate, self.events + elapsed * self.events_rate)
+        self.bytes = min(self.bytes_rate, self.bytes + elapsed * self.bytes_rate)
+        if self.events <= 0 or self.bytes <= 0:
+            return False
+        self.events -= events
+        self.bytes -= size_bytes
+        return True
+
+class LocalEventHub:
+    """The state behind the server: credentials, partition logs and fault injection."""
+    
+    def __init__(self, eventhub_name: str, key_name: str, key: str,
+                 partition_count: int = 4, retention: int = 1000000,
+                 data_dir: Optional[str] = None, latency_ms: float = 0.0,
+                 latency_jitter_ms: float = 0.0, throughput_units: Optional[float] = None,
+                 throttle_probability: float = 0.0, error_probability: float = 0.0,
+                 max_request_bytes: int = MAX_REQUEST_BYTES):
+        self.eventhub_name = eventhub_name
+        self.key_name = key_name
+        self._key_bytes = key.encode('utf-8')
+        if data_dir:
+            os.makedirs(data_dir, exist_ok=True)
+        self.partitions = [
+            PartitionLog(str(index), retention, data_dir)
+            for index in range(partition_count)
+        ]
+        self.latency_ms = latency_ms
+        self.latency_jitter_ms = latency_jitter_ms
+        self.throttle = IngressThrottle(throughput_units) if throughput_units else None
+        self.throttle_probability = throttle_probability
+        self.error_probability = error_probability
+        self.max_request_bytes = max_request_bytes
+        self.status_counts: Dict[int, int] = {}
+        self._round_robin = 0
+        # Signature checks are cached per token string until the token expires
+        self._valid_tokens: Dict[str, int] = {}
+    
+    def connection_string(self, host: str, port: int) -> str:
+        """Connection string the sample senders can use against this server."""
+        key = self._key_bytes.decode('utf-8')
+        return (
+            f"Endpoint=sb://{host}:{port}/;SharedAccessKeyName={self.key_name};"
+            f"SharedAccessKey={key}"
+        )
+    
+    def check_token(self, header: Optional[str]) -> bool:
+        """Validate a SharedAccessSignature header against the configured key."""
+        if not header or not header.startswith("SharedAccessSignature "):
+            return False
+        
+        now = int(time.time())
+        cached_expiry = self._valid_tokens.get(header)
+        if cached_expiry is not None:
+            return now < cached_expiry
+        
+        fields = dict(urllib.parse.parse_qsl(header[len("SharedAccessSignature "):]))
+        try:
+            resource = fields["sr"]
+            signature = fields["sig"]
+            expiry = int(fields["se"])
+            key_name = fields["skn"]
+        except (KeyError, ValueError):
+            return False
+        if key_name != self.key_name or expiry <= now:
+            return False
+        if f"/{self.eventhub_name}" not in resource:
+            return False
+        
+        # parse_qsl unquoted sr; the signature covers its URL-encoded form
+        string_to_sign = f"{urllib.parse.quote(resource, safe='')}\n{expiry}".encode('utf-8')
+        expected = base64.b64encode(
+            hmac.new(self._key_bytes, string_to_sign, hashlib.sha256).digest()
+        ).decode('utf-8')
+        if not hmac.compare_digest(expected, signature):
+            return False
+        
+        if len(self._valid_tokens) > 10000:
+            self._valid_tokens.clear()
+        self._valid_tokens[header] = expiry
+        return True
+    
+    def _pick_partition(self, partition_key: Optional[str]) -> PartitionLog:
+        if partition_key is not None:
+            index = zlib.crc32(partition_key.encode('utf-8')) % len(self.partitions)
+            return self.partitions[index]
+        self._round_robin = (self._round_robin + 1) % len(self.partitions)
+        return self.partitions[self._round_robin]
+    
+    def parse_events(self, content_type: str, body: bytes,
+                     headers: Dict[str, str]) -> List[Tuple[Union[str, bytes], Optional[str]]]:
+        """Turn a request body into (event body, partition key) pairs."""
+        if content_type.startswith(BATCH_CONTENT_TYPE):
+            entries = json.loads(body)
+            if not isinstance(entries, list):
+                raise ValueError("Batch body must be a JSON array")
+            events = []
+            for entry in entries:
+                broker = entry.get("BrokerProperties") or {}
+                events.append((entry["Body"], broker.get("PartitionKey")))
+            return events
+        
+        broker = headers.get("brokerproperties")
+        partition_key = json.loads(broker).get("PartitionKey") if broker else None
+        if content_type.startswith(BINARY_CONTENT_TYPE):
+            return [(body, partition_key)]
+        return [(body.decode('utf-8'), partition_key)]
+    
+    def append(self, events: List[Tuple[Union[str, bytes], Optional[str]]], partition_id: Optional[str]):
+        now = time.time()
+        if partition_id is not None:
+            log = self.partitions[int(partition_id)]
+            for body, partition_key in events:
+                log.append(body, partition_key, now)
+            return
+        # Events in one batch share a partition, as on the real service
+        log = self._pick_partition(events[0][1] if events else None)
+        for body, partition_key in events:
+            log.append(body, partition_key, now)
+    
+    def read(self, partition_id: str, from_sequence: int, limit: int) -> List[Dict[str, Any]]:
+        """Read events back from a partition, oldest first."""
+        return [event.to_dict() for event in self.partitions[int(partition_id)].read(from_sequence, limit)]
+    
+    def flush(self):
+        for log in self.partitions:
+            log.flush()
+    
+    def close(self):
+        for log in self.partitions:
+            log.close()
+
+class LocalEventHubServer:
+    """Minimal asyncio HTTP/1.1 server (keep-alive, Content-Length bodies) for LocalEventHub."""
+    
+    def __init__(self, hub: LocalEventHub, host: str = "127.0.0.1", port: int = 8080):
+        self.hub = hub
+        self.host = host
+        self.port = port
+        self._server = None
+        self._loop = None
+        self._thread = None
+        self._flush_task = None
+        self._connections = set()
+    
+    @property
+    def base_url(self) -> str:
+        return f"http://{self.host}:{self.port}"
+    
+    @property
+    def connection_string(self) -> str:
+        return self.hub.connection_string(self.host, self.port)
+    
+    async def serve(self):
+        """Start listening; returns once the socket is bound."""
+        self._server = await asyncio.start_server(self._handle_connection, self.host, self.port)
+        # Port 0 binds an ephemeral port; report the real one
+        self.port = self._server.sockets[0].getsockname()[1]
+        self._flush_task = asyncio.create_task(self._flush_periodically())
+    
+    async def shutdown(self):
+        if self._flush_task is not None:
+            self._flush_task.cancel()
+        if self._server is not None:
+            self._server.close()
+            # Idle keep-alive connections would otherwise outlive the server
+            for task in list(self._connections):
+                task.cancel()
+            await asyncio.gather(*self._connections, return_exceptions=True)
+            await self._server.wait_closed()
+        self.hub.close()
+    
+    async def _flush_periodically(self):
+        while True:
+            await asyncio.sleep(1.0)
+            self.hub.flush()
+    
+    def start(self):
+        """Run the server on a background thread with its own event loop."""
+        ready = threading.Event()
+        
+        def run():
+            self._loop = asyncio.new_event_loop()
+            asyncio.set_event_loop(self._loop)
+            self._loop.run_until_complete(self.serve())
+            ready.set()
+            self._loop.run_forever()
+        
+        self._thread = threading.Thread(target=run, name="local-eventhub", daemon=True)
+        self._thread.start()
+        ready.wait()
+        return self
+    
+    def stop(self):
+        """Stop a server started with start()."""
+        if self._loop is None:
+            return
+        asyncio.run_coroutine_threadsafe(self.shutdown(), self._loop).result()
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+        self._loop.close()
+        self._loop = None
+    
+    async def _handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        task = asyncio.current_task()
+        self._connections.add(task)
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                method, target, version = request_line.decode('latin-1').split(' ', 2)
+                
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b'\r\n', b'\n', b''):
+                        break
+                    name, _, value = line.decode('latin-1').partition(':')
+                    headers[name.strip().lower()] = value.strip()
+                
+                length = headers.get('content-length')
+                if method == 'POST' and length is None:
+                    await self._respond(writer, 411, b'Content-Length required')
+                    break
+                body = await reader.readexactly(int(length)) if length else b''
+                
+                status, payload, extra_headers = await self._dispatch(method, target, headers, body)
+                await self._respond(writer, status, payload, extra_headers)
+                
+                if headers.get('connection', '').lower() == 'close' or version.strip() == 'HTTP/1.0':
+                    break
+        except (asyncio.IncompleteReadError, ConnectionResetError, ValueError):
+            pass
+        finally:
+            self._connections.discard(task)
+            writer.close()
+    
+    async def _respond(self, writer: asyncio.StreamWriter, status: int, payload: bytes,
+                       extra_headers: Optional[Dict[str, str]] = None):
+        self.hub.status_counts[status] = self.hub.status_counts.get(status, 0) + 1
+        lines = [f"HTTP/1.1 {status} {_REASONS.get(status, '')}", f"Content-Length: {len(payload)}"]
+        for name, value in (extra_headers or {}).items():
+            lines.append(f"{name}: {value}")
+        writer.write(("\r\n".join(lines) + "\r\n\r\n").encode('latin-1') + payload)
+        await writer.drain()
+    
+    async def _dispatch(self, method: str, target: str, headers: Dict[str, str],
+                        body: bytes) -> Tuple[int, bytes, Dict[str, str]]:
+        url = urllib.parse.urlsplit(target)
+        parts = [p for p in url.path.split('/') if p]
+        hub = self.hub
+        
+        if not parts or parts[0] != hub.eventhub_name:
+            return 404, b'Unknown event hub', {}
+        
+        if method == 'GET':
+            return self._handle_read(parts[1:], urllib.parse.parse_qs(url.query))
+        
+        if method != 'POST':
+            return 405, b'', {}
+        
+        if parts[1:] == ['messages']:
+            partition_id = None
+        elif len(parts) == 4 and parts[1] == 'partitions' and parts[3] == 'messages':
+            partition_id = parts[2]
+            if not partition_id.isdigit() or int(partition_id) >= len(hub.partitions):
+                return 404, b'Unknown partition', {}
+        else:
+            return 404, b'Unknown path', {}
+        
+        if not hub.check_token(headers.get('authorization')):
+            return 401, b'Invalid or expired SAS token', {}
+        
+        if len(body) > hub.max_request_bytes:
+            return 413, b'Request exceeds the maximum allowed size', {}
+        
+        if hub.latency_ms or hub.latency_jitter_ms:
+            delay = hub.latency_ms + random.uniform(0, hub.latency_jitter_ms)
+            await asyncio.sleep(delay / 1000)
+        
+        if hub.error_probability and random.random() < hub.error_probability:
+            return 503, b'Injected server error', {'Retry-After': '1'}
+        
+        try:
+            events = hub.parse_events(headers.get('content-type', ''), body, headers)
+        except (ValueError, KeyError, TypeError, AttributeError) as e:
+            return 400, f'Malformed body: {e}'.encode('utf-8'), {}
+        
+        throttled = hub.throttle_probability and random.random() < hub.throttle_probability
+        if throttled or (hub.throttle is not None and not hub.throttle.admit(len(events), len(body))):
+            return 429, b'ServerBusy: throughput limit exceeded', {'Retry-After': '1'}
+        
+        hub.append(events, partition_id)
+        return 201, b'', {}
+    
+    def _handle_read(self, parts: List[str], query: Dict[str, List[str]]) -> Tuple[int, bytes, Dict[str, str]]:
+        hub = self.hub
+        if parts == ['partitions']:
+            summary = [
+                {
+                    "partitionId": log.partition_id,
+                    "firstSequenceNumber": log.first_sequence,
+                    "lastSequenceNumber": log.next_sequence - 1,
+                }
+                for log in hub.partitions
+            ]
+            return 200, json.dumps(summary).encode('utf-8'), {'Content-Type': 'application/json'}
+        
+        if len(parts) == 3 and parts[0] == 'partitions' and parts[2] == 'events':
+            partition_id = parts[1]
+            if not partition_id.isdigit() or int(partition_id) >= len(hub.partitions):
+                return 404, b'Unknown partition', {}
+            from_sequence = int(query.get('from', ['0'])[0])
+            limit = int(query.get('limit', ['1000'])[0])
+            events = hub.read(partition_id, from_sequence, limit)
+            next_sequence = events[-1]["sequenceNumber"] + 1 if events else from_sequence
+            payload = json.dumps({"events": events, "nextSequence": next_sequence})
+            return 200, payload.encode('utf-8'), {'Content-Type': 'application/json'}
+        
+        return 404, b'Unknown path', {}
+
+def parse_args():
+    """Parse command line options."""
+    parser = argparse.ArgumentParser(description="Local Event Hubs REST stand-in")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--eventhub", default="telemetry-data")
+    parser.add_argument("--key-name", default="RootManageSharedAccessKey")
+    parser.add_argument("--key", default="local-development-key")
+    parser.add_argument("--partitions", type=int, default=4)
+    parser.add_argument("--retention", type=int, default=1000000,
+                        help="Events kept in memory per partition")
+    parser.add_argument("--data-dir", default=None,
+                        help="Also append events to partition-N.jsonl files here")
+    parser.add_argument("--latency-ms", type=float, default=0.0,
+                        help="Added delay per send request")
+    parser.add_argument("--latency-jitter-ms", type=float, default=0.0)
+    parser.add_argument("--throughput-units", type=float, default=None,
+                        help="Return 429 above 1000 events/s and 1 MB/s per unit")
+    parser.add_argument("--throttle-probability", type=float, default=0.0,
+                        help="Fraction of sends to reject with 429")
+    parser.add_argument("--error-probability", type=float, default=0.0,
+                        help="Fraction of sends to reject with 503")
+    return parser.parse_args()
+
+def main():
+    """Run the stand-in until Ctrl+C."""
+    args = parse_args()
+    hub = LocalEventHub(
+        eventhub_name=args.eventhub,
+        key_name=args.key_name,
+        key=args.key,
+        partition_count=args.partitions,
+        retention=args.retention,
+        data_dir=args.data_dir,
+        latency_ms=args.latency_ms,
+        latency_jitter_ms=args.latency_jitter_ms,
+        throughput_units=args.throughput_units,
+        throttle_probability=args.throttle_probability,
+        error_probability=args.error_probability
+    )
+    server = LocalEventHubServer(hub, args.host, args.port)
+    
+    async def run():
+        await server.serve()
+        logger.info(f"Local Event Hub '{args.eventhub}' listening on {server.base_url}")
+        logger.info(f"Connection string: {server.connection_string}")
+        logger.info(f"REST base URL:     {server.base_url}")
+        try:
+            await asyncio.Event().wait()
+        finally:
+            await server.shutdown()
+    
+    try:
+        asyncio.run(run())
+    except KeyboardInterrupt:
+        logger.info("⏹️  Stopped. Responses: " + ", ".join(
+            f"{status}: {count}" for status, count in sorted(hub.status_counts.items())
+        ))
+
+if __name__ == "__main__":
+    main()
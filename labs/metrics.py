@@ -0,0 +1,319 @@
+#!/usr/bin/env python3
+"""
+Generator Metrics
+Counters, gauges and fixed-bucket histograms for the senders. They can be
+served in the Prometheus text format from a local HTTP endpoint and
+summarized in one periodic line, so high-rate runs can be watched without
+per-event terminal output.
+
+Updates take no lock. Every thread adds to its own cell, and a scrape sums
+the cells. The metrics live in the module-level METRICS, which the sending
+code updates unconditionally. An update costs about as much as an
+attribute increment, so there is nothing to switch off.
+"""
+
+import bisect
+import logging
+import threading
+import time
+from typing import Dict, List, Optional, Sequence, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Send latency buckets in seconds (upper bounds; +Inf is implied)
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Batch fill ratio buckets: how full each batch was against its size limit
+FILL_BUCKETS = (0.1, 0.2, 0.3, 0.4, 0.5, 0.6, 0.7, 0.8, 0.9, 1.0)
+
+PROMETHEUS_CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+class _PerThread:
+    """Per-thread cells of a metric; cells are created under a lock once per thread."""
+    
+    def __init__(self, size: int):
+        self._size = size
+        self._local = threading.local()
+        self._cells: List[list] = []
+        self._lock = threading.Lock()
+    
+    def cell(self) -> list:
+        cell = getattr(self._local, 'cell', None)
+        if cell is None:
+            cell = self._local.cell = [0] * self._size
+            with self._lock:
+                self._cells.append(cell)
+        return cell
+    
+    def totals(self) -> list:
+        with self._lock:
+            cells = list(self._cells)
+        return [sum(column) for column in zip(*cells)] if cells else [0] * self._size
+
+class Counter:
+    """Monotonically increasing total."""
+    
+    kind = "counter"
+    
+    def __init__(self, name: str, help_text: str):
+        self.name = name
+        self.help = help_text
+        self._cells = _PerThread(1)
+    
+    def inc(self, amount: float = 1):
+        self._cells.cell()[0] += amount
+    
+    @property
+    def value(self) -> float:
+        return self._cells.totals()[0]
+    
+    def samples(self) -> List[Tuple[str, float]]:
+        return [(self.name, self.value)]
+
+class Gauge:
+    """Last value set, e.g. a queue depth."""
+    
+    kind = "gauge"
+    
+    def __init__(self, name: str, help_text: str):
+        self.name = name
+        self.help = help_text
+        self.value = 0.0
+    
+    def set(self, value: float):
+        self.value = value
+    
+    def samples(self) -> List[Tuple[str, float]]:
+        return [(self.name, self.value)]
+
+class Histogram:
+    """Observation counts in fixed buckets, plus their sum."""
+    
+    kind = "histogram"
+    
+    def __init__(self, name: str, help_text: str, buckets: Sequence[float]):
+        self.name = name
+        self.help = help_text
+        self.buckets = tuple(sorted(buckets))
+        # One count per bucket, one for +Inf, then the sum
+        self._cells = _PerThread(len(self.buckets) + 2)
+    
+    def observe(self, value: float):
+        cell = self._cells.cell()
+        cell[bisect.bisect_left(self.buckets, value)] += 1
+        cell[-1] += value
+    
+    def snapshot(self) -> Tuple[List[int], float]:
+        """Per-bucket counts (the last one is +Inf) and the sum of observations."""
+        totals = self._cells.totals()
+        return totals[:-1], totals[-1]
+    
+    def quantile(self, fraction: float, counts: Optional[List[int]] = None) -> float:
+        """Upper bound of the bucket holding the given fraction of observations."""
+        counts = counts if counts is not None else self.snapshot()[0]
+        total = sum(counts)
+        if not total:
+            return 0.0
+        seen = 0
+        for index, count in enumerate(counts):
+            seen += count
+            if seen >= fraction * total:
+                return self.buckets[index] if index < len(self.buckets) else float('inf')
+        return float('inf')
+    
+    def samples(self) -> List[Tuple[str, float]]:
+        counts, total = self.snapshot()
+        samples = []
+        cumulative = 0
+        for bound, count in zip(self.buckets + (float('inf'),), counts):
+            cumulative += count
+            label = '+Inf' if bound == float('inf') else f"{bound:g}"
+            samples.append((f'{self.name}_bucket{{le="{label}"}}', cumulative))
+        samples.append((f"{self.name}_sum", total))
+        samples.append((f"{self.name}_count", cumulative))
+        return samples
+
+class MetricsRegistry:
+    """Named metrics rendered together in the Prometheus text format."""
+    
+    def __init__(self):
+        self.metrics: Dict[str, object] = {}
+    
+    def _register(self, metric):
+        if metric.name in self.metrics:
+            raise ValueError(f"Metric {metric.name} is already registered")
+        self.metrics[metric.name] = metric
+        return metric
+    
+    def counter(self, name: str, help_text: str) -> Counter:
+        return self._register(Counter(name, help_text))
+    
+    def gauge(self, name: str, help_text: str) -> Gauge:
+        return self._register(Gauge(name, help_text))
+    
+    def histogram(self, name: str, help_text: str, buckets: Sequence[float]) -> Histogram:
+        return self._register(Histogram(name, help_text, buckets))
+    
+    def render(self) -> str:
+        lines = []
+        for metric in self.metrics.values():
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(f"{name} {value:g}" for name, value in metric.samples())
+        return "\n".join(lines) + "\n"
+
+class GeneratorMetrics:
+    """The metrics every sender reports."""
+    
+    def __init__(self, registry: Optional[MetricsRegistry] = None):
+        self.registry = registry or MetricsRegistry()
+        r = self.registry
+        self.generated = r.counter("eventhub_generator_events_generated_total", "Events generated or replayed")
+        self.sent = r.counter("eventhub_generator_events_sent_total", "Events accepted by the hub")
+        self.failed = r.counter("eventhub_generator_events_failed_total", "Events given up on after retries")
+        self.spooled = r.counter("eventhub_generator_events_spooled_total",
+                                 "Events kept in the offline spool while the hub was unreachable")
+        self.bytes_sent = r.counter("eventhub_generator_bytes_sent_total", "Payload bytes accepted by the hub")
+        self.batch_fill = r.histogram("eventhub_generator_batch_fill_ratio",
+                                      "Batch size as a fraction of the batch size limit", FILL_BUCKETS)
+        self.queue_depth = r.gauge("eventhub_generator_queue_depth",
+                                   "Batches waiting for a sender (async) or events waiting for retry (adaptive)")
+        self.send_latency = r.histogram("eventhub_generator_send_latency_seconds",
+                                        "Time to get a batch accepted, including retries", LATENCY_BUCKETS)
+    
+    def summary(self, elapsed: float, previous: Optional[Dict[str, float]] = None) -> Tuple[str, Dict[str, float]]:
+        """One-line summary with rates since previous; returns the line and the new totals."""
+        totals = {
+            "generated": self.generated.value,
+            "sent": self.sent.value,
+            "failed": self.failed.value,
+            "bytes": self.bytes_sent.value,
+        }
+        previous = previous or dict.fromkeys(totals, 0)
+        elapsed = max(elapsed, 1e-9)
+        latency_counts, _ = self.send_latency.snapshot()
+        fill_counts, fill_sum = self.batch_fill.snapshot()
+        batches = sum(fill_counts)
+        fill = f"{fill_sum / batches:.0%}" if batches else "n/a"
+        line = (
+            f"generated {totals['generated']:.0f} ({(totals['generated'] - previous['generated']) / elapsed:.0f}/s), "
+            f"sent {totals['sent']:.0f} ({(totals['sent'] - previous['sent']) / elapsed:.0f}/s), "
+            f"failed {totals['failed']:.0f}, "
+            f"{(totals['bytes'] - previous['bytes']) / elapsed / 1024:.1f} KiB/s, "
+            f"batch fill {fill}, queue {self.queue_depth.value:.0f}, "
+            f"send p50 <= {self.send_latency.quantile(0.5, latency_counts) * 1000:g} ms, "
+            f"p99 <= {self.send_latency.quantile(0.99, latency_counts) * 1000:g} ms"
+        )
+        return line, totals
+
+# Updated by the generators, async_sender and flow_control
+METRICS = GeneratorMetrics()
+
+# ---------------------------------------------------------------------------
+# Exposition
+# ---------------------------------------------------------------------------
+
+class MetricsServer:
+    """Serves GET /metrics from a daemon thread."""
+    
+    def __init__(self, metrics: GeneratorMetrics = METRICS, host: str = "127.0.0.1", port: int = 9464):
+        import http.server
+        
+        registry = metrics.registry
+        
+        class Handler(http.server.BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split('?')[0] not in ('/metrics', '/'):
+                    self.send_error(404)
+                    return
+                payload = registry.render().encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', PROMETHEUS_CONTENT_TYPE)
+                self.send_header('Content-Length', str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+            
+            def log_message(self, format, *args):
+                pass
+        
+        self.server = http.server.ThreadingHTTPServer((host, port), Handler)
+        self.server.daemon_threads = True
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+    
+    @property
+    def url(self) -> str:
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}/metrics"
+    
+    def start(self):
+        self.thread.start()
+    
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+class SummaryReporter:
+    """Prints METRICS as one line every interval seconds from a daemon thread."""
+    
+    def __init__(self, interval: float, metrics: GeneratorMetrics = METRICS):
+        self.interval = interval
+        self.metrics = metrics
+        self.started = time.monotonic()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+    
+    def start(self):
+        self._thread.start()
+    
+    def _run(self):
+        previous, last = None, self.started
+        while not self._stop.wait(self.interval):
+            now = time.monotonic()
+            line, previous = self.metrics.summary(now - last, previous)
+            last = now
+            print(f"[{now - self.started:7.1f}s] {line}", flush=True)
+    
+    def stop(self):
+        """Stop reporting and print totals over the whole run."""
+        self._stop.set()
+        line, _ = self.metrics.summary(time.monotonic() - self.started)
+        print(f"Metrics: {line}")
+
+# ---------------------------------------------------------------------------
+# Command line
+# ---------------------------------------------------------------------------
+
+def add_metrics_arguments(parser):
+    """Add the --quiet and metrics options shared by both generators."""
+    group = parser.add_argument_group("metrics")
+    group.add_argument("--quiet", action="store_true",
+                       help="No per-event or per-batch output; implies --summary-interval 10")
+    group.add_argument("--summary-interval", type=float, default=None, metavar="SECONDS",
+                       help="Print a one-line metrics summary this often (0 = never)")
+    group.add_argument("--metrics-port", type=int, default=None,
+                       help="Serve Prometheus metrics at http://<metrics-host>:<port>/metrics")
+    group.add_argument("--metrics-host", default="127.0.0.1",
+                       help="Address for the metrics endpoint (default: 127.0.0.1)")
+
+class MetricsOutput:
+    """The endpoint and summary reporter selected on the command line."""
+    
+    def __init__(self, args):
+        interval = args.summary_interval
+        if interval is None:
+            interval = 10.0 if args.quiet else 0.0
+        self.server = MetricsServer(METRICS, args.metrics_host, args.metrics_port) if args.metrics_port else None
+        self.reporter = SummaryReporter(interval) if interval > 0 else None
+    
+    def start(self):
+        if self.server is not None:
+            self.server.start()
+            print(f"Serving metrics at {self.server.url}")
+        if self.reporter is not None:
+            self.reporter.start()
+    
+    def stop(self):
+        if self.reporter is not None:
+            self.reporter.stop()
+        if self.server is not None:
+            self.server.stop()
@@ -0,0 +1,499 @@
+#!/usr/bin/env python3
+"""
+Output Sinks for the Offline SAQL Engine
+Local stand-ins for the job outputs the queries write INTO: a rolling file
+writer laid out like a Blob Storage output, and a Power BI push dataset
+simulator. Both measure what the output costs and show how rows batch.
+
+Sinks run on the row's time, which is the output's System.Timestamp, so a
+replayed recording rolls files and meets rate limits as it would live. The
+clock never goes backwards; a row older than one already written counts as
+written at that later time.
+
+RollingFileSink encodes rows as JSON Lines or CSV (serializers.py) into a
+buffer and writes it to the current file in one sequential write once it
+holds write_buffer_bytes. Files go under a {date}/{time} path pattern and
+roll over when the pattern's time period ends, when they reach
+max_file_bytes on disk, or when they are max_file_seconds old. A file is
+written under a .tmp name and renamed when it is complete, so a reader
+only ever sees whole files. With gzip, each file is one gzip stream.
+
+PowerBIPushSimulator batches rows into POST rows requests under the
+dataset's rows- and bytes-per-request limits. A batch is also sent once
+its oldest row is flush_interval old. Requests are checked against the
+dataset's sliding-window rate limits. A request over a limit gets a 429
+and is retried once the window allows it, while later requests queue
+behind it. The report gives requests, 429s, delivery latency and the
+largest backlog, which is what output batching is tuned against.
+"""
+
+import logging
+import os
+import time
+import uuid
+import zlib
+from abc import ABC, abstractmethod
+from collections import deque
+from datetime import datetime, timezone
+from typing import Any, Deque, Dict, List, Optional, Tuple
+
+from serializers import CSV, JSON, JsonSerializer, make_serializer
+
+logger = logging.getLogger(__name__)
+
+FILE_FORMATS = (JSON, CSV)
+GZIP = "gzip"
+
+DEFAULT_PATH_PATTERN = "{date}/{time}"
+DEFAULT_DATE_FORMAT = "YYYY/MM/DD"
+DEFAULT_TIME_FORMAT = "HH"
+
+# Blob output date and time format tokens, as strftime directives
+_DATE_TOKENS = (("YYYY", "%Y"), ("MM", "%m"), ("DD", "%d"))
+_TIME_TOKENS = (("HH", "%H"), ("mm", "%M"))
+
+class OutputSink(ABC):
+    """Takes a query output's rows, each with its time in epoch seconds."""
+    
+    @abstractmethod
+    def write(self, row: Dict[str, Any], now: Optional[float] = None):
+        """Accept one output row."""
+    
+    def close(self, now: Optional[float] = None):
+        """Flush everything still buffered."""
+    
+    @abstractmethod
+    def summary(self) -> str:
+        """One-line report of what the sink did."""
+
+# ---------------------------------------------------------------------------
+# Rolling file sink
+# ---------------------------------------------------------------------------
+
+def _strftime_format(text: str, tokens: Tuple[Tuple[str, str], ...]) -> str:
+    text = text.replace("%", "%%")
+    for token, directive in tokens:
+        text = text.replace(token, directive)
+    return text
+
+class FileSinkStats:
+    """Rows, bytes, writes and files of a RollingFileSink."""
+    
+    def __init__(self):
+        self.rows = 0
+        self.raw_bytes = 0
+        self.disk_bytes = 0
+        self.writes = 0
+        self.files = 0
+        self.seconds = 0.0
+
+class RollingFileSink(OutputSink):
+    """Buffered, partitioned, rolling JSON Lines or CSV files."""
+    
+    def __init__(self, directory: str, path_pattern: str = DEFAULT_PATH_PATTERN,
+                 date_format: str = DEFAULT_DATE_FORMAT, time_format: str = DEFAULT_TIME_FORMAT,
+                 file_format: str = JSON, compression: Optional[str] = None, compression_level: int = 6,
+                 max_file_bytes: int = 256 * 1024 * 1024, max_file_seconds: Optional[float] = 3600.0,
+                 write_buffer_bytes: int = 4 * 1024 * 1024):
+        if file_format not in FILE_FORMATS:
+            raise ValueError(f"file format must be one of: {', '.join(FILE_FORMATS)}")
+        if compression not in (None, GZIP):
+            raise ValueError(f"compression must be {GZIP} or none")
+        self.directory = directory
+        self.path_pattern = path_pattern
+        self.serializer = make_serializer(file_format)
+        self.compression = compression
+        self.compression_level = compression_level
+        self.max_file_bytes = max_file_bytes
+        self.max_file_seconds = max_file_seconds or None
+        self.write_buffer_bytes = write_buffer_bytes
+        self.extension = file_format + (".gz" if compression else "")
+        self.stats = FileSinkStats()
+        
+        self._date_format = _strftime_format(date_format, _DATE_TOKENS)
+        self._time_format = _strftime_format(time_format, _TIME_TOKENS)
+        # Partitions last as long as the finest time unit the path shows
+        if "{time}" in path_pattern:
+            self._period = 60 if "%M" in self._time_format else 3600
+        elif "{date}" in path_pattern:
+            self._period = 86400
+        else:
+            self._period = None
+        self._run_id = uuid.uuid4().hex[:12]
+        self._now = float('-inf')
+        self._partition = ""
+        self._partition_end = float('-inf')
+        self._sequence = 0
+        
+        self._parts: List[bytes] = []
+        self._buffered = 0
+        self._file = None
+        self._path = ""
+        self._file_started: Optional[float] = None
+        self._file_bytes = 0
+        self._compressor = None
+    
+    def _partition_at(self, now: float) -> str:
+        moment = datetime.fromtimestamp(now, timezone.utc)
+        return self.path_pattern.replace("{date}", moment.strftime(self._date_format)) \
+                                .replace("{time}", moment.strftime(self._time_format))
+    
+    def write(self, row: Dict[str, Any], now: Optional[float] = None):
+        started = time.perf_counter()
+        now = time.time() if now is None else now
+        if now < self._now:
+            now = self._now
+        self._now = now
+        
+        if now >= self._partition_end:
+            self._roll()
+            self._partition = self._partition_at(now)
+            self._partition_end = (now // self._period + 1) * self._period if self._period else float('inf')
+        elif self._file_started is not None and self.max_file_seconds is not None \
+                and now - self._file_started >= self.max_file_seconds:
+            self._roll()
+        if self._file_started is None:
+            self._file_started = now
+        
+        part = self.serializer.encode(row)
+        self._parts.append(part)
+        self._buffered += len(part) + 1
+        self.stats.rows += 1
+        if self._buffered >= self.write_buffer_bytes:
+            self._flush()
+            if self._file_bytes >= self.max_file_bytes:
+                self._roll()
+        self.stats.seconds += time.perf_counter() - started
+    
+    def _open(self):
+        self._path = os.path.join(self.directory, self._partition, f"{self._sequence}_{self._run_id}.{self.extension}")
+        self._sequence += 1
+        os.makedirs(os.path.dirname(self._path), exist_ok=True)
+        # Unbuffered: every flush is already one large write
+        self._file = open(self._path + ".tmp", "wb", buffering=0)
+        self._file_bytes = 0
+        if self.compression:
+            self._compressor = zlib.compressobj(self.compression_level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    
+    def _write(self, data: bytes):
+        self.stats.raw_bytes += len(data)
+        if self._compressor is not None:
+            data = self._compressor.compress(data)
+            if not data:
+                return
+        self._file.write(data)
+        self._file_bytes += len(data)
+        self.stats.disk_bytes += len(data)
+        self.stats.writes += 1
+    
+    def _flush(self):
+        """Write the buffered rows to the current file in one write."""
+        if not self._parts:
+            return
+        self._parts.append(b'')
+        data = b'\n'.join(self._parts)
+        if self._file is None:
+            self._open()
+            data = self.serializer.header() + data
+        self._write(data)
+        self._parts = []
+        self._buffered = 0
+    
+    def _roll(self):
+        """Finish the current file and start the next one at the next row."""
+        self._flush()
+        self._file_started = None
+        if self._file is None:
+            return
+        if self._compressor is not None:
+            tail = self._compressor.flush()
+            self._file.write(tail)
+            self._file_bytes += len(tail)
+            self.stats.disk_bytes += len(tail)
+            self._compressor = None
+        self._file.close()
+        self._file = None
+        os.replace(self._path + ".tmp", self._path)
+        self.stats.files += 1
+        logger.debug(f"Closed {self._path} ({self._file_bytes} bytes)")
+    
+    def close(self, now: Optional[float] = None):
+        started = time.perf_counter()
+        self._roll()
+        self.stats.seconds += time.perf_counter() - started
+    
+    def summary(self) -> str:
+        stats = self.stats
+        per_row = stats.seconds / stats.rows * 1e6 if stats.rows else 0.0
+        compressed = f" ({stats.disk_bytes / 1024:.1f} KiB {self.compression})" if self.compression else ""
+        return (
+            f"{stats.rows} rows to {stats.files} {self.extension} files under {self.directory}, "
+            f"{stats.raw_bytes / 1024:.1f} KiB{compressed} in {stats.writes} writes, "
+            f"{per_row:.2f} µs/row"
+        )
+
+# ---------------------------------------------------------------------------
+# Power BI push dataset simulator
+# ---------------------------------------------------------------------------
+
+# Bytes of a POST rows body besides the rows: {"rows": [...]}
+_ROWS_BODY_OVERHEAD = len(b'{"rows": []}')
+
+class PushLimits:
+    """Per-request caps and sliding-window rate limits of a Power BI dataset."""
+    
+    def __init__(self, name: str, max_rows_per_request: Optional[int] = None,
+                 max_request_bytes: Optional[int] = None,
+                 request_rates: Tuple[Tuple[int, float], ...] = (),
+                 row_rates: Tuple[Tuple[int, float], ...] = ()):
+        self.name = name
+        self.max_rows_per_request = max_rows_per_request
+        self.max_request_bytes = max_request_bytes
+        # (count, window seconds) pairs
+        self.request_rates = request_rates
+        self.row_rates = row_rates
+    
+    def describe(self) -> str:
+        parts = []
+        if self.max_rows_per_request:
+            parts.append(f"{self.max_rows_per_request} rows/request")
+        if self.max_request_bytes:
+            parts.append(f"{self.max_request_bytes // 1024} KiB/request")
+        parts.extend(f"{count} requests/{seconds:g}s" for count, seconds in self.request_rates)
+        parts.extend(f"{count} rows/{seconds:g}s" for count, seconds in self.row_rates)
+        return f"{self.name}: " + ", ".join(parts)
+
+# Push datasets take 10,000 rows per request, 120 requests a minute and 1M
+# rows an hour; streaming datasets 5 requests a second of up to 15 KB each
+POWERBI_LIMITS = {
+    "push": PushLimits("push", max_rows_per_request=10000, request_rates=((120, 60.0),),
+                       row_rates=((1000000, 3600.0),)),
+    "streaming": PushLimits("streaming", max_request_bytes=15 * 1024, request_rates=((5, 1.0),)),
+}
+
+class _RateWindow:
+    """Sliding-window counter for one rate limit."""
+    
+    def __init__(self, limit: int, seconds: float):
+        self.limit = limit
+        self.seconds = seconds
+        self.entries: Deque[Tuple[float, int]] = deque()
+        self.total = 0
+    
+    def wait(self, now: float, amount: int) -> float:
+        """Seconds until amount more fits in the window."""
+        entries = self.entries
+        while entries and entries[0][0] <= now - self.seconds:
+            self.total -= entries.popleft()[1]
+        excess = self.total + amount - self.limit
+        if excess <= 0:
+            return 0.0
+        for sent_at, count in entries:
+            excess -= count
+            if excess <= 0:
+                return sent_at + self.seconds - now
+        return self.seconds
+    
+    def add(self, now: float, amount: int):
+        self.entries.append((now, amount))
+        self.total += amount
+
+class _Request:
+    __slots__ = ('rows', 'bytes', 'oldest', 'time_sum')
+    
+    def __init__(self, rows: int, size: int, oldest: float, time_sum: float):
+        self.rows = rows
+        self.bytes = size
+        self.oldest = oldest
+        self.time_sum = time_sum
+
+class PushStats:
+    """Requests, throttling and delivery latency of a PowerBIPushSimulator."""
+    
+    def __init__(self):
+        self.rows = 0
+        self.requests = 0
+        self.bytes = 0
+        self.throttled = 0
+        self.rejected = 0
+        self.dropped = 0
+        self.latency_sum = 0.0
+        self.max_latency = 0.0
+        self.max_backlog = 0
+        self.seconds = 0.0
+
+class PowerBIPushSimulator(OutputSink):
+    """Batches rows into Power BI POST rows requests under the dataset's limits."""
+    
+    def __init__(self, limits: PushLimits = POWERBI_LIMITS["push"], max_rows_per_request: Optional[int] = None,
+                 max_request_kb: Optional[float] = None, flush_interval: float = 1.0,
+                 max_backlog_rows: int = 1000000):
+        self.limits = limits
+        self.max_rows = min(filter(None, (max_rows_per_request, limits.max_rows_per_request)), default=10000)
+        user_bytes = int(max_request_kb * 1024) if max_request_kb else None
+        self.max_bytes = min(filter(None, (user_bytes, limits.max_request_bytes)), default=None)
+        self.flush_interval = flush_interval
+        self.max_backlog_rows = max_backlog_rows
+        self.encoder = JsonSerializer()
+        self.stats = PushStats()
+        self._windows = [_RateWindow(count, seconds) for count, seconds in limits.request_rates]
+        self._row_windows = [_RateWindow(count, seconds) for count, seconds in limits.row_rates]
+        self._now = float('-inf')
+        
+        self._batch_rows = 0
+        self._batch_bytes = _ROWS_BODY_OVERHEAD
+        self._batch_oldest = 0.0
+        self._batch_time_sum = 0.0
+        self._queue: Deque[_Request] = deque()
+        self._queued_rows = 0
+        self._retry_at = float('-inf')
+    
+    def write(self, row: Dict[str, Any], now: Optional[float] = None):
+        started = time.perf_counter()
+        now = time.time() if now is None else now
+        if now < self._now:
+            now = self._now
+        self._now = now
+        
+        size = len(self.encoder.encode(row))
+        if self.max_bytes is not None and _ROWS_BODY_OVERHEAD + size > self.max_bytes:
+            self.stats.rejected += 1
+            self.stats.seconds += time.perf_counter() - started
+            return
+        if self._batch_rows and (now - self._batch_oldest >= self.flush_interval
+                                 or self._batch_rows >= self.max_rows
+                                 or self.max_bytes is not None and self._batch_bytes + 1 + size > self.max_bytes):
+            self._close_batch()
+        if not self._batch_rows:
+            self._batch_oldest = now
+        self._batch_rows += 1
+        self._batch_bytes += size + (1 if self._batch_rows > 1 else 0)
+        self._batch_time_sum += now
+        self._deliver(now)
+        self.stats.seconds += time.perf_counter() - started
+    
+    def _close_batch(self):
+        self._queue.append(_Request(self._batch_rows, self._batch_bytes, self._batch_oldest, self._batch_time_sum))
+        self._queued_rows += self._batch_rows
+        self._batch_rows = 0
+        self._batch_bytes = _ROWS_BODY_OVERHEAD
+        self._batch_time_sum = 0.0
+        while self._queued_rows > self.max_backlog_rows:
+            dropped = self._queue.popleft()
+            self._queued_rows -= dropped.rows
+            self.stats.dropped += dropped.rows
+        self.stats.max_backlog = max(self.stats.max_backlog, self._queued_rows)
+    
+    def _deliver(self, now: float):
+        """Send queued requests the rate limits allow at now."""
+        queue = self._queue
+        while queue and now >= self._retry_at:
+            request = queue[0]
+            wait = max([window.wait(now, 1) for window in self._windows]
+                       + [window.wait(now, request.rows) for window in self._row_windows], default=0.0)
+            if wait > 0:
+                # 429 Too Many Requests; retry when the window has room
+                self.stats.throttled += 1
+                self._retry_at = now + wait
+                return
+            queue.popleft()
+            self._queued_rows -= request.rows
+            for window in self._windows:
+                window.add(now, 1)
+            for window in self._row_windows:
+                window.add(now, request.rows)
+            stats = self.stats
+            stats.requests += 1
+            stats.rows += request.rows
+            stats.bytes += request.bytes
+            stats.latency_sum += request.rows * now - request.time_sum
+            stats.max_latency = max(stats.max_latency, now - request.oldest)
+    
+    def close(self, now: Optional[float] = None):
+        started = time.perf_counter()
+        now = max(self._now, now if now is not None else self._now)
+        if self._batch_rows:
+            now = max(now, self._batch_oldest + self.flush_interval)
+            self._close_batch()
+        while self._queue:
+            now = max(now, self._retry_at)
+            self._deliver(now)
+        self._now = now
+        self.stats.seconds += time.perf_counter() - started
+    
+    def summary(self) -> str:
+        stats = self.stats
+        if not stats.requests:
+            return f"no Power BI requests ({self.limits.describe()})"
+        per_row = stats.seconds / (stats.rows + stats.rejected + stats.dropped) * 1e6
+        problems = "".join(
+            f", {count} {label}" for count, label in (
+                (stats.rejected, "rows over the request size rejected"),
+                (stats.dropped, "rows dropped from the backlog"),
+            ) if count
+        )
+        return (
+            f"{stats.rows} rows in {stats.requests} Power BI requests "
+            f"({stats.rows / stats.requests:.0f} rows, {stats.bytes / stats.requests / 1024:.1f} KiB each), "
+            f"{stats.throttled} throttled (429){problems}; latency avg {stats.latency_sum / stats.rows:.2f}s "
+            f"max {stats.max_latency:.2f}s, backlog max {stats.max_backlog} rows, {per_row:.2f} µs/row\n"
+            f"limits {self.limits.describe()}"
+        )
+
+# ---------------------------------------------------------------------------
+# Command line
+# ---------------------------------------------------------------------------
+
+def add_sink_arguments(parser):
+    """Add the --file-sink and --powerbi-sink options of the engine."""
+    group = parser.add_argument_group("output sinks")
+    group.add_argument("--file-sink", action="append", default=[], metavar="OUTPUT=DIR",
+                       help="Write a query output to rolling files under DIR, laid out like a Blob output")
+    group.add_argument("--path-pattern", default=DEFAULT_PATH_PATTERN,
+                       help=f"File path pattern under DIR (default: {DEFAULT_PATH_PATTERN})")
+    group.add_argument("--date-format", default=DEFAULT_DATE_FORMAT,
+                       help=f"{{date}} format (default: {DEFAULT_DATE_FORMAT})")
+    group.add_argument("--time-format", default=DEFAULT_TIME_FORMAT,
+                       help=f"{{time}} format, HH or with mm (default: {DEFAULT_TIME_FORMAT})")
+    group.add_argument("--sink-format", choices=FILE_FORMATS, default=JSON,
+                       help="File format: JSON Lines or CSV (default: json)")
+    group.add_argument("--sink-compression", choices=[GZIP], default=None,
+                       help="Compress each file")
+    group.add_argument("--max-file-mb", type=float, default=256,
+                       help="Start a new file at this size on disk (default: 256)")
+    group.add_argument("--max-file-seconds", type=float, default=3600, metavar="SECONDS",
+                       help="Start a new file after this much row time; 0 rolls only with the path (default: 3600)")
+    group.add_argument("--write-buffer-kb", type=int, default=4096,
+                       help="Rows are written in chunks of this size (default: 4096)")
+    
+    group = parser.add_argument_group("Power BI push simulator")
+    group.add_argument("--powerbi-sink", action="append", default=[], metavar="OUTPUT",
+                       help="Send a query output to a simulated Power BI dataset and report throttling")
+    group.add_argument("--powerbi-limits", choices=sorted(POWERBI_LIMITS), default="push",
+                       help="Dataset type whose limits apply (default: push)")
+    group.add_argument("--powerbi-rows-per-request", type=int, default=None,
+                       help="Max rows per request, within the dataset's limit")
+    group.add_argument("--powerbi-max-request-kb", type=float, default=None,
+                       help="Max request body size, within the dataset's limit")
+    group.add_argument("--powerbi-flush-interval", type=float, default=1.0, metavar="SECONDS",
+                       help="Send a partial batch once its oldest row is this old (default: 1.0)")
+    group.add_argument("--powerbi-max-backlog", type=int, default=1000000, metavar="ROWS",
+                       help="Drop the oldest queued requests beyond this many rows (default: 1000000)")
+
+def sinks_from_args(args) -> Dict[str, OutputSink]:
+    """Sinks for the --file-sink and --powerbi-sink options, keyed by lower-case output name."""
+    sinks: Dict[str, OutputSink] = {}
+    for spec in args.file_sink:
+        name, separator, directory = spec.partition('=')
+        if not separator:
+            raise ValueError(f"--file-sink needs OUTPUT=DIR, got {spec!r}")
+        sinks[name.lower()] = RollingFileSink(
+            directory, args.path_pattern, args.date_format, args.time_format,
+            file_format=args.sink_format, compression=args.sink_compression,
+            max_file_bytes=int(args.max_file_mb * 1024 * 1024), max_file_seconds=args.max_file_seconds,
+            write_buffer_bytes=args.write_buffer_kb * 1024)
+    for name in args.powerbi_sink:
+        sinks[name.lower()] = PowerBIPushSimulator(
+            POWERBI_LIMITS[args.powerbi_limits], args.powerbi_rows_per_request, args.powerbi_max_request_kb,
+            args.powerbi_flush_interval, args.powerbi_max_backlog)
+    return sinks
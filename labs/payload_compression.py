@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+"""
+Compressed Event Payloads
+Packs many serialized telemetry records into one GZip- or Deflate-
+compressed event body. A Stream Analytics input configured with the
+matching compression type decompresses the body and reads the records in
+the input's format: line-separated JSON by default, or CSV or Avro
+(serializers.py). Keys such as "location" and "sensorType" that repeat in
+every record cost almost nothing on the wire.
+
+A body closes when it holds max_records records or max_raw_bytes of
+uncompressed records, whichever comes first. A body that still compresses to
+more than the event size limit is split in half and compressed again.
+"""
+
+import zlib
+from typing import Any, Dict, List, Optional, Tuple
+
+from serializers import MAX_BODY_BYTES, RecordPacker, Serializer, decode_records
+
+GZIP = "gzip"
+DEFLATE = "deflate"
+CODECS = (GZIP, DEFLATE)
+
+# zlib window bits: gzip framing, or raw RFC 1951 deflate as written by
+# .NET's DeflateStream, which is what Stream Analytics expects for Deflate
+_WBITS = {GZIP: 16 + zlib.MAX_WBITS, DEFLATE: -zlib.MAX_WBITS}
+
+# Content type for a compressed single-event REST body
+COMPRESSED_CONTENT_TYPE = 'application/octet-stream'
+
+class CompressionStats:
+    """Raw and compressed byte counts of every body produced."""
+    
+    def __init__(self, codec: str, level: int):
+        self.codec = codec
+        self.level = level
+        self.bodies = 0
+        self.records = 0
+        self.raw_bytes = 0
+        self.compressed_bytes = 0
+        self.dropped = 0
+    
+    def record(self, records: int, raw_bytes: int, compressed_bytes: int):
+        """Record one compressed body."""
+        self.bodies += 1
+        self.records += records
+        self.raw_bytes += raw_bytes
+        self.compressed_bytes += compressed_bytes
+    
+    @property
+    def ratio(self) -> float:
+        """Uncompressed bytes per compressed byte."""
+        return self.raw_bytes / self.compressed_bytes if self.compressed_bytes else 0.0
+    
+    def summary(self) -> str:
+        """Return a one-line summary of everything compressed so far."""
+        dropped = f", {self.dropped} oversized records dropped" if self.dropped else ""
+        return (
+            f"{self.records} records in {self.bodies} {self.codec} bodies (level {self.level}), "
+            f"{self.raw_bytes / 1024:.1f} KiB -> {self.compressed_bytes / 1024:.1f} KiB, "
+            f"ratio {self.ratio:.1f}x{dropped}"
+        )
+
+class PayloadCompressor(RecordPacker):
+    """Packs encoded records into compressed bodies; emits (body, record count) pairs."""
+    
+    def __init__(self, codec: str = GZIP, level: int = 6, max_records: int = 500,
+                 max_raw_bytes: int = 256 * 1024, max_body_bytes: int = MAX_BODY_BYTES,
+                 serializer: Optional[Serializer] = None):
+        if codec not in CODECS:
+            raise ValueError(f"codec must be one of: {', '.join(CODECS)}")
+        if not 0 <= level <= 9:
+            raise ValueError("compression level must be between 0 and 9")
+        super().__init__(serializer, max_records, max_raw_bytes, max_body_bytes)
+        self.codec = codec
+        self.level = level
+        self.stats = CompressionStats(codec, level)
+    
+    @property
+    def content_type(self) -> str:
+        return COMPRESSED_CONTENT_TYPE
+    
+    def compress(self, data: bytes) -> bytes:
+        """Compress data with this compressor's codec and level."""
+        compressor = zlib.compressobj(self.level, zlib.DEFLATED, _WBITS[self.codec])
+        return compressor.compress(data) + compressor.flush()
+    
+    def finish(self, raw: bytes) -> bytes:
+        return self.compress(raw)
+    
+    def count_records(self, body: bytes) -> int:
+        return self.serializer.count(decompress(body))
+    
+    def _closed(self, records: int, raw: bytes, body: bytes):
+        self.stats.record(records, len(raw), len(body))
+    
+    def _close(self, records: List[bytes]) -> List[Tuple[bytes, int]]:
+        dropped = self.dropped
+        bodies = super()._close(records)
+        self.stats.dropped += self.dropped - dropped
+        return bodies
+
+def decompress(body: bytes) -> bytes:
+    """Decompress a gzip or raw deflate body."""
+    wbits = _WBITS[GZIP] if body[:2] == b'\x1f\x8b' else _WBITS[DEFLATE]
+    return zlib.decompress(body, wbits)
+
+def decompress_records(body: bytes) -> List[Dict[str, Any]]:
+    """Decode a compressed body back into its records, in any serializers.py format."""
+    return decode_records(decompress(body))
+
+def add_compression_arguments(parser):
+    """Add the --compression options shared by both generators."""
+    group = parser.add_argument_group("compressed payloads")
+    group.add_argument("--compression", choices=CODECS, default=None,
+                       help="Pack many records into one compressed event body "
+                            "(set the Stream Analytics input's compression type to match)")
+    group.add_argument("--compression-level", type=int, default=6,
+                       help="zlib level, 1 (fastest) to 9 (smallest); 0 stores uncompressed (default: 6)")
+    group.add_argument("--compress-records", type=int, default=500,
+                       help="Max records per compressed body (default: 500)")
+    group.add_argument("--compress-bytes", type=int, default=256 * 1024,
+                       help="Max uncompressed bytes per compressed body (default: 262144)")
+
+def compressor_from_args(args, serializer: Optional[Serializer] = None):
+    """Build a PayloadCompressor from parsed --compression options, or None."""
+    if not args.compression:
+        return None
+    return PayloadCompressor(args.compression, args.compression_level,
+                             args.compress_records, args.compress_bytes, serializer=serializer)
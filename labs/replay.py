@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+"""
+Replay of Recorded Telemetry
+Re-sends recorded events, streamed from JSON array or JSON Lines files of
+any size by saql_engine.iter_json_records, at their original cadence, N
+times faster, or as fast as possible. Timestamps can be rebased so a
+replayed incident looks like it is happening now.
+"""
+
+import time
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, Iterable, List, Optional
+
+from saql_engine import format_datetime, parse_datetime
+
+# Rebase modes: keep recorded timestamps; move them so the first event is
+# "now" with the original spacing; or also compress the spacing by the
+# speed-up so event time tracks send time
+REBASE_NONE = "none"
+REBASE_SHIFT = "shift"
+REBASE_WARP = "warp"
+REBASE_MODES = (REBASE_NONE, REBASE_SHIFT, REBASE_WARP)
+
+class ReplayStats:
+    """Progress of a replay against the recording's own clock."""
+    
+    def __init__(self, speed: float, report_interval: float = 5.0):
+        self.speed = speed
+        self.report_interval = report_interval
+        self.started = time.monotonic()
+        self.events = 0
+        self.sent = 0
+        self.recorded_span = 0.0
+        self.max_lag = 0.0
+        self._last_report = self.started
+    
+    def record(self, events: int, sent: int, recorded_span: float, lag: float):
+        self.events += events
+        self.sent += sent
+        self.recorded_span = recorded_span
+        self.max_lag = max(self.max_lag, lag)
+    
+    def maybe_report(self, lag: float):
+        now = time.monotonic()
+        if now - self._last_report < self.report_interval:
+            return
+        self._last_report = now
+        elapsed = now - self.started
+        print(f"[{elapsed:7.1f}s] replayed {self.events} events, recording at +{self.recorded_span:.1f}s "
+              f"({self.recorded_span / max(elapsed, 1e-9):.1f}x), behind schedule {lag:.2f}s")
+    
+    def summary(self) -> str:
+        elapsed = max(time.monotonic() - self.started, 1e-9)
+        pace = "as fast as possible" if not self.speed else f"target {self.speed:g}x"
+        return (f"sent {self.sent}/{self.events} events in {elapsed:.1f}s ({self.sent / elapsed:.1f}/s), "
+                f"{self.recorded_span:.1f}s of recording ({self.recorded_span / elapsed:.1f}x, {pace}), "
+                f"max {self.max_lag:.2f}s behind schedule")
+
+def run_replay(records: Iterable[Dict[str, Any]],
+               send: Callable[[List[Dict[str, Any]]], int],
+               speed: float = 1.0,
+               rebase: str = REBASE_NONE,
+               time_field: str = "timestamp",
+               max_events: Optional[int] = None,
+               max_chunk: int = 500,
+               report_interval: float = 5.0) -> ReplayStats:
+    """Send recorded events on the recording's schedule, scaled by speed.
+    
+    Event i is due speed-times faster than its offset from the first event
+    (speed 0 disables pacing). Events are released in chunks of up to 10 ms
+    worth of schedule so fast replays do not pay per-event sleeps. A
+    recording that goes back in time never moves the schedule backwards.
+    Events without a parseable time_field keep the previous event's slot.
+    """
+    if rebase not in REBASE_MODES:
+        raise ValueError(f"rebase must be one of: {', '.join(REBASE_MODES)}")
+    stats = ReplayStats(speed, report_interval)
+    started = stats.started
+    wall_start = datetime.now(timezone.utc)
+    first: Optional[datetime] = None
+    offset = 0.0
+    chunk: List[Dict[str, Any]] = []
+    
+    def flush(lag: float):
+        stats.record(len(chunk), send(chunk) if chunk else 0, offset, lag)
+        chunk.clear()
+        stats.maybe_report(lag)
+    
+    try:
+        for index, record in enumerate(records):
+            if max_events is not None and index >= max_events:
+                break
+            recorded = parse_datetime(record.get(time_field))
+            if recorded is not None:
+                if first is None:
+                    first = recorded
+                offset = max(offset, (recorded - first).total_seconds())
+                if rebase == REBASE_SHIFT or (rebase == REBASE_WARP and not speed):
+                    record[time_field] = format_datetime(wall_start + (recorded - first))
+                elif rebase == REBASE_WARP:
+                    record[time_field] = format_datetime(wall_start + (recorded - first) / speed)
+            
+            if speed:
+                wait = offset / speed - (time.monotonic() - started)
+                if wait > 0.01:
+                    flush(0.0)
+                    wait = offset / speed - (time.monotonic() - started)
+                    if wait > 0:
+                        time.sleep(wait)
+            chunk.append(record)
+            if len(chunk) >= max_chunk:
+                flush(max(0.0, time.monotonic() - started - offset / speed) if speed else 0.0)
+        
+        flush(0.0)
+    except KeyboardInterrupt:
+        print("\n⏹️  Stopping replay...")
+    
+    print(f"Replay summary: {stats.summary()}")
+    return stats
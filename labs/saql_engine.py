@@ -0,0 +1,1742 @@
+#!/usr/bin/env python3
+"""
+Offline Stream Analytics Query Engine
+Runs the subset of the Stream Analytics query language (SAQL) used by the
+queries/ directory against local files or generated telemetry, so queries can
+be checked without deploying a job.
+
+Queries are parsed into a small AST, expressions are compiled into Python
+closures, and each SELECT becomes a chain of generator operators
+(scan -> filter -> project). Events stream through one at a time; nothing
+is materialized beyond what an operator needs for its own state. JOINs with
+reference data and between streams are handled by saql_joins.py. Outputs
+can be written to rolling files or a simulated Power BI dataset through
+output_sinks.py.
+"""
+
+import argparse
+import itertools
+import json
+import logging
+import mmap
+import operator
+import os
+import re
+import sys
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+# Configure logging
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger(__name__)
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_SAMPLE_DATA = os.path.join(REPO_ROOT, "sample-data", "telemetry-sample.json")
+
+# Output name used when a SELECT has no INTO clause
+DEFAULT_OUTPUT = "output"
+
+class SaqlError(Exception):
+    """Raised for queries the engine cannot parse or does not support."""
+
+# ---------------------------------------------------------------------------
+# Values
+# ---------------------------------------------------------------------------
+
+def parse_datetime(value: Any) -> Optional[datetime]:
+    """Convert an ISO 8601 string (or datetime) to an aware UTC datetime."""
+    if value is None:
+        return None
+    if isinstance(value, datetime):
+        parsed = value
+    elif isinstance(value, str):
+        try:
+            parsed = datetime.fromisoformat(value)
+        except ValueError:
+            # Python's parser accepts at most 6 fractional digits; SAQL writes 7
+            match = re.match(r'^(.*\.\d{6})\d+(.*)$', value)
+            if not match:
+                return None
+            parsed = datetime.fromisoformat(match.group(1) + match.group(2))
+    else:
+        return None
+    if parsed.tzinfo is None:
+        return parsed.replace(tzinfo=timezone.utc)
+    return parsed.astimezone(timezone.utc)
+
+def format_datetime(value: datetime) -> str:
+    """Format a datetime the way the generators write timestamps."""
+    return value.astimezone(timezone.utc).strftime('%Y-%m-%dT%H:%M:%S.') + f"{value.microsecond // 1000:03d}Z"
+
+def json_default(value: Any) -> Any:
+    """json.dumps() hook for values the engine produces."""
+    if isinstance(value, datetime):
+        return format_datetime(value)
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+def plain_row(row: Dict[str, Any]) -> Dict[str, Any]:
+    """The row with datetime columns formatted, for encoders without a json_default hook."""
+    for value in row.values():
+        if isinstance(value, datetime):
+            return {key: format_datetime(item) if isinstance(item, datetime) else item
+                    for key, item in row.items()}
+    return row
+
+def _cast(value: Any, type_name: str) -> Any:
+    """Convert value to a SAQL type; raises ValueError/TypeError when it can't."""
+    if value is None:
+        return None
+    base = type_name.lower().split('(')[0]
+    if base == 'float':
+        return float(value)
+    if base == 'bigint':
+        if isinstance(value, str):
+            return int(float(value))
+        return int(value)
+    if base == 'nvarchar':
+        if isinstance(value, datetime):
+            return format_datetime(value)
+        if isinstance(value, bool):
+            return 'true' if value else 'false'
+        return str(value)
+    if base == 'datetime':
+        parsed = parse_datetime(value)
+        if parsed is None:
+            raise ValueError(f"cannot convert {value!r} to datetime")
+        return parsed
+    if base == 'bit':
+        if isinstance(value, str):
+            return 1 if value.lower() in ('1', 'true') else 0
+        return 1 if value else 0
+    if base in ('record', 'array'):
+        return value
+    raise SaqlError(f"Unsupported CAST type: {type_name}")
+
+# ---------------------------------------------------------------------------
+# Lexer
+# ---------------------------------------------------------------------------
+
+_TOKEN_PATTERN = re.compile(r"""
+    (?P<ws>\s+|--[^\n]*|/\*.*?\*/)
+  | (?P<number>\d+\.\d*(?:[eE][+-]?\d+)?|\.\d+(?:[eE][+-]?\d+)?|\d+(?:[eE][+-]?\d+)?)
+  | (?P<string>'(?:[^']|'')*')
+  | (?P<bracket>\[[^\]]*\])
+  | (?P<ident>[A-Za-z_@][A-Za-z0-9_]*)
+  | (?P<op><>|!=|<=|>=|[=<>+\-*/%(),.;])
+""", re.VERBOSE | re.DOTALL)
+
+class Token:
+    __slots__ = ('kind', 'value', 'position')
+    
+    def __init__(self, kind: str, value: Any, position: int):
+        self.kind = kind
+        self.value = value
+        self.position = position
+    
+    def __repr__(self) -> str:
+        return f"Token({self.kind}, {self.value!r})"
+
+def tokenize(text: str) -> List[Token]:
+    """Split query text into tokens; identifiers keep their case, keywords are matched case-insensitively."""
+    tokens = []
+    position = 0
+    while position < len(text):
+        match = _TOKEN_PATTERN.match(text, position)
+        if match is None:
+            raise SaqlError(f"Unexpected character {text[position]!r} at offset {position}")
+        kind = match.lastgroup
+        value = match.group()
+        if kind == 'number':
+            tokens.append(Token('number', float(value) if any(c in value for c in '.eE') else int(value), position))
+        elif kind == 'string':
+            tokens.append(Token('string', value[1:-1].replace("''", "'"), position))
+        elif kind == 'bracket':
+            tokens.append(Token('ident', value[1:-1], position))
+        elif kind in ('ident', 'op'):
+            tokens.append(Token(kind, value, position))
+        position = match.end()
+    tokens.append(Token('eof', None, position))
+    return tokens
+
+# ---------------------------------------------------------------------------
+# AST
+# ---------------------------------------------------------------------------
+
+class Node:
+    """Base class for expression nodes."""
+    __slots__ = ()
+
+class Literal(Node):
+    __slots__ = ('value',)
+    
+    def __init__(self, value: Any):
+        self.value = value
+
+class Column(Node):
+    """A (possibly nested) property reference such as location.lat."""
+    __slots__ = ('path',)
+    
+    def __init__(self, path: List[str]):
+        self.path = path
+
+class Star(Node):
+    """* in a SELECT list or COUNT(*); qualifier is set for alias.*"""
+    __slots__ = ('qualifier',)
+    
+    def __init__(self, qualifier: Optional[str] = None):
+        self.qualifier = qualifier
+
+class Call(Node):
+    """Function call, optionally with DISTINCT and an OVER clause."""
+    __slots__ = ('name', 'args', 'distinct', 'over')
+    
+    def __init__(self, name: str, args: List[Node], distinct: bool = False, over: Optional['OverClause'] = None):
+        self.name = name
+        self.args = args
+        self.distinct = distinct
+        self.over = over
+
+class OverClause:
+    """OVER (PARTITION BY ... ORDER BY ... LIMIT DURATION(unit, n) WHEN ...) of a function.
+    
+    Also holds the ORDER BY of PERCENTILE_CONT(...) WITHIN GROUP (ORDER BY ...).
+    """
+    __slots__ = ('partition_by', 'limit_duration', 'when', 'order_by')
+    
+    def __init__(self, partition_by: List[Node], limit_duration: Optional[Tuple[str, float]], when: Optional[Node],
+                 order_by: Optional[Node] = None):
+        self.partition_by = partition_by
+        self.limit_duration = limit_duration
+        self.when = when
+        self.order_by = order_by
+
+class Case(Node):
+    __slots__ = ('operand', 'whens', 'default')
+    
+    def __init__(self, operand: Optional[Node], whens: List[Tuple[Node, Node]], default: Optional[Node]):
+        self.operand = operand
+        self.whens = whens
+        self.default = default
+
+class Cast(Node):
+    __slots__ = ('expr', 'type_name', 'safe')
+    
+    def __init__(self, expr: Node, type_name: str, safe: bool = False):
+        self.expr = expr
+        self.type_name = type_name
+        self.safe = safe
+
+class Unary(Node):
+    __slots__ = ('op', 'operand')
+    
+    def __init__(self, op: str, operand: Node):
+        self.op = op
+        self.operand = operand
+
+class Binary(Node):
+    __slots__ = ('op', 'left', 'right')
+    
+    def __init__(self, op: str, left: Node, right: Node):
+        self.op = op
+        self.left = left
+        self.right = right
+
+class IsNull(Node):
+    __slots__ = ('operand', 'negated')
+    
+    def __init__(self, operand: Node, negated: bool):
+        self.operand = operand
+        self.negated = negated
+
+class Between(Node):
+    __slots__ = ('operand', 'low', 'high', 'negated')
+    
+    def __init__(self, operand: Node, low: Node, high: Node, negated: bool):
+        self.operand = operand
+        self.low = low
+        self.high = high
+        self.negated = negated
+
+class InList(Node):
+    __slots__ = ('operand', 'items', 'negated')
+    
+    def __init__(self, operand: Node, items: List[Node], negated: bool):
+        self.operand = operand
+        self.items = items
+        self.negated = negated
+
+class Like(Node):
+    __slots__ = ('operand', 'pattern', 'negated')
+    
+    def __init__(self, operand: Node, pattern: Node, negated: bool):
+        self.operand = operand
+        self.pattern = pattern
+        self.negated = negated
+
+class SelectItem:
+    __slots__ = ('expr', 'alias')
+    
+    def __init__(self, expr: Node, alias: Optional[str]):
+        self.expr = expr
+        self.alias = alias
+
+class Source:
+    """FROM input or step, with its alias and TIMESTAMP BY expression."""
+    __slots__ = ('name', 'alias', 'timestamp_by', 'timestamp_over')
+    
+    def __init__(self, name: str, alias: Optional[str], timestamp_by: Optional[Node],
+                 timestamp_over: Optional[List[Node]] = None):
+        self.name = name
+        self.alias = alias
+        self.timestamp_by = timestamp_by
+        self.timestamp_over = timestamp_over
+
+class Join:
+    """JOIN or LEFT OUTER JOIN of another input, step or reference data set."""
+    __slots__ = ('kind', 'source', 'condition')
+    
+    def __init__(self, kind: str, source: Source, condition: Node):
+        self.kind = kind
+        self.source = source
+        self.condition = condition
+
+class SelectStatement:
+    __slots__ = ('items', 'distinct', 'top', 'into', 'source', 'joins', 'where', 'group_by', 'having')
+    
+    def __init__(self):
+        self.items: List[SelectItem] = []
+        self.distinct = False
+        self.top: Optional[int] = None
+        self.into: Optional[str] = None
+        self.source: Optional[Source] = None
+        self.joins: List[Join] = []
+        self.where: Optional[Node] = None
+        self.group_by: List[Node] = []
+        self.having: Optional[Node] = None
+
+class Query:
+    """A parsed query: WITH steps plus the statements that write to outputs."""
+    
+    def __init__(self, steps: Dict[str, SelectStatement], statements: List[SelectStatement]):
+        self.steps = steps
+        self.statements = statements
+
+# ---------------------------------------------------------------------------
+# Parser
+# ---------------------------------------------------------------------------
+
+# Words that end an expression or a SELECT item, so they can't be bare aliases
+_CLAUSE_KEYWORDS = {
+    'SELECT', 'INTO', 'FROM', 'WHERE', 'GROUP', 'HAVING', 'TIMESTAMP', 'BY', 'AS', 'WITH',
+    'AND', 'OR', 'NOT', 'ON', 'JOIN', 'INNER', 'LEFT', 'OUTER', 'CROSS', 'APPLY', 'UNION',
+    'CASE', 'WHEN', 'THEN', 'ELSE', 'END', 'IS', 'NULL', 'BETWEEN', 'IN', 'LIKE',
+    'OVER', 'PARTITION', 'LIMIT', 'DURATION', 'DISTINCT', 'TOP', 'ORDER', 'WITHIN',
+}
+
+class Parser:
+    """Recursive-descent parser for the supported SAQL subset."""
+    
+    def __init__(self, text: str):
+        self.tokens = tokenize(text)
+        self.index = 0
+    
+    # Token helpers
+    
+    @property
+    def current(self) -> Token:
+        return self.tokens[self.index]
+    
+    def _peek(self, offset: int = 1) -> Token:
+        return self.tokens[min(self.index + offset, len(self.tokens) - 1)]
+    
+    def _advance(self) -> Token:
+        token = self.current
+        self.index += 1
+        return token
+    
+    def _is_keyword(self, *words: str, token: Optional[Token] = None) -> bool:
+        token = token or self.current
+        return token.kind == 'ident' and token.value.upper() in words
+    
+    def _accept_keyword(self, *words: str) -> bool:
+        if self._is_keyword(*words):
+            self.index += 1
+            return True
+        return False
+    
+    def _expect_keyword(self, word: str):
+        if not self._accept_keyword(word):
+            self._error(f"Expected {word}")
+    
+    def _is_op(self, *ops: str) -> bool:
+        return self.current.kind == 'op' and self.current.value in ops
+    
+    def _accept_op(self, op: str) -> bool:
+        if self._is_op(op):
+            self.index += 1
+            return True
+        return False
+    
+    def _expect_op(self, op: str):
+        if not self._accept_op(op):
+            self._error(f"Expected '{op}'")
+    
+    def _expect_ident(self) -> str:
+        token = self.current
+        if token.kind != 'ident':
+            self._error("Expected a name")
+        self.index += 1
+        return token.value
+    
+    def _error(self, message: str):
+        token = self.current
+        found = 'end of query' if token.kind == 'eof' else repr(token.value)
+        raise SaqlError(f"{message} at offset {token.position}, found {found}")
+    
+    # Statements
+    
+    def parse(self) -> Query:
+        steps = {}
+        if self._accept_keyword('WITH'):
+            while True:
+                name = self._expect_ident()
+                self._expect_keyword('AS')
+                self._expect_op('(')
+                steps[name.lower()] = self.parse_select()
+                self._expect_op(')')
+                if not self._accept_op(','):
+                    break
+        
+        statements = []
+        while self.current.kind != 'eof':
+            if self._accept_op(';'):
+                continue
+            statements.append(self.parse_select())
+        if not statements:
+            self._error("Expected SELECT")
+        return Query(steps, statements)
+    
+    def parse_select(self) -> SelectStatement:
+        statement = SelectStatement()
+        self._expect_keyword('SELECT')
+        if self._accept_keyword('TOP'):
+            statement.top = int(self._advance().value)
+        statement.distinct = self._accept_keyword('DISTINCT')
+        
+        statement.items.append(self._parse_select_item())
+        while self._accept_op(','):
+            statement.items.append(self._parse_select_item())
+        
+        if self._accept_keyword('INTO'):
+            statement.into = self._expect_ident()
+        
+        self._expect_keyword('FROM')
+        statement.source = self._parse_source()
+        
+        while self._is_keyword('JOIN', 'INNER', 'LEFT', 'CROSS', 'OUTER'):
+            statement.joins.append(self._parse_join())
+        
+        if self._accept_keyword('WHERE'):
+            statement.where = self.parse_expression()
+        if self._accept_keyword('GROUP'):
+            self._expect_keyword('BY')
+            statement.group_by.append(self.parse_expression())
+            while self._accept_op(','):
+                statement.group_by.append(self.parse_expression())
+        if self._accept_keyword('HAVING'):
+            statement.having = self.parse_expression()
+        return statement
+    
+    def _parse_select_item(self) -> SelectItem:
+        if self._accept_op('*'):
+            return SelectItem(Star(), None)
+        # alias.*
+        if self.current.kind == 'ident' and self._peek().value == '.' and self._peek(2).value == '*':
+            qualifier = self._advance().value
+            self.index += 2
+            return SelectItem(Star(qualifier), None)
+        
+        expr = self.parse_expression()
+        alias = None
+        if self._accept_keyword('AS'):
+            alias = self._expect_ident()
+        elif self.current.kind == 'ident' and self.current.value.upper() not in _CLAUSE_KEYWORDS:
+            alias = self._advance().value
+        return SelectItem(expr, alias)
+    
+    def _parse_join(self) -> Join:
+        kind = 'INNER'
+        if self._accept_keyword('LEFT'):
+            self._accept_keyword('OUTER')
+            kind = 'LEFT'
+        elif not self._accept_keyword('INNER') and not self._is_keyword('JOIN'):
+            self._error("Only JOIN and LEFT OUTER JOIN are supported")
+        self._expect_keyword('JOIN')
+        source = self._parse_source()
+        self._expect_keyword('ON')
+        return Join(kind, source, self.parse_expression())
+    
+    def _parse_source(self) -> Source:
+        name = self._expect_ident()
+        alias = None
+        if self._accept_keyword('AS'):
+            alias = self._expect_ident()
+        elif self.current.kind == 'ident' and self.current.value.upper() not in _CLAUSE_KEYWORDS:
+            alias = self._advance().value
+        
+        timestamp_by = None
+        timestamp_over = None
+        if self._accept_keyword('TIMESTAMP'):
+            self._expect_keyword('BY')
+            timestamp_by = self.parse_expression()
+            if self._accept_keyword('OVER'):
+                # TIMESTAMP BY ... OVER key: independent time per substream
+                timestamp_over = [self.parse_expression()]
+                while self._accept_op(','):
+                    timestamp_over.append(self.parse_expression())
+        return Source(name, alias, timestamp_by, timestamp_over)
+    
+    # Expressions, lowest precedence first
+    
+    def parse_expression(self) -> Node:
+        return self._parse_or()
+    
+    def _parse_or(self) -> Node:
+        node = self._parse_and()
+        while self._accept_keyword('OR'):
+            node = Binary('OR', node, self._parse_and())
+        return node
+    
+    def _parse_and(self) -> Node:
+        node = self._parse_not()
+        while self._accept_keyword('AND'):
+            node = Binary('AND', node, self._parse_not())
+        return node
+    
+    def _parse_not(self) -> Node:
+        if self._accept_keyword('NOT'):
+            return Unary('NOT', self._parse_not())
+        return self._parse_comparison()
+    
+    def _parse_comparison(self) -> Node:
+        node = self._parse_additive()
+        while True:
+            if self._is_op('=', '<>', '!=', '<', '>', '<=', '>='):
+                op = self._advance().value
+                node = Binary('<>' if op == '!=' else op, node, self._parse_additive())
+            elif self._accept_keyword('IS'):
+                negated = self._accept_keyword('NOT')
+                self._expect_keyword('NULL')
+                node = IsNull(node, negated)
+            else:
+                negated = False
+                if self._is_keyword('NOT') and self._is_keyword('BETWEEN', 'IN', 'LIKE', token=self._peek()):
+                    self.index += 1
+                    negated = True
+                if self._accept_keyword('BETWEEN'):
+                    low = self._parse_additive()
+                    self._expect_keyword('AND')
+                    node = Between(node, low, self._parse_additive(), negated)
+                elif self._accept_keyword('IN'):
+                    self._expect_op('(')
+                    items = [self.parse_expression()]
+                    while self._accept_op(','):
+                        items.append(self.parse_expression())
+                    self._expect_op(')')
+                    node = InList(node, items, negated)
+                elif self._accept_keyword('LIKE'):
+                    node = Like(node, self._parse_additive(), negated)
+                else:
+                    return node
+    
+    def _parse_additive(self) -> Node:
+        node = self._parse_multiplicative()
+        while self._is_op('+', '-'):
+            op = self._advance().value
+            node = Binary(op, node, self._parse_multiplicative())
+        return node
+    
+    def _parse_multiplicative(self) -> Node:
+        node = self._parse_unary()
+        while self._is_op('*', '/', '%'):
+            op = self._advance().value
+            node = Binary(op, node, self._parse_unary())
+        return node
+    
+    def _parse_unary(self) -> Node:
+        if self._accept_op('-'):
+            return Unary('-', self._parse_unary())
+        if self._accept_op('+'):
+            return self._parse_unary()
+        return self._parse_primary()
+    
+    def _parse_primary(self) -> Node:
+        token = self.current
+        if token.kind in ('number', 'string'):
+            self.index += 1
+            return Literal(token.value)
+        if self._accept_op('('):
+            node = self.parse_expression()
+            self._expect_op(')')
+            return node
+        if token.kind != 'ident':
+            self._error("Expected an expression")
+        
+        word = token.value.upper()
+        if word == 'NULL':
+            self.index += 1
+            return Literal(None)
+        if word in ('TRUE', 'FALSE') and self._peek().value != '(':
+            self.index += 1
+            return Literal(1 if word == 'TRUE' else 0)
+        if word == 'CASE':
+            return self._parse_case()
+        if word in ('CAST', 'TRY_CAST') and self._peek().value == '(':
+            self.index += 2
+            expr = self.parse_expression()
+            self._expect_keyword('AS')
+            type_name = self._parse_type_name()
+            self._expect_op(')')
+            return Cast(expr, type_name, safe=(word == 'TRY_CAST'))
+        
+        # Property path, or a function call if followed by '('
+        path = [self._advance().value]
+        while self._is_op('.') and self._peek().kind == 'ident':
+            self.index += 1
+            path.append(self._advance().value)
+        if self._is_op('('):
+            return self._parse_call('.'.join(path))
+        return Column(path)
+    
+    def _parse_type_name(self) -> str:
+        type_name = self._expect_ident()
+        if self._accept_op('('):
+            size = self._advance().value
+            self._expect_op(')')
+            type_name = f"{type_name}({size})"
+        return type_name
+    
+    def _parse_case(self) -> Node:
+        self._expect_keyword('CASE')
+        operand = None
+        if not self._is_keyword('WHEN'):
+            operand = self.parse_expression()
+        whens = []
+        while self._accept_keyword('WHEN'):
+            condition = self.parse_expression()
+            self._expect_keyword('THEN')
+            whens.append((condition, self.parse_expression()))
+        if not whens:
+            self._error("Expected WHEN")
+        default = self.parse_expression() if self._accept_keyword('ELSE') else None
+        self._expect_keyword('END')
+        return Case(operand, whens, default)
+    
+    def _parse_call(self, name: str) -> Node:
+        self._expect_op('(')
+        args = []
+        distinct = self._accept_keyword('DISTINCT')
+        if not self._is_op(')'):
+            while True:
+                if self._accept_op('*'):
+                    args.append(Star())
+                elif self._is_datepart_name(name, len(args)):
+                    # First argument of DATEADD/DATEDIFF/DATEPART and window
+                    # functions is a unit keyword, not a column
+                    args.append(Literal(self._expect_ident().lower()))
+                else:
+                    args.append(self.parse_expression())
+                if not self._accept_op(','):
+                    break
+        self._expect_op(')')
+        
+        over = None
+        if self._accept_keyword('OVER'):
+            over = self._parse_over()
+        elif self._accept_keyword('WITHIN'):
+            self._expect_keyword('GROUP')
+            self._expect_op('(')
+            self._expect_keyword('ORDER')
+            self._expect_keyword('BY')
+            over = OverClause([], None, None, order_by=self.parse_expression())
+            self._expect_op(')')
+        return Call(name, args, distinct, over)
+    
+    @staticmethod
+    def _is_datepart_name(function_name: str, arg_index: int) -> bool:
+        return arg_index == 0 and function_name.upper() in _UNIT_FIRST_FUNCTIONS
+    
+    def _parse_over(self) -> OverClause:
+        self._expect_op('(')
+        partition_by = []
+        limit_duration = None
+        when = None
+        if self._accept_keyword('PARTITION'):
+            self._expect_keyword('BY')
+            partition_by.append(self.parse_expression())
+            while self._accept_op(','):
+                partition_by.append(self.parse_expression())
+        order_by = None
+        if self._accept_keyword('ORDER'):
+            self._expect_keyword('BY')
+            order_by = self.parse_expression()
+        if self._accept_keyword('LIMIT'):
+            self._expect_keyword('DURATION')
+            self._expect_op('(')
+            unit = self._expect_ident().lower()
+            self._expect_op(',')
+            amount = self._advance().value
+            self._expect_op(')')
+            limit_duration = (unit, amount)
+        if self._accept_keyword('WHEN'):
+            when = self.parse_expression()
+        self._expect_op(')')
+        return OverClause(partition_by, limit_duration, when, order_by)
+
+# Functions whose first argument is a time unit keyword (minute, hour, ...)
+_UNIT_FIRST_FUNCTIONS = {
+    'DATEADD', 'DATEDIFF', 'DATEPART',
+    'TUMBLINGWINDOW', 'HOPPINGWINDOW', 'SLIDINGWINDOW', 'SESSIONWINDOW',
+}
+
+def parse_query(text: str) -> Query:
+    """Parse SAQL text into a Query."""
+    return Parser(text).parse()
+
+def iter_child_nodes(node: Node) -> Iterator[Node]:
+    """Yield the direct sub-expressions of an expression node."""
+    if isinstance(node, Call):
+        yield from node.args
+        if node.over is not None:
+            yield from node.over.partition_by
+            if node.over.order_by is not None:
+                yield node.over.order_by
+            if node.over.when is not None:
+                yield node.over.when
+    elif isinstance(node, Case):
+        if node.operand is not None:
+            yield node.operand
+        for condition, result in node.whens:
+            yield condition
+            yield result
+        if node.default is not None:
+            yield node.default
+    elif isinstance(node, (Cast, Unary, IsNull, Between, InList, Like)):
+        for name in node.__slots__:
+            child = getattr(node, name)
+            if isinstance(child, Node):
+                yield child
+            elif isinstance(child, list):
+                yield from child
+    elif isinstance(node, Binary):
+        yield node.left
+        yield node.right
+
+# ---------------------------------------------------------------------------
+# Expression compiler
+# ---------------------------------------------------------------------------
+
+# A compiled expression takes (record, event time) and returns a value
+Evaluator = Callable[[Dict[str, Any], datetime], Any]
+
+AGGREGATE_FUNCTIONS = {
+    'COUNT', 'SUM', 'AVG', 'MIN', 'MAX', 'STDEV', 'STDEVP', 'VAR', 'VARP',
+    'TOPONE', 'COLLECT', 'PERCENTILE_CONT', 'PERCENTILE_DISC',
+}
+
+# Analytic functions (name(...) OVER (...)) live in their own modules and are
+# imported on first use: name -> (module, factory(call, compiler) -> Evaluator).
+# The evaluator keeps per-partition state and sees events in stream order.
+ANALYTIC_FUNCTIONS = {
+    'ANOMALYDETECTION_SPIKEANDDIP': ('anomaly_detection', 'compile_spike_and_dip'),
+    'ANOMALYDETECTION_CHANGEPOINT': ('changepoint_detection', 'compile_changepoint'),
+    'LAG': ('saql_lag', 'compile_lag'),
+}
+
+def _lookup(record: Any, name: str) -> Any:
+    """Case-insensitive property access, as in SAQL."""
+    if not isinstance(record, dict):
+        return None
+    if name in record:
+        return record[name]
+    lowered = name.lower()
+    for key, value in record.items():
+        if key.lower() == lowered:
+            return value
+    return None
+
+def _null_safe(function: Callable) -> Callable:
+    """Wrap a scalar function so any NULL argument yields NULL."""
+    def wrapper(*args):
+        if any(arg is None for arg in args):
+            return None
+        return function(*args)
+    return wrapper
+
+def _round(value, digits=0):
+    return round(value, int(digits))
+
+def _substring(value, start, length):
+    start = int(start) - 1
+    return value[max(start, 0):start + int(length)]
+
+def _concat(*values):
+    return ''.join('' if value is None else str(value) for value in values)
+
+def _coalesce(*values):
+    for value in values:
+        if value is not None:
+            return value
+    return None
+
+_SCALAR_FUNCTIONS: Dict[str, Callable] = {
+    'ABS': _null_safe(abs),
+    'ROUND': _null_safe(_round),
+    'FLOOR': _null_safe(lambda value: float(int(value // 1))),
+    'CEILING': _null_safe(lambda value: float(-int(-value // 1))),
+    'SQRT': _null_safe(lambda value: value ** 0.5),
+    'POWER': _null_safe(lambda value, exponent: value ** exponent),
+    'SQUARE': _null_safe(lambda value: value * value),
+    'SIGN': _null_safe(lambda value: (value > 0) - (value < 0)),
+    'LOWER': _null_safe(str.lower),
+    'UPPER': _null_safe(str.upper),
+    'LEN': _null_safe(len),
+    'SUBSTRING': _null_safe(_substring),
+    'CONCAT': _concat,
+    'COALESCE': _coalesce,
+    'ISNULL': _coalesce,
+    'GETRECORDPROPERTYVALUE': lambda record, name: _lookup(record, name) if name is not None else None,
+    'GETARRAYELEMENT': _null_safe(lambda array, index: array[int(index)] if 0 <= int(index) < len(array) else None),
+    'GETARRAYLENGTH': _null_safe(len),
+}
+
+def _compare(op: str) -> Callable[[Any, Any], Any]:
+    function = {
+        '=': operator.eq, '<>': operator.ne, '<': operator.lt,
+        '>': operator.gt, '<=': operator.le, '>=': operator.ge,
+    }[op]
+    
+    def compare(left, right):
+        if left is None or right is None:
+            return None
+        try:
+            return function(left, right)
+        except TypeError:
+            return None
+    return compare
+
+def _arithmetic(op: str) -> Callable[[Any, Any], Any]:
+    def apply(left, right):
+        if left is None or right is None:
+            return None
+        if op == '+':
+            if isinstance(left, str) or isinstance(right, str):
+                return f"{left}{right}"
+            return left + right
+        if op == '-':
+            return left - right
+        if op == '*':
+            return left * right
+        if right == 0:
+            return None
+        if op == '/':
+            return left / right
+        return left % right
+    return apply
+
+def _like_regex(pattern: str):
+    regex = ''.join('.*' if c == '%' else '.' if c == '_' else re.escape(c) for c in pattern)
+    return re.compile(f'^{regex}$', re.DOTALL)
+
+class ExpressionCompiler:
+    """Turns AST nodes into closures over (record, event time).
+    
+    alias is the FROM alias, so t.deviceId resolves to deviceId. Subclasses
+    and operators can register extra function handlers through
+    compile_call_hook, which gets first refusal on every Call node.
+    saql_joins.JoinExpressionCompiler resolves columns of joined rows.
+    """
+    
+    def __init__(self, alias: Optional[str] = None, compile_call_hook=None):
+        self.alias = alias.lower() if alias else None
+        self.compile_call_hook = compile_call_hook
+    
+    def compile(self, node: Node) -> Evaluator:
+        method = getattr(self, f"_compile_{type(node).__name__.lower()}", None)
+        if method is None:
+            raise SaqlError(f"Unsupported expression: {type(node).__name__}")
+        return method(node)
+    
+    def compile_time_argument(self, node: Node) -> Evaluator:
+        """Compile a DATEDIFF argument; join compilers map a bare source alias to its event time."""
+        return self.compile(node)
+    
+    def star_columns(self, node: Star) -> Optional[Evaluator]:
+        """Evaluator for the fields * copies into a row, or None to copy the whole record."""
+        return None
+    
+    def _compile_literal(self, node: Literal) -> Evaluator:
+        value = node.value
+        return lambda record, ts: value
+    
+    def _compile_column(self, node: Column) -> Evaluator:
+        path = list(node.path)
+        if len(path) > 1 and self.alias and path[0].lower() == self.alias:
+            path = path[1:]
+        
+        if len(path) == 1:
+            name = path[0]
+            
+            def column(record, ts):
+                value = record.get(name)
+                if value is None and name not in record:
+                    return _lookup(record, name)
+                return value
+            return column
+        
+        def nested(record, ts):
+            value = record
+            for name in path:
+                value = _lookup(value, name)
+                if value is None:
+                    return None
+            return value
+        return nested
+    
+    def _compile_star(self, node: Star) -> Evaluator:
+        raise SaqlError("* is only allowed in the SELECT list or COUNT(*)")
+    
+    def _compile_analytic(self, node: Call) -> Evaluator:
+        entry = ANALYTIC_FUNCTIONS.get(node.name.upper())
+        if entry is None:
+            raise SaqlError(f"Analytic function {node.name} is not supported")
+        import importlib
+        
+        module_name, factory = entry
+        return getattr(importlib.import_module(module_name), factory)(node, self)
+    
+    def _compile_call(self, node: Call) -> Evaluator:
+        if self.compile_call_hook is not None:
+            compiled = self.compile_call_hook(node, self)
+            if compiled is not None:
+                return compiled
+        
+        name = node.name.upper()
+        if name == 'SYSTEM.TIMESTAMP':
+            return lambda record, ts: ts
+        if node.over is not None:
+            return self._compile_analytic(node)
+        if name in AGGREGATE_FUNCTIONS:
+            raise SaqlError(f"Aggregate {node.name} requires GROUP BY")
+        if name == 'DATEADD':
+            unit = node.args[0].value
+            amount = self.compile(node.args[1])
+            base = self.compile(node.args[2])
+            
+            def dateadd(record, ts):
+                value = parse_datetime(base(record, ts))
+                count = amount(record, ts)
+                if value is None or count is None:
+                    return None
+                return value + time_unit_delta(unit, count)
+            return dateadd
+        if name == 'DATEDIFF':
+            if len(node.args) != 3:
+                raise SaqlError("DATEDIFF takes (unit, start, end)")
+            unit = node.args[0].value
+            datediff(unit, EPOCH, EPOCH)  # reject unknown units at compile time
+            start = self.compile_time_argument(node.args[1])
+            end = self.compile_time_argument(node.args[2])
+            return lambda record, ts: datediff(unit, start(record, ts), end(record, ts))
+        
+        function = _SCALAR_FUNCTIONS.get(name)
+        if function is None:
+            raise SaqlError(f"Unknown function {node.name}")
+        args = [self.compile(arg) for arg in node.args]
+        if len(args) == 1:
+            only = args[0]
+            return lambda record, ts: function(only(record, ts))
+        return lambda record, ts: function(*[arg(record, ts) for arg in args])
+    
+    def _compile_case(self, node: Case) -> Evaluator:
+        whens = [(self.compile(condition), self.compile(result)) for condition, result in node.whens]
+        default = self.compile(node.default) if node.default is not None else (lambda record, ts: None)
+        
+        if node.operand is not None:
+            operand = self.compile(node.operand)
+            
+            def simple_case(record, ts):
+                value = operand(record, ts)
+                for candidate, result in whens:
+                    if value is not None and value == candidate(record, ts):
+                        return result(record, ts)
+                return default(record, ts)
+            return simple_case
+        
+        def searched_case(record, ts):
+            for condition, result in whens:
+                if condition(record, ts):
+                    return result(record, ts)
+            return default(record, ts)
+        return searched_case
+    
+    def _compile_cast(self, node: Cast) -> Evaluator:
+        expr = self.compile(node.expr)
+        type_name = node.type_name
+        _cast(None, type_name)  # reject unknown types at compile time
+        if node.safe:
+            def try_cast(record, ts):
+                try:
+                    return _cast(expr(record, ts), type_name)
+                except (TypeError, ValueError):
+                    return None
+            return try_cast
+        
+        def cast(record, ts):
+            value = expr(record, ts)
+            try:
+                return _cast(value, type_name)
+            except (TypeError, ValueError):
+                raise SaqlError(f"Cannot CAST {value!r} AS {type_name}")
+        return cast
+    
+    def _compile_unary(self, node: Unary) -> Evaluator:
+        operand = self.compile(node.operand)
+        if node.op == 'NOT':
+            def negate(record, ts):
+                value = operand(record, ts)
+                return None if value is None else not value
+            return negate
+        
+        def minus(record, ts):
+            value = operand(record, ts)
+            return None if value is None else -value
+        return minus
+    
+    def _compile_binary(self, node: Binary) -> Evaluator:
+        left = self.compile(node.left)
+        right = self.compile(node.right)
+        if node.op == 'AND':
+            return lambda record, ts: bool(left(record, ts)) and bool(right(record, ts))
+        if node.op == 'OR':
+            return lambda record, ts: bool(left(record, ts)) or bool(right(record, ts))
+        if node.op in ('+', '-', '*', '/', '%'):
+            apply = _arithmetic(node.op)
+        else:
+            apply = _compare(node.op)
+            # Column compared with a literal is by far the most common predicate
+            if isinstance(node.right, Literal) and node.right.value is not None:
+                constant = node.right.value
+                return lambda record, ts: apply(left(record, ts), constant)
+        return lambda record, ts: apply(left(record, ts), right(record, ts))
+    
+    def _compile_isnull(self, node: IsNull) -> Evaluator:
+        operand = self.compile(node.operand)
+        if node.negated:
+            return lambda record, ts: operand(record, ts) is not None
+        return lambda record, ts: operand(record, ts) is None
+    
+    def _compile_between(self, node: Between) -> Evaluator:
+        operand = self.compile(node.operand)
+        low = self.compile(node.low)
+        high = self.compile(node.high)
+        negated = node.negated
+        
+        def between(record, ts):
+            value, lo, hi = operand(record, ts), low(record, ts), high(record, ts)
+            if value is None or lo is None or hi is None:
+                return None
+            return (lo <= value <= hi) != negated
+        return between
+    
+    def _compile_inlist(self, node: InList) -> Evaluator:
+        operand = self.compile(node.operand)
+        items = [self.compile(item) for item in node.items]
+        negated = node.negated
+        
+        def in_list(record, ts):
+            value = operand(record, ts)
+            if value is None:
+                return None
+            return any(value == item(record, ts) for item in items) != negated
+        return in_list
+    
+    def _compile_like(self, node: Like) -> Evaluator:
+        operand = self.compile(node.operand)
+        negated = node.negated
+        if isinstance(node.pattern, Literal):
+            regex = _like_regex(node.pattern.value)
+            
+            def like_constant(record, ts):
+                value = operand(record, ts)
+                return None if value is None else bool(regex.match(str(value))) != negated
+            return like_constant
+        
+        pattern = self.compile(node.pattern)
+        
+        def like(record, ts):
+            value, text = operand(record, ts), pattern(record, ts)
+            if value is None or text is None:
+                return None
+            return bool(_like_regex(text).match(str(value))) != negated
+        return like
+
+_UNIT_SECONDS = {
+    'microsecond': 1e-6, 'mcs': 1e-6, 'us': 1e-6,
+    'millisecond': 1e-3, 'ms': 1e-3,
+    'second': 1, 'ss': 1, 's': 1,
+    'minute': 60, 'mi': 60, 'n': 60,
+    'hour': 3600, 'hh': 3600,
+    'day': 86400, 'dd': 86400, 'd': 86400,
+    'week': 604800, 'wk': 604800, 'ww': 604800,
+}
+
+def time_unit_seconds(unit: str) -> float:
+    """Length of a SAQL time unit (minute, hh, ss, ...) in seconds."""
+    try:
+        return _UNIT_SECONDS[unit.lower()]
+    except KeyError:
+        raise SaqlError(f"Unsupported time unit: {unit}")
+
+def time_unit_delta(unit: str, amount: float) -> timedelta:
+    """A SAQL time unit amount as a timedelta."""
+    return timedelta(seconds=time_unit_seconds(unit) * amount)
+
+EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+# Weeks start on Sunday, as in DATEPART(weekday, ...); 1970-01-04 was one
+_WEEK_ORIGIN = timedelta(days=3)
+
+def datediff(unit: str, start: Any, end: Any) -> Optional[int]:
+    """DATEDIFF: how many unit boundaries lie between start and end (negative if end is earlier)."""
+    start, end = parse_datetime(start), parse_datetime(end)
+    if start is None or end is None:
+        return None
+    unit = unit.lower()
+    if unit in ('year', 'yy', 'yyyy'):
+        return end.year - start.year
+    if unit in ('quarter', 'qq', 'q'):
+        return (end.year - start.year) * 4 + (end.month - 1) // 3 - (start.month - 1) // 3
+    if unit in ('month', 'mm', 'm'):
+        return (end.year - start.year) * 12 + end.month - start.month
+    size = timedelta(seconds=time_unit_seconds(unit))
+    origin = EPOCH + _WEEK_ORIGIN if size == timedelta(weeks=1) else EPOCH
+    return (end - origin) // size - (start - origin) // size
+
+def output_name(item: SelectItem, position: int) -> str:
+    """Column name for a SELECT item: its alias, else the last property name."""
+    if item.alias:
+        return item.alias
+    if isinstance(item.expr, Column):
+        return item.expr.path[-1]
+    return f"Column{position}"
+
+# ---------------------------------------------------------------------------
+# Operators
+# ---------------------------------------------------------------------------
+
+# Events flow between operators as (event time, record) tuples. A None
+# record is a watermark: no event earlier than its time will follow. Every
+# operator passes watermarks on; window operators also use them to close windows
+Event = Tuple[datetime, Optional[Dict[str, Any]]]
+
+def scan(records: Iterable[Dict[str, Any]], timestamp: Optional[Evaluator]) -> Iterator[Event]:
+    """Assign event times to raw records.
+    
+    With TIMESTAMP BY the time comes from the expression; without it, from
+    EventEnqueuedUtcTime when present (as Event Hubs inputs do), else the
+    time the record is read.
+    """
+    last_text = None
+    last_time = None
+    for record in records:
+        if timestamp is not None:
+            value = timestamp(record, None)
+        else:
+            value = record.get('EventEnqueuedUtcTime')
+            if value is None:
+                yield datetime.now(timezone.utc), record
+                continue
+        
+        # Consecutive events often share a timestamp string; parse it once
+        if value != last_text:
+            last_text = value
+            last_time = parse_datetime(value)
+        if last_time is None:
+            logger.debug(f"Dropping event with unparseable timestamp {value!r}")
+            continue
+        yield last_time, record
+
+def filter_events(events: Iterable[Event], predicate: Evaluator) -> Iterator[Event]:
+    """WHERE: pass events whose predicate is true (NULL counts as false)."""
+    for ts, record in events:
+        if record is None or predicate(record, ts):
+            yield ts, record
+
+def project(events: Iterable[Event], columns: List[Tuple[Optional[str], Optional[Evaluator]]]) -> Iterator[Event]:
+    """SELECT list: build each output record from (name, evaluator) pairs.
+    
+    A None name stands for *, which copies every input field, or the fields
+    its evaluator returns (alias.* and * over a join).
+    """
+    for ts, record in events:
+        if record is None:
+            yield ts, None
+            continue
+        row = {}
+        for name, evaluator in columns:
+            if name is None:
+                row.update(record if evaluator is None else evaluator(record, ts))
+            else:
+                row[name] = evaluator(record, ts)
+        yield ts, row
+
+def distinct(events: Iterable[Event]) -> Iterator[Event]:
+    """SELECT DISTINCT over a stream: drop rows already seen at the same event time."""
+    current_time = None
+    seen = set()
+    for ts, row in events:
+        if row is None:
+            yield ts, None
+            continue
+        if ts != current_time:
+            current_time = ts
+            seen = set()
+        key = json.dumps(row, sort_keys=True, default=json_default)
+        if key not in seen:
+            seen.add(key)
+            yield ts, row
+
+def top(events: Iterable[Event], count: int) -> Iterator[Event]:
+    """SELECT TOP n per event time."""
+    current_time = None
+    emitted = 0
+    for ts, row in events:
+        if row is None:
+            yield ts, None
+            continue
+        if ts != current_time:
+            current_time = ts
+            emitted = 0
+        if emitted < count:
+            emitted += 1
+            yield ts, row
+
+# ---------------------------------------------------------------------------
+# Compilation and execution
+# ---------------------------------------------------------------------------
+
+class CompiledQuery:
+    """A query compiled into generator pipelines, one per output statement."""
+    
+    def __init__(self, query: Query, ordering=None):
+        self.query = query
+        self.inputs = self._find_inputs()
+        self.outputs = [statement.into or DEFAULT_OUTPUT for statement in query.statements]
+        # Optional event_ordering.EventOrderingPolicy applied after TIMESTAMP BY;
+        # each run records (source name, ReorderBuffer) for reporting
+        self.ordering = ordering
+        self.ordering_stages = []
+    
+    def _sources(self) -> Iterator[Source]:
+        """FROM and JOIN sources of every statement."""
+        for statement in list(self.query.steps.values()) + self.query.statements:
+            yield statement.source
+            for join in statement.joins:
+                yield join.source
+    
+    def _find_inputs(self) -> List[str]:
+        names = []
+        for source in self._sources():
+            if source.name.lower() not in self.query.steps and source.name not in names:
+                names.append(source.name)
+        return names
+    
+    def _reference_counts(self) -> Dict[str, int]:
+        counts: Dict[str, int] = {}
+        for source in self._sources():
+            key = source.name.lower()
+            counts[key] = counts.get(key, 0) + 1
+        return counts
+    
+    def run(self, inputs: Dict[str, Iterable[Dict[str, Any]]],
+            reference: Optional[Dict[str, Any]] = None) -> Iterator[Tuple[str, Dict[str, Any]]]:
+        """Run the query, yielding (output name, row) pairs as they are produced."""
+        for output, _, row in self.run_timed(inputs, reference):
+            yield output, row
+    
+    def run_timed(self, inputs: Dict[str, Iterable[Dict[str, Any]]],
+                  reference: Optional[Dict[str, Any]] = None) -> Iterator[Tuple[str, datetime, Dict[str, Any]]]:
+        """Run the query, yielding (output name, System.Timestamp, row) as rows are produced.
+        
+        inputs maps input names (case-insensitive) to iterables of records,
+        and reference maps the names of reference data inputs to
+        saql_joins.ReferenceData tables. Sources read by more than one
+        statement are shared with itertools.tee; outputs are pulled
+        round-robin so those buffers stay small for stateless pipelines.
+        """
+        sources = {name.lower(): iter(records) for name, records in inputs.items()}
+        tables = {name.lower(): table for name, table in (reference or {}).items()}
+        for name in self.inputs:
+            if name.lower() not in sources and name.lower() not in tables:
+                raise SaqlError(f"No data bound to input [{name}]")
+        
+        counts = self._reference_counts()
+        shared: Dict[str, List[Iterator]] = {}
+        
+        def take_source(name: str, build: Callable[[], Iterator]) -> Iterator:
+            key = name.lower()
+            if key not in shared:
+                shared[key] = list(itertools.tee(build(), counts[key])) if counts[key] > 1 else [build()]
+            return shared[key].pop()
+        
+        def open_events(source: Source) -> Iterator[Event]:
+            key = source.name.lower()
+            if key in tables:
+                raise SaqlError(f"Reference data [{source.name}] can only be used in a JOIN")
+            if key in self.query.steps:
+                step = self.query.steps[key]
+                upstream = take_source(source.name, lambda: open_stream(step))
+                if source.timestamp_by is not None:
+                    # Re-time the step's rows by the given expression
+                    rows = (row for _, row in upstream if row is not None)
+                    upstream = self._order(source.name, scan(rows, self._timestamp_evaluator(source)))
+                return upstream
+            upstream = take_source(source.name, lambda: sources[key])
+            events = scan(upstream, self._timestamp_evaluator(source))
+            if source.timestamp_by is not None:
+                events = self._order(source.name, events)
+            return events
+        
+        def open_stream(statement: SelectStatement) -> Iterator[Event]:
+            events = open_events(statement.source)
+            joined = [
+                tables[join.source.name.lower()] if join.source.name.lower() in tables else open_events(join.source)
+                for join in statement.joins
+            ]
+            return self.build_pipeline(statement, events, joined)
+        
+        pipelines = [
+            (output, open_stream(statement))
+            for output, statement in zip(self.outputs, self.query.statements)
+        ]
+        
+        while pipelines:
+            for entry in list(pipelines):
+                output, pipeline = entry
+                try:
+                    ts, row = next(pipeline)
+                except StopIteration:
+                    pipelines.remove(entry)
+                    continue
+                if row is not None:
+                    yield output, ts, row
+    
+    def _order(self, source_name: str, events: Iterator[Event]) -> Iterator[Event]:
+        """Apply the event ordering policy, if any, to a TIMESTAMP BY stream."""
+        if self.ordering is None:
+            return events
+        from event_ordering import ReorderBuffer
+        
+        stage = ReorderBuffer(self.ordering)
+        self.ordering_stages.append((source_name, stage))
+        return stage.run(events)
+    
+    @staticmethod
+    def _timestamp_evaluator(source: Source) -> Optional[Evaluator]:
+        if source.timestamp_by is None:
+            return None
+        return ExpressionCompiler(source.alias).compile(source.timestamp_by)
+    
+    def build_pipeline(self, statement: SelectStatement, events: Iterator[Event],
+                       joined: Optional[List[Any]] = None) -> Iterator[Event]:
+        """Chain the operators for one SELECT over an event stream.
+        
+        joined holds, for each JOIN, the right-hand event stream or
+        reference data table; WHERE applies to the joined rows.
+        """
+        compiler = statement_compiler(statement)
+        if statement.joins:
+            from saql_joins import build_joins
+            
+            events = build_joins(statement, events, joined or [], compiler)
+        
+        if statement.where is not None:
+            events = filter_events(events, compiler.compile(statement.where))
+        
+        if statement.group_by:
+            events = self._build_aggregation(statement, events)
+        elif statement.having is not None:
+            raise SaqlError("HAVING requires GROUP BY")
+        else:
+            events = project(events, self._project_columns(statement, compiler))
+        
+        if statement.distinct:
+            events = distinct(events)
+        if statement.top is not None:
+            events = top(events, statement.top)
+        return events
+    
+    @staticmethod
+    def _project_columns(statement: SelectStatement,
+                         compiler: ExpressionCompiler) -> List[Tuple[Optional[str], Optional[Evaluator]]]:
+        columns = []
+        for position, item in enumerate(statement.items, start=1):
+            if isinstance(item.expr, Star):
+                columns.append((None, compiler.star_columns(item.expr)))
+            else:
+                columns.append((output_name(item, position), compiler.compile(item.expr)))
+        return columns
+    
+    @staticmethod
+    def _build_aggregation(statement: SelectStatement, events: Iterator[Event]) -> Iterator[Event]:
+        """GROUP BY keys plus one window: hand the stream to a saql_windows operator."""
+        from saql_windows import WINDOW_FUNCTIONS, build_aggregate_spec, build_window_operator
+        
+        compiler = statement_compiler(statement)
+        window = None
+        keys = []
+        for expr in statement.group_by:
+            if isinstance(expr, Call) and expr.name.upper() in WINDOW_FUNCTIONS:
+                if window is not None:
+                    raise SaqlError("GROUP BY can only use one window")
+                window = expr
+            else:
+                keys.append(compiler.compile(expr))
+        if window is None:
+            raise SaqlError("GROUP BY needs a window such as TumblingWindow(minute, 5)")
+        
+        # Each aggregate call becomes a slot in the window's result list; the
+        # SELECT and HAVING expressions read their slot when a window closes
+        specs = []
+        slots: Dict[int, int] = {}
+        
+        def collect(node: Node):
+            if isinstance(node, Call) and node.name.upper() in AGGREGATE_FUNCTIONS:
+                slots[id(node)] = len(specs)
+                specs.append(build_aggregate_spec(node, compiler.compile))
+                return
+            for child in iter_child_nodes(node):
+                collect(child)
+        
+        for item in statement.items:
+            if isinstance(item.expr, Star):
+                raise SaqlError("SELECT * cannot be used with GROUP BY")
+            collect(item.expr)
+        if statement.having is not None:
+            collect(statement.having)
+        
+        current = [None]
+        
+        def aggregate_slot(node: Call, _compiler: ExpressionCompiler) -> Optional[Evaluator]:
+            slot = slots.get(id(node))
+            if slot is None:
+                return None
+            return lambda record, ts: current[0][slot]
+        
+        outer = statement_compiler(statement, compile_call_hook=aggregate_slot)
+        columns = [
+            (output_name(item, position), outer.compile(item.expr))
+            for position, item in enumerate(statement.items, start=1)
+        ]
+        having = outer.compile(statement.having) if statement.having is not None else None
+        
+        def emit(window_end: datetime, representative: Dict[str, Any], results: List[Any]) -> Optional[Dict[str, Any]]:
+            current[0] = results
+            if having is not None and not having(representative, window_end):
+                return None
+            return {name: evaluator(representative, window_end) for name, evaluator in columns}
+        
+        return build_window_operator(window, keys, specs, emit).run(events)
+
+def statement_compiler(statement: SelectStatement, compile_call_hook=None) -> ExpressionCompiler:
+    """Expression compiler for a SELECT: plain for one source, join-aware with JOINs."""
+    if statement.joins:
+        from saql_joins import JoinExpressionCompiler
+        
+        return JoinExpressionCompiler(statement, compile_call_hook)
+    return ExpressionCompiler(statement.source.alias, compile_call_hook)
+
+def compile_query(text: str, ordering=None) -> CompiledQuery:
+    """Parse and compile SAQL text, optionally with an event ordering policy."""
+    return CompiledQuery(parse_query(text), ordering)
+
+# ---------------------------------------------------------------------------
+# Input readers
+# ---------------------------------------------------------------------------
+
+_SEPARATORS = re.compile(r'[\s,]*')
+
+def iter_json_records(path: str, chunk_size: int = 4 << 20) -> Iterator[Dict[str, Any]]:
+    """Stream records from a JSON array file or a JSON Lines file through mmap.
+    
+    The file is never read as a whole, so multi-gigabyte recordings start
+    immediately and use little memory: JSON Lines are decoded a block of
+    lines at a time with a single json.loads() call, and JSON arrays are
+    decoded element by element from a window that slides over the mapping.
+    """
+    with open(path, 'rb') as handle:
+        if os.fstat(handle.fileno()).st_size == 0:
+            return
+        with mmap.mmap(handle.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            start = 3 if mapped[:3] == b'\xef\xbb\xbf' else 0
+            while start < len(mapped) and mapped[start:start + 1].isspace():
+                start += 1
+            if mapped[start:start + 1] == b'[':
+                yield from _iter_array(mapped, start + 1, chunk_size, path)
+            else:
+                yield from _iter_lines(mapped, start, chunk_size)
+
+def _iter_lines(mapped: mmap.mmap, position: int, chunk_size: int) -> Iterator[Dict[str, Any]]:
+    size = len(mapped)
+    while position < size:
+        end = min(position + chunk_size, size)
+        if end < size:
+            # Cut after the last complete line, or after the first one if a
+            # single line is longer than the chunk
+            cut = mapped.rfind(b'\n', position, end)
+            if cut < 0:
+                cut = mapped.find(b'\n', end)
+            end = size if cut < 0 else cut + 1
+        lines = [line for line in mapped[position:end].split(b'\n') if line.strip()]
+        position = end
+        try:
+            # One decoder call per block instead of one per line
+            records = json.loads(b'[' + b','.join(lines) + b']')
+        except json.JSONDecodeError:
+            # Re-decode line by line so the error names the bad line
+            records = [json.loads(line) for line in lines]
+        yield from records
+
+def _decode_window(mapped: mmap.mmap, offset: int, chunk_size: int) -> Tuple[str, int]:
+    """Decode about chunk_size bytes from offset without splitting a UTF-8 character.
+    
+    Returns the text and the byte offset where it ends.
+    """
+    end = min(offset + chunk_size, len(mapped))
+    while end < len(mapped) and end > offset and mapped[end] & 0xC0 == 0x80:
+        end -= 1
+    return mapped[offset:end].decode('utf-8'), end
+
+def _iter_array(mapped: mmap.mmap, offset: int, chunk_size: int, path: str) -> Iterator[Dict[str, Any]]:
+    decoder = json.JSONDecoder()
+    size = len(mapped)
+    text, window_end = _decode_window(mapped, offset, chunk_size)
+    # Character and byte offsets coincide in pure-ASCII windows
+    ascii_only = text.isascii()
+    position = 0
+    
+    while True:
+        position = _SEPARATORS.match(text, position).end()
+        at_end = window_end >= size
+        if position < len(text):
+            if text[position] == ']':
+                return
+            try:
+                record, end = decoder.raw_decode(text, position)
+                # An element that ends exactly at the window edge may be cut short
+                if end < len(text) or at_end:
+                    yield record
+                    position = end
+                    continue
+            except json.JSONDecodeError:
+                if at_end:
+                    raise
+        elif at_end:
+            raise SaqlError(f"{path}: unterminated JSON array")
+        
+        # Slide the window to the unconsumed text; grow it if one element
+        # does not fit
+        consumed = position if ascii_only else len(text[:position].encode('utf-8'))
+        if consumed == 0:
+            chunk_size *= 2
+        offset += consumed
+        text, window_end = _decode_window(mapped, offset, chunk_size)
+        ascii_only = text.isascii()
+        position = 0
+
+def generated_records(count: Optional[int], batch_size: int = 10000) -> Iterator[Dict[str, Any]]:
+    """Synthetic telemetry records, spaced 10 ms apart in event time."""
+    try:
+        from telemetry_batch import generate_telemetry_batch
+    except ImportError:
+        generate_telemetry_batch = None
+    
+    start = datetime.now(timezone.utc)
+    produced = 0
+    while count is None or produced < count:
+        size = batch_size if count is None else min(batch_size, count - produced)
+        batch_start = start + timedelta(milliseconds=10 * produced)
+        if generate_telemetry_batch is not None:
+            yield from generate_telemetry_batch(size, start_time=batch_start, spacing_ms=10).iter_records()
+        else:
+            import random
+            for index in range(size):
+                yield {
+                    "deviceId": f"device-{random.randint(1, 100):03d}",
+                    "timestamp": format_datetime(batch_start + timedelta(milliseconds=10 * index)),
+                    "temperature": round(random.uniform(20, 40), 1),
+                    "humidity": round(random.uniform(30, 80), 1),
+                    "pressure": round(random.uniform(1000, 1100), 2),
+                    "location": {"lat": 47.6062, "lon": -122.3321},
+                }
+        produced += size
+
+# ---------------------------------------------------------------------------
+# Command line
+# ---------------------------------------------------------------------------
+
+def parse_args():
+    """Parse command line options."""
+    parser = argparse.ArgumentParser(description="Run a Stream Analytics query locally")
+    parser.add_argument("query", help="Path to a .sql file")
+    parser.add_argument("--input", action="append", default=[], metavar="[NAME=]PATH",
+                        help="JSON array or JSON Lines file for an input; without NAME it feeds "
+                             "every input (default: sample-data/telemetry-sample.json)")
+    parser.add_argument("--reference", action="append", default=[], metavar="NAME=PATH",
+                        help="CSV, JSON or JSON Lines file for a reference data input used in a JOIN")
+    parser.add_argument("--reference-refresh", type=float, default=5.0, metavar="SECONDS",
+                        help="How often to check reference data files for changes (default: 5)")
+    parser.add_argument("--generate", type=int, default=None, metavar="N",
+                        help="Use N generated telemetry events instead of files (0 = endless)")
+    parser.add_argument("--output", default=None,
+                        help="Write JSON Lines here instead of stdout")
+    parser.add_argument("--count-only", action="store_true",
+                        help="Only report row counts and throughput per output")
+    ordering = parser.add_argument_group("event ordering (applies to TIMESTAMP BY inputs)")
+    ordering.add_argument("--out-of-order-tolerance", type=float, default=None, metavar="SECONDS",
+                          help="Reorder events up to this far out of order; enables the ordering stage")
+    ordering.add_argument("--late-arrival-tolerance", type=float, default=None, metavar="SECONDS",
+                          help="Maximum event time lag behind EventEnqueuedUtcTime; enables the ordering stage")
+    ordering.add_argument("--order-action", choices=["adjust", "drop"], default="adjust",
+                          help="What to do with events outside the tolerances (default: adjust)")
+    ordering.add_argument("--partition-field", default="PartitionId",
+                          help="Field holding the input partition (default: PartitionId)")
+    from output_sinks import add_sink_arguments
+    
+    add_sink_arguments(parser)
+    return parser.parse_args()
+
+def build_ordering_policy(args):
+    """Event ordering policy from the command line, or None when not requested."""
+    if args.out_of_order_tolerance is None and args.late_arrival_tolerance is None:
+        return None
+    from event_ordering import EventOrderingPolicy
+    
+    return EventOrderingPolicy(out_of_order_tolerance=args.out_of_order_tolerance or 0.0,
+                               late_arrival_tolerance=args.late_arrival_tolerance,
+                               action=args.order_action,
+                               partition_field=args.partition_field or None)
+
+def bind_reference(specs: List[str], refresh_interval: float) -> Dict[str, Any]:
+    """Load the --reference NAME=PATH files."""
+    if not specs:
+        return {}
+    from saql_joins import ReferenceData
+    
+    tables = {}
+    for spec in specs:
+        name, separator, path = spec.partition('=')
+        if not separator:
+            raise SaqlError(f"--reference needs NAME=PATH, got {spec!r}")
+        tables[name.lower()] = ReferenceData(path, refresh_interval)
+    return tables
+
+def bind_inputs(compiled: CompiledQuery, specs: List[str], generate: Optional[int],
+                reference: Optional[Dict[str, Any]] = None) -> Dict[str, Iterable[Dict[str, Any]]]:
+    """Map the query's input names, other than reference data, to record streams from --input / --generate."""
+    streams = [name for name in compiled.inputs if name.lower() not in (reference or {})]
+    if generate is not None:
+        count = generate or None
+        return {name: generated_records(count) for name in streams}
+    
+    named = {}
+    default_path = None
+    for spec in specs or [DEFAULT_SAMPLE_DATA]:
+        name, separator, path = spec.partition('=')
+        if separator and not os.path.exists(spec):
+            named[name.lower()] = path
+        else:
+            default_path = spec
+    
+    bound = {}
+    for name in streams:
+        path = named.get(name.lower(), default_path)
+        if path is None:
+            raise SaqlError(f"No --input given for [{name}]")
+        bound[name] = iter_json_records(path)
+    return bound
+
+def bind_sinks(compiled: CompiledQuery, args) -> Dict[str, Any]:
+    """Output sinks from --file-sink / --powerbi-sink, checked against the query's outputs."""
+    if not args.file_sink and not args.powerbi_sink:
+        return {}
+    from output_sinks import sinks_from_args
+    
+    sinks = sinks_from_args(args)
+    outputs = {output.lower() for output in compiled.outputs}
+    for name in sinks:
+        if name not in outputs:
+            raise SaqlError(f"The query has no output [{name}]; it writes to: {', '.join(compiled.outputs)}")
+    return sinks
+
+def main():
+    """Run a query file and print its output rows."""
+    args = parse_args()
+    
+    try:
+        with open(args.query, 'r', encoding='utf-8') as handle:
+            compiled = compile_query(handle.read(), build_ordering_policy(args))
+        reference = bind_reference(args.reference, args.reference_refresh)
+        inputs = bind_inputs(compiled, args.input, args.generate, reference)
+        sinks = bind_sinks(compiled, args)
+    except (OSError, ValueError, SaqlError) as e:
+        logger.error(f"✗ {e}")
+        sys.exit(1)
+    
+    counts = {output: 0 for output in compiled.outputs}
+    out = open(args.output, 'w', encoding='utf-8') if args.output else sys.stdout
+    started = time.perf_counter()
+    last_time = None
+    try:
+        for output, ts, row in compiled.run_timed(inputs, reference):
+            counts[output] += 1
+            sink = sinks.get(output.lower()) if sinks else None
+            if sink is not None:
+                last_time = ts.timestamp()
+                sink.write(plain_row(row), last_time)
+            elif not args.count_only:
+                row_json = json.dumps(row, default=json_default)
+                if len(compiled.outputs) > 1:
+                    out.write(f"[{output}] {row_json}\n")
+                else:
+                    out.write(row_json + "\n")
+    except KeyboardInterrupt:
+        pass
+    except SaqlError as e:
+        logger.error(f"✗ {e}")
+        sys.exit(1)
+    finally:
+        if out is not sys.stdout:
+            out.close()
+        for sink in sinks.values():
+            sink.close(last_time)
+    
+    elapsed = max(time.perf_counter() - started, 1e-9)
+    for output, count in counts.items():
+        print(f"✓ [{output}] {count} rows in {elapsed:.2f}s ({count / elapsed:.1f} rows/sec)", file=sys.stderr)
+        if output.lower() in sinks:
+            print("  " + sinks[output.lower()].summary().replace("\n", "\n  "), file=sys.stderr)
+    if compiled.ordering is not None:
+        print(f"Event ordering: {compiled.ordering.describe()}", file=sys.stderr)
+        for source_name, stage in compiled.ordering_stages:
+            print(f"  [{source_name}] " + stage.stats.summary().replace("\n", "\n    "), file=sys.stderr)
+
+if __name__ == "__main__":
+    # Operator modules import this one by name; let them share the running copy
+    sys.modules.setdefault("saql_engine", sys.modules[__name__])
+    main()
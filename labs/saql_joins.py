@@ -0,0 +1,488 @@
+#!/usr/bin/env python3
+"""
+Joins for the Offline SAQL Engine
+JOIN and LEFT OUTER JOIN against reference data and between two streams.
+
+Reference data (a CSV, JSON or JSON Lines file) is held in memory and
+indexed in a hash table on the columns the ON clause compares with =, so
+each event costs one dictionary lookup however large the table is. The
+file is checked for changes every refresh interval. A changed file is
+loaded into a new snapshot that replaces the old one whole, so lookups
+never see a half-loaded table; a file that fails to load leaves the last
+good snapshot in place.
+
+A JOIN between two streams must bound the time between the joined events
+with DATEDIFF in its ON clause, e.g. DATEDIFF(second, a, b) BETWEEN 0 AND
+60. The two inputs are merged in event-time order, and each side keeps its
+events in per-key deques, oldest first. An event is dropped as soon as
+event time (or a watermark) has moved past the range in which the other
+side could still match it, so memory is bounded by the events that arrive
+within the DATEDIFF range.
+"""
+
+import heapq
+import logging
+import os
+import time
+from collections import deque
+from datetime import datetime
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Set, Tuple
+
+from saql_engine import (
+    Between,
+    Binary,
+    Call,
+    Column,
+    Evaluator,
+    Event,
+    ExpressionCompiler,
+    Literal,
+    Node,
+    SaqlError,
+    SelectStatement,
+    Source,
+    Star,
+    Unary,
+    iter_child_nodes,
+    time_unit_seconds,
+)
+from saql_windows import from_micros, to_micros
+from serializers import decode_records
+
+logger = logging.getLogger(__name__)
+
+INNER = 'INNER'
+LEFT = 'LEFT'
+
+def source_alias(source: Source) -> str:
+    """Name a source's columns are qualified with: its alias, else its name."""
+    return (source.alias or source.name).lower()
+
+class JoinedRecord(dict):
+    """A joined row: each side's record by lowercase alias, plus each side's event time.
+    
+    The right side of an unmatched LEFT OUTER JOIN row is None.
+    """
+    __slots__ = ('times',)
+    
+    def __init__(self, sides: Dict[str, Any], times: Dict[str, Optional[datetime]]):
+        super().__init__(sides)
+        self.times = times
+    
+    def extended(self, alias: str, record: Optional[Dict[str, Any]], ts: Optional[datetime]) -> 'JoinedRecord':
+        joined = JoinedRecord(self, dict(self.times))
+        joined[alias] = record
+        joined.times[alias] = ts
+        return joined
+
+def _wrap(events: Iterable[Event], alias: str) -> Iterator[Event]:
+    """Turn an input's records into single-sided joined rows."""
+    for ts, record in events:
+        if record is None:
+            yield ts, None
+        else:
+            yield ts, JoinedRecord({alias: record}, {alias: ts})
+
+# ---------------------------------------------------------------------------
+# Expressions over joined rows
+# ---------------------------------------------------------------------------
+
+class JoinExpressionCompiler(ExpressionCompiler):
+    """Compiles expressions of a SELECT with JOINs against JoinedRecord rows.
+    
+    alias.column reads that side's record. An unqualified column is looked
+    up in every side in FROM order, and a bare alias as a DATEDIFF argument
+    stands for that side's event time.
+    """
+    
+    def __init__(self, statement: SelectStatement, compile_call_hook=None):
+        super().__init__(None, compile_call_hook)
+        self.aliases = [source_alias(statement.source)] + [source_alias(join.source) for join in statement.joins]
+        if len(set(self.aliases)) != len(self.aliases):
+            raise SaqlError("Every source of a JOIN needs its own alias")
+        # Resolves a column path within one side's record
+        self._plain = ExpressionCompiler()
+    
+    def _compile_column(self, node: Column) -> Evaluator:
+        side = node.path[0].lower()
+        if side in self.aliases:
+            if len(node.path) == 1:
+                return lambda record, ts: record.get(side)
+            inner = self._plain.compile(Column(node.path[1:]))
+            
+            def qualified(record, ts):
+                value = record.get(side)
+                return None if value is None else inner(value, ts)
+            return qualified
+        
+        inner = self._plain.compile(node)
+        aliases = self.aliases
+        
+        def unqualified(record, ts):
+            for alias in aliases:
+                value = record.get(alias)
+                if value is not None:
+                    value = inner(value, ts)
+                    if value is not None:
+                        return value
+            return None
+        return unqualified
+    
+    def compile_time_argument(self, node: Node) -> Evaluator:
+        if isinstance(node, Column) and len(node.path) == 1 and node.path[0].lower() in self.aliases:
+            alias = node.path[0].lower()
+            return lambda record, ts: record.times.get(alias)
+        return self.compile(node)
+    
+    def star_columns(self, node: Star) -> Optional[Evaluator]:
+        if node.qualifier is not None:
+            alias = node.qualifier.lower()
+            if alias not in self.aliases:
+                raise SaqlError(f"Unknown source alias {node.qualifier} in {node.qualifier}.*")
+            return lambda record, ts: record.get(alias) or {}
+        # Earlier sources win name clashes, so update from the last one back
+        aliases = self.aliases[::-1]
+        
+        def all_columns(record, ts):
+            row = {}
+            for alias in aliases:
+                side = record.get(alias)
+                if side:
+                    row.update(side)
+            return row
+        return all_columns
+
+# ---------------------------------------------------------------------------
+# ON clause analysis
+# ---------------------------------------------------------------------------
+
+def _conjuncts(node: Node) -> List[Node]:
+    if isinstance(node, Binary) and node.op == 'AND':
+        return _conjuncts(node.left) + _conjuncts(node.right)
+    return [node]
+
+def _referenced_aliases(node: Node, aliases: List[str]) -> Set[str]:
+    """Aliases whose columns an expression reads; '' stands for an unqualified column."""
+    if isinstance(node, Column):
+        first = node.path[0].lower()
+        return {first if first in aliases else ''}
+    found = set()
+    for child in iter_child_nodes(node):
+        found |= _referenced_aliases(child, aliases)
+    return found
+
+def _split_condition(condition: Node, aliases: List[str], left: Set[str],
+                     right: str) -> Tuple[List[Tuple[Node, Node]], List[Node]]:
+    """Split ON into (left expression, right expression) equality keys and the remaining conjuncts."""
+    keys = []
+    rest = []
+    for conjunct in _conjuncts(condition):
+        if isinstance(conjunct, Binary) and conjunct.op == '=':
+            first = _referenced_aliases(conjunct.left, aliases)
+            second = _referenced_aliases(conjunct.right, aliases)
+            if first and first <= left and second == {right}:
+                keys.append((conjunct.left, conjunct.right))
+                continue
+            if second and second <= left and first == {right}:
+                keys.append((conjunct.right, conjunct.left))
+                continue
+        rest.append(conjunct)
+    return keys, rest
+
+def _datediff_sign(node: Node, left: Set[str], right: str) -> Optional[Tuple[int, int]]:
+    """(unit in microseconds, sign) of DATEDIFF(unit, left alias, right alias); sign is -1 when reversed."""
+    if not (isinstance(node, Call) and node.name.upper() == 'DATEDIFF' and node.over is None
+            and len(node.args) == 3):
+        return None
+    start, end = node.args[1], node.args[2]
+    if not all(isinstance(arg, Column) and len(arg.path) == 1 for arg in (start, end)):
+        return None
+    start, end = start.path[0].lower(), end.path[0].lower()
+    unit = round(time_unit_seconds(node.args[0].value) * 1e6)
+    if start in left and end == right:
+        return unit, 1
+    if start == right and end in left:
+        return unit, -1
+    return None
+
+def _number(node: Node) -> Optional[float]:
+    if isinstance(node, Unary) and node.op == '-':
+        value = _number(node.operand)
+        return None if value is None else -value
+    if isinstance(node, Literal) and isinstance(node.value, (int, float)):
+        return node.value
+    return None
+
+def _time_bounds(conjuncts: List[Node], left: Set[str], right: str) -> Tuple[int, int]:
+    """Microsecond range of right time - left time the DATEDIFF conditions allow.
+    
+    DATEDIFF counts unit boundaries, so a count of n can mean almost one
+    unit more or less than n units; the range is widened by a unit on each
+    side and the exact condition is checked on every candidate pair.
+    """
+    lower = upper = None
+    
+    def bound(datediff: Node, op: str, limit: Optional[float]):
+        nonlocal lower, upper
+        found = _datediff_sign(datediff, left, right)
+        if found is None or limit is None:
+            return
+        unit, sign = found
+        if sign < 0:
+            # DATEDIFF(unit, right, left) <= n bounds right - left from below
+            op = {'<': '>', '<=': '>=', '>': '<', '>=': '<=', '=': '='}[op]
+            limit = -limit
+        if op in ('>', '>=', '='):
+            value = round((limit - 1) * unit)
+            lower = value if lower is None else max(lower, value)
+        if op in ('<', '<=', '='):
+            value = round((limit + 1) * unit)
+            upper = value if upper is None else min(upper, value)
+    
+    for conjunct in conjuncts:
+        if isinstance(conjunct, Between) and not conjunct.negated:
+            bound(conjunct.operand, '>=', _number(conjunct.low))
+            bound(conjunct.operand, '<=', _number(conjunct.high))
+        elif isinstance(conjunct, Binary) and conjunct.op in ('<', '<=', '>', '>=', '='):
+            bound(conjunct.left, conjunct.op, _number(conjunct.right))
+            mirrored = {'<': '>', '<=': '>=', '>': '<', '>=': '<=', '=': '='}[conjunct.op]
+            bound(conjunct.right, mirrored, _number(conjunct.left))
+    
+    if lower is None or upper is None:
+        raise SaqlError(f"A JOIN between streams needs a DATEDIFF range bounded on both sides in its ON clause, "
+                        f"e.g. DATEDIFF(second, <input>, {right}) BETWEEN 0 AND 60")
+    if lower > upper:
+        raise SaqlError(f"The DATEDIFF range of the JOIN with {right} is empty")
+    return lower, upper
+
+def _all_of(evaluators: List[Evaluator]) -> Optional[Evaluator]:
+    if not evaluators:
+        return None
+    if len(evaluators) == 1:
+        return evaluators[0]
+    return lambda record, ts: all(evaluator(record, ts) for evaluator in evaluators)
+
+# ---------------------------------------------------------------------------
+# Reference data
+# ---------------------------------------------------------------------------
+
+class ReferenceData:
+    """A reference data file held in memory, reloaded when the file changes.
+    
+    records is the current snapshot. Hash indexes are built per key on
+    first use and belong to the snapshot, so a reload starts them afresh.
+    """
+    
+    def __init__(self, path: str, refresh_interval: float = 5.0):
+        self.path = path
+        self.refresh_interval = refresh_interval
+        self.records: List[Dict[str, Any]] = []
+        self.loads = 0
+        self._indexes: Dict[Any, Dict[Tuple, List[Dict[str, Any]]]] = {}
+        self._signature = None
+        self._rejected = None
+        self._checked = time.monotonic()
+        self.reload()
+    
+    def _file_signature(self) -> Tuple[int, int]:
+        stat = os.stat(self.path)
+        return stat.st_mtime_ns, stat.st_size
+    
+    def reload(self) -> bool:
+        """Load the file if it changed since the last load; returns whether a new snapshot was loaded."""
+        signature = None
+        try:
+            signature = self._file_signature()
+            if signature in (self._signature, self._rejected):
+                return False
+            with open(self.path, 'rb') as handle:
+                data = handle.read()
+            records = decode_records(data) if data.strip() else []
+        except (OSError, ValueError) as e:
+            if self._signature is None:
+                raise SaqlError(f"Could not load reference data from {self.path}: {e}")
+            self._rejected = signature
+            logger.warning(f"Keeping the previous reference data; reloading {self.path} failed: {e}")
+            return False
+        # Swap in the new snapshot as a whole
+        self.records, self._indexes, self._signature = records, {}, signature
+        self.loads += 1
+        logger.info(f"Loaded {len(records)} reference records from {self.path}")
+        return True
+    
+    def refresh(self):
+        """Reload the file if it changed, at most once per refresh interval."""
+        now = time.monotonic()
+        if now - self._checked >= self.refresh_interval:
+            self._checked = now
+            self.reload()
+    
+    def index(self, key: Callable[[Dict[str, Any]], Tuple]) -> Dict[Tuple, List[Dict[str, Any]]]:
+        """Records of the current snapshot by key(record); records with a NULL key are left out."""
+        index = self._indexes.get(key)
+        if index is None:
+            index = {}
+            for record in self.records:
+                value = key(record)
+                if None not in value:
+                    index.setdefault(value, []).append(record)
+            self._indexes[key] = index
+        return index
+
+def reference_join(events: Iterable[Event], kind: str, alias: str, table: ReferenceData,
+                   left_keys: List[Evaluator], right_keys: List[Evaluator],
+                   residual: Optional[Evaluator]) -> Iterator[Event]:
+    """Join each event with the reference records whose key equals the event's key."""
+    def record_key(record: Dict[str, Any]) -> Tuple:
+        row = JoinedRecord({alias: record}, {})
+        return tuple(key(row, None) for key in right_keys)
+    
+    for ts, record in events:
+        if record is None:
+            yield ts, None
+            continue
+        table.refresh()
+        key = tuple(key(record, ts) for key in left_keys)
+        matched = False
+        for reference in table.index(record_key).get(key, ()):
+            joined = record.extended(alias, reference, ts)
+            if residual is None or residual(joined, ts):
+                matched = True
+                yield ts, joined
+        if not matched and kind == LEFT:
+            yield ts, record.extended(alias, None, None)
+
+# ---------------------------------------------------------------------------
+# Stream-to-stream joins
+# ---------------------------------------------------------------------------
+
+class _Buffer:
+    """One side's events that can still match, in per-key deques and one arrival-order deque."""
+    __slots__ = ('by_key', 'order')
+    
+    def __init__(self):
+        self.by_key: Dict[Tuple, deque] = {}
+        self.order: deque = deque()
+    
+    def add(self, key: Tuple, entry: list):
+        entries = self.by_key.get(key)
+        if entries is None:
+            entries = self.by_key[key] = deque()
+        entries.append(entry)
+        self.order.append((key, entry))
+    
+    def expire(self, before: int) -> Iterator[list]:
+        """Remove and yield the entries whose expiry time is before the given time."""
+        order = self.order
+        while order and order[0][1][0] < before:
+            key, entry = order.popleft()
+            entries = self.by_key[key]
+            entries.popleft()
+            if not entries:
+                del self.by_key[key]
+            yield entry
+
+class StreamJoin:
+    """Joins two event-time ordered streams within a DATEDIFF range.
+    
+    lower and upper bound right time - left time in microseconds. Buffered
+    entries are [expiry micros, event time, record, matched]. A left event
+    can match right events up to upper after it, and a right event left
+    events down to lower before it; once event time passes that point the
+    entry is dropped, and an unmatched left row of a LEFT OUTER JOIN is
+    emitted stamped with the time its range closed.
+    """
+    
+    def __init__(self, kind: str, alias: str, left_keys: List[Evaluator], right_keys: List[Evaluator],
+                 residual: Optional[Evaluator], lower: int, upper: int):
+        self.kind = kind
+        self.alias = alias
+        self.left_keys = left_keys
+        self.right_keys = right_keys
+        self.residual = residual
+        self.lower = lower
+        self.upper = upper
+    
+    def run(self, left: Iterable[Event], right: Iterable[Event]) -> Iterator[Event]:
+        alias = self.alias
+        residual = self.residual
+        outer = self.kind == LEFT
+        lefts, rights = _Buffer(), _Buffer()
+        merged = heapq.merge(((ts, 0, record) for ts, record in left),
+                             ((ts, 1, record) for ts, record in right),
+                             key=lambda item: item[0])
+        now = None
+        for ts, side, record in merged:
+            micros = to_micros(ts)
+            if now is None or micros > now:
+                now = micros
+                for entry in lefts.expire(now):
+                    if outer and not entry[3]:
+                        yield from_micros(entry[0]), entry[2].extended(alias, None, None)
+                for _ in rights.expire(now):
+                    pass
+            if record is None:
+                yield ts, None
+                continue
+            
+            if side == 0:
+                key = tuple(evaluate(record, ts) for evaluate in self.left_keys)
+                entry = [micros + self.upper, ts, record, False]
+                if None not in key:
+                    for other in rights.by_key.get(key, ()):
+                        joined = record.extended(alias, other[2], other[1])
+                        if residual is None or residual(joined, ts):
+                            entry[3] = True
+                            yield ts, joined
+                    lefts.add(key, entry)
+                elif outer:
+                    yield ts, record.extended(alias, None, None)
+            else:
+                key = tuple(evaluate(record, ts) for evaluate in self.right_keys)
+                if None in key:
+                    continue
+                # Right events arrive as one-sided rows; buffer the bare record
+                record = record[alias]
+                for other in lefts.by_key.get(key, ()):
+                    joined = other[2].extended(alias, record, ts)
+                    if residual is None or residual(joined, ts):
+                        other[3] = True
+                        yield ts, joined
+                rights.add(key, [micros - self.lower, ts, record, False])
+        
+        if outer:
+            for entry in lefts.expire(float('inf')):
+                if not entry[3]:
+                    yield from_micros(entry[0]), entry[2].extended(alias, None, None)
+
+# ---------------------------------------------------------------------------
+# Construction from SELECT ... JOIN
+# ---------------------------------------------------------------------------
+
+def build_joins(statement: SelectStatement, events: Iterable[Event], joined: List[Any],
+                compiler: JoinExpressionCompiler) -> Iterator[Event]:
+    """Apply a SELECT's JOINs in order; joined holds each JOIN's stream or ReferenceData."""
+    aliases = compiler.aliases
+    events = _wrap(events, aliases[0])
+    for position, (join, right) in enumerate(zip(statement.joins, joined), start=1):
+        alias = aliases[position]
+        left = set(aliases[:position])
+        keys, rest = _split_condition(join.condition, aliases, left, alias)
+        left_keys = [compiler.compile(expr) for expr, _ in keys]
+        right_keys = [compiler.compile(expr) for _, expr in keys]
+        
+        if isinstance(right, ReferenceData):
+            if join.source.timestamp_by is not None:
+                raise SaqlError(f"Reference data [{join.source.name}] cannot have TIMESTAMP BY")
+            if not keys:
+                raise SaqlError(f"A JOIN with reference data [{join.source.name}] needs an equality between "
+                                f"the input and the reference data, e.g. ON i.deviceId = {alias}.deviceId")
+            residual = _all_of([compiler.compile(conjunct) for conjunct in rest])
+            events = reference_join(events, join.kind, alias, right, left_keys, right_keys, residual)
+        else:
+            lower, upper = _time_bounds(rest, left, alias)
+            # The DATEDIFF conditions stay in the residual for the exact check
+            residual = _all_of([compiler.compile(conjunct) for conjunct in rest])
+            operator = StreamJoin(join.kind, alias, left_keys, right_keys, residual, lower, upper)
+            events = operator.run(events, _wrap(right, alias))
+    return events
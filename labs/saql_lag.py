@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+"""
+LAG for the Offline SAQL Engine
+LAG(expression[, offset[, default]]) OVER (PARTITION BY ... LIMIT DURATION(unit, n) WHEN ...)
+returns the expression's value for the offset-th previous event of the
+same partition, or default (NULL) when there is none within the duration.
+
+Each partition keeps the values and times of its last offset events in a
+fixed-size ring, so an event costs O(1) and a partition's memory is
+bounded by offset. Partitions are kept in order of their latest event;
+with LIMIT DURATION, partitions idle for longer than the duration are
+dropped from the front of that order, which bounds the number kept to the
+devices seen within the duration.
+
+Events are taken in stream order, which is event-time order for TIMESTAMP
+BY inputs, so an ORDER BY in the OVER clause has no further effect. Events
+that fail the WHEN condition get a result but are not added to the history.
+"""
+
+from collections import OrderedDict
+from typing import Any, List, Optional
+
+from saql_engine import Evaluator, Literal, SaqlError, time_unit_seconds
+from saql_windows import to_micros
+
+# previous() result when there is no event offset back within the duration
+MISSING = object()
+
+class _Ring:
+    """Values and times of a partition's last size events."""
+    __slots__ = ('values', 'times', 'next', 'count')
+    
+    def __init__(self, size: int):
+        self.values: List[Any] = [None] * size
+        self.times: List[int] = [0] * size
+        self.next = 0
+        self.count = 0
+
+class LagState:
+    """Per-partition rings of the last offset values."""
+    
+    def __init__(self, offset: int, limit_duration: Optional[float] = None):
+        if offset < 1:
+            raise SaqlError("LAG offset must be at least 1")
+        self.offset = offset
+        self.limit_micros = None if limit_duration is None else round(limit_duration * 1e6)
+        self.partitions: 'OrderedDict[Any, _Ring]' = OrderedDict()
+    
+    def _evict_idle(self, micros: int):
+        partitions = self.partitions
+        horizon = micros - self.limit_micros
+        while partitions:
+            ring = next(iter(partitions.values()))
+            if ring.times[(ring.next - 1) % self.offset] >= horizon:
+                break
+            partitions.popitem(last=False)
+    
+    def previous(self, key: Any, micros: int) -> Any:
+        """Value offset events back in the partition, or MISSING if there is none within the duration."""
+        ring = self.partitions.get(key)
+        if ring is None or ring.count < self.offset:
+            return MISSING
+        # A full ring's next slot holds the offset-th previous event
+        if self.limit_micros is not None and micros - ring.times[ring.next] > self.limit_micros:
+            return MISSING
+        return ring.values[ring.next]
+    
+    def add(self, key: Any, value: Any, micros: int):
+        """Record the current event's value as the newest in its partition."""
+        partitions = self.partitions
+        ring = partitions.get(key)
+        if ring is None:
+            ring = partitions[key] = _Ring(self.offset)
+        else:
+            partitions.move_to_end(key)
+        ring.values[ring.next] = value
+        ring.times[ring.next] = micros
+        ring.next = (ring.next + 1) % self.offset
+        if ring.count < self.offset:
+            ring.count += 1
+        if self.limit_micros is not None:
+            self._evict_idle(micros)
+
+def compile_lag(node, compiler) -> Evaluator:
+    """Engine hook for LAG(expression[, offset[, default]]) OVER (...)."""
+    if not 1 <= len(node.args) <= 3:
+        raise SaqlError("LAG takes (expression[, offset[, default]])")
+    value = compiler.compile(node.args[0])
+    offset = 1
+    if len(node.args) > 1:
+        if not isinstance(node.args[1], Literal) or not isinstance(node.args[1].value, int):
+            raise SaqlError("LAG offset must be an integer constant")
+        offset = node.args[1].value
+    default = compiler.compile(node.args[2]) if len(node.args) > 2 else None
+    
+    over = node.over
+    limit_duration = None
+    if over.limit_duration is not None:
+        unit, amount = over.limit_duration
+        limit_duration = time_unit_seconds(unit) * amount
+    keys = [compiler.compile(expr) for expr in over.partition_by]
+    when = compiler.compile(over.when) if over.when is not None else None
+    state = LagState(offset, limit_duration)
+    
+    def lag(record, ts):
+        key = tuple(key(record, ts) for key in keys)
+        micros = to_micros(ts)
+        result = state.previous(key, micros)
+        if result is MISSING:
+            result = default(record, ts) if default is not None else None
+        if when is None or when(record, ts):
+            state.add(key, value(record, ts), micros)
+        return result
+    return lag
@@ -0,0 +1,830 @@
+#!/usr/bin/env python3
+"""
+Windowed Aggregation for the Offline SAQL Engine
+Incremental GROUP BY operators for TumblingWindow, HoppingWindow,
+SlidingWindow and SessionWindow.
+
+Every aggregate keeps O(1)-per-event running state: compensated counts
+and sums for COUNT/SUM/AVG, Welford's algorithm for STDEV and VAR,
+monotonic deques for MIN/MAX over sliding windows, and a mergeable
+quantile sketch for PERCENTILE_CONT.
+Hopping windows share partial aggregates per pane (the greatest common
+divisor of window size and hop), so each event is folded in once no matter
+how many windows overlap it. Memory grows with the number of open windows
+and groups, not with the number of events (sliding windows necessarily
+keep the events they still cover).
+"""
+
+import bisect
+import heapq
+import math
+from abc import ABC, abstractmethod
+from collections import deque
+from datetime import datetime, timedelta, timezone
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from saql_engine import Call, Evaluator, Event, Literal, SaqlError, time_unit_seconds
+
+EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+def to_micros(ts: datetime) -> int:
+    """Event time as integer microseconds since the epoch (exact, unlike timestamp())."""
+    return (ts - EPOCH) // timedelta(microseconds=1)
+
+def from_micros(micros: int) -> datetime:
+    return EPOCH + timedelta(microseconds=micros)
+
+# ---------------------------------------------------------------------------
+# Aggregate states
+# ---------------------------------------------------------------------------
+
+class CountState:
+    __slots__ = ('count',)
+    
+    def __init__(self):
+        self.count = 0
+    
+    def add(self, value):
+        self.count += 1
+    
+    def remove(self, value):
+        self.count -= 1
+    
+    def merge(self, other: 'CountState'):
+        self.count += other.count
+    
+    def result(self):
+        return self.count
+
+class SumState:
+    """Sum with Neumaier compensation, so adding and removing values on a
+    sliding window doesn't accumulate rounding drift."""
+    __slots__ = ('total', 'compensation', 'count')
+    
+    def __init__(self):
+        self.total = 0
+        self.compensation = 0.0
+        self.count = 0
+    
+    def _accumulate(self, value):
+        total = self.total + value
+        if abs(self.total) >= abs(value):
+            self.compensation += (self.total - total) + value
+        else:
+            self.compensation += (value - total) + self.total
+        self.total = total
+    
+    def add(self, value):
+        self._accumulate(value)
+        self.count += 1
+    
+    def remove(self, value):
+        self._accumulate(-value)
+        self.count -= 1
+    
+    def merge(self, other: 'SumState'):
+        self._accumulate(other.total)
+        self.compensation += other.compensation
+        self.count += other.count
+    
+    def _sum(self):
+        return self.total + self.compensation if self.compensation else self.total
+    
+    def result(self):
+        return self._sum() if self.count else None
+
+class AvgState(SumState):
+    __slots__ = ()
+    
+    def result(self):
+        return self._sum() / self.count if self.count else None
+
+class WelfordState:
+    """Running mean and sum of squared deviations (Welford), mergeable (Chan et al.).
+    
+    kind is one of STDEV, STDEVP, VAR, VARP.
+    """
+    __slots__ = ('kind', 'count', 'mean', 'm2')
+    
+    def __init__(self, kind: str):
+        self.kind = kind
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+    
+    def add(self, value):
+        self.count += 1
+        delta = value - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (value - self.mean)
+    
+    def merge(self, other: 'WelfordState'):
+        if other.count == 0:
+            return
+        total = self.count + other.count
+        delta = other.mean - self.mean
+        self.m2 += other.m2 + delta * delta * self.count * other.count / total
+        self.mean += delta * other.count / total
+        self.count = total
+    
+    def result(self):
+        population = self.kind.endswith('P')
+        divisor = self.count if population else self.count - 1
+        if divisor <= 0:
+            return None
+        variance = self.m2 / divisor
+        return math.sqrt(variance) if self.kind.startswith('STDEV') else variance
+
+class SlidingVarianceState:
+    """Variance over a sliding window from compensated sums of shifted values.
+    
+    Removing values from a Welford state drifts over long runs; sums of
+    (value - shift) and its square, with shift the first value seen, can be
+    added to and subtracted from without that drift.
+    """
+    __slots__ = ('kind', 'shift', 'linear', 'squares')
+    
+    def __init__(self, kind: str):
+        self.kind = kind
+        self.shift = None
+        self.linear = SumState()
+        self.squares = SumState()
+    
+    def add(self, value):
+        if self.shift is None:
+            self.shift = value
+        delta = value - self.shift
+        self.linear.add(delta)
+        self.squares.add(delta * delta)
+    
+    def remove(self, value):
+        delta = value - self.shift
+        self.linear.remove(delta)
+        self.squares.remove(delta * delta)
+    
+    def result(self):
+        count = self.linear.count
+        population = self.kind.endswith('P')
+        divisor = count if population else count - 1
+        if divisor <= 0:
+            return None
+        linear = self.linear._sum()
+        variance = max(0.0, (self.squares._sum() - linear * linear / count) / divisor)
+        return math.sqrt(variance) if self.kind.startswith('STDEV') else variance
+
+class ExtremeState:
+    """MIN or MAX for windows that only grow (tumbling, hopping panes, sessions)."""
+    __slots__ = ('better', 'value')
+    
+    def __init__(self, is_min: bool):
+        self.better = (lambda a, b: a < b) if is_min else (lambda a, b: a > b)
+        self.value = None
+    
+    def add(self, value):
+        if self.value is None or self.better(value, self.value):
+            self.value = value
+    
+    def merge(self, other: 'ExtremeState'):
+        if other.value is not None:
+            self.add(other.value)
+    
+    def result(self):
+        return self.value
+
+class MonotonicExtremeState:
+    """MIN or MAX over a FIFO window using a monotonic deque.
+    
+    Values are removed in the order they were added, so each value is pushed
+    and popped at most once: amortized O(1) per event.
+    """
+    __slots__ = ('is_min', 'window', 'added', 'removed')
+    
+    def __init__(self, is_min: bool):
+        self.is_min = is_min
+        self.window = deque()
+        self.added = 0
+        self.removed = 0
+    
+    def add(self, value):
+        window = self.window
+        if self.is_min:
+            while window and window[-1][1] >= value:
+                window.pop()
+        else:
+            while window and window[-1][1] <= value:
+                window.pop()
+        window.append((self.added, value))
+        self.added += 1
+    
+    def remove(self, value):
+        if self.window and self.window[0][0] == self.removed:
+            self.window.popleft()
+        self.removed += 1
+    
+    def result(self):
+        return self.window[0][1] if self.window else None
+
+class DistinctCountState:
+    __slots__ = ('counts',)
+    
+    def __init__(self):
+        self.counts: Dict[Any, int] = {}
+    
+    def add(self, value):
+        self.counts[value] = self.counts.get(value, 0) + 1
+    
+    def remove(self, value):
+        remaining = self.counts[value] - 1
+        if remaining:
+            self.counts[value] = remaining
+        else:
+            del self.counts[value]
+    
+    def merge(self, other: 'DistinctCountState'):
+        for value, count in other.counts.items():
+            self.counts[value] = self.counts.get(value, 0) + count
+    
+    def result(self):
+        return len(self.counts)
+
+class CollectState:
+    __slots__ = ('values',)
+    
+    def __init__(self):
+        self.values = deque()
+    
+    def add(self, value):
+        self.values.append(value)
+    
+    def remove(self, value):
+        self.values.popleft()
+    
+    def merge(self, other: 'CollectState'):
+        self.values.extend(other.values)
+    
+    def result(self):
+        return list(self.values)
+
+class QuantileSketch:
+    """Mergeable quantile sketch with bounded memory.
+    
+    Values are kept exactly until there are more than exact_limit of them;
+    after that they go into log-spaced buckets (as in DDSketch), so every
+    estimate is within relative_accuracy of a true value and memory depends
+    on the value range, not the count. Two sketches merge by adding bucket
+    counts.
+    """
+    __slots__ = ('exact', 'exact_limit', 'gamma', 'log_gamma', 'positive', 'negative', 'zeros', 'count')
+    
+    def __init__(self, relative_accuracy: float = 0.005, exact_limit: int = 1024):
+        self.exact: Optional[List[float]] = []
+        self.exact_limit = exact_limit
+        self.gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self.log_gamma = math.log(self.gamma)
+        self.positive: Dict[int, int] = {}
+        self.negative: Dict[int, int] = {}
+        self.zeros = 0
+        self.count = 0
+    
+    def add(self, value):
+        self.count += 1
+        if self.exact is not None:
+            self.exact.append(value)
+            if len(self.exact) > self.exact_limit:
+                self._spill()
+            return
+        self._add_bucket(value, 1)
+    
+    def _spill(self):
+        values, self.exact = self.exact, None
+        for value in values:
+            self._add_bucket(value, 1)
+    
+    def _add_bucket(self, value, count: int):
+        if value > 0:
+            key = math.ceil(math.log(value) / self.log_gamma)
+            self.positive[key] = self.positive.get(key, 0) + count
+        elif value < 0:
+            key = math.ceil(math.log(-value) / self.log_gamma)
+            self.negative[key] = self.negative.get(key, 0) + count
+        else:
+            self.zeros += count
+    
+    def merge(self, other: 'QuantileSketch'):
+        self.count += other.count
+        if other.exact is not None:
+            if self.exact is not None:
+                self.exact.extend(other.exact)
+                if len(self.exact) > self.exact_limit:
+                    self._spill()
+            else:
+                for value in other.exact:
+                    self._add_bucket(value, 1)
+            return
+        if self.exact is not None:
+            self._spill()
+        for key, count in other.positive.items():
+            self.positive[key] = self.positive.get(key, 0) + count
+        for key, count in other.negative.items():
+            self.negative[key] = self.negative.get(key, 0) + count
+        self.zeros += other.zeros
+    
+    def _bucket_value(self, key: int) -> float:
+        # Midpoint of the bucket in relative terms
+        return 2 * self.gamma ** key / (self.gamma + 1)
+    
+    def _value_at_rank(self, rank: int) -> float:
+        """Approximate value of the rank-th smallest element (0-based)."""
+        seen = 0
+        for key in sorted(self.negative, reverse=True):
+            seen += self.negative[key]
+            if seen > rank:
+                return -self._bucket_value(key)
+        seen += self.zeros
+        if seen > rank:
+            return 0.0
+        for key in sorted(self.positive):
+            seen += self.positive[key]
+            if seen > rank:
+                return self._bucket_value(key)
+        return self._bucket_value(max(self.positive)) if self.positive else 0.0
+    
+    def quantile(self, fraction: float, discrete: bool = False) -> Optional[float]:
+        """PERCENTILE_CONT (interpolated) or PERCENTILE_DISC of the values seen."""
+        if self.count == 0:
+            return None
+        if self.exact is not None:
+            return _exact_percentile(sorted(self.exact), fraction, discrete)
+        if discrete:
+            return self._value_at_rank(max(0, math.ceil(fraction * self.count) - 1))
+        position = fraction * (self.count - 1)
+        lower = math.floor(position)
+        low_value = self._value_at_rank(lower)
+        if position == lower:
+            return low_value
+        return low_value + (position - lower) * (self._value_at_rank(lower + 1) - low_value)
+
+def _exact_percentile(values: List[float], fraction: float, discrete: bool) -> Optional[float]:
+    if not values:
+        return None
+    if discrete:
+        return values[max(0, math.ceil(fraction * len(values)) - 1)]
+    position = fraction * (len(values) - 1)
+    lower = math.floor(position)
+    if lower + 1 >= len(values):
+        return values[lower]
+    return values[lower] + (position - lower) * (values[lower + 1] - values[lower])
+
+class PercentileState:
+    __slots__ = ('fraction', 'discrete', 'sketch')
+    
+    def __init__(self, fraction: float, discrete: bool):
+        self.fraction = fraction
+        self.discrete = discrete
+        self.sketch = QuantileSketch()
+    
+    def add(self, value):
+        self.sketch.add(value)
+    
+    def merge(self, other: 'PercentileState'):
+        self.sketch.merge(other.sketch)
+    
+    def result(self):
+        return self.sketch.quantile(self.fraction, self.discrete)
+
+class SortedPercentileState:
+    """Exact percentile over a sliding window, kept as a sorted list."""
+    __slots__ = ('fraction', 'discrete', 'values')
+    
+    def __init__(self, fraction: float, discrete: bool):
+        self.fraction = fraction
+        self.discrete = discrete
+        self.values: List[float] = []
+    
+    def add(self, value):
+        bisect.insort(self.values, value)
+    
+    def remove(self, value):
+        del self.values[bisect.bisect_left(self.values, value)]
+    
+    def result(self):
+        return _exact_percentile(self.values, self.fraction, self.discrete)
+
+class AggregateSpec:
+    """One aggregate call in a windowed SELECT: which state to build and what to feed it."""
+    
+    def __init__(self, name: str, argument: Optional[Evaluator], distinct: bool = False,
+                 fraction: Optional[float] = None):
+        self.name = name
+        self.argument = argument
+        self.distinct = distinct
+        self.fraction = fraction
+    
+    def new_state(self, sliding: bool = False):
+        """A fresh state; sliding states also support remove()."""
+        name = self.name
+        if name == 'COUNT':
+            return DistinctCountState() if self.distinct else CountState()
+        if name == 'SUM':
+            return SumState()
+        if name == 'AVG':
+            return AvgState()
+        if name in ('STDEV', 'STDEVP', 'VAR', 'VARP'):
+            return SlidingVarianceState(name) if sliding else WelfordState(name)
+        if name in ('MIN', 'MAX'):
+            return MonotonicExtremeState(name == 'MIN') if sliding else ExtremeState(name == 'MIN')
+        if name == 'COLLECT':
+            return CollectState()
+        if name in ('PERCENTILE_CONT', 'PERCENTILE_DISC'):
+            discrete = name == 'PERCENTILE_DISC'
+            if sliding:
+                return SortedPercentileState(self.fraction, discrete)
+            return PercentileState(self.fraction, discrete)
+        raise SaqlError(f"Aggregate {name} is not supported")
+
+def build_aggregate_spec(call: Call, compile_expression: Callable) -> AggregateSpec:
+    """Turn an aggregate Call node into an AggregateSpec."""
+    name = call.name.upper()
+    if name in ('PERCENTILE_CONT', 'PERCENTILE_DISC'):
+        # PERCENTILE_CONT(f) OVER (ORDER BY x) or WITHIN GROUP (ORDER BY x)
+        if call.over is None or call.over.order_by is None:
+            raise SaqlError(f"{call.name} needs OVER (ORDER BY column)")
+        if len(call.args) != 1 or not isinstance(call.args[0], Literal):
+            raise SaqlError(f"{call.name} takes a constant fraction")
+        fraction = float(call.args[0].value)
+        if not 0 <= fraction <= 1:
+            raise SaqlError(f"{call.name} fraction must be between 0 and 1")
+        return AggregateSpec(name, compile_expression(call.over.order_by), fraction=fraction)
+    
+    if call.over is not None:
+        raise SaqlError(f"OVER is not supported on {call.name} in GROUP BY queries")
+    if name == 'COUNT' and (not call.args or type(call.args[0]).__name__ == 'Star'):
+        return AggregateSpec(name, lambda record, ts: 1)
+    if len(call.args) != 1:
+        raise SaqlError(f"{call.name} takes one argument")
+    return AggregateSpec(name, compile_expression(call.args[0]), distinct=call.distinct)
+
+# ---------------------------------------------------------------------------
+# Group state shared by all window kinds
+# ---------------------------------------------------------------------------
+
+class GroupState:
+    """Aggregate states for one group in one window (or pane).
+    
+    representative is the group's first event, used to evaluate the
+    non-aggregate SELECT columns, which must be GROUP BY keys.
+    """
+    __slots__ = ('representative', 'states')
+    
+    def __init__(self, representative: Dict[str, Any], specs: List[AggregateSpec], sliding: bool = False):
+        self.representative = representative
+        self.states = [spec.new_state(sliding) for spec in specs]
+    
+    def merge(self, other: 'GroupState'):
+        for state, other_state in zip(self.states, other.states):
+            state.merge(other_state)
+    
+    def results(self) -> List[Any]:
+        return [state.result() for state in self.states]
+
+def _add_event(group: GroupState, values: List[Any]):
+    for state, value in zip(group.states, values):
+        if value is not None:
+            state.add(value)
+
+def _remove_event(group: GroupState, values: List[Any]):
+    for state, value in zip(group.states, values):
+        if value is not None:
+            state.remove(value)
+
+# Builds the output row (or None if HAVING rejects it) from
+# (window end, group representative, aggregate results)
+Emitter = Callable[[datetime, Dict[str, Any], List[Any]], Optional[Dict[str, Any]]]
+
+class WindowOperator(ABC):
+    """Base class: evaluates group keys and aggregate inputs, tracks event time.
+    
+    Inputs are expected in event-time order. An event older than the latest
+    time seen is treated as arriving at that time (SAQL's "adjust" policy
+    with no out-of-order tolerance), so no window ever has to reopen.
+    Watermarks, (time, None) pairs from the event ordering stage, advance
+    time without adding an event so windows close without waiting for one.
+    """
+    
+    def __init__(self, keys: List[Evaluator], specs: List[AggregateSpec], emit: Emitter):
+        self.keys = keys
+        self.specs = specs
+        self.emit = emit
+        self.watermark: Optional[int] = None
+        self.adjusted_events = 0
+    
+    def _key(self, record: Dict[str, Any], ts: datetime) -> Tuple:
+        return tuple(key(record, ts) for key in self.keys)
+    
+    def _values(self, record: Dict[str, Any], ts: datetime) -> List[Any]:
+        return [spec.argument(record, ts) for spec in self.specs]
+    
+    def _event_micros(self, ts: datetime, record: Optional[Dict[str, Any]] = None) -> int:
+        micros = to_micros(ts)
+        if self.watermark is not None and micros < self.watermark:
+            if record is not None:
+                self.adjusted_events += 1
+            return self.watermark
+        self.watermark = micros
+        return micros
+    
+    def _output(self, end_micros: int, group: GroupState) -> Optional[Event]:
+        end = from_micros(end_micros)
+        row = self.emit(end, group.representative, group.results())
+        return None if row is None else (end, row)
+    
+    @abstractmethod
+    def run(self, events: Iterable[Event]) -> Iterator[Event]:
+        """Consume (time, record) events and watermarks; yield (window end, row) results."""
+
+def _window_end(micros: int, size: int, offset: int) -> int:
+    """End of the (start, end] window of length size containing micros."""
+    return -((offset - micros) // size) * size + offset
+
+class TumblingWindowOperator(WindowOperator):
+    """Fixed, non-overlapping (start, end] windows; one result per group per window."""
+    
+    def __init__(self, keys, specs, emit, size: int, offset: int = 0):
+        super().__init__(keys, specs, emit)
+        self.size = size
+        self.offset = offset
+    
+    def run(self, events: Iterable[Event]) -> Iterator[Event]:
+        windows: Dict[int, Dict[Tuple, GroupState]] = {}
+        for ts, record in events:
+            micros = self._event_micros(ts, record)
+            
+            # Close every window that ended before this event (or watermark)
+            for closed in sorted(e for e in windows if e < micros):
+                for group in windows.pop(closed).values():
+                    output = self._output(closed, group)
+                    if output is not None:
+                        yield output
+            if record is None:
+                continue
+            
+            end = _window_end(micros, self.size, self.offset)
+            groups = windows.get(end)
+            if groups is None:
+                groups = windows[end] = {}
+            key = self._key(record, ts)
+            group = groups.get(key)
+            if group is None:
+                group = groups[key] = GroupState(record, self.specs)
+            _add_event(group, self._values(record, ts))
+        
+        for closed in sorted(windows):
+            for group in windows[closed].values():
+                output = self._output(closed, group)
+                if output is not None:
+                    yield output
+
+class HoppingWindowOperator(WindowOperator):
+    """Overlapping windows of length size every hop, built from shared panes.
+    
+    Events are folded into panes of gcd(size, hop); a window's result is
+    the merge of the size/pane panes it covers. Panes older than any open
+    window are dropped, so memory is bounded by size/pane panes per group.
+    """
+    
+    def __init__(self, keys, specs, emit, size: int, hop: int, offset: int = 0):
+        super().__init__(keys, specs, emit)
+        if hop > size:
+            raise SaqlError("HoppingWindow hop size must not exceed the window size")
+        self.size = size
+        self.hop = hop
+        self.offset = offset
+        self.pane = math.gcd(size, hop)
+    
+    def run(self, events: Iterable[Event]) -> Iterator[Event]:
+        panes: Dict[int, Dict[Tuple, GroupState]] = {}
+        next_window_end = None
+        
+        for ts, record in events:
+            micros = self._event_micros(ts, record)
+            if next_window_end is None:
+                if record is None:
+                    continue
+                next_window_end = _window_end(micros, self.hop, self.offset)
+            
+            while next_window_end < micros:
+                yield from self._emit_window(panes, next_window_end)
+                next_window_end += self.hop
+                self._evict(panes, next_window_end)
+                if not panes:
+                    # Nothing buffered: skip ahead instead of emitting empty windows
+                    next_window_end = _window_end(micros, self.hop, self.offset)
+            if record is None:
+                continue
+            
+            pane_end = _window_end(micros, self.pane, self.offset)
+            groups = panes.get(pane_end)
+            if groups is None:
+                groups = panes[pane_end] = {}
+            key = self._key(record, ts)
+            group = groups.get(key)
+            if group is None:
+                group = groups[key] = GroupState(record, self.specs)
+            _add_event(group, self._values(record, ts))
+        
+        # Flush every window that still covers buffered panes
+        while panes:
+            yield from self._emit_window(panes, next_window_end)
+            next_window_end += self.hop
+            self._evict(panes, next_window_end)
+    
+    def _evict(self, panes: Dict[int, Dict[Tuple, GroupState]], next_window_end: int):
+        for pane_end in [end for end in panes if end <= next_window_end - self.size]:
+            del panes[pane_end]
+    
+    def _emit_window(self, panes: Dict[int, Dict[Tuple, GroupState]], window_end: int) -> Iterator[Event]:
+        window_start = window_end - self.size
+        merged: Dict[Tuple, GroupState] = {}
+        for pane_end in sorted(panes):
+            if window_start < pane_end <= window_end:
+                for key, pane_group in panes[pane_end].items():
+                    group = merged.get(key)
+                    if group is None:
+                        group = merged[key] = GroupState(pane_group.representative, self.specs)
+                    group.merge(pane_group)
+        for group in merged.values():
+            output = self._output(window_end, group)
+            if output is not None:
+                yield output
+
+class SlidingWindowOperator(WindowOperator):
+    """(t - size, t] windows that produce output whenever their content changes.
+    
+    A group produces output at each point in time when one of its events
+    enters or leaves the window (if events remain), once per point in time
+    even when several events share a timestamp. Aggregates are updated
+    incrementally with remove(); MIN and MAX use monotonic deques.
+    """
+    
+    def __init__(self, keys, specs, emit, size: int):
+        super().__init__(keys, specs, emit)
+        self.size = size
+    
+    def run(self, events: Iterable[Event]) -> Iterator[Event]:
+        groups: Dict[Tuple, Tuple[GroupState, deque]] = {}
+        expiries: List[Tuple[int, int, Tuple]] = []
+        # Groups changed at the current time, emitted once time moves on
+        pending: Dict[Tuple, None] = {}
+        current = None
+        sequence = 0
+        
+        for ts, record in events:
+            micros = self._event_micros(ts, record)
+            if micros != current:
+                yield from self._flush(groups, pending, current)
+                current = micros
+                yield from self._expire(groups, expiries, micros, pending)
+            if record is None:
+                continue
+            
+            key = self._key(record, ts)
+            entry = groups.get(key)
+            if entry is None:
+                entry = groups[key] = (GroupState(record, self.specs, sliding=True), deque())
+            group, buffered = entry
+            values = self._values(record, ts)
+            _add_event(group, values)
+            buffered.append(values)
+            heapq.heappush(expiries, (micros + self.size, sequence, key))
+            sequence += 1
+            pending[key] = None
+        
+        yield from self._flush(groups, pending, current)
+        yield from self._expire(groups, expiries, None, pending)
+    
+    def _flush(self, groups, pending: Dict[Tuple, None], micros: Optional[int]) -> Iterator[Event]:
+        for key in pending:
+            entry = groups.get(key)
+            if entry is not None:
+                output = self._output(micros, entry[0])
+                if output is not None:
+                    yield output
+        pending.clear()
+    
+    def _expire(self, groups, expiries, now: Optional[int], pending: Dict[Tuple, None]) -> Iterator[Event]:
+        """Remove events whose window exit time is at or before now (all, if now is None).
+        
+        Exits before now are emitted right away; exits exactly at now join
+        the pending changes for now.
+        """
+        while expiries and (now is None or expiries[0][0] <= now):
+            exit_time = expiries[0][0]
+            changed = []
+            while expiries and expiries[0][0] == exit_time:
+                _, _, key = heapq.heappop(expiries)
+                group, buffered = groups[key]
+                _remove_event(group, buffered.popleft())
+                if not buffered:
+                    del groups[key]
+                elif key not in changed:
+                    changed.append(key)
+            
+            if exit_time == now:
+                pending.update(dict.fromkeys(changed))
+                continue
+            for key in changed:
+                entry = groups.get(key)
+                if entry is not None:
+                    output = self._output(exit_time, entry[0])
+                    if output is not None:
+                        yield output
+
+class SessionWindowOperator(WindowOperator):
+    """Per-group sessions that close after timeout without events or at max_duration.
+    
+    A session's result is emitted at its end: timeout after its last event,
+    or the maximum duration boundary if that comes first. Like Stream
+    Analytics, the maximum duration is checked at multiples of max_duration
+    since time zero, so the boundary is the first one at or after the start.
+    """
+    
+    def __init__(self, keys, specs, emit, timeout: int, max_duration: int):
+        super().__init__(keys, specs, emit)
+        if max_duration < timeout:
+            raise SaqlError("SessionWindow maximum duration must not be less than the timeout")
+        self.timeout = timeout
+        self.max_duration = max_duration
+    
+    def _session_end(self, start: int, last: int) -> int:
+        return min(last + self.timeout, _window_end(start, self.max_duration, 0))
+    
+    def run(self, events: Iterable[Event]) -> Iterator[Event]:
+        # key -> [start, last event time, GroupState]
+        sessions: Dict[Tuple, list] = {}
+        deadlines: List[Tuple[int, int, Tuple]] = []
+        sequence = 0
+        
+        for ts, record in events:
+            micros = self._event_micros(ts, record)
+            
+            # Close sessions that ended before this event (or watermark)
+            while deadlines and deadlines[0][0] < micros:
+                end, _, key = heapq.heappop(deadlines)
+                session = sessions.get(key)
+                # Entries are lazily invalidated when a session is extended
+                if session is not None and self._session_end(session[0], session[1]) == end:
+                    del sessions[key]
+                    output = self._output(end, session[2])
+                    if output is not None:
+                        yield output
+            if record is None:
+                continue
+            
+            key = self._key(record, ts)
+            session = sessions.get(key)
+            if session is None:
+                session = sessions[key] = [micros, micros, GroupState(record, self.specs)]
+            else:
+                session[1] = micros
+            _add_event(session[2], self._values(record, ts))
+            heapq.heappush(deadlines, (self._session_end(session[0], session[1]), sequence, key))
+            sequence += 1
+        
+        for key, (start, last, group) in sorted(sessions.items(), key=lambda item: self._session_end(item[1][0], item[1][1])):
+            output = self._output(self._session_end(start, last), group)
+            if output is not None:
+                yield output
+
+# ---------------------------------------------------------------------------
+# Construction from GROUP BY
+# ---------------------------------------------------------------------------
+
+WINDOW_FUNCTIONS = ('TUMBLINGWINDOW', 'HOPPINGWINDOW', 'SLIDINGWINDOW', 'SESSIONWINDOW')
+
+def _window_micros(unit: str, amount) -> int:
+    if not isinstance(amount, Literal) or not isinstance(amount.value, (int, float)):
+        raise SaqlError("Window sizes must be numeric constants")
+    micros = round(time_unit_seconds(unit) * amount.value * 1e6)
+    if micros <= 0:
+        raise SaqlError("Window sizes must be positive")
+    return micros
+
+def build_window_operator(window: Call, keys: List[Evaluator], specs: List[AggregateSpec],
+                          emit: Emitter) -> WindowOperator:
+    """Create the operator for a TumblingWindow/HoppingWindow/SlidingWindow/SessionWindow call."""
+    name = window.name.upper()
+    args = window.args
+    if not args or not isinstance(args[0], Literal) or not isinstance(args[0].value, str):
+        raise SaqlError(f"{window.name} needs a time unit as its first argument")
+    unit = args[0].value
+    sizes = [_window_micros(unit, arg) for arg in args[1:]]
+    
+    if name == 'TUMBLINGWINDOW' and len(sizes) in (1, 2):
+        return TumblingWindowOperator(keys, specs, emit, sizes[0], sizes[1] if len(sizes) > 1 else 0)
+    if name == 'HOPPINGWINDOW' and len(sizes) in (2, 3):
+        return HoppingWindowOperator(keys, specs, emit, sizes[0], sizes[1], sizes[2] if len(sizes) > 2 else 0)
+    if name == 'SLIDINGWINDOW' and len(sizes) == 1:
+        return SlidingWindowOperator(keys, specs, emit, sizes[0])
+    if name == 'SESSIONWINDOW' and len(sizes) == 2:
+        return SessionWindowOperator(keys, specs, emit, sizes[0], sizes[1])
+    raise SaqlError(f"Wrong number of arguments to {window.name}")
@@ -0,0 +1,427 @@
+#!/usr/bin/env python3
+"""
+Disk-Backed Offline Spool
+Keeps events on local disk while the hub is unreachable, and re-sends them
+in large batches once it is back, so an edge gateway rides out long
+outages without losing data or growing its memory.
+
+The spool is an append-only write-ahead log split into segment files.
+Each record is framed as length, CRC-32, kind and body. Appends go through
+a buffered file and are fsynced as a group, at most every fsync_interval
+seconds, so a power cut loses at most that much. Reads map segments with
+mmap. A small cursor file records how far the log has been drained. Fully
+drained segments are deleted. When the disk budget is exceeded, the oldest
+segments are evicted whole, undrained or not, and the evicted events are
+counted.
+
+Recovery on open truncates a torn record at the end of the newest segment,
+and resumes from the cursor. Delivery is at least once: events drained
+after the last cursor write are sent again after a crash.
+"""
+
+import json
+import logging
+import mmap
+import os
+import struct
+import threading
+import time
+import zlib
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Record kinds: one JSON event, or a multi-record body from a packer
+# (serializers.RecordPacker, compressed by payload_compression.py or not)
+KIND_JSON = 0
+KIND_PACKED = 1
+
+# length, CRC-32 of the body, kind
+_HEADER = struct.Struct('<IIB')
+
+_SEGMENT_SUFFIX = '.seg'
+_CURSOR_FILE = 'cursor.json'
+
+class SegmentSpool:
+    """Append-only segmented log of event bodies with a durable read cursor."""
+    
+    def __init__(self, directory: str, max_bytes: int = 1 << 30, segment_bytes: int = 64 << 20,
+                 fsync_interval: float = 1.0):
+        if segment_bytes > max_bytes:
+            raise ValueError("segment size must not exceed the disk budget")
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.segment_bytes = segment_bytes
+        self.fsync_interval = fsync_interval
+        self.evicted = 0
+        self._maps: Dict[int, Tuple[mmap.mmap, int]] = {}
+        os.makedirs(directory, exist_ok=True)
+        
+        # Segment id -> [size in bytes, record count], oldest first
+        self._segments: Dict[int, List[int]] = {}
+        for name in sorted(os.listdir(directory)):
+            if name.endswith(_SEGMENT_SUFFIX) and name[:-len(_SEGMENT_SUFFIX)].isdigit():
+                self._segments[int(name[:-len(_SEGMENT_SUFFIX)])] = [0, 0]
+        newest = max(self._segments) if self._segments else None
+        for segment_id in self._segments:
+            self._segments[segment_id] = self._recover(segment_id, truncate=segment_id == newest)
+        
+        self._cursor = self._load_cursor()
+        self._pending = 0  # records behind the cursor, counted from the segments
+        self._count_pending()
+        
+        if newest is None:
+            newest = self._cursor[0]
+            self._segments[newest] = [0, 0]
+        self._active = newest
+        self._writer = open(self._path(newest), 'ab', buffering=1 << 20)
+        self._dirty = False
+        self._last_sync = time.monotonic()
+    
+    def _path(self, segment_id: int) -> str:
+        return os.path.join(self.directory, f"{segment_id:010d}{_SEGMENT_SUFFIX}")
+    
+    def _recover(self, segment_id: int, truncate: bool) -> List[int]:
+        """Scan a segment; returns [valid bytes, records]. A torn tail is cut off the newest one."""
+        path = self._path(segment_id)
+        size = os.path.getsize(path)
+        offset = records = 0
+        if size:
+            with open(path, 'rb') as handle, mmap.mmap(handle.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                for offset_after, _, _ in _iter_frames(mapped, 0, size):
+                    offset = offset_after
+                    records += 1
+        if offset < size:
+            logger.warning(f"Spool segment {path}: {size - offset} bytes of incomplete records "
+                           f"{'truncated' if truncate else 'ignored'}")
+            if truncate:
+                with open(path, 'r+b') as handle:
+                    handle.truncate(offset)
+        return [offset, records]
+    
+    def _load_cursor(self) -> Tuple[int, int]:
+        try:
+            with open(os.path.join(self.directory, _CURSOR_FILE), 'r', encoding='utf-8') as handle:
+                cursor = json.load(handle)
+            position = (int(cursor["segment"]), int(cursor["offset"]))
+        except FileNotFoundError:
+            position = None
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            logger.warning(f"Spool cursor unreadable, draining from the oldest segment: {e}")
+            position = None
+        oldest = min(self._segments) if self._segments else 0
+        if position is None or position[0] < oldest:
+            return oldest, 0
+        return position
+    
+    def _save_cursor(self):
+        path = os.path.join(self.directory, _CURSOR_FILE)
+        temporary = path + '.tmp'
+        with open(temporary, 'w', encoding='utf-8') as handle:
+            json.dump({"segment": self._cursor[0], "offset": self._cursor[1]}, handle)
+        os.replace(temporary, path)
+    
+    def _count_pending(self):
+        segment_id, offset = self._cursor
+        pending = 0
+        for other, (size, records) in self._segments.items():
+            if other > segment_id:
+                pending += records
+            elif other == segment_id and offset < size:
+                mapped, _ = self._map_segment(other, size, cache=False)
+                pending += sum(1 for _ in _iter_frames(mapped, offset, size))
+                mapped.close()
+        self._pending = pending
+    
+    def _map_segment(self, segment_id: int, size: int, cache: bool = True) -> Tuple[mmap.mmap, int]:
+        cached = self._maps.get(segment_id) if cache else None
+        if cached is not None and cached[1] >= size:
+            return cached
+        if cached is not None:
+            cached[0].close()
+        with open(self._path(segment_id), 'rb') as handle:
+            mapped = mmap.mmap(handle.fileno(), size, access=mmap.ACCESS_READ)
+        if cache:
+            self._maps[segment_id] = (mapped, size)
+        return mapped, size
+    
+    def _drop_segment(self, segment_id: int):
+        cached = self._maps.pop(segment_id, None)
+        if cached is not None:
+            cached[0].close()
+        del self._segments[segment_id]
+        try:
+            os.remove(self._path(segment_id))
+        except FileNotFoundError:
+            pass
+    
+    @property
+    def pending(self) -> int:
+        """Records not yet drained."""
+        return self._pending
+    
+    @property
+    def size_bytes(self) -> int:
+        return sum(size for size, _ in self._segments.values())
+    
+    def append(self, bodies: Iterable[bytes], kind: int = KIND_JSON) -> int:
+        """Append bodies; returns how many were written."""
+        written = 0
+        for body in bodies:
+            frame = _HEADER.pack(len(body), zlib.crc32(body), kind) + body
+            if len(frame) > self.segment_bytes:
+                logger.error(f"✗ Record of {len(body)} bytes is larger than a spool segment, dropped")
+                continue
+            if self._segments[self._active][0] + len(frame) > self.segment_bytes:
+                self._roll()
+            self._make_room(len(frame))
+            active = self._segments[self._active]
+            self._writer.write(frame)
+            active[0] += len(frame)
+            active[1] += 1
+            self._pending += 1
+            written += 1
+        self._dirty = self._dirty or written > 0
+        self.sync_if_due()
+        return written
+    
+    def sync_if_due(self):
+        """Group-commit pending appends once fsync_interval has passed since the last sync."""
+        if self._dirty and time.monotonic() - self._last_sync >= self.fsync_interval:
+            self.sync()
+    
+    def sync(self):
+        """Flush and fsync everything appended so far (the group commit)."""
+        if self._dirty:
+            self._writer.flush()
+            os.fsync(self._writer.fileno())
+            self._dirty = False
+        self._last_sync = time.monotonic()
+    
+    def _roll(self):
+        self.sync()
+        self._writer.close()
+        self._active += 1
+        self._segments[self._active] = [0, 0]
+        self._writer = open(self._path(self._active), 'ab', buffering=1 << 20)
+    
+    def _make_room(self, frame_bytes: int):
+        """Evict the oldest closed segments until frame_bytes fits in the budget."""
+        while self.size_bytes + frame_bytes > self.max_bytes:
+            oldest = min(self._segments)
+            if oldest == self._active:
+                # Only the active segment is left; start a fresh one so it can go
+                self._roll()
+            size, records = self._segments[oldest]
+            segment_id, offset = self._cursor
+            if oldest > segment_id:
+                lost = records
+            elif oldest == segment_id:
+                mapped, _ = self._map_segment(oldest, size)
+                lost = sum(1 for _ in _iter_frames(mapped, offset, size))
+            else:
+                lost = 0
+            self._drop_segment(oldest)
+            if oldest >= segment_id:
+                self._cursor = (min(self._segments), 0)
+                self._save_cursor()
+            self._pending -= lost
+            self.evicted += lost
+            if lost:
+                logger.warning(f"✗ Spool over its {self.max_bytes} byte budget: evicted {lost} oldest events")
+    
+    def read_batch(self, max_records: int = 5000,
+                   max_bytes: int = 4 << 20) -> Tuple[List[Tuple[int, bytes]], List[Tuple[int, int]]]:
+        """Up to max_records (kind, body) records from the cursor, with the position after each.
+        
+        Nothing moves until commit() is called with one of the positions.
+        """
+        if self._dirty:
+            # Make buffered appends visible to the mapping (no fsync needed)
+            self._writer.flush()
+        records: List[Tuple[int, bytes]] = []
+        positions: List[Tuple[int, int]] = []
+        segment_id, offset = self._cursor
+        total = 0
+        while len(records) < max_records and total < max_bytes and segment_id in self._segments:
+            size = self._segments[segment_id][0]
+            if offset < size:
+                mapped, _ = self._map_segment(segment_id, size)
+                for offset, kind, body in _iter_frames(mapped, offset, size):
+                    records.append((kind, body))
+                    positions.append((segment_id, offset))
+                    total += len(body)
+                    if len(records) >= max_records or total >= max_bytes:
+                        break
+            if offset >= size and segment_id != self._active:
+                segment_id, offset = segment_id + 1, 0
+            else:
+                break
+        return records, positions
+    
+    def commit(self, position: Tuple[int, int], records: int):
+        """Mark everything before position (records records) as drained."""
+        if position < self._cursor or position[0] not in self._segments:
+            # Evicted while it was being sent; eviction already moved the cursor
+            return
+        self._cursor = position
+        self._pending -= records
+        for segment_id in [other for other in self._segments if other < position[0]]:
+            self._drop_segment(segment_id)
+        if position[1] >= self._segments[position[0]][0]:
+            # The cursor's own segment is fully drained too; if it is the
+            # one being written, start a fresh one so the disk is reclaimed
+            if position[0] == self._active:
+                self._roll()
+            self._drop_segment(position[0])
+            self._cursor = (min(self._segments), 0)
+        self._save_cursor()
+    
+    def close(self):
+        self.sync()
+        self._writer.close()
+        for mapped, _ in self._maps.values():
+            mapped.close()
+        self._maps.clear()
+
+def _iter_frames(mapped: mmap.mmap, offset: int, size: int):
+    """Yield (offset after, kind, body) for each complete, intact frame from offset."""
+    header_size = _HEADER.size
+    while offset + header_size <= size:
+        length, checksum, kind = _HEADER.unpack_from(mapped, offset)
+        end = offset + header_size + length
+        if end > size:
+            return
+        body = mapped[offset + header_size:end]
+        if zlib.crc32(body) != checksum:
+            return
+        offset = end
+        yield offset, kind, body
+
+class OfflineSpool:
+    """Routes sends through a SegmentSpool while the link is down, and drains it in the background.
+    
+    While the spool holds anything, callers append new events behind it so
+    they stay in order, and only the drain thread talks to the hub. After a
+    failed drain the next attempt waits retry_interval seconds. Once a
+    batch is accepted, the backlog is sent in drain_records batches as fast
+    as the hub takes them. The drain thread also wakes at least every
+    fsync_interval to group-commit appends that no later append will sync.
+    """
+    
+    def __init__(self, spool: SegmentSpool, send: Callable[[List[Tuple[int, bytes]]], int],
+                 retry_interval: float = 5.0, drain_records: int = 5000):
+        self.spool = spool
+        self.send = send
+        self.retry_interval = retry_interval
+        self.drain_records = drain_records
+        self.link_up = True
+        self.spooled = 0
+        self.drained = 0
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._closing = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="spool-drain", daemon=True)
+        if spool.pending:
+            logger.info(f"Spool {spool.directory} holds {spool.pending} events from an earlier run")
+        self._thread.start()
+    
+    @property
+    def active(self) -> bool:
+        """True while new events must go to the spool rather than the hub."""
+        return not self.link_up or self.spool.pending > 0
+    
+    def store(self, bodies: Iterable[bytes], kind: int = KIND_JSON) -> int:
+        """Append bodies that could not be sent, or that must queue behind the backlog."""
+        with self._lock:
+            written = self.spool.append(bodies, kind)
+        self.spooled += written
+        self._wake.set()
+        return written
+    
+    def link_failed(self):
+        """Stop sending directly; the drain thread probes the hub every retry_interval."""
+        if self.link_up:
+            logger.warning(f"✗ Hub unreachable; spooling events to {self.spool.directory}")
+        self.link_up = False
+    
+    def _run(self):
+        tick = max(self.spool.fsync_interval, 0.01)
+        retry_at = None
+        while not self._closing.is_set():
+            with self._lock:
+                self.spool.sync_if_due()
+            if not self.link_up:
+                now = time.monotonic()
+                if retry_at is None:
+                    retry_at = now + self.retry_interval
+                if now < retry_at:
+                    self._closing.wait(min(retry_at - now, tick))
+                    continue
+            elif not self.spool.pending:
+                self._wake.wait(tick)
+                self._wake.clear()
+                continue
+            retry_at = None
+            self._drain()
+    
+    def _drain(self):
+        """Send the backlog until it is empty or a batch is refused."""
+        while self.spool.pending and not self._closing.is_set():
+            with self._lock:
+                self.spool.sync_if_due()
+                records, positions = self.spool.read_batch(self.drain_records)
+            if not records:
+                return
+            try:
+                accepted = self.send(records)
+            except Exception as e:
+                logger.debug(f"Spool drain failed: {e}")
+                accepted = 0
+            if accepted:
+                with self._lock:
+                    self.spool.commit(positions[accepted - 1], accepted)
+                self.drained += accepted
+                if not self.link_up:
+                    logger.info(f"✓ Hub reachable again; draining {self.spool.pending} spooled events")
+                    self.link_up = True
+            if accepted < len(records):
+                self.link_failed()
+                return
+    
+    def close(self, drain_timeout: float = 10.0):
+        """Give the drain up to drain_timeout seconds, then make whatever is left durable."""
+        deadline = time.monotonic() + drain_timeout
+        while self.spool.pending and self.link_up and time.monotonic() < deadline:
+            time.sleep(0.05)
+        self._closing.set()
+        self._wake.set()
+        self._thread.join(timeout=60)
+        with self._lock:
+            self.spool.close()
+    
+    def summary(self) -> str:
+        return (f"{self.spooled} events spooled, {self.drained} drained, {self.spool.pending} left on disk "
+                f"({self.spool.size_bytes / 1024:.1f} KiB), {self.spool.evicted} evicted over budget")
+
+def add_spool_arguments(parser):
+    """Add the --spool-dir options shared by both generators."""
+    group = parser.add_argument_group("offline spool")
+    group.add_argument("--spool-dir", default=None,
+                       help="Keep events that cannot be sent in a disk spool here and re-send them later")
+    group.add_argument("--spool-max-mb", type=float, default=1024,
+                       help="Disk budget; the oldest events are evicted beyond it (default: 1024)")
+    group.add_argument("--spool-segment-mb", type=float, default=64,
+                       help="Spool segment file size (default: 64)")
+    group.add_argument("--spool-fsync-interval", type=float, default=1.0, metavar="SECONDS",
+                       help="Group-commit interval; a power cut loses at most this much (default: 1.0)")
+    group.add_argument("--spool-retry-interval", type=float, default=5.0, metavar="SECONDS",
+                       help="Wait between reconnect attempts while the hub is down (default: 5.0)")
+
+def spool_from_args(args) -> Optional[SegmentSpool]:
+    """Open the spool selected on the command line, or None."""
+    if not args.spool_dir:
+        return None
+    return SegmentSpool(args.spool_dir, max_bytes=int(args.spool_max_mb * (1 << 20)),
+                        segment_bytes=int(args.spool_segment_mb * (1 << 20)),
+                        fsync_interval=args.spool_fsync_interval)
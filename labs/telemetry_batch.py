@@ -0,0 +1,172 @@
+#!/usr/bin/env python3
+"""
+Vectorized Telemetry Generation
+Generates N telemetry records at once as NumPy columns and only turns them
+into per-event payloads at the serialization step.
+"""
+
+from datetime import datetime, timezone
+from typing import Any, Dict, Iterator, List, Optional
+
+import numpy as np
+
+# Categorical values, built once and indexed by small integer codes
+SENSOR_TYPES = np.array(["DHT22", "BME280", "SHT30", "AM2302", "DS18B20"])
+FIRMWARE_VERSIONS = np.array(["v1.2.3", "v1.3.0", "v1.2.5", "v1.4.1", "v1.1.9"])
+
+DEFAULT_LOCATION = (47.6062, -122.3321)
+
+# Same layout json.dumps() produces for a record dict; every string value is
+# generated by this module and needs no escaping
+_JSON_TEMPLATE = (
+    '{"deviceId": "%s", "timestamp": "%s", "temperature": %r, "humidity": %r, '
+    '"pressure": %r, "location": {"lat": %r, "lon": %r}'
+)
+_JSON_METADATA_TEMPLATE = ', "metadata": {"sensorType": "%s", "firmware": "%s"}}'
+
+def _format_unique(values: np.ndarray, formatter) -> np.ndarray:
+    """Format only the distinct values, then scatter them back by index."""
+    uniques, inverse = np.unique(values, return_inverse=True)
+    formatted = np.array([formatter(value) for value in uniques.tolist()], dtype=object)
+    return formatted[inverse]
+
+class TelemetryBatch:
+    """A batch of telemetry records stored column by column."""
+    
+    def __init__(self, device_numbers: np.ndarray, timestamps: np.ndarray,
+                 temperature: np.ndarray, humidity: np.ndarray, pressure: np.ndarray,
+                 lat: np.ndarray, lon: np.ndarray,
+                 sensor_codes: np.ndarray, firmware_codes: np.ndarray,
+                 include_metadata: bool = True):
+        self.device_numbers = device_numbers
+        self.timestamps = timestamps
+        self.temperature = temperature
+        self.humidity = humidity
+        self.pressure = pressure
+        self.lat = lat
+        self.lon = lon
+        self.sensor_codes = sensor_codes
+        self.firmware_codes = firmware_codes
+        self.include_metadata = include_metadata
+    
+    def __len__(self) -> int:
+        return len(self.device_numbers)
+    
+    def device_ids(self) -> np.ndarray:
+        """Format device numbers as device-NNN strings."""
+        return _format_unique(self.device_numbers, lambda number: f"device-{number:03d}")
+    
+    def timestamp_strings(self) -> np.ndarray:
+        """Format timestamps as ISO 8601 UTC strings with millisecond precision."""
+        uniques, inverse = np.unique(self.timestamps, return_inverse=True)
+        formatted = np.char.add(np.datetime_as_string(uniques, unit='ms'), 'Z').astype(object)
+        return formatted[inverse]
+    
+    def iter_records(self) -> Iterator[Dict[str, Any]]:
+        """Yield one dict per record, in the same shape as generate_telemetry_data()."""
+        # tolist() converts each column to Python objects once, which is much
+        # cheaper than indexing NumPy scalars record by record
+        columns = zip(
+            self.device_ids().tolist(),
+            self.timestamp_strings().tolist(),
+            self.temperature.tolist(),
+            self.humidity.tolist(),
+            self.pressure.tolist(),
+            self.lat.tolist(),
+            self.lon.tolist(),
+            SENSOR_TYPES[self.sensor_codes].tolist(),
+            FIRMWARE_VERSIONS[self.firmware_codes].tolist(),
+        )
+        for device_id, timestamp, temperature, humidity, pressure, lat, lon, sensor, firmware in columns:
+            record = {
+                "deviceId": device_id,
+                "timestamp": timestamp,
+                "temperature": temperature,
+                "humidity": humidity,
+                "pressure": pressure,
+                "location": {
+                    "lat": lat,
+                    "lon": lon
+                }
+            }
+            if self.include_metadata:
+                record["metadata"] = {
+                    "sensorType": sensor,
+                    "firmware": firmware
+                }
+            yield record
+    
+    def take(self, indices: np.ndarray) -> 'TelemetryBatch':
+        """The records at indices, as a new batch."""
+        return TelemetryBatch(
+            self.device_numbers[indices], self.timestamps[indices],
+            self.temperature[indices], self.humidity[indices], self.pressure[indices],
+            self.lat[indices], self.lon[indices],
+            self.sensor_codes[indices], self.firmware_codes[indices],
+            include_metadata=self.include_metadata
+        )
+    
+    def to_records(self) -> List[Dict[str, Any]]:
+        """Materialize every record as a dict."""
+        return list(self.iter_records())
+    
+    def iter_json(self) -> Iterator[str]:
+        """Yield one JSON payload per record without building intermediate dicts.
+        
+        The output is identical to json.dumps() of the matching iter_records() dict.
+        """
+        columns = zip(
+            self.device_ids().tolist(),
+            self.timestamp_strings().tolist(),
+            self.temperature.tolist(),
+            self.humidity.tolist(),
+            self.pressure.tolist(),
+            self.lat.tolist(),
+            self.lon.tolist(),
+        )
+        if self.include_metadata:
+            template = _JSON_TEMPLATE + _JSON_METADATA_TEMPLATE
+            sensors = SENSOR_TYPES[self.sensor_codes].tolist()
+            firmwares = FIRMWARE_VERSIONS[self.firmware_codes].tolist()
+            for values, sensor, firmware in zip(columns, sensors, firmwares):
+                yield template % (values + (sensor, firmware))
+        else:
+            template = _JSON_TEMPLATE + '}'
+            for values in columns:
+                yield template % values
+
+def generate_telemetry_batch(count: int, rng: Optional[np.random.Generator] = None,
+                             device_count: int = 100,
+                             first_device: int = 1,
+                             start_time: Optional[datetime] = None,
+                             spacing_ms: int = 0,
+                             decimals: int = 1,
+                             include_metadata: bool = True) -> TelemetryBatch:
+    """Generate count random telemetry records as columns.
+    
+    Values follow the same distributions as generate_telemetry_data();
+    device numbers are drawn from first_device..device_count and decimals
+    sets the rounding of temperature and humidity. All records
+    share start_time (default: now) unless spacing_ms spreads them out,
+    which is useful for producing a replayable event-time sequence.
+    """
+    rng = rng if rng is not None else np.random.default_rng()
+    start_time = start_time or datetime.now(timezone.utc)
+    if start_time.tzinfo is not None:
+        start_time = start_time.astimezone(timezone.utc).replace(tzinfo=None)
+    
+    start = np.datetime64(start_time, 'ms')
+    timestamps = start + np.arange(count, dtype=np.int64) * np.timedelta64(spacing_ms, 'ms')
+    
+    return TelemetryBatch(
+        device_numbers=rng.integers(first_device, device_count + 1, size=count),
+        timestamps=timestamps,
+        temperature=np.round(rng.uniform(20, 40, size=count), decimals),
+        humidity=np.round(rng.uniform(30, 80, size=count), decimals),
+        pressure=np.round(rng.uniform(1000, 1100, size=count), 2),
+        lat=np.full(count, DEFAULT_LOCATION[0]),
+        lon=np.full(count, DEFAULT_LOCATION[1]),
+        sensor_codes=rng.integers(0, len(SENSOR_TYPES), size=count, dtype=np.int8),
+        firmware_codes=rng.integers(0, len(FIRMWARE_VERSIONS), size=count, dtype=np.int8),
+        include_metadata=include_metadata,
+    )
@@ -0,0 +1,32 @@
+#!/usr/bin/env python3
+"""
+Change Point Detection Regression Tests
+Run with: python -m pytest test_changepoint_detection.py
+"""
+
+import random
+
+from changepoint_detection import ChangePointDetector
+
+def _change_points(values, confidence=80, history=120, key="device-001"):
+    detector = ChangePointDetector(confidence, history)
+    return [index for index, value in enumerate(values)
+            if detector.score(key, value)["IsChangePoint"]]
+
+def test_stationary_noise_raises_next_to_no_change_points():
+    rng = random.Random(7)
+    assert len(_change_points([rng.gauss(20, 1) for _ in range(20000)])) <= 1
+    
+    detector = ChangePointDetector(80, 120)
+    for _ in range(1000):
+        for device in range(200):
+            detector.score(device, rng.gauss(20, 1))
+    assert detector.change_points <= 2
+
+def test_level_shift_is_reported_once():
+    rng = random.Random(11)
+    for shift in (1.5, 3.0, 10.0):
+        values = [rng.gauss(20, 1) for _ in range(600)] + [rng.gauss(20 + shift, 1) for _ in range(600)]
+        change_points = _change_points(values)
+        assert len(change_points) == 1, (shift, change_points)
+        assert 600 <= change_points[0] < 720
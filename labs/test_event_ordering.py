@@ -0,0 +1,44 @@
+#!/usr/bin/env python3
+"""
+Event Ordering Regression Tests
+Run with: python -m pytest test_event_ordering.py
+"""
+
+from datetime import datetime, timedelta, timezone
+
+from event_ordering import ADJUST, DROP, EventOrderingPolicy, ReorderBuffer
+
+START = datetime(2024, 1, 15, 10, 0, tzinfo=timezone.utc)
+
+def _events(pairs):
+    return [(START + timedelta(seconds=seconds), {"PartitionId": partition, "seconds": seconds})
+            for partition, seconds in pairs]
+
+def _run(action):
+    buffer = ReorderBuffer(EventOrderingPolicy(out_of_order_tolerance=2, late_arrival_tolerance=None,
+                                               action=action))
+    # Partition 1 first shows up after partition 0 has moved the watermark to 8s
+    output = list(buffer.run(_events([(0, 0), (0, 5), (0, 10), (1, 1)])))
+    return buffer, output
+
+def _assert_no_event_behind_watermark(output):
+    watermark = None
+    for ts, record in output:
+        if record is None:
+            watermark = ts
+        else:
+            assert watermark is None or ts >= watermark, f"event at {ts} after watermark {watermark}"
+
+def test_new_partition_behind_emitted_watermark_is_adjusted():
+    buffer, output = _run(ADJUST)
+    _assert_no_event_behind_watermark(output)
+    adjusted = [ts for ts, record in output if record is not None and record["seconds"] == 1]
+    assert adjusted == [START + timedelta(seconds=8)]
+    assert buffer.stats.out_of_order == 1
+    assert buffer.stats.adjusted_out_of_order == 1
+
+def test_new_partition_behind_emitted_watermark_is_dropped():
+    buffer, output = _run(DROP)
+    _assert_no_event_behind_watermark(output)
+    assert [record["seconds"] for _, record in output if record is not None] == [0, 5, 10]
+    assert buffer.stats.dropped_out_of_order == 1